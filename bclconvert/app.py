@@ -1,10 +1,21 @@
 # This file has been modified from the https://github.com/arteria-project/arteria-bcl2fastq repo
 # bcl2fastq/app.py
 
+import logging
+import os
+import re
+
 from arteria.web.app import AppService
 from bclconvert.handlers.bclconvert_handlers import *
+from bclconvert.lib.config_utils import get_config_value
+from bclconvert.lib.runfolder_watcher import DEFAULT_MARKERS, DEFAULT_MAX_RETRIES, DEFAULT_RETRY_DELAY, RunfolderWatcher
+from tornado import gen
+from tornado.httpclient import AsyncHTTPClient, HTTPError
+from tornado.ioloop import IOLoop
 from tornado.web import URLSpec as url
 
+log = logging.getLogger(__name__)
+
 
 def routes(**kwargs):
     """
@@ -18,14 +29,68 @@ def routes(**kwargs):
         url(r"/api/1.0/start/([\w_-]+)", StartHandler, name="start", kwargs=kwargs),
         url(r"/api/1.0/status/(\d*)", StatusHandler, name="status", kwargs=kwargs),
         url(r"/api/1.0/stop/([\d|all]*)", StopHandler, name="stop", kwargs=kwargs),
-        url(r"/api/1.0/logs/([\w_-]+)", BclConvertLogHandler, name="logs", kwargs=kwargs)
+        url(r"/api/1.0/logs/([\w_-]+)", BclConvertLogHandler, name="logs", kwargs=kwargs),
+        url(r"/api/1.0/purges/(\d*)", PurgeStatusHandler, name="purges", kwargs=kwargs),
+        url(r"/api/1.0/utilization", UtilizationHandler, name="utilization", kwargs=kwargs),
+        url(r"/api/1.0/events", JobEventsHandler, name="events", kwargs=kwargs),
+        url(r"/api/1.0/qc/([\w_-]+)", RunQcHandler, name="qc", kwargs=kwargs),
+        url(r"/api/1.0/stats/(\d+)", DemuxStatsHandler, name="stats", kwargs=kwargs),
+        url(r"/api/1.0/checksums/(\d+)", ChecksumsHandler, name="checksums", kwargs=kwargs)
     ]
 
 
+def start_runfolder_watcher(config, port):
+    """
+    Start a `RunfolderWatcher` on the `runfolder_path` directories, which starts a conversion
+    with default parameters of each runfolder that is complete. Runfolders are started through
+    the start endpoint of the service, so they are checked and queued as any other request.
+    Runfolders that have a job in the job registry, or an output directory in
+    `default_output_path`, are not started again. Runfolders whose start is refused are
+    started again later, see `RunfolderWatcher.failed`.
+    :param config: the configuration of the service
+    :param port: the port the service listens on
+    :return: the watcher
+    """
+    registry = BclConvertServiceMixin.runner_service(config).registry
+    io_loop = IOLoop.current()
+    http_client = AsyncHTTPClient()
+
+    def is_converted(runfolder):
+        if not re.fullmatch(r"[\w_-]+", runfolder):
+            log.warning(f"Not starting {runfolder}, it can not be started through the start endpoint")
+            return True
+        return bool(registry.find(runfolder=runfolder)) or \
+            os.path.isdir(os.path.join(config["default_output_path"], runfolder))
+
+    @gen.coroutine
+    def start_runfolder(runfolder):
+        try:
+            response = yield http_client.fetch(f"http://localhost:{port}/api/1.0/start/{runfolder}",
+                                               method="POST", body="{}")
+            log.info(f"Started {runfolder}: {response.body.decode()}")
+        except (HTTPError, OSError) as e:
+            log.error(f"Failed to start {runfolder}: {e}")
+            watcher.failed(runfolder)
+
+    watcher = RunfolderWatcher(config["runfolder_path"],
+                               on_complete=lambda runfolder: io_loop.add_callback(start_runfolder, runfolder),
+                               is_converted=is_converted,
+                               markers=get_config_value(config, "runfolder_watcher_markers", DEFAULT_MARKERS),
+                               interval=get_config_value(config, "runfolder_watcher_interval", 60),
+                               use_inotify=get_config_value(config, "runfolder_watcher_inotify", True),
+                               start_existing=get_config_value(config, "runfolder_watcher_start_existing", False),
+                               max_retries=get_config_value(config, "runfolder_watcher_max_retries", DEFAULT_MAX_RETRIES),
+                               retry_delay=get_config_value(config, "runfolder_watcher_retry_delay", DEFAULT_RETRY_DELAY))
+    watcher.start()
+    return watcher
+
+
 def start():
     """
     Start the bclconvert-ws app
     """
 
     app_svc = AppService.create(__package__)
+    if get_config_value(app_svc.config_svc, "runfolder_watcher_enabled", False):
+        start_runfolder_watcher(app_svc.config_svc, app_svc._port)
     app_svc.start(routes(config=app_svc.config_svc))
@@ -1,13 +1,39 @@
 # This file has been modified from the https://github.com/arteria-project/arteria-bcl2fastq repo
 # bcl2fastq/handlers/bcl2fastq_handlers.py
+import copy
 import json
 import logging
 import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 
-from bclconvert.lib.jobrunner import LocalQAdapter
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+from tornado.iostream import StreamClosedError
+from tornado.queues import Queue
+
+from bclconvert.lib.jobrunner import LocalQAdapter, SlurmAdapter
 from bclconvert.lib.bclconvert_utils import BclConvertRunnerFactory, BclConvertConfig
 from bclconvert import __version__ as version
-from bclconvert.lib.bclconvert_logs import BclConvertLogFileProvider
+from bclconvert.lib.bclconvert_logs import BclConvertLogFileProvider, LogArchiver
+from bclconvert.lib.checksums import CHECKSUM_FILE_NAMES, MANIFEST_FILE_NAME, ChecksumService
+from bclconvert.lib.config_utils import get_config_value
+from bclconvert.lib.demux_stats import DemuxStatsService
+from bclconvert.lib.disk_space import check_disk_space
+from bclconvert.lib.fastq_validation import FastqValidator
+from bclconvert.lib.interop import get_run_qc
+from bclconvert.lib.job_registry import JobRegistry
+from bclconvert.lib.lane_split import (REPORTS_DIR_NAME, STAGING_DIR_NAME, changed_lanes, lane_staging_dir,
+                                       merge_lane_jobs)
+from bclconvert.lib.output_deletion import OutputDeletionService
+from bclconvert.lib.preflight import PreflightError
+from bclconvert.lib.progress import DEFAULT_TILE_PATTERNS, ProgressTracker, command_option, job_output_dir
+from bclconvert.lib.request_fingerprint import request_fingerprint
+from bclconvert.lib.runinfo import get_runinfo
+from bclconvert.lib.scheduler import FINISHED_STATES, ResourceAwareAdapter, job_priority, node_memory_mb
+from bclconvert.lib.thread_tuning import plan_threads
 from arteria.exceptions import ArteriaUsageException
 from arteria.web.state import State
 from arteria.web.handlers import BaseRestHandler
@@ -15,6 +41,12 @@ from arteria.web.handlers import BaseRestHandler
 log = logging.getLogger(__name__)
 
 
+MERGE_LANES_FINISHER = "merge_lanes"
+
+# Functions called when a group of jobs has finished, by name, see `ResourceAwareAdapter.start_group`
+FINISHERS = {MERGE_LANES_FINISHER: merge_lane_jobs}
+
+
 class BclConvertServiceMixin:
     """
     Provides bclconvert related services that can be mixed in.
@@ -25,17 +57,74 @@ class BclConvertServiceMixin:
     _runner_service = None
 
     @staticmethod
-    def runner_service():
+    def runner_service(config):
         """
-        Create an adaptor to the runner service unless one already exists
+        Create an adaptor to the runner service unless one already exists.
+        Jobs are queued by a `ResourceAwareAdapter`, which hands them on to the job runner chosen
+        by `job_runner` in the config:
+         - localq (default) runs the jobs on this node, once the cores and memory they reserve are free
+         - asyncio runs the jobs on this node like localq, but notices at once when a job exits
+           instead of polling, so the next job is started without delay
+         - slurm submits the jobs to a SLURM cluster, which does its own scheduling
+        Queued jobs are started in order of priority, which grows by `priority_aging_per_hour` while
+        they wait, and with `preemption_enabled` running jobs of a lower priority are stopped and
+        queued again when a job of a higher priority does not fit.
+        Jobs are recorded in the database at `job_registry_path`, so that they are kept across
+        restarts of the service. The log of each job is compressed once the job has finished.
+        With `fastq_validation_enabled` in the config, the fastq files written by a job are checked
+        before it is marked as done, by `fastq_validation_workers` processes.
         """
         if BclConvertServiceMixin._runner_service:
             return BclConvertServiceMixin._runner_service
         else:
-            import multiprocessing
-            nbr_of_cores = multiprocessing.cpu_count()
-            # TODO Make configurable
-            BclConvertServiceMixin._runner_service = LocalQAdapter(nbr_of_cores=nbr_of_cores, interval=2)
+            job_runner = get_config_value(config, "job_runner", "localq")
+            if job_runner == "slurm":
+                slurm_config = get_config_value(config, "slurm", {})
+                runner = SlurmAdapter(job_name=slurm_config.get("job_name", "bclconvert"),
+                                      partition=slurm_config.get("partition"),
+                                      account=slurm_config.get("account"),
+                                      time_limit=slurm_config.get("time_limit"),
+                                      extra_args=slurm_config.get("extra_args"),
+                                      status_cache_seconds=slurm_config.get("status_cache_seconds", 10),
+                                      max_status_misses=slurm_config.get("max_status_misses", 3))
+                nbr_of_cores = None
+                memory_mb = None
+            elif job_runner in ("localq", "asyncio"):
+                import multiprocessing
+                nbr_of_cores = get_config_value(config, "node_cores", multiprocessing.cpu_count())
+                memory_mb = get_config_value(config, "node_memory_mb", node_memory_mb())
+                if job_runner == "localq":
+                    runner = LocalQAdapter(nbr_of_cores=nbr_of_cores, interval=2)
+                else:
+                    from bclconvert.lib.async_jobrunner import AsyncioAdapter
+                    runner = AsyncioAdapter()
+            else:
+                raise ArteriaUsageException(
+                    f"Unknown job_runner '{job_runner}', should be 'localq', 'asyncio' or 'slurm'")
+
+            if get_config_value(config, "fastq_validation_enabled", False):
+                validator = FastqValidator(get_config_value(config, "fastq_validation_workers", None),
+                                           get_config_value(config, "sample_name_column_enabled", None))
+            else:
+                validator = None
+
+            registry_path = get_config_value(config, "job_registry_path", None)
+            if not registry_path:
+                log.warning("No job_registry_path in the config, jobs will not be kept across restarts.")
+            BclConvertServiceMixin._runner_service = ResourceAwareAdapter(
+                runner,
+                nbr_of_cores=nbr_of_cores,
+                memory_mb=memory_mb,
+                max_backfill_wait=get_config_value(config, "max_backfill_wait", 3600),
+                registry=JobRegistry(registry_path) if registry_path else None,
+                finishers=FINISHERS,
+                validator=validator,
+                aging_per_hour=get_config_value(config, "priority_aging_per_hour", 10),
+                preemption=get_config_value(config, "preemption_enabled", False))
+            log_archiver = LogArchiver(config, BclConvertServiceMixin._runner_service.registry)
+            BclConvertServiceMixin._runner_service.events.subscribe(log_archiver.on_event)
+            BclConvertServiceMixin.demux_stats_service(config)
+            BclConvertServiceMixin.checksum_service(config)
             return BclConvertServiceMixin._runner_service
 
     _bclconvert_cmd_generation_service = None
@@ -51,6 +140,88 @@ class BclConvertServiceMixin:
             BclConvertServiceMixin._bclconvert_cmd_generation_service = BclConvertRunnerFactory(config)
             return BclConvertServiceMixin._bclconvert_cmd_generation_service
 
+    _deletion_service = None
+
+    @staticmethod
+    def deletion_service(config):
+        """
+        Create a service for deleting old output in the background unless one already exists.
+        Any trash left behind by a previous instance of the service is purged when it is created,
+        in the allowed output folders and next to the output of every job in the registry.
+        """
+        if BclConvertServiceMixin._deletion_service:
+            return BclConvertServiceMixin._deletion_service
+        else:
+            deletion_service = OutputDeletionService(
+                nbr_of_workers=get_config_value(config, "output_purge_workers", 8))
+            registry_path = get_config_value(config, "job_registry_path", None)
+            outputs = []
+            if registry_path:
+                registry = JobRegistry(registry_path)
+                outputs = [output for output in map(job_output_dir, registry.find()) if output]
+                registry.close()
+            deletion_service.purge_leftovers(get_config_value(config, "allowed_output_folders", []), outputs=outputs)
+            BclConvertServiceMixin._deletion_service = deletion_service
+            return BclConvertServiceMixin._deletion_service
+
+    _demux_stats_service = None
+
+    @staticmethod
+    def demux_stats_service(config):
+        """
+        Create a service that parses the demultiplexing reports of jobs as they finish, for the
+        job registry of the runner service, unless one already exists.
+        """
+        runner_service = BclConvertServiceMixin.runner_service(config)
+        stats_service = BclConvertServiceMixin._demux_stats_service
+        if stats_service and stats_service.registry is runner_service.registry:
+            return stats_service
+        else:
+            stats_service = DemuxStatsService(runner_service.registry,
+                                              maxsize=get_config_value(config, "demux_stats_cache_size", 256))
+            runner_service.events.subscribe(stats_service.on_event)
+            BclConvertServiceMixin._demux_stats_service = stats_service
+            return stats_service
+
+    _checksum_service = None
+
+    @staticmethod
+    def checksum_service(config):
+        """
+        Create a service that writes checksum manifests of the output of jobs, for the job registry
+        of the runner service, unless one already exists. With `checksums_enabled` in the config
+        the manifest of each job is written as soon as it has finished, otherwise only on request.
+        """
+        runner_service = BclConvertServiceMixin.runner_service(config)
+        checksum_service = BclConvertServiceMixin._checksum_service
+        if checksum_service and checksum_service.registry is runner_service.registry:
+            return checksum_service
+        else:
+            checksum_service = ChecksumService(runner_service.registry,
+                                               nbr_of_workers=get_config_value(config, "checksum_workers", None))
+            if get_config_value(config, "checksums_enabled", False):
+                runner_service.events.subscribe(checksum_service.on_event)
+            BclConvertServiceMixin._checksum_service = checksum_service
+            return checksum_service
+
+    _progress_tracker = None
+
+    @staticmethod
+    def progress_tracker(config):
+        """
+        Create a tracker of the progress of running jobs unless one already exists. Processed
+        tiles are found in the logs of jobs by the regular expressions `progress_tile_patterns`
+        in the config, if set. The tracker forgets jobs as the runner service reports them finished.
+        """
+        events = BclConvertServiceMixin.runner_service(config).events
+        progress_tracker = BclConvertServiceMixin._progress_tracker
+        if progress_tracker and progress_tracker.events is events:
+            return progress_tracker
+        else:
+            BclConvertServiceMixin._progress_tracker = ProgressTracker(
+                get_config_value(config, "progress_tile_patterns", DEFAULT_TILE_PATTERNS), events)
+            return BclConvertServiceMixin._progress_tracker
+
 
 class BaseBclConvertHandler(BaseRestHandler):
     """
@@ -84,6 +255,48 @@ class StartHandler(BaseBclConvertHandler, BclConvertServiceMixin):
     Start bclconvert
     """
 
+    # The disk space check walks the output trees, which can take long on network file systems,
+    # so it is run off the IOLoop
+    _disk_space_checks = ThreadPoolExecutor(max_workers=2, thread_name_prefix="disk-space-check")
+
+    # Runfolders with a start request between its in-flight check and its job being started, by
+    # runfolder, with the fingerprint of that request and a future resolved once it is answered
+    _starting = {}
+
+    def plan_threads(self, runfolder_input):
+        """
+        Plan the bcl-convert thread counts for a runfolder from its RunInfo.xml and the jobs
+        currently running on the node.
+        :param runfolder_input: path to the runfolder
+        :return: a `ThreadPlan`
+        """
+        utilization = self.runner_service(self.config).utilization()
+        if utilization["cores"]["total"] is None:
+            # Jobs run on a cluster, so plan for a node of the configured size to itself
+            import multiprocessing
+            return plan_threads(get_runinfo(runfolder_input),
+                                node_cores=get_config_value(self.config, "node_cores", multiprocessing.cpu_count()))
+        return plan_threads(get_runinfo(runfolder_input),
+                            node_cores=utilization["cores"]["total"],
+                            free_cores=utilization["cores"]["total"] - utilization["cores"]["reserved"],
+                            running_jobs=utilization["jobs"]["running"])
+
+    def find_runfolder(self, runfolder):
+        """
+        :param runfolder: name of the runfolder
+        :return: the path to the runfolder, in the first of the `runfolder_path` it is found in
+        :raises ArteriaUsageException: if it is not in any of them
+        """
+        runfolder_input = ""
+        for runfolders_path in self.config["runfolder_path"]:
+            if os.path.isdir(os.path.join(runfolders_path, runfolder)):
+                runfolder_input = os.path.join(runfolders_path, runfolder)
+                break
+
+        if not os.path.isdir(runfolder_input):
+            raise ArteriaUsageException(f"No such file: {runfolder_input}")
+        return runfolder_input
+
     def create_config_from_request(self, runfolder, request_body):
         """
         For the specified runfolder, will look it up from the place setup in the
@@ -102,7 +315,6 @@ class StartHandler(BaseBclConvertHandler, BclConvertServiceMixin):
 
         # TODO Make sure to escape them for sec. reasons.
         bclconvert_version = ""
-        runfolder_input = ""
         samplesheet = ""
         output = ""
         barcode_mismatches = ""
@@ -112,19 +324,14 @@ class StartHandler(BaseBclConvertHandler, BclConvertServiceMixin):
         bcl_only_lane = None
         lanes = None
         create_indexes = False
+        split_lanes = False
         bcl_num_parallel_tiles = None
         bcl_num_conversion_threads = None
         bcl_num_compression_threads = None
         bcl_num_decompression_threads = None
         additional_args = ""
 
-        for runfolders_path in self.config["runfolder_path"]:
-            if os.path.isdir(os.path.join(runfolders_path, runfolder)):
-                runfolder_input = os.path.join(runfolders_path, runfolder)
-                break
-
-        if not os.path.isdir(runfolder_input):
-            raise ArteriaUsageException(f"No such file: {runfolder_input}")
+        runfolder_input = self.find_runfolder(runfolder)
 
         if "bclconvert_version" in request_data:
             bclconvert_version = request_data["bclconvert_version"]
@@ -151,6 +358,10 @@ class StartHandler(BaseBclConvertHandler, BclConvertServiceMixin):
             if request_data["create_indexes"] == "True":
                 create_indexes = True
 
+        if "split_lanes" in request_data:
+            if request_data["split_lanes"] in ("True", True):
+                split_lanes = True
+
         if "bcl_only_lane" in request_data:
             bcl_only_lane = request_data['bcl_only_lane']
 
@@ -172,9 +383,17 @@ class StartHandler(BaseBclConvertHandler, BclConvertServiceMixin):
         if "lanes" in request_data:
             lanes = request_data["lanes"]
 
+        # A rerun of the changed lanes converts each lane as a separate job, see `plan_rerun`
+        rerun = request_data.get("rerun", "all")
+        if rerun == "changed_lanes":
+            split_lanes = True
+        elif rerun != "all":
+            raise ArteriaUsageException(f"Unknown rerun '{rerun}', should be 'changed_lanes' or 'all'")
+
         # If lanes is specified, convert it to tiles regex
         # If user also specified tiles, lanes takes precedence (with warning)
-        if lanes:
+        # When splitting by lane, the tiles of each lane job are set when the jobs are started.
+        if lanes and not split_lanes:
             calculated_tiles = BclConvertConfig.parse_lanes_to_tiles_regex(lanes)
             if tiles:
                 log.warning(
@@ -183,6 +402,23 @@ class StartHandler(BaseBclConvertHandler, BclConvertServiceMixin):
                 )
             tiles = calculated_tiles
 
+        # With auto-tuning, thread counts that were not given in the request are planned
+        # from the run and the load on the node.
+        thread_tuning = request_data.get("thread_tuning", get_config_value(self.config, "bcl_thread_tuning", "fixed"))
+        thread_plan = None
+        if thread_tuning == "auto":
+            thread_plan = self.plan_threads(runfolder_input)
+            thread_plan.override(parallel_tiles=bcl_num_parallel_tiles,
+                                 conversion_threads=bcl_num_conversion_threads,
+                                 compression_threads=bcl_num_compression_threads,
+                                 decompression_threads=bcl_num_decompression_threads)
+            bcl_num_parallel_tiles = thread_plan.parallel_tiles
+            bcl_num_conversion_threads = thread_plan.conversion_threads
+            bcl_num_compression_threads = thread_plan.compression_threads
+            bcl_num_decompression_threads = thread_plan.decompression_threads
+        elif thread_tuning != "fixed":
+            raise ArteriaUsageException(f"Unknown thread_tuning '{thread_tuning}', should be 'auto' or 'fixed'")
+
         config = BclConvertConfig(
             general_config=self.config,
             bclconvert_version=bclconvert_version,
@@ -198,10 +434,133 @@ class StartHandler(BaseBclConvertHandler, BclConvertServiceMixin):
             bcl_num_conversion_threads=bcl_num_conversion_threads,
             bcl_num_compression_threads=bcl_num_compression_threads,
             bcl_num_decompression_threads=bcl_num_decompression_threads,
-            additional_args=additional_args)
+            additional_args=additional_args,
+            thread_plan=thread_plan,
+            split_lanes=split_lanes)
+
+        if split_lanes:
+            config.lanes = BclConvertConfig.parse_lanes(lanes) if lanes \
+                else list(range(1, get_runinfo(runfolder_input).lane_count + 1))
 
         return config
 
+    def previous_conversion(self, runfolder):
+        """
+        :param runfolder: name of the runfolder
+        :return: the record of the last job that converted the runfolder successfully, or None
+        """
+        registry = self.runner_service(self.config).registry
+        records = [record for record in registry.find(runfolder=runfolder, state=State.DONE)
+                   if record["parent_id"] is None]
+        return records[-1] if records else None
+
+    def plan_rerun(self, runfolder, runfolder_config):
+        """
+        Find the lanes to convert again when rerunning a runfolder after its samplesheet has
+        changed. The samplesheet is compared lane by lane (see `changed_lanes`) with the one the
+        last successful conversion of the runfolder used, which bcl-convert copied to its Reports.
+        :param runfolder: name of the runfolder
+        :param runfolder_config: the `BclConvertConfig` of the rerun, with the lanes to consider
+        :return: the record of the last successful conversion, and the lanes that have changed
+        :raises ArteriaUsageException: if there is no successful conversion of the runfolder to
+                                       the same output, with fastq files split by lane
+        """
+        previous = self.previous_conversion(runfolder)
+        if not previous:
+            raise ArteriaUsageException(f"{runfolder} has not been converted successfully, so there is no "
+                                        f"output to rerun the changed lanes in")
+        previous_output = job_output_dir(previous)
+        if not previous_output or os.path.abspath(previous_output) != os.path.abspath(runfolder_config.output):
+            raise ArteriaUsageException(f"The last conversion of {runfolder}, job {previous['job_id']}, wrote "
+                                        f"{previous_output}, not {runfolder_config.output}")
+        if command_option(previous["command"], "--no-lane-splitting") == "true":
+            raise ArteriaUsageException(f"The fastq files of job {previous['job_id']} are not split by lane, "
+                                        f"so the changed lanes can not be replaced in them")
+        previous_samplesheet = os.path.join(previous_output, REPORTS_DIR_NAME, "SampleSheet.csv")
+        if not os.path.exists(previous_samplesheet):
+            raise ArteriaUsageException(f"Can not compare the samplesheet with that of job {previous['job_id']}, "
+                                        f"{previous_samplesheet} does not exist")
+        lanes = changed_lanes(previous_samplesheet, runfolder_config.samplesheet_file, runfolder_config.lanes)
+        log.info(f"Lane(s) {', '.join(map(str, lanes)) or 'none'} of {runfolder} have changed since job "
+                 f"{previous['job_id']}")
+        return previous, lanes
+
+    def start_split_by_lane(self, runfolder, runfolder_config, parameters, priority=0, fingerprint=None,
+                            replace=False):
+        """
+        Start one job per lane of the runfolder, under a parent job. Each lane is converted into
+        its own staging directory in the output directory, and the output of the lanes that
+        succeeded is merged into the output directory once all lanes have finished.
+        :param runfolder: name of the runfolder
+        :param runfolder_config: the `BclConvertConfig` for the whole runfolder
+        :param parameters: the parameters of the request, recorded with the job
+        :param priority: of the jobs, see `job_priority`
+        :param fingerprint: of the request, see `request_fingerprint`
+        :param replace: True to replace the lanes in the existing output directory, keeping the
+                        other lanes in it, see `merge_lane_outputs`
+        :return: the id of the parent job, and a dict with the job id of each lane
+        """
+        os.makedirs(os.path.join(runfolder_config.output, STAGING_DIR_NAME), exist_ok=True)
+
+        jobs = []
+        for lane in runfolder_config.lanes:
+            lane_config = copy.copy(runfolder_config)
+            lane_config.tiles = BclConvertConfig.parse_lanes_to_tiles_regex(str(lane))
+            lane_config.output = lane_staging_dir(runfolder_config.output, lane)
+            # Fastq file names have to include the lane, or the lanes could not be merged
+            lane_config.no_lane_splitting = False
+            lane_runner = self.bclconvert_cmd_generation_service(self.config).create_bclconvert_runner(lane_config)
+            log_file = self.bclconvert_log_file_provider.job_log_path(runfolder, suffix=f"L{lane:03d}")
+            jobs.append({"cmd": lane_runner.construct_command(),
+                         "nbr_of_cores": lane_config.nbr_of_cores,
+                         "memory_mb": lane_config.memory_mb,
+                         "run_dir": lane_config.runfolder_input,
+                         "stdout": log_file,
+                         "stderr": log_file,
+                         "runfolder": runfolder,
+                         "parameters": {"lane": lane}})
+
+        job_id, lane_job_ids = self.runner_service(self.config).start_group(
+            jobs,
+            finisher=MERGE_LANES_FINISHER,
+            finisher_args={"output": runfolder_config.output, "lanes": runfolder_config.lanes, "replace": replace},
+            runfolder=runfolder,
+            parameters=parameters,
+            priority=priority,
+            fingerprint=fingerprint)
+        log.info(f"Split {runfolder} into lane jobs {lane_job_ids} under job {job_id}")
+        return job_id, dict(zip(runfolder_config.lanes, lane_job_ids))
+
+    def write_coalesced(self, job):
+        """
+        Answer a start request with the job that was already started for the same request.
+        :param job: the job, as a dict from `ResourceAwareAdapter.in_flight`
+        """
+        reverse_url = self.reverse_url("status", job["job_id"])
+        self.set_status(202, reason="already processing")
+        self.write_json({"job_id": job["job_id"],
+                         "service_version": version,
+                         "link": f"{self.request.protocol}://{self.request.host}{reverse_url}",
+                         "state": job["state"],
+                         "reservation": job["reservation"],
+                         "coalesced": True})
+
+    def write_unchanged(self, runfolder, previous):
+        """
+        Answer a rerun of the changed lanes when no lanes have changed.
+        :param previous: the record of the last successful conversion of the runfolder
+        """
+        reverse_url = self.reverse_url("status", previous["job_id"])
+        self.set_status(200, reason="no lanes have changed")
+        self.write_json({"message": f"No lanes of {runfolder} have changed since job {previous['job_id']}, "
+                                    f"there is nothing to convert",
+                         "job_id": previous["job_id"],
+                         "service_version": version,
+                         "link": f"{self.request.protocol}://{self.request.host}{reverse_url}",
+                         "state": previous["state"],
+                         "lanes": {}})
+
+    @gen.coroutine
     def post(self, runfolder):
         """
         Starts a bclconvert for a runfolder. The input data can contain extra
@@ -215,36 +574,141 @@ class StartHandler(BaseBclConvertHandler, BclConvertServiceMixin):
                   converted to tiles regex. Supports complex patterns like "13-5" or "1-46-7")
          - tiles (direct tiles regex; if both lanes and tiles specified, lanes takes precedence)
          - use_base_mask
+         - bcl_num_parallel_tiles, bcl_num_conversion_threads, bcl_num_compression_threads
+           and bcl_num_decompression_threads
+         - thread_tuning ("auto" to plan the thread counts not given from the run and the
+           load on the node, or "fixed" to use the configured ones)
+         - split_lanes ("True" to convert each lane, or each lane given in lanes, as a separate
+           job and merge their output. The returned job rolls up the state of the lane jobs.)
          - additional_args
+         - rerun ("changed_lanes" to only convert the lanes whose samples in the samplesheet
+           differ from those of the last successful conversion of the runfolder, each as a
+           separate job, and replace those lanes in its output. Changes to the reads or settings
+           of the samplesheet change all lanes. If no lanes have changed nothing is started, and
+           the last conversion is returned with a 200. By default "all", which converts the whole
+           runfolder into an empty output directory.)
+         - priority (the name of a priority class, see `priority_classes` in the config. Jobs of
+           a higher priority are started first, and may stop running jobs of a lower priority
+           if `preemption_enabled` is set. By default the class of the first of
+           `priority_runfolder_patterns` that matches the runfolder, or `default_priority_class`)
         If these are not set defaults setup in bclconvertConfig will be
         used (and those should be good enough for most cases).
 
+        Before anything is queued the samplesheet is checked against the RunInfo.xml of the
+        runfolder (unless `preflight_enabled` is false in the config), and the output size is
+        estimated from RunInfo.xml and the clusters in the InterOp files, and compared with the
+        space left on the file system of the output once the jobs already queued or running there
+        have written theirs (unless `disk_space_check_enabled` is false). If these checks fail
+        a 400 is returned with a report of the problems found.
+
+        A runfolder is never converted by two jobs at the same time. If a job for the runfolder is
+        already queued or running, and was started for the same request (one that resolves to the
+        same samplesheet content, output directory, bcl-convert version and options apart from the
+        thread counts, see `request_fingerprint`, whatever its priority and whether it spells out
+        the defaults or not), its id is returned with "coalesced" set and nothing is started. If it
+        was started for another request a 409 is returned, and the job has to be stopped or finish
+        before the runfolder can be started again.
+
         :param runfolder: name of the runfolder we want to start bclconvert for
         """
 
+        starting = None
+        runfolder_config = None
         try:
+            parameters = json.loads(self.request.body) if self.request.body else {}
+            priority_class, priority = job_priority(self.config, runfolder, parameters.get("priority"))
+
+            # A request for a runfolder that is already queued or running must neither clear its
+            # output nor replace its samplesheet, so this is checked before anything is written.
+            # Resolving the request writes nothing, see `BclConvertConfig.prepare`.
             runfolder_config = self.create_config_from_request(runfolder, self.request.body)
+            fingerprint = request_fingerprint(runfolder_config, parameters.get("rerun"))
+            # A request that comes in while another one for the runfolder is being started waits
+            # for that one to be answered if they are the same, so that it can be coalesced with
+            # the job started, and is refused otherwise.
+            while runfolder in StartHandler._starting:
+                starting_fingerprint, answered = StartHandler._starting[runfolder]
+                if starting_fingerprint != fingerprint:
+                    log.warning(f"Not starting {runfolder}, it is already being started with other parameters")
+                    self.set_status(409, reason="runfolder already being converted")
+                    self.write_json({"message": f"{runfolder} is already being started with other parameters.",
+                                     "job_ids": []})
+                    return
+                yield answered
+            in_flight = self.runner_service(self.config).in_flight(runfolder)
+            for job in in_flight:
+                if job["fingerprint"] == fingerprint:
+                    log.info(f"Request to start {runfolder} is the same as that of job {job['job_id']}, "
+                             f"not starting it again")
+                    self.write_coalesced(job)
+                    return
+            if in_flight:
+                job_ids = ", ".join(str(job["job_id"]) for job in in_flight)
+                log.warning(f"Not starting {runfolder}, it is already being converted by job(s) {job_ids} "
+                            f"with other parameters")
+                self.set_status(409, reason="runfolder already being converted")
+                self.write_json({"message": f"{runfolder} is already being converted by job(s) {job_ids} with "
+                                            f"other parameters. Stop them, or wait for them to finish, "
+                                            f"before starting it again.",
+                                 "job_ids": [job["job_id"] for job in in_flight]})
+                return
+
+            starting = Future()
+            StartHandler._starting[runfolder] = (fingerprint, starting)
+            rerun_of = None
+            if parameters.get("rerun") == "changed_lanes":
+                rerun_of, runfolder_config.lanes = self.plan_rerun(runfolder, runfolder_config)
+                if not runfolder_config.lanes:
+                    self.write_unchanged(runfolder, rerun_of)
+                    return
+                runfolder_config.tiles = BclConvertConfig.parse_lanes_to_tiles_regex(
+                    "".join(map(str, runfolder_config.lanes)))
 
             job_runner = self.bclconvert_cmd_generation_service(self.config). \
                 create_bclconvert_runner(runfolder_config)
             bclconvert_version = job_runner.version()
+            if get_config_value(self.config, "preflight_enabled", True):
+                preflight_report = job_runner.preflight()
+            else:
+                preflight_report = None
+            if get_config_value(self.config, "disk_space_check_enabled", True):
+                disk_space = yield StartHandler._disk_space_checks.submit(
+                    check_disk_space, runfolder_config, self.runner_service(self.config).registry,
+                    margin=get_config_value(self.config, "output_size_margin", 0.1),
+                    output_deleted=rerun_of is None)
+            else:
+                disk_space = None
+            # Only now that the request has passed its checks is its samplesheet written into the runfolder
+            runfolder_config.prepare()
             cmd = job_runner.construct_command()
-            # If the output directory exists, we always want to clear it.
-            job_runner.delete_output()
+            # If the output directory exists, we always want to clear it. It is moved
+            # out of the way here and purged in the background. A rerun of the changed
+            # lanes replaces them in the existing output instead.
+            purge = job_runner.delete_output(self.deletion_service(self.config)) if rerun_of is None else None
             # job_runner.symlink_output_to_unaligned()
 
-            log_file = self.bclconvert_log_file_provider.log_file_path(runfolder)
+            if runfolder_config.split_lanes:
+                job_id, lane_job_ids = self.start_split_by_lane(runfolder, runfolder_config, parameters, priority,
+                                                                fingerprint, replace=rerun_of is not None)
+            else:
+                log_file = self.bclconvert_log_file_provider.job_log_path(runfolder)
 
-            job_id = self.runner_service().start(
-                cmd,
-                nbr_of_cores=runfolder_config.nbr_of_cores,
-                run_dir=runfolder_config.runfolder_input,
-                stdout=log_file,
-                stderr=log_file)
+                job_id = self.runner_service(self.config).start(
+                    cmd,
+                    nbr_of_cores=runfolder_config.nbr_of_cores,
+                    memory_mb=runfolder_config.memory_mb,
+                    run_dir=runfolder_config.runfolder_input,
+                    stdout=log_file,
+                    stderr=log_file,
+                    runfolder=runfolder,
+                    parameters=parameters,
+                    priority=priority,
+                    fingerprint=fingerprint)
 
-            log.info(
-                f"Cmd: {cmd} started in {runfolder_config.runfolder_input} "
-                f"with {runfolder_config.nbr_of_cores} cores. Writing logs to: {log_file}")
+                log.info(
+                    f"Cmd: {cmd} submitted in {runfolder_config.runfolder_input} "
+                    f"reserving {runfolder_config.nbr_of_cores} cores and {runfolder_config.memory_mb} MB. "
+                    f"Writing logs to: {log_file}")
 
             reverse_url = self.reverse_url("status", job_id)
             status_end_point = f"{self.request.protocol}://{self.request.host}{reverse_url}"
@@ -254,30 +718,129 @@ class StartHandler(BaseBclConvertHandler, BclConvertServiceMixin):
                 "bclconvert_version": bclconvert_version,
                 "service_version": version,
                 "link": status_end_point,
-                "state": State.STARTED}
+                "state": State.STARTED,
+                "priority": priority_class,
+                "reservation": self.runner_service(self.config).job_info(job_id)["reservation"]}
+
+            if purge:
+                response_data["purge_id"] = purge.purge_id
+
+            if runfolder_config.split_lanes:
+                response_data["lanes"] = lane_job_ids
+
+            if rerun_of:
+                response_data["rerun_of"] = rerun_of["job_id"]
+
+            if runfolder_config.thread_plan:
+                response_data["thread_plan"] = runfolder_config.thread_plan.as_dict()
+
+            if preflight_report:
+                response_data["preflight"] = preflight_report.as_dict()
+
+            if disk_space:
+                response_data["disk_space"] = disk_space
 
             self.set_status(202, reason="started processing")
             self.write_json(response_data)
+        except PreflightError as e:
+            log.warning(f"Not starting {runfolder}. Message: {e}")
+            self.set_status(400, reason="preflight checks failed")
+            self.write_json({"message": str(e), "preflight": e.report.as_dict()})
         except ArteriaUsageException as e:
             log.warning(f"Failed starting {runfolder}. Message: {e}")
             self.send_error(status_code=500, reason=e)
+        finally:
+            if runfolder_config:
+                runfolder_config.discard()
+            if starting:
+                del StartHandler._starting[runfolder]
+                starting.set_result(None)
 
 
 class StatusHandler(BaseBclConvertHandler, BclConvertServiceMixin):
     """
     Get the status of one or all jobs.
     """
+
+    @gen.coroutine
+    def wait_for_change(self, job_id, version, timeout):
+        """
+        Wait until the state of a job, or of one of the jobs in its group, has changed since
+        `version`, or `timeout` seconds have passed. Returns at once if the job has finished or
+        already changed.
+        """
+        scheduler = self.runner_service(self.config)
+        changed = Future()
+        io_loop = IOLoop.current()
+
+        def on_event(event):
+            if job_id in (event["job_id"], event["parent_id"]):
+                io_loop.add_callback(lambda: changed.done() or changed.set_result(event))
+
+        # Subscribe before looking at the job, so that no change can be missed in between
+        scheduler.events.subscribe(on_event)
+        try:
+            job_info = scheduler.job_info(job_id)
+            if job_info and job_info["version"] == version and job_info["state"] not in FINISHED_STATES:
+                yield gen.with_timeout(timedelta(seconds=timeout), changed)
+        except gen.TimeoutError:
+            pass
+        finally:
+            scheduler.events.unsubscribe(on_event)
+
+    @gen.coroutine
     def get(self, job_id):
         """
         Get the status of the specified job_id, or if now id is given, the
-        status of all jobs.
+        status of all jobs. Jobs are looked up in the job registry, so jobs
+        started before the service was restarted are included. The status of
+        all jobs can be filtered with the `runfolder` and `state` query arguments.
+
+        The status of a job includes a `version`, which changes each time the state
+        of the job changes. If the `version` query argument is given the request is
+        held until the job no longer has that version, or until `timeout` seconds
+        (at most `long_poll_timeout` in the config, 30 by default) have passed, so
+        that clients can wait for a job to change without polling.
+
+        The status of a job that is queued, running or done includes its `progress`: the tiles
+        converted and to convert, percent complete, tiles converted per second and the estimated
+        seconds left (`eta`). Values that cannot be told yet are null. The logs of a running job
+        are read from where the last request stopped. The status of a queued job includes its
+        `queue` position, counted from 1, and the time it can be expected to start, which is null
+        if it cannot be told yet.
         :param job_id: to check status for (set to empty to get status for all)
         """
 
         if job_id:
-            status = {"state": self.runner_service().status(job_id)}
+            version = self.get_argument("version", None)
+            if version is not None:
+                max_timeout = get_config_value(self.config, "long_poll_timeout", 30)
+                timeout = min(float(self.get_argument("timeout", max_timeout)), max_timeout)
+                yield self.wait_for_change(int(job_id), int(version), timeout)
+
+            status = {"state": self.runner_service(self.config).status(job_id)}
+            job_info = self.runner_service(self.config).job_info(job_id)
+            if job_info:
+                for key in ["runfolder", "reservation", "queue_wait", "submitted", "started", "finished",
+                            "exit_code", "priority", "preemptions", "version"]:
+                    status[key] = job_info[key]
+                if "children" in job_info:
+                    status["children"] = {child_id: self.runner_service(self.config).status(child_id)
+                                          for child_id in job_info["children"]}
+                scheduler = self.runner_service(self.config)
+                progress_tracker = self.progress_tracker(self.config)
+                progress = progress_tracker.progress(scheduler, job_info["job_id"])
+                if progress:
+                    status["progress"] = progress
+                queue = scheduler.queue_info(
+                    job_info["job_id"],
+                    remaining_seconds=lambda running_id: (progress_tracker.progress(scheduler, running_id) or {}).get("eta"))
+                if queue:
+                    status["queue"] = queue
         else:
-            all_status = self.runner_service().status_all()
+            all_status = self.runner_service(self.config).status_all(
+                runfolder=self.get_argument("runfolder", None),
+                state=self.get_argument("state", None))
             status_dict = {}
             for k, v in all_status.items():
                 status_dict[k] = {"state": v}
@@ -286,6 +849,79 @@ class StatusHandler(BaseBclConvertHandler, BclConvertServiceMixin):
         self.write_json(status)
 
 
+class JobEventsHandler(BaseBclConvertHandler, BclConvertServiceMixin):
+    """
+    Stream changes of the state of jobs as Server-Sent Events.
+    """
+
+    def initialize(self, config):
+        super().initialize(config)
+        self.closed = False
+
+    def on_connection_close(self):
+        self.closed = True
+
+    def write_event(self, event_type, data, event_id=None):
+        if event_id is not None:
+            self.write(f"id: {event_id}\n")
+        self.write(f"event: {event_type}\ndata: {json.dumps(data)}\n\n")
+
+    @gen.coroutine
+    def get(self):
+        """
+        Sends a `state` event each time a job changes state, with the job id, state, runfolder
+        and parent job id of the job as json. The id of each event is its version, so a client
+        that reconnects with a `Last-Event-ID` header is sent the events it missed. If those are
+        no longer kept, a `reset` event is sent first, and the client should get the status of
+        all jobs. The events can be limited to the jobs of one runfolder with the `runfolder`
+        query argument. A comment is sent every `event_stream_heartbeat` seconds (15 by default)
+        to keep the connection open.
+        """
+        runfolder = self.get_argument("runfolder", None)
+        last_event_id = self.request.headers.get("Last-Event-ID", self.get_argument("since", None))
+        heartbeat = get_config_value(self.config, "event_stream_heartbeat", 15)
+
+        self.set_header("Content-Type", "text/event-stream")
+        self.set_header("Cache-Control", "no-cache")
+
+        events = self.runner_service(self.config).events
+        queue = Queue()
+        io_loop = IOLoop.current()
+
+        def on_event(event):
+            io_loop.add_callback(queue.put_nowait, event)
+
+        events.subscribe(on_event)
+        try:
+            last_version = events.version
+            if last_event_id is not None:
+                last_seen = int(last_event_id)
+                missed = events.since(last_seen)
+                # Versions start over when the service is restarted
+                if last_seen > last_version or (missed and missed[0]["version"] > last_seen + 1):
+                    self.write_event("reset", {"version": last_version})
+                for event in missed:
+                    if event["version"] <= last_version and runfolder in (None, event["runfolder"]):
+                        self.write_event("state", event, event["version"])
+            yield self.flush()
+
+            while not self.closed:
+                try:
+                    event = yield queue.get(timeout=timedelta(seconds=heartbeat))
+                except gen.TimeoutError:
+                    self.write(": keep-alive\n\n")
+                    yield self.flush()
+                    continue
+                if event["version"] <= last_version or runfolder not in (None, event["runfolder"]):
+                    continue
+                self.write_event("state", event, event["version"])
+                yield self.flush()
+        except StreamClosedError:
+            pass
+        finally:
+            events.unsubscribe(on_event)
+
+
 class StopHandler(BaseBclConvertHandler, BclConvertServiceMixin):
     """
     Stop one or all jobs.
@@ -299,12 +935,12 @@ class StopHandler(BaseBclConvertHandler, BclConvertServiceMixin):
         try:
             if job_id == "all":
                 log.info("Attempting to stop all jobs.")
-                self.runner_service().stop_all()
+                self.runner_service(self.config).stop_all()
                 log.info("Stopped all jobs!")
                 self.set_status(200)
             elif job_id:
                 log.info(f"Attempting to stop job: {job_id}")
-                self.runner_service().stop(job_id)
+                self.runner_service(self.config).stop(job_id)
                 self.set_status(200)
             else:
                 ArteriaUsageException("Unknown job to stop")
@@ -313,22 +949,312 @@ class StopHandler(BaseBclConvertHandler, BclConvertServiceMixin):
             self.send_error(500, reason=str(e))
 
 
-class BclConvertLogHandler(BaseBclConvertHandler):
+class UtilizationHandler(BaseBclConvertHandler, BclConvertServiceMixin):
+    """
+    Get the utilization of the node by the jobs run by the service.
+    """
+
+    def get(self):
+        """
+        Returns the cores and memory reserved by running jobs out of what is available on the node,
+        the number of running and pending jobs, and how long jobs wait in the queue.
+        """
+        self.write_json(self.runner_service(self.config).utilization())
+
+
+class DemuxStatsHandler(BaseBclConvertHandler, BclConvertServiceMixin):
+    """
+    Get the demultiplexing statistics of a finished job.
+    """
+
+    def get(self, job_id):
+        """
+        Returns the reads, percent of perfect and mismatched index reads, yield and percent of
+        bases with a quality score of at least 30, per lane, sample and project, the undetermined
+        fraction of each lane, and the most common unknown barcodes of each lane, as parsed from
+        the Reports of the output of the job. The reports are parsed when the job finishes, and
+        kept until they change.
+        :param job_id: a job that has finished, or the parent job of a run split by lane
+        """
+        try:
+            self.write_json(self.demux_stats_service(self.config).get(int(job_id)))
+        except KeyError:
+            self.send_error(404, reason=f"Job {job_id} has not finished successfully")
+        except FileNotFoundError as e:
+            self.send_error(404, reason=f"No demultiplexing stats for job {job_id}: {e}")
+
+
+class ChecksumsHandler(BaseBclConvertHandler, BclConvertServiceMixin):
+    """
+    Get, or regenerate, the checksums of the files in the output of a finished job.
+    """
+
+    def get(self, job_id):
+        """
+        Returns the checksums of the files in the output of the job, in the format of md5sum
+        (`format=md5`, the default) or sha256sum (`format=sha256`), with paths relative to the
+        output directory, or the manifest with the size, mtime and both checksums of each file
+        (`format=json`).
+        :param job_id: a job that has finished, or the parent job of a run split by lane
+        """
+        checksum_format = self.get_argument("format", "md5")
+        if checksum_format not in CHECKSUM_FILE_NAMES and checksum_format != "json":
+            self.send_error(400, reason=f"Unknown format {checksum_format}, should be md5, sha256 or json")
+            return
+        checksum_service = self.checksum_service(self.config)
+        try:
+            output = checksum_service.output(int(job_id))
+        except KeyError:
+            self.send_error(404, reason=f"Job {job_id} has not finished successfully")
+            return
+        file_name = MANIFEST_FILE_NAME if checksum_format == "json" else CHECKSUM_FILE_NAMES[checksum_format]
+        if checksum_service.is_pending(int(job_id)) or not os.path.exists(os.path.join(output, file_name)):
+            self.send_error(404, reason=f"The checksums of job {job_id} have not been written yet")
+            return
+        with open(os.path.join(output, file_name), "rb") as f:
+            content = f.read()
+        self.set_header("Content-Type", "application/json" if checksum_format == "json" else "text/plain; charset=UTF-8")
+        self.set_header("Content-Disposition", f'attachment; filename="{file_name}"')
+        self.write(content)
+
+    def post(self, job_id):
+        """
+        Write the checksums of the files in the output of the job again in the background, e.g.
+        after files have been added or changed. Only files that have changed since the checksums
+        were last written are hashed.
+        :param job_id: a job that has finished, or the parent job of a run split by lane
+        """
+        try:
+            self.checksum_service(self.config).submit(int(job_id))
+        except KeyError:
+            self.send_error(404, reason=f"Job {job_id} has not finished successfully")
+            return
+        reverse_url = self.reverse_url("checksums", job_id)
+        self.set_status(202, reason="writing checksums")
+        self.write_json({"job_id": int(job_id),
+                         "link": f"{self.request.protocol}://{self.request.host}{reverse_url}"})
+
+
+class RunQcHandler(BaseBclConvertHandler):
+    """
+    Get a summary of the quality of a run from the InterOp files of the runfolder.
+    """
+
+    # The InterOp files of a large run take long to parse, so they are read off the IOLoop
+    _qc_reads = ThreadPoolExecutor(max_workers=2, thread_name_prefix="run-qc")
+
+    @gen.coroutine
+    def get(self, runfolder):
+        """
+        Returns, per lane, the cluster density and density passing filter (in K/mm2), the
+        clusters and percent of clusters passing filter, the percent of bases with a quality
+        score of at least 30, the mean intensity of each channel at the first cycle, and the
+        clusters of each index, sample and project. Parts for which the runfolder has no
+        InterOp file are left out. The summary is kept until the InterOp files change.
+        :param runfolder: name of the runfolder
+        """
+        for runfolders_path in self.config["runfolder_path"]:
+            runfolder_input = os.path.join(runfolders_path, runfolder)
+            if os.path.isdir(runfolder_input):
+                break
+        else:
+            self.send_error(404, reason=f"No runfolder {runfolder}")
+            return
+
+        try:
+            qc = yield RunQcHandler._qc_reads.submit(get_run_qc, runfolder_input)
+        except FileNotFoundError as e:
+            self.send_error(404, reason=str(e))
+            return
+        self.write_json({"runfolder": runfolder, **qc})
+
+
+class PurgeStatusHandler(BaseBclConvertHandler, BclConvertServiceMixin):
+    """
+    Get the status of the background deletion of old output directories.
+    """
+
+    def get(self, purge_id):
+        """
+        Get the status of the specified purge, or if no id is given, the
+        status of all purges (pending, running and finished).
+        :param purge_id: to check status for (set to empty to get status for all)
+        """
+        if purge_id:
+            status = self.deletion_service(self.config).status(purge_id)
+            if not status:
+                self.send_error(404, reason=f"No purge with id {purge_id}")
+                return
+        else:
+            status = self.deletion_service(self.config).status_all()
+
+        self.write_json(status)
+
+
+class BclConvertLogHandler(BaseBclConvertHandler, BclConvertServiceMixin):
     """
     Gets the content of the log for a particular runfolder
     """
 
+    RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+    def initialize(self, config):
+        super().initialize(config)
+        self.closed = False
+
+    def on_connection_close(self):
+        self.closed = True
+
+    def has_unfinished_jobs(self, runfolder):
+        states = self.runner_service(self.config).status_all(runfolder=runfolder)
+        return any(state not in FINISHED_STATES for state in states.values())
+
+    def write_range(self, runfolder, range_header, max_read_bytes, log_path):
+        """
+        Answer a request for a single byte range of the log, see RFC 7233. A range that goes
+        beyond `max_read_bytes` is cut short, as stated in the Content-Range of the response.
+        """
+        match = BclConvertLogHandler.RANGE_PATTERN.match(range_header.strip())
+        size = self.bclconvert_log_file_provider.read_log(runfolder, 0, 0, log_path=log_path).size
+        if not match or not any(match.groups()):
+            self.set_status(416)
+            self.set_header("Content-Range", f"bytes */{size}")
+            return
+        first, last = match.groups()
+        if first:
+            start = int(first)
+            end = min(int(last) + 1, size) if last else size
+        else:
+            start = max(size - int(last), 0)
+            end = size
+        if start >= size or end <= start:
+            self.set_status(416)
+            self.set_header("Content-Range", f"bytes */{size}")
+            return
+
+        chunk = self.bclconvert_log_file_provider.read_log(runfolder, start, min(end - start, max_read_bytes),
+                                                           log_path=log_path)
+        self.set_status(206)
+        self.set_header("Content-Type", "text/plain; charset=UTF-8")
+        self.set_header("Content-Range", f"bytes {chunk.start}-{chunk.end - 1}/{chunk.size}")
+        self.write(chunk.content)
+
+    @gen.coroutine
+    def follow(self, runfolder, chunk, max_read_bytes, log_path):
+        """
+        Stream the log from the end of `chunk` as lines are written to it, until no job for the
+        runfolder is unfinished.
+        """
+        interval = get_config_value(self.config, "log_follow_interval", 1)
+        self.set_header("Content-Type", "text/plain; charset=UTF-8")
+        self.write(chunk.content)
+        position = chunk.end
+        try:
+            yield self.flush()
+            while not self.closed:
+                running = self.has_unfinished_jobs(runfolder)
+                chunk = self.bclconvert_log_file_provider.read_log(runfolder, position, max_read_bytes,
+                                                                   whole_lines=running, log_path=log_path)
+                if chunk.size < position:
+                    # The latest log is now the log of a new job
+                    position = 0
+                    continue
+                if chunk.content:
+                    self.write(chunk.content)
+                    yield self.flush()
+                    position = chunk.end
+                if chunk.end < chunk.size and chunk.content:
+                    continue
+                if not running:
+                    break
+                yield gen.sleep(interval)
+        except StreamClosedError:
+            pass
+
+    @gen.coroutine
     def get(self, runfolder):
         """
-        Get the content of the log for a particular runfolder
+        Get the content of the log for a particular runfolder, as {"runfolder": ..., "log": ...}.
+        Each job has a log of its own. The log of the latest job of the runfolder is returned, or
+        the log of the job given by the `job_id` query argument. Logs of finished jobs are kept
+        compressed, and can be read in the same way.
+
+        Parts of a large log can be read without reading all of it:
+         - offset and limit: read at most limit bytes from the byte offset (from the end of the
+           log if negative). The limit defaults to, and is capped at, `log_max_read_bytes` in the
+           config (1 MB by default).
+         - tail: read the last N lines
+        With either, the response also has the `offset` the part starts at, the `next_offset` to
+        continue reading from, and the `size` of the log.
+
+        A request with a Range header (a single range of bytes) is answered with that part of the
+        log as text/plain. Responses carry an ETag, and 304 is returned if the log has not changed
+        since the ETag in If-None-Match.
+
+        With follow=true the log is streamed as text/plain, from offset or the last tail lines
+        (the current end of the log if neither is given), as lines are written to it, until no
+        job for the runfolder is still queued or running.
         :param runfolder:
         :return:
         """
+        provider = self.bclconvert_log_file_provider
+        max_read_bytes = get_config_value(self.config, "log_max_read_bytes", 2 ** 20)
+        offset = self.get_argument("offset", None)
+        limit = self.get_argument("limit", None)
+        tail = self.get_argument("tail", None)
+        follow = self.get_argument("follow", "false").lower() == "true"
+        range_header = self.request.headers.get("Range")
+
         try:
-            log_content = self.bclconvert_log_file_provider.get_log_for_runfolder(runfolder)
-            response_data = {"runfolder": runfolder, "log": log_content}
-            self.set_status(200)
-            self.write_json(response_data)
+            job_id = self.get_argument("job_id", None)
+            if job_id is not None:
+                record = self.runner_service(self.config).registry.get(int(job_id))
+                if not record or record["runfolder"] != runfolder or not record["stdout"]:
+                    self.send_error(404, reason=f"No log for job {job_id} of {runfolder}")
+                    return
+                log_path = record["stdout"]
+            else:
+                log_path = None
+
+            try:
+                self.set_header("Etag", provider.etag(runfolder, log_path=log_path))
+            except OSError:
+                # Reported below when the log is read
+                pass
+            else:
+                if not follow and self.check_etag_header():
+                    self.set_status(304)
+                    return
+
+            if tail is not None:
+                chunk = provider.tail_log(runfolder, int(tail), log_path=log_path)
+            elif offset is not None or limit is not None or follow:
+                if follow and offset is None:
+                    offset = provider.read_log(runfolder, 0, 0, log_path=log_path).size
+                chunk = provider.read_log(runfolder, int(offset or 0),
+                                          min(int(limit), max_read_bytes) if limit else max_read_bytes,
+                                          log_path=log_path)
+            elif range_header:
+                self.write_range(runfolder, range_header, max_read_bytes, log_path)
+                return
+            else:
+                log_content = provider.get_log_for_runfolder(runfolder, log_path=log_path) if log_path \
+                    else provider.get_log_for_runfolder(runfolder)
+                response_data = {"runfolder": runfolder, "log": log_content}
+                self.set_status(200)
+                self.write_json(response_data)
+                return
+
+            if follow:
+                yield self.follow(runfolder, chunk, max_read_bytes, log_path)
+            else:
+                self.write_json({"runfolder": runfolder,
+                                 "log": chunk.content,
+                                 "offset": chunk.start,
+                                 "next_offset": chunk.end,
+                                 "size": chunk.size})
+        except ValueError as e:
+            self.send_error(400, reason=f"Invalid offset, limit or tail: {e}")
         except IOError as e:
             log.warning(f"Problem with accessing {runfolder}, message: {e}")
             self.send_error(500, reason=str(e))
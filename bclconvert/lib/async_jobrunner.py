@@ -0,0 +1,123 @@
+import asyncio
+import logging
+import subprocess
+import threading
+
+from arteria.web.state import State as arteria_state
+
+from bclconvert.lib.jobrunner import JobRunnerAdapter
+
+log = logging.getLogger(__name__)
+
+
+class _Job:
+    __slots__ = ("state", "exit_code", "process", "stop_requested")
+
+    def __init__(self):
+        self.state = arteria_state.PENDING
+        self.exit_code = None
+        self.process = None
+        self.stop_requested = False
+
+
+class AsyncioAdapter(JobRunnerAdapter):
+    """
+    An implementation of `JobRunnerAdapter` running jobs as child processes of the service, from an
+    asyncio event loop in a thread of its own. The loop is told as soon as a child exits, so a
+    finished job, and its exit code, is known at once instead of on the next poll, and the
+    listeners added with `add_finished_listener` are called.
+
+    Every job is started as soon as it is given to the adapter, so it should be wrapped in a
+    `ResourceAwareAdapter` which decides when a job fits on the node.
+    """
+
+    def __init__(self):
+        self._loop = asyncio.new_event_loop()
+        self._jobs = {}
+        self._next_job_id = 1
+        self._listeners = []
+        self._lock = threading.Lock()
+        thread = threading.Thread(target=self._loop.run_forever, name="jobrunner", daemon=True)
+        thread.start()
+
+    def add_finished_listener(self, listener):
+        self._listeners.append(listener)
+
+    async def _run(self, job_id, job, cmd, run_dir, stdout, stderr):
+        try:
+            output = open(stdout, "ab") if stdout else subprocess.DEVNULL
+            errors = output if stderr == stdout else open(stderr, "ab") if stderr else subprocess.DEVNULL
+            try:
+                if isinstance(cmd, str):
+                    job.process = await asyncio.create_subprocess_shell(cmd, cwd=run_dir, stdout=output, stderr=errors)
+                else:
+                    job.process = await asyncio.create_subprocess_exec(*map(str, cmd), cwd=run_dir,
+                                                                       stdout=output, stderr=errors)
+            finally:
+                # The child has its own copies of the files
+                for f in {output, errors}:
+                    if f is not subprocess.DEVNULL:
+                        f.close()
+            job.state = arteria_state.STARTED
+            if job.stop_requested:
+                job.process.terminate()
+            job.exit_code = await job.process.wait()
+            if job.exit_code == 0:
+                job.state = arteria_state.DONE
+            elif job.stop_requested:
+                job.state = arteria_state.CANCELLED
+            else:
+                job.state = arteria_state.ERROR
+        except Exception:
+            log.exception(f"Failed to run job {job_id}")
+            job.state = arteria_state.ERROR
+
+        for listener in self._listeners:
+            try:
+                listener(job_id)
+            except Exception:
+                log.exception(f"Failed to pass on that job {job_id} finished")
+
+    def start(self, cmd, nbr_of_cores, run_dir, stdout=None, stderr=None, memory_mb=None):
+        with self._lock:
+            job_id = self._next_job_id
+            self._next_job_id += 1
+            job = self._jobs[job_id] = _Job()
+        asyncio.run_coroutine_threadsafe(self._run(job_id, job, cmd, run_dir, stdout, stderr), self._loop)
+        return job_id
+
+    @staticmethod
+    def _terminate(process):
+        try:
+            process.terminate()
+        except ProcessLookupError:
+            # It has already exited
+            pass
+
+    def stop(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if not job:
+            return None
+        job.stop_requested = True
+        if job.process is not None and job.exit_code is None:
+            self._loop.call_soon_threadsafe(AsyncioAdapter._terminate, job.process)
+        return job_id
+
+    def stop_all(self):
+        with self._lock:
+            job_ids = list(self._jobs)
+        for job_id in job_ids:
+            self.stop(job_id)
+
+    def status(self, job_id):
+        job = self._jobs.get(job_id)
+        return job.state if job else arteria_state.NONE
+
+    def status_all(self):
+        with self._lock:
+            return {job_id: job.state for job_id, job in self._jobs.items()}
+
+    def exit_code(self, job_id):
+        job = self._jobs.get(job_id)
+        return job.exit_code if job else None
@@ -1,7 +1,35 @@
 # This file has been modified from the https://github.com/arteria-project/arteria-bcl2fastq repo
 # bcl2fastq/lib/bcl2fastq_logs.py
 
+import logging
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from bclconvert.lib.config_utils import get_config_value
+from bclconvert.lib.log_archive import ARCHIVE_SUFFIX, DEFAULT_BLOCK_SIZE, INDEX_SUFFIX, LogArchive, \
+    compress_log, remove_archive
+from bclconvert.lib.scheduler import FINISHED_STATES
+
+log = logging.getLogger(__name__)
+
+# A part of a log: its content, the byte offsets it starts and ends at, and the size of the whole log
+LogChunk = namedtuple("LogChunk", ["content", "start", "end", "size"])
+
+LOG_SUFFIX = ".log"
+
+
 class BclConvertLogFileProvider:
+    """
+    Finds the logs of runfolders. Each job writes a log of its own, `job_log_path`, in a directory
+    per runfolder, and logs are compressed to `LogArchive`s once their job has finished. Logs can be
+    read from a particular log, or from the latest log of the runfolder. Runfolders converted before
+    logs were kept per job have a single log, `log_file_path`.
+    """
+
+    # Size of the blocks read backwards from the end of a log to find its last lines
+    TAIL_BLOCK_SIZE = 64 * 1024
 
     def __init__(self, config):
         self.config = config
@@ -11,8 +39,193 @@ class BclConvertLogFileProvider:
         log_file = f"{log_base_path}/{runfolder}.log"
         return log_file
 
-    def get_log_for_runfolder(self, runfolder):
-        log_path = self.log_file_path(runfolder)
+    def job_log_dir(self, runfolder):
+        return os.path.join(self.config["bclconvert_logs_path"], runfolder)
+
+    def job_log_path(self, runfolder, suffix=None):
+        """
+        Create the directory for the logs of a runfolder, and return a new log path for a job
+        named by the time it was created, so that logs sort by age.
+        :param suffix: added to the name of the log, e.g. to tell the logs of lanes apart
+        """
+        log_dir = self.job_log_dir(runfolder)
+        os.makedirs(log_dir, exist_ok=True)
+        now = time.time()
+        name = time.strftime("%Y%m%d-%H%M%S", time.localtime(now)) + f"-{int(now % 1 * 1e6):06d}"
+        if suffix:
+            name += f"_{suffix}"
+        return os.path.join(log_dir, name + LOG_SUFFIX)
+
+    def job_logs(self, runfolder):
+        """
+        :return: the paths of the logs of the jobs of a runfolder, oldest first. A log that has
+                 been compressed is given as the path of its archive.
+        """
+        try:
+            names = os.listdir(self.job_log_dir(runfolder))
+        except (FileNotFoundError, NotADirectoryError):
+            return []
+        logs = {}
+        for name in names:
+            if name.endswith(LOG_SUFFIX):
+                # A log that is being compressed is read as it is until the archive is complete
+                logs[name] = name
+            elif name.endswith(LOG_SUFFIX + ARCHIVE_SUFFIX):
+                logs.setdefault(name[:-len(ARCHIVE_SUFFIX)], name)
+        return [os.path.join(self.job_log_dir(runfolder), logs[name]) for name in sorted(logs)]
+
+    def latest_log_path(self, runfolder):
+        """
+        :return: the path of the log of the latest job of the runfolder, or of its single log if
+                 the runfolder has no logs per job
+        """
+        logs = self.job_logs(runfolder)
+        return logs[-1] if logs else self.log_file_path(runfolder)
+
+    @staticmethod
+    def _current_path(log_path):
+        """
+        :return: `log_path`, or the path of its archive if the log has been compressed
+        """
+        if log_path.endswith(LOG_SUFFIX) and not os.path.exists(log_path) and \
+                os.path.exists(log_path + ARCHIVE_SUFFIX):
+            return log_path + ARCHIVE_SUFFIX
+        return log_path
+
+    def _open(self, runfolder, log_path):
+        """
+        :return: the size of the log, and a function reading (offset, limit) bytes from it
+        """
+        path = BclConvertLogFileProvider._current_path(log_path or self.latest_log_path(runfolder))
+        if path.endswith(ARCHIVE_SUFFIX):
+            archive = LogArchive(path)
+            return archive.size, archive.read
+
+        def read(offset, limit=None):
+            with open(path, "rb") as f:
+                f.seek(offset)
+                return f.read(limit) if limit is not None else f.read()
+
+        return os.path.getsize(path), read
+
+    def get_log_for_runfolder(self, runfolder, log_path=None):
+        log_path = BclConvertLogFileProvider._current_path(log_path or self.latest_log_path(runfolder))
+        if log_path.endswith(ARCHIVE_SUFFIX):
+            return LogArchive(log_path).read().decode(errors="replace")
         with open(log_path) as f:
             file_content = f.read()
         return file_content
+
+    def etag(self, runfolder, log_path=None):
+        """
+        :return: an entity tag that changes whenever the log is written to, replaced or compressed
+        """
+        stat = os.stat(BclConvertLogFileProvider._current_path(log_path or self.latest_log_path(runfolder)))
+        return f'"{stat.st_ino:x}-{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+    def read_log(self, runfolder, offset=0, limit=None, whole_lines=False, log_path=None):
+        """
+        Read part of the log, without reading the rest of it.
+        :param offset: byte offset to start reading at, negative to count from the end of the log
+        :param limit: maximum number of bytes to read, None to read to the end of the log
+        :param whole_lines: leave out a last line that has not been ended yet, unless it is all that was read
+        :param log_path: the log to read, by default the latest log of the runfolder
+        :return: a `LogChunk`
+        """
+        size, read = self._open(runfolder, log_path)
+        start = max(size + offset, 0) if offset < 0 else min(offset, size)
+        content = read(start, limit)
+        if whole_lines and b"\n" in content:
+            content = content[:content.rindex(b"\n") + 1]
+        elif whole_lines and start + len(content) == size:
+            content = b""
+        return LogChunk(content.decode(errors="replace"), start, start + len(content), size)
+
+    def tail_log(self, runfolder, nbr_of_lines, log_path=None):
+        """
+        Read the last lines of the log, reading blocks backwards from the end of the log.
+        :param nbr_of_lines: number of lines to read
+        :param log_path: the log to read, by default the latest log of the runfolder
+        :return: a `LogChunk`
+        """
+        size, read = self._open(runfolder, log_path)
+        start = size
+        content = b""
+        while start > 0:
+            start = max(start - BclConvertLogFileProvider.TAIL_BLOCK_SIZE, 0)
+            content = read(start, size - start)
+            # The newline ending the last line does not start another line
+            if content.count(b"\n", 0, max(len(content) - 1, 0)) >= nbr_of_lines:
+                break
+        ends_with_newline = content.endswith(b"\n")
+        lines = (content[:-1] if ends_with_newline else content).split(b"\n")[-nbr_of_lines:] if nbr_of_lines > 0 else []
+        kept = b"\n".join(lines) + (b"\n" if ends_with_newline and lines else b"")
+        return LogChunk(kept.decode(errors="replace"), size - len(kept), size, size)
+
+    def prune_logs(self, runfolder, keep_count, keep_bytes):
+        """
+        Remove the oldest compressed logs of a runfolder, keeping at most `keep_count` of them
+        and at most `keep_bytes` of compressed logs. The latest compressed log is always kept,
+        and logs that have not been compressed yet are never removed.
+        :return: the paths of the archives removed
+        """
+        archives = [path for path in self.job_logs(runfolder) if path.endswith(ARCHIVE_SUFFIX)]
+        kept_count = 0
+        kept_bytes = 0
+        removed = []
+        for archive in reversed(archives):
+            try:
+                archive_bytes = os.path.getsize(archive) + os.path.getsize(archive + INDEX_SUFFIX)
+            except FileNotFoundError:
+                continue
+            if kept_count and (kept_count >= keep_count or kept_bytes + archive_bytes > keep_bytes):
+                remove_archive(archive)
+                removed.append(archive)
+            else:
+                kept_count += 1
+                kept_bytes += archive_bytes
+        return removed
+
+
+class LogArchiver:
+    """
+    Compresses the log of each job once it has finished, and removes old logs of the runfolder,
+    see `BclConvertLogFileProvider.prune_logs`. Logs are compressed in a thread of their own so
+    that large logs do not hold up the job scheduler. Subscribe `on_event` to the `JobEvents` of
+    the scheduler.
+    """
+
+    def __init__(self, config, registry):
+        """
+        :param config: the configuration, read for `log_archive_block_bytes`, `log_retention_count`
+                       and `log_retention_bytes`
+        :param registry: the `JobRegistry` the logs of jobs are looked up in
+        """
+        self.provider = BclConvertLogFileProvider(config)
+        self.registry = registry
+        self.block_size = get_config_value(config, "log_archive_block_bytes", DEFAULT_BLOCK_SIZE)
+        self.keep_count = get_config_value(config, "log_retention_count", 10)
+        self.keep_bytes = get_config_value(config, "log_retention_bytes", 2 ** 30)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="log-archiver")
+
+    def on_event(self, event):
+        if event["state"] in FINISHED_STATES:
+            self._executor.submit(self.archive, event["job_id"], event["runfolder"])
+
+    def archive(self, job_id, runfolder):
+        """
+        Compress the log of a job, and remove old logs of its runfolder.
+        """
+        try:
+            record = self.registry.get(job_id)
+            log_path = record["stdout"] if record else None
+            # Only logs of single jobs are compressed, not a log a runfolder had before logs were kept per job
+            if not log_path or not runfolder or os.path.dirname(log_path) != self.provider.job_log_dir(runfolder) \
+                    or not log_path.endswith(LOG_SUFFIX) or not os.path.exists(log_path):
+                return
+            archive = compress_log(log_path, self.block_size)
+            log.info(f"Compressed the log of job {job_id} to {archive}")
+            for removed in self.provider.prune_logs(runfolder, self.keep_count, self.keep_bytes):
+                log.info(f"Removed the old log {removed}")
+        except Exception:
+            log.exception(f"Failed to archive the log of job {job_id}")
@@ -2,17 +2,16 @@ import subprocess
 import os
 import re
 import errno
-from itertools import groupby
 import logging
 import shutil
+import tempfile
 import time
 
 
-import xmltodict
-
-
 from arteria.exceptions import ArteriaUsageException
-from bclconvert.lib.illumina import Samplesheet
+from bclconvert.lib.config_utils import get_config_value
+from bclconvert.lib.runinfo import get_runinfo
+from bclconvert.lib.scheduler import estimate_memory_mb
 
 log = logging.getLogger(__name__)
 
@@ -39,7 +38,9 @@ class BclConvertConfig:
                  bcl_num_conversion_threads=None,
                  bcl_num_compression_threads=None,
                  bcl_num_decompression_threads=None,
-                 additional_args=None):
+                 additional_args=None,
+                 thread_plan=None,
+                 split_lanes=False):
         """
         Instantiate BclConvertConfig
         :param general_config: a dict containing general configuration.
@@ -49,7 +50,8 @@ class BclConvertConfig:
         :param output: where the output of bclconvert should be placed
         :param samplesheet: a samplesheet as a raw string - if none is provided the samplesheet in the
                             runfolder will be used. If it is specified this provided string will be
-                            written to a file and passed to bclconvert.
+                            written to a temporary file, and into the runfolder by `prepare`, and
+                            passed to bclconvert.
         :param barcode_mismatches: how many mismatches to allow in tag.
         :param tiles: tiles to include when running bclconvert
         :param exclude_tiles: tiles to exclude when running bclconvert
@@ -61,23 +63,23 @@ class BclConvertConfig:
         :bcl_num_compression_threads number of compression threads, default 1
         :bcl_num_decompression_threads number of decompression threads, default 1
         :param additional_args: this can be used to pass any other arguments to bclconvert
+        :param thread_plan: the `ThreadPlan` the thread counts were chosen from, if they were auto-tuned
+        :param split_lanes: convert each lane as a separate job, and merge the output when all are done
         """
 
         self.general_config = general_config
 
         self.runfolder_input = runfolder_input
 
+        self.samplesheet = samplesheet or None
         if not samplesheet:
             self.samplesheet_file = runfolder_input + "/SampleSheet.csv"
         else:
             log.debug("Got a new samplesheet. Will use that instead of the one found in the runfolder.")
-            new_samplesheet_file = runfolder_input + "/SampleSheet.csv"
-
-            if os.path.exists(new_samplesheet_file):
-                BclConvertConfig.copy_old_samplesheet(new_samplesheet_file)
-
-            BclConvertConfig.write_samplesheet(samplesheet, new_samplesheet_file)
-            self.samplesheet_file = new_samplesheet_file
+            # Nothing is written to the runfolder until the request has been checked, see `prepare`
+            fd, self.samplesheet_file = tempfile.mkstemp(prefix="SampleSheet.", suffix=".csv")
+            os.close(fd)
+            BclConvertConfig.write_samplesheet(samplesheet, self.samplesheet_file)
 
         if bclconvert_version:
             self.bclconvert_version = bclconvert_version
@@ -91,8 +93,7 @@ class BclConvertConfig:
             output_base = general_config["default_output_path"]
             runfolder_base_name = os.path.basename(runfolder_input)
             self.output = os.path.join(output_base, runfolder_base_name)
-            if not os.path.exists(self.output):
-                os.mkdir(self.output)
+        self.default_output = not output
 
         self.barcode_mismatches = barcode_mismatches
         self.exclude_tiles = exclude_tiles
@@ -105,10 +106,8 @@ class BclConvertConfig:
         self.use_base_mask = use_base_mask
         self.additional_args = additional_args
         self.create_indexes = create_indexes
-
-        # Nbr of cores to use will default to the number of cpus on the system.
-        import multiprocessing
-        self.nbr_of_cores = multiprocessing.cpu_count()
+        self.thread_plan = thread_plan
+        self.split_lanes = split_lanes
 
         self.bcl_sampleproject_subdirectories = general_config["bcl_sampleproject_subdirectories"]
         self.sample_name_column_enabled = general_config["sample_name_column_enabled"]
@@ -138,9 +137,46 @@ class BclConvertConfig:
         else:
             self.bcl_num_decompression_threads = general_config["bcl_num_decompression_threads"]
 
-        threads_requested = self.bcl_num_conversion_threads + self.bcl_num_compression_threads + self.bcl_num_decompression_threads
-        if self.nbr_of_cores < threads_requested:
-            logging.warning(f"bcl-convert will use {threads_requested} threads, {self.nbr_of_cores} exist!")
+        # bcl-convert runs the threads of each stage for every tile it processes in parallel
+        threads_requested = int(self.bcl_num_parallel_tiles) * (
+            self.bcl_num_conversion_threads + self.bcl_num_compression_threads + self.bcl_num_decompression_threads)
+
+        # Reserve the cores bcl-convert will actually use, rather than the whole node, so that small
+        # conversions can run next to large ones, capped at the cores the node has.
+        import multiprocessing
+        node_cores = get_config_value(general_config, "node_cores", multiprocessing.cpu_count())
+        if node_cores < threads_requested:
+            logging.warning(f"bcl-convert will use {threads_requested} threads, {node_cores} exist!")
+        self.nbr_of_cores = min(threads_requested, node_cores)
+        self.memory_mb = estimate_memory_mb(threads_requested, general_config)
+
+    def prepare(self):
+        """
+        Write the samplesheet given in the request into the runfolder, keeping a copy of the one
+        there, and create the default output directory. Called once the request has been checked,
+        so that a request that is refused leaves the runfolder and the output as they were.
+        """
+        new_samplesheet_file = self.runfolder_input + "/SampleSheet.csv"
+        if self.samplesheet and self.samplesheet_file != new_samplesheet_file:
+            if os.path.exists(new_samplesheet_file):
+                BclConvertConfig.copy_old_samplesheet(new_samplesheet_file)
+            BclConvertConfig.write_samplesheet(self.samplesheet, new_samplesheet_file)
+            self.discard()
+            self.samplesheet_file = new_samplesheet_file
+
+        if self.default_output and not os.path.exists(self.output):
+            os.mkdir(self.output)
+
+    def discard(self):
+        """
+        Remove the temporary file the samplesheet given in the request was written to, if it has
+        not been written into the runfolder.
+        """
+        if self.samplesheet and self.samplesheet_file != self.runfolder_input + "/SampleSheet.csv":
+            try:
+                os.remove(self.samplesheet_file)
+            except FileNotFoundError:
+                pass
 
     @staticmethod
     def copy_old_samplesheet(new_samplesheet_file):
@@ -156,6 +192,8 @@ class BclConvertConfig:
 
     @staticmethod
     def runinfo_as_dict(runfolder):
+        import xmltodict
+
         runinfo_path = os.path.join(runfolder, "RunInfo.xml")
         with open(runinfo_path) as f:
             return xmltodict.parse(f.read())
@@ -171,8 +209,7 @@ class BclConvertConfig:
         :return the version of bclconvert to use.
         """
 
-        run_info = BclConvertConfig.runinfo_as_dict(runfolder)
-        instrument_name = run_info["RunInfo"]["Run"]["Instrument"]
+        instrument_name = get_runinfo(runfolder).instrument
 
         machine_type_mappings = {"M": "MiSeq",
                                  "D": "HiSeq 2500",
@@ -201,22 +238,11 @@ class BclConvertConfig:
                  {2: 7, 3: 8}
         """
 
-        run_info = BclConvertConfig.runinfo_as_dict(runfolder)
-        reads = run_info["RunInfo"]["Run"]["Reads"]["Read"]
-
-        index_lengths = {}
-        for read in reads:
-            if read['@IsIndexedRead'] == 'Y':
-                index_lengths[int(read['@Number'])] = int(read['@NumCycles'])
-        return index_lengths
+        return get_runinfo(runfolder).index_lengths
 
     @staticmethod
     def is_single_read(runfolder):
-        run_info = BclConvertConfig.runinfo_as_dict(runfolder)
-        reads = run_info["RunInfo"]["Run"]["Reads"]["Read"]
-
-        nbr_of_reads = len(list(filter(lambda x: not x["@IsIndexedRead"] == 'Y', reads)))
-        return nbr_of_reads < 2
+        return get_runinfo(runfolder).is_single_read
 
     @staticmethod
     def get_bases_mask_per_lane_from_samplesheet(samplesheet, index_lengths, is_single_read):
@@ -278,15 +304,8 @@ class BclConvertConfig:
             else:
                 return ",".join(["y*"] + idx_masks + ["y*"])
 
-        def by_lane(x):
-            return x.lane
-        sample_rows_sorted_by_lane = sorted(samplesheet.samples, key=by_lane)
-        lanes_and_indexes = groupby(sample_rows_sorted_by_lane, by_lane)
-
-        first_sample_in_each_lane = {k: next(v) for k, v in lanes_and_indexes}
-
         base_masks = {}
-        for lane, sample_row in first_sample_in_each_lane.items():
+        for lane, sample_row in samplesheet.first_sample_per_lane().items():
             if sample_row.index2:
                 base_masks[lane] = construct_base_mask([sample_row.index1.strip(), sample_row.index2.strip()])
             else:
@@ -366,6 +385,22 @@ class BclConvertConfig:
         else:
             return convert(lanes_spec)
 
+    @staticmethod
+    def parse_lanes(lanes_spec):
+        """
+        Expand a lane specification, as accepted by `parse_lanes_to_tiles_regex`, into lane numbers.
+        E.g. "13-5" -> [1, 3, 4, 5]
+        :param lanes_spec: Lane specification string
+        :return: sorted list of lane numbers
+        :raises ArteriaUsageException: If format is invalid
+        """
+        BclConvertConfig.parse_lanes_to_tiles_regex(lanes_spec)
+        lanes = set()
+        for part in re.findall(r'\d-\d|\d', lanes_spec):
+            start, _, end = part.partition("-")
+            lanes.update(range(int(start), int(end or start) + 1))
+        return sorted(lanes)
+
 
 class BclConvertRunnerFactory:
     """
@@ -443,6 +478,29 @@ class BaseBclConvertRunner(object):
         """
         raise NotImplementedError("Subclasses should implement this!")
 
+    def preflight(self):
+        """
+        Check the samplesheet against the RunInfo.xml of the runfolder, so that problems such as
+        colliding barcodes are found before the conversion is started rather than by bcl-convert.
+        :return: the `PreflightReport` of the checks
+        :raises PreflightError: if any of the checks failed
+        """
+        from bclconvert.lib.illumina import Samplesheet
+        from bclconvert.lib.preflight import PreflightError, PreflightReport, run_preflight
+
+        try:
+            samplesheet = Samplesheet(self.config.samplesheet_file)
+        except (AssertionError, OSError) as e:
+            report = PreflightReport()
+            report.add_error("samplesheet", f"Could not read samplesheet {self.config.samplesheet_file}: {e}")
+            raise PreflightError(report)
+
+        report = run_preflight(samplesheet, get_runinfo(self.config.runfolder_input), self.config.barcode_mismatches)
+        if not report.ok:
+            log.warning(f"Preflight checks failed for {self.config.runfolder_input}: {report.summary()}")
+            raise PreflightError(report)
+        return report
+
     def validate_output(self):
 
         def _parent_dir(d):
@@ -457,12 +515,18 @@ class BaseBclConvertRunner(object):
             log.error(error_string)
             raise ArteriaUsageException(error_string)
 
-    def delete_output(self):
+    def delete_output(self, deletion_service=None):
         """
         Delete the output directory if it exists and  the output path is valid
-        :return: None
+        :param deletion_service: if given, the output is handed to this `OutputDeletionService`,
+                                 which moves it out of the way at once and purges it in the background.
+                                 Otherwise it is removed before returning.
+        :return: the `Purge` tracking the deletion if a deletion service was used, else None
         """
         self.validate_output()
+        if deletion_service:
+            return deletion_service.delete(self.config.output)
+
         log.info(f"Found a directory at output path {self.config.output}, will remove it.")
         try:
             shutil.rmtree(self.config.output)
@@ -515,6 +579,7 @@ class BclConvertRunner(BaseBclConvertRunner):
         return self.config.bclconvert_version
 
     def construct_command(self):
+        from bclconvert.lib.illumina import Samplesheet
 
         ##################################
         # First run configurebclconvert.pl
@@ -0,0 +1,201 @@
+import hashlib
+import json
+import logging
+import mmap
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from arteria.web.state import State as arteria_state
+
+from bclconvert.lib.lane_split import STAGING_DIR_NAME
+from bclconvert.lib.progress import job_output_dir
+
+log = logging.getLogger(__name__)
+
+# The manifest, with the size, mtime and inode each checksum was computed for
+MANIFEST_FILE_NAME = "checksums.json"
+# The checksums in the format of md5sum and sha256sum, which can be checked with `md5sum -c`
+CHECKSUM_FILE_NAMES = {"md5": "md5sums.txt", "sha256": "sha256sums.txt"}
+
+MANIFEST_FILES = (MANIFEST_FILE_NAME,) + tuple(CHECKSUM_FILE_NAMES.values())
+
+# Bytes hashed at a time from files that can not be memory mapped
+BUFFER_BYTES = 8 * 1024 * 1024
+
+# Most processes hashing the files of a job by default. Jobs are hashed once they have released
+# their cores to the scheduler, so the hashing must not take them all.
+DEFAULT_WORKERS = 4
+
+
+def hash_file(path):
+    """
+    :return: the path, and the md5 and sha256 of the file as hex strings
+    """
+    md5 = hashlib.md5()
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        try:
+            # Hashing a mapping avoids copying the file, and hashlib releases the GIL while hashing it
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                md5.update(mapped)
+                sha256.update(mapped)
+        except (ValueError, OSError):
+            # Empty files, and files on file systems that can not be mapped
+            buffer = bytearray(BUFFER_BYTES)
+            view = memoryview(buffer)
+            while True:
+                size = f.readinto(buffer)
+                if not size:
+                    break
+                md5.update(view[:size])
+                sha256.update(view[:size])
+    return path, md5.hexdigest(), sha256.hexdigest()
+
+
+def _output_files(output):
+    """
+    :return: dict with the os.stat_result of each file in the output by its path relative to the output
+    """
+    files = {}
+    for dir_path, dir_names, file_names in os.walk(output):
+        if dir_path == output:
+            dir_names[:] = [name for name in dir_names if name != STAGING_DIR_NAME]
+            file_names = [name for name in file_names if name not in MANIFEST_FILES and not name.startswith(".")]
+        for file_name in file_names:
+            path = os.path.join(dir_path, file_name)
+            files[os.path.relpath(path, output)] = os.stat(path)
+    return files
+
+
+def read_manifest(output):
+    """
+    :return: the manifest of the output as a dict with the size, mtime_ns, inode, md5 and sha256 of
+             each file by its path relative to the output, or an empty dict if there is none
+    """
+    try:
+        with open(os.path.join(output, MANIFEST_FILE_NAME)) as f:
+            return json.load(f)["files"]
+    except (OSError, ValueError, KeyError):
+        return {}
+
+
+def _write_atomically(path, content):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def update_manifest(output, nbr_of_workers=1):
+    """
+    Compute the md5 and sha256 of every file in the output of a conversion, and write them to the
+    manifest in the output, and to files in the format of md5sum and sha256sum. Files with the same
+    size, mtime and inode as when the manifest was last written are not hashed again. The files
+    are hashed in parallel by a pool of processes.
+    :param output: the output directory of the conversion
+    :param nbr_of_workers: number of processes hashing files
+    :return: the manifest, see `read_manifest`
+    """
+    previous = read_manifest(output)
+    manifest = {}
+    changed = []
+    for relative_path, stat in _output_files(output).items():
+        entry = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "inode": stat.st_ino}
+        known = previous.get(relative_path)
+        if known and all(known.get(key) == value for key, value in entry.items()):
+            manifest[relative_path] = known
+        else:
+            manifest[relative_path] = entry
+            changed.append(relative_path)
+
+    # Hashing the largest files first keeps the workers busy until the end
+    paths = [os.path.join(output, relative_path)
+             for relative_path in sorted(changed, key=lambda path: manifest[path]["size"], reverse=True)]
+    if nbr_of_workers > 1 and len(paths) > 1:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        # The service runs threads, which must not be forked
+        with ProcessPoolExecutor(max_workers=min(nbr_of_workers, len(paths)),
+                                 mp_context=multiprocessing.get_context("spawn")) as executor:
+            results = list(executor.map(hash_file, paths))
+    else:
+        results = [hash_file(path) for path in paths]
+    for path, md5, sha256 in results:
+        manifest[os.path.relpath(path, output)].update(md5=md5, sha256=sha256)
+
+    for algorithm, file_name in CHECKSUM_FILE_NAMES.items():
+        _write_atomically(os.path.join(output, file_name),
+                          "".join(f"{manifest[path][algorithm]}  {path}\n" for path in sorted(manifest)))
+    _write_atomically(os.path.join(output, MANIFEST_FILE_NAME), json.dumps({"files": manifest}, indent=1))
+    log.info(f"Wrote checksums of {len(manifest)} files in {output}, {len(changed)} of them hashed")
+    return manifest
+
+
+class ChecksumService:
+    """
+    Writes a checksum manifest (see `update_manifest`) to the output of each job once it has
+    finished. Subscribe `on_event` to the `JobEvents` of the scheduler. Manifests are written one
+    at a time in the background.
+    """
+
+    def __init__(self, registry, nbr_of_workers=None):
+        """
+        :param registry: the `JobRegistry` the output directories of jobs are looked up in
+        :param nbr_of_workers: number of processes hashing files, None to use the cores reserved by
+                               the job, but at most `DEFAULT_WORKERS`, or `DEFAULT_WORKERS` for
+                               jobs that do not reserve any
+        """
+        self.registry = registry
+        self.nbr_of_workers = nbr_of_workers
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="checksums")
+        self._lock = threading.Lock()
+        # Jobs whose manifest is being written or waits to be
+        self._queued = set()
+
+    def on_event(self, event):
+        # Lane jobs are merged into the output of their group, which is hashed instead
+        if event["state"] == arteria_state.DONE and event["parent_id"] is None:
+            self.submit(event["job_id"])
+
+    def output(self, job_id):
+        """
+        :return: the output directory of a job that has finished successfully
+        :raises KeyError: if there is no such job, or it has not finished successfully
+        """
+        record = self.registry.get(job_id)
+        if not record or record["state"] != arteria_state.DONE or record["parent_id"] is not None:
+            raise KeyError(job_id)
+        output = job_output_dir(record)
+        if not output:
+            raise KeyError(job_id)
+        return output
+
+    def submit(self, job_id):
+        """
+        Write the manifest of a job in the background, unless it is already about to be written.
+        :return: True if the manifest was queued
+        :raises KeyError: if there is no such job, or it has not finished successfully
+        """
+        output = self.output(job_id)
+        with self._lock:
+            if job_id in self._queued:
+                return False
+            self._queued.add(job_id)
+        self._executor.submit(self._update, job_id, output)
+        return True
+
+    def is_pending(self, job_id):
+        with self._lock:
+            return job_id in self._queued
+
+    def _update(self, job_id, output):
+        try:
+            nbr_of_workers = self.nbr_of_workers or min(self.registry.get(job_id)["cores"] or DEFAULT_WORKERS, DEFAULT_WORKERS)
+            update_manifest(output, nbr_of_workers)
+        except Exception:
+            log.exception(f"Failed to write the checksums of job {job_id}")
+        finally:
+            with self._lock:
+                self._queued.discard(job_id)
@@ -0,0 +1,17 @@
+def get_config_value(config, key, default=None):
+    """
+    Get an optional setting from the configuration. The configuration service only supports
+    item access, so settings that are missing from an older app.config (or are set to null)
+    fall back to `default` instead of raising a KeyError.
+    :param config: the configuration to read from
+    :param key: the setting to look up
+    :param default: value to use if the setting is missing
+    :return: the configured value, or `default`
+    """
+    try:
+        value = config[key]
+    except KeyError:
+        return default
+    if value is None:
+        return default
+    return value
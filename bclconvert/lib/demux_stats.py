@@ -0,0 +1,225 @@
+import csv
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from arteria.web.state import State as arteria_state
+
+from bclconvert.lib.lane_split import REPORTS_DIR_NAME
+from bclconvert.lib.progress import job_output_dir
+from bclconvert.lib.signature_cache import SignatureCache, file_signature
+
+log = logging.getLogger(__name__)
+
+DEMULTIPLEX_STATS_FILE = "Demultiplex_Stats.csv"
+QUALITY_METRICS_FILE = "Quality_Metrics.csv"
+TOP_UNKNOWN_BARCODES_FILE = "Top_Unknown_Barcodes.csv"
+SAMPLESHEET_FILE = "SampleSheet.csv"
+
+REPORT_FILES = (DEMULTIPLEX_STATS_FILE, QUALITY_METRICS_FILE, TOP_UNKNOWN_BARCODES_FILE, SAMPLESHEET_FILE)
+
+UNDETERMINED = "Undetermined"
+
+
+def _read_csv(path):
+    """
+    :return: the rows of a csv report as dicts, or an empty list if there is no such report
+    """
+    try:
+        with open(path, newline="") as f:
+            return list(csv.DictReader(f))
+    except FileNotFoundError:
+        return []
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _percent(part, whole):
+    return round(100.0 * part / whole, 2) if whole else None
+
+
+class _Counts:
+    """
+    Reads, index matches and yield added up over rows of the reports.
+    """
+    __slots__ = ("reads", "perfect", "one_mismatch", "two_mismatch", "yield_bases", "yield_q30")
+
+    def __init__(self):
+        self.reads = 0
+        self.perfect = 0
+        self.one_mismatch = 0
+        self.two_mismatch = 0
+        self.yield_bases = 0
+        self.yield_q30 = 0
+
+    def add_demultiplexing(self, row):
+        self.reads += int(_number(row.get("# Reads")))
+        self.perfect += int(_number(row.get("# Perfect Index Reads")))
+        self.one_mismatch += int(_number(row.get("# One Mismatch Index Reads")))
+        self.two_mismatch += int(_number(row.get("# Two Mismatch Index Reads")))
+
+    def add_quality(self, row):
+        self.yield_bases += int(_number(row.get("Yield")))
+        self.yield_q30 += int(_number(row.get("YieldQ30")))
+
+    def as_dict(self, lane_reads=None):
+        counts = {"reads": self.reads,
+                  "percent_perfect_index": _percent(self.perfect, self.reads),
+                  "percent_one_mismatch_index": _percent(self.one_mismatch, self.reads),
+                  "percent_two_mismatch_index": _percent(self.two_mismatch, self.reads),
+                  "yield": self.yield_bases,
+                  "percent_q30": _percent(self.yield_q30, self.yield_bases)}
+        if lane_reads is not None:
+            counts["percent_of_lane"] = _percent(self.reads, lane_reads)
+        return counts
+
+
+def _sample_projects(samplesheet_path):
+    """
+    :return: a dict with the project of each sample id in the samplesheet
+    """
+    from bclconvert.lib.illumina import Samplesheet
+
+    try:
+        samplesheet = Samplesheet(samplesheet_path)
+    except (AssertionError, OSError, ValueError) as e:
+        log.debug(f"Could not read the projects of the samples from {samplesheet_path}: {e}")
+        return {}
+    return {sample.sample_id: sample.sample_project for sample in samplesheet.samples}
+
+
+def parse_reports(output):
+    """
+    Aggregate the demultiplexing reports bcl-convert wrote to the Reports directory of `output`
+    per lane, sample and project.
+    :param output: the output directory of the conversion
+    :return: a dict with:
+              - lanes: per lane, the reads, the fraction of them that were undetermined, index
+                       match rates, yield and percent of bases >= Q30, and the same for each
+                       sample in the lane, with the percent of the lane it got
+              - samples: per sample, its project and the same counts over all lanes
+              - projects: per project, its samples and the same counts over all lanes
+              - top_unknown_barcodes: per lane, the most common barcodes not in the samplesheet
+    :raises FileNotFoundError: if there is no Demultiplex_Stats.csv in the output
+    """
+    reports = os.path.join(output, REPORTS_DIR_NAME)
+    demultiplex_stats_path = os.path.join(reports, DEMULTIPLEX_STATS_FILE)
+    if not os.path.exists(demultiplex_stats_path):
+        raise FileNotFoundError(f"No {DEMULTIPLEX_STATS_FILE} in {reports}")
+
+    projects_of_samples = _sample_projects(os.path.join(reports, SAMPLESHEET_FILE))
+    lanes = {}
+    lane_samples = {}
+    samples = {}
+    projects = {}
+    undetermined = {}
+
+    def counts_of(lane, sample_id):
+        lane_counts = lanes.setdefault(lane, _Counts())
+        if sample_id == UNDETERMINED:
+            return lane_counts, [undetermined.setdefault(lane, _Counts())]
+        project = projects_of_samples.get(sample_id)
+        return lane_counts, [lane_samples.setdefault(lane, {}).setdefault(sample_id, _Counts()),
+                             samples.setdefault(sample_id, _Counts()),
+                             projects.setdefault(project, _Counts())]
+
+    for row in _read_csv(demultiplex_stats_path):
+        lane_counts, sample_counts = counts_of(row["Lane"], row["SampleID"])
+        lane_counts.add_demultiplexing(row)
+        for counts in sample_counts:
+            counts.add_demultiplexing(row)
+
+    for row in _read_csv(os.path.join(reports, QUALITY_METRICS_FILE)):
+        lane_counts, sample_counts = counts_of(row["Lane"], row["SampleID"])
+        lane_counts.add_quality(row)
+        for counts in sample_counts:
+            counts.add_quality(row)
+
+    top_unknown_barcodes = {}
+    for row in _read_csv(os.path.join(reports, TOP_UNKNOWN_BARCODES_FILE)):
+        barcode = {"index": row.get("index"), "reads": int(_number(row.get("# Reads"))),
+                   # The shares are fractions in the report
+                   "percent_of_unknown": round(_number(row.get("% of Unknown Barcodes")) * 100, 2),
+                   "percent_of_lane": round(_number(row.get("% of All Reads")) * 100, 2)}
+        if row.get("index2"):
+            barcode["index2"] = row["index2"]
+        top_unknown_barcodes.setdefault(row["Lane"], []).append(barcode)
+
+    samples_of_projects = {}
+    for sample_id in samples:
+        samples_of_projects.setdefault(projects_of_samples.get(sample_id), []).append(sample_id)
+
+    lane_stats = {}
+    for lane, counts in sorted(lanes.items(), key=lambda item: int(item[0])):
+        lane_stats[lane] = counts.as_dict()
+        undetermined_reads = undetermined[lane].reads if lane in undetermined else 0
+        lane_stats[lane]["undetermined_reads"] = undetermined_reads
+        lane_stats[lane]["undetermined_fraction"] = round(undetermined_reads / counts.reads, 4) if counts.reads else None
+        lane_stats[lane]["samples"] = {sample_id: sample_counts.as_dict(lane_reads=counts.reads)
+                                       for sample_id, sample_counts in lane_samples.get(lane, {}).items()}
+
+    return {"lanes": lane_stats,
+            "samples": {sample_id: dict(counts.as_dict(), project=projects_of_samples.get(sample_id))
+                        for sample_id, counts in samples.items()},
+            "projects": {str(project): dict(counts.as_dict(), samples=samples_of_projects.get(project, []))
+                         for project, counts in projects.items()},
+            "top_unknown_barcodes": top_unknown_barcodes}
+
+
+class DemuxStatsService:
+    """
+    Parses the demultiplexing reports of each job once it has finished, and keeps the result so
+    that it can be served without reading the reports again. Subscribe `on_event` to the
+    `JobEvents` of the scheduler. Stats of jobs that finished before the service was started are
+    parsed the first time they are asked for. An entry is only reused as long as the reports of
+    the job are unchanged, and the least recently used entries are evicted once `maxsize` jobs
+    are cached.
+    """
+
+    def __init__(self, registry, maxsize=256):
+        """
+        :param registry: the `JobRegistry` the output directories of jobs are looked up in
+        :param maxsize: most jobs to keep the stats of
+        """
+        self.registry = registry
+        self._cache = SignatureCache(maxsize)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="demux-stats")
+
+    def on_event(self, event):
+        # Lane jobs are merged into the output of their group, whose reports are parsed instead
+        if event["state"] == arteria_state.DONE and event["parent_id"] is None:
+            self._executor.submit(self._parse_finished, event["job_id"])
+
+    def _parse_finished(self, job_id):
+        try:
+            self.get(job_id)
+        except FileNotFoundError as e:
+            log.info(f"No demultiplexing stats for job {job_id}: {e}")
+        except Exception:
+            log.exception(f"Failed to parse the demultiplexing stats of job {job_id}")
+
+    def get(self, job_id):
+        """
+        :param job_id: a job that has finished
+        :return: the `parse_reports` of the output of the job, with the job id and runfolder
+        :raises KeyError: if there is no such job, or it has not finished successfully
+        :raises FileNotFoundError: if the job has no demultiplexing reports
+        """
+        record = self.registry.get(job_id)
+        if not record or record["state"] != arteria_state.DONE or record["parent_id"] is not None:
+            raise KeyError(job_id)
+        output = job_output_dir(record)
+        if not output:
+            raise FileNotFoundError(f"The output directory of job {job_id} is not known")
+        signature = file_signature(os.path.join(output, REPORTS_DIR_NAME, name) for name in REPORT_FILES)
+        return self._cache.lookup(
+            job_id, signature,
+            lambda: dict(parse_reports(output), job_id=job_id, runfolder=record["runfolder"], output=output))
+
+    def __len__(self):
+        return len(self._cache)
@@ -0,0 +1,175 @@
+import logging
+import os
+
+from bclconvert.lib.interop import INTEROP_DIR_NAME, TILE_METRICS_FILE, InteropFormatError, read_tile_metrics
+from bclconvert.lib.preflight import PreflightError, PreflightReport
+from bclconvert.lib.progress import command_option, job_output_dir, tile_selector
+from bclconvert.lib.runinfo import get_runinfo
+from bclconvert.lib.scheduler import FINISHED_STATES
+
+log = logging.getLogger(__name__)
+
+# bcl-convert compresses fastq files with gzip level 1 unless told otherwise
+DEFAULT_COMPRESSION_LEVEL = 1
+
+# Size of a fastq.gz file relative to the uncompressed fastq, by gzip compression level. These
+# are on the high side of what binned quality scores compress to, so that the estimate errs on
+# the side of needing more space.
+COMPRESSION_RATIOS = {0: 1.0, 1: 0.32, 2: 0.31, 3: 0.30, 4: 0.29, 5: 0.28, 6: 0.28, 7: 0.27, 8: 0.27, 9: 0.27}
+
+# Bytes of a fastq record header apart from the index, e.g. "@A00123:45:HABCDEFGH:1:1101:12345:1000 1:N:0:"
+HEADER_BYTES = 50
+
+
+def _human(nbr_of_bytes):
+    for unit in ("B", "KB", "MB", "GB", "TB"):
+        if abs(nbr_of_bytes) < 1024 or unit == "TB":
+            return f"{nbr_of_bytes:.1f} {unit}" if unit != "B" else f"{nbr_of_bytes} B"
+        nbr_of_bytes /= 1024
+
+
+def pf_clusters(runfolder, tiles=None, exclude_tiles=None):
+    """
+    :param runfolder: path to the runfolder
+    :param tiles: the tiles converted, as given to bcl-convert, see `tile_selector`
+    :param exclude_tiles: the tiles left out, as given to bcl-convert
+    :return: the number of clusters passing filter in the tiles converted, according to the
+             InterOp files of the runfolder, or None if they do not say
+    """
+    path = os.path.join(runfolder, INTEROP_DIR_NAME, TILE_METRICS_FILE)
+    try:
+        tile_metrics = read_tile_metrics(path)
+    except FileNotFoundError:
+        return None
+    except (InteropFormatError, OSError, ValueError) as e:
+        log.warning(f"Could not read the clusters of {runfolder}: {e}")
+        return None
+    selected = tile_selector(tiles)
+    excluded = tile_selector(exclude_tiles)
+    clusters = 0.0
+    for lane, tile, clusters_pf in zip(tile_metrics["lane"], tile_metrics["tile"], tile_metrics["clusters_pf"]):
+        name = f"s_{lane}_{tile}"
+        if (selected and not selected(name)) or (excluded and excluded(name)) or clusters_pf != clusters_pf:
+            continue
+        clusters += clusters_pf
+    return int(clusters)
+
+
+def estimate_output_bytes(runfolder, tiles=None, exclude_tiles=None, compression_level=None):
+    """
+    Estimate the size of the fastq files a conversion writes: a record per cluster passing filter
+    in each data read, of the header with the index, the bases and the qualities, compressed
+    with gzip at `compression_level`.
+    :param runfolder: path to the runfolder
+    :param tiles: regular expression selecting the tiles converted, as given to bcl-convert
+    :param exclude_tiles: regular expression of tiles left out, as given to bcl-convert
+    :param compression_level: the gzip compression level of the fastq files, None for the default
+    :return: the estimated size in bytes, or None if the clusters of the run are not known
+    """
+    try:
+        run_info = get_runinfo(runfolder)
+    except Exception as e:
+        log.warning(f"Could not read the reads of {runfolder}: {e}")
+        return None
+    clusters = pf_clusters(runfolder, tiles, exclude_tiles)
+    if clusters is None:
+        return None
+    level = DEFAULT_COMPRESSION_LEVEL if compression_level in (None, "") else int(compression_level)
+    header = HEADER_BYTES + sum(run_info.index_lengths.values()) + 1
+    # Header, bases, "+" and qualities, each on a line of its own
+    record_bytes = sum(header + 2 * read.num_cycles + 5 for read in run_info.data_reads)
+    return int(clusters * record_bytes * COMPRESSION_RATIOS.get(level, COMPRESSION_RATIOS[DEFAULT_COMPRESSION_LEVEL]))
+
+
+def _existing_path(path):
+    """
+    :return: `path`, or the closest of its parents that exists
+    """
+    path = os.path.abspath(path)
+    while not os.path.exists(path) and os.path.dirname(path) != path:
+        path = os.path.dirname(path)
+    return path
+
+
+def disk_usage(path):
+    """
+    :return: the bytes allocated on disk to the files under `path`, 0 if it does not exist
+    """
+    used = 0
+    for dir_path, _, file_names in os.walk(path):
+        for file_name in file_names:
+            try:
+                used += os.lstat(os.path.join(dir_path, file_name)).st_blocks * 512
+            except OSError:
+                pass
+    return used
+
+
+def reserved_bytes(registry, device):
+    """
+    The space the jobs that have not finished yet still need on a file system: what they are
+    expected to write minus what they have written so far.
+    :param registry: the `JobRegistry` of the scheduler
+    :param device: the st_dev of the file system
+    :return: the bytes reserved, and the number of jobs reserving them
+    """
+    reserved = 0
+    nbr_of_jobs = 0
+    for record in registry.unfinished(FINISHED_STATES):
+        # The lane jobs of a group are counted one by one
+        if record["command"] is None:
+            continue
+        output = job_output_dir(record)
+        if not output or not record["run_dir"] or os.stat(_existing_path(output)).st_dev != device:
+            continue
+        expected = estimate_output_bytes(record["run_dir"],
+                                         tiles=command_option(record["command"], "--tiles"),
+                                         exclude_tiles=command_option(record["command"], "--exclude-tiles"),
+                                         compression_level=command_option(record["command"],
+                                                                          "--fastq-gzip-compression-level"))
+        if expected:
+            reserved += max(0, expected - disk_usage(output))
+            nbr_of_jobs += 1
+    return reserved, nbr_of_jobs
+
+
+def check_disk_space(runfolder_config, registry, margin=0.1, output_deleted=True):
+    """
+    Check that the file system the output of a conversion is written to has room for it, once
+    the jobs already queued or running there have written their output. The existing output of
+    the runfolder, which is deleted before the conversion starts, counts as free.
+    :param runfolder_config: the `BclConvertConfig` of the conversion
+    :param registry: the `JobRegistry` of the scheduler, with the jobs already queued or running
+    :param margin: fraction added to the estimated size of the output
+    :param output_deleted: False if the existing output is kept, e.g. when lanes are replaced in it,
+                           and so does not count as free
+    :return: a dict with the estimated size of the output, and the free and reserved space
+    :raises PreflightError: if there is not room for the output
+    """
+    output = os.path.abspath(runfolder_config.output)
+    estimate = estimate_output_bytes(runfolder_config.runfolder_input,
+                                     tiles=runfolder_config.tiles,
+                                     exclude_tiles=runfolder_config.exclude_tiles,
+                                     compression_level=runfolder_config.fastq_gzip_compression_level)
+    if estimate is None:
+        log.warning(f"Not checking the space for {output}, the clusters of "
+                    f"{runfolder_config.runfolder_input} are not known")
+        return {"output": output, "estimated_bytes": None}
+
+    existing = _existing_path(output)
+    stat = os.statvfs(existing)
+    free = stat.f_bavail * stat.f_frsize
+    reclaimable = disk_usage(output) if output_deleted else 0
+    reserved, nbr_of_jobs = reserved_bytes(registry, os.stat(existing).st_dev)
+    needed = int(estimate * (1 + margin))
+    available = free + reclaimable - reserved
+    space = {"output": output, "estimated_bytes": estimate, "needed_bytes": needed, "free_bytes": free,
+             "reclaimable_bytes": reclaimable, "reserved_bytes": reserved, "available_bytes": available}
+    if needed > available:
+        report = PreflightReport()
+        report.add_error("disk_space",
+                         f"The output {output} needs about {_human(needed)}, but only {_human(max(available, 0))} "
+                         f"are available on its file system ({_human(free)} free, {_human(reserved)} of it "
+                         f"reserved by {nbr_of_jobs} queued or running job(s))")
+        raise PreflightError(report)
+    return space
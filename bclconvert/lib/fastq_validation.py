@@ -0,0 +1,265 @@
+import csv
+import gzip
+import logging
+import os
+import re
+import zlib
+from itertools import repeat
+
+from bclconvert.lib.demux_stats import UNDETERMINED, parse_reports
+from bclconvert.lib.illumina import DATA_SECTION_HEADERS, read_sections
+from bclconvert.lib.lane_split import LOGS_DIR_NAME, REPORTS_DIR_NAME, STAGING_DIR_NAME
+from bclconvert.lib.progress import command_option, job_output_dir
+
+log = logging.getLogger(__name__)
+
+# Bytes of decompressed fastq read at a time
+CHUNK_BYTES = 4 * 1024 * 1024
+
+# Directories in the output that do not hold fastq files of the conversion
+SKIPPED_DIRS = (LOGS_DIR_NAME, REPORTS_DIR_NAME, STAGING_DIR_NAME)
+
+# e.g. Sample1_S1_L001_R1_001.fastq.gz, or Sample1_S1_R1_001.fastq.gz without lane splitting
+FASTQ_NAME = re.compile(r"^(?P<sample>.+)_S\d+(?:_L(?P<lane>\d{3}))?_(?P<read>[RI]\d)_001\.fastq(?:\.gz)?$")
+
+# Most errors listed in the message of a `FastqValidationError`
+MAX_ERRORS_IN_MESSAGE = 10
+
+# Processes checking the files of jobs that do not reserve any cores, i.e. groups of lane jobs,
+# which are checked once the lane jobs have released theirs
+DEFAULT_WORKERS = 4
+
+
+class FastqValidationError(Exception):
+    """
+    Raised when the fastq files of a conversion are not valid. Carries all errors found.
+    """
+
+    def __init__(self, output, errors):
+        listed = "; ".join(errors[:MAX_ERRORS_IN_MESSAGE])
+        more = f" (and {len(errors) - MAX_ERRORS_IN_MESSAGE} more)" if len(errors) > MAX_ERRORS_IN_MESSAGE else ""
+        super().__init__(f"{len(errors)} error(s) in the fastq files in {output}: {listed}{more}")
+        self.output = output
+        self.errors = errors
+
+
+def find_fastq_files(output):
+    """
+    :return: the paths of the fastq files written to `output`, largest first
+    """
+    paths = []
+    for dir_path, dir_names, file_names in os.walk(output):
+        if dir_path == output:
+            dir_names[:] = [name for name in dir_names if name not in SKIPPED_DIRS]
+        paths.extend(os.path.join(dir_path, name) for name in file_names if name.endswith((".fastq.gz", ".fastq")))
+    # Checking the largest files first keeps the workers busy until the end
+    return sorted(paths, key=lambda path: os.path.getsize(path), reverse=True)
+
+
+def _check_records(lines, first_line):
+    """
+    :param lines: complete records of four lines each
+    :param first_line: line number in the file of the first of the lines
+    :return: a description of the first malformed record, or None if all are well formed
+    """
+    headers = lines[0::4]
+    sequences = lines[1::4]
+    separators = lines[2::4]
+    qualities = lines[3::4]
+    if all(map(bytes.startswith, headers, repeat(b"@"))) and all(map(bytes.startswith, separators, repeat(b"+"))) \
+            and list(map(len, sequences)) == list(map(len, qualities)):
+        return None
+    # Something is wrong, find out what and where
+    for record, (header, sequence, separator, quality) in enumerate(zip(headers, sequences, separators, qualities)):
+        line = first_line + 4 * record
+        if not header.startswith(b"@"):
+            return f"line {line} is not a record header"
+        if not separator.startswith(b"+"):
+            return f"line {line + 2} is not a record separator"
+        if len(sequence) != len(quality):
+            return f"the record at line {line} has {len(sequence)} bases but {len(quality)} qualities"
+    return None
+
+
+def check_fastq(path, chunk_bytes=CHUNK_BYTES):
+    """
+    Read a fastq file to the end, checking that it is complete and well formed: a gzip compressed
+    file must end with a complete gzip stream whose checksum matches, and every record must have
+    a header, a sequence, a separator and as many qualities as there are bases.
+    :param path: of a fastq file, gzip compressed if it ends with .gz
+    :return: the path, the number of reads in the file and a description of what is wrong with
+             it, or None if nothing is
+    """
+    reads = 0
+    line = 1
+    rest = b""
+    try:
+        with (gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb")) as f:
+            while True:
+                chunk = f.read(chunk_bytes)
+                if not chunk:
+                    break
+                lines = (rest + chunk).split(b"\n")
+                complete = (len(lines) - 1) // 4 * 4
+                error = _check_records(lines[:complete], line)
+                if error:
+                    return path, reads, error
+                reads += complete // 4
+                line += complete
+                rest = b"\n".join(lines[complete:])
+    except (EOFError, OSError, zlib.error) as e:
+        return path, reads, f"could not be read to the end: {e}"
+    if rest:
+        return path, reads, f"ends with an incomplete record at line {line}"
+    return path, reads, None
+
+
+def fastq_sample_names(samplesheet_file):
+    """
+    With `--sample-name-column-enabled` bcl-convert names the fastq files of a sample after its
+    Sample_Name rather than its Sample_ID, or after its Sample_ID if it has no Sample_Name.
+    :param samplesheet_file: path to the samplesheet of the conversion
+    :return: a dict with the Sample_Name of each sample that has one, by Sample_ID
+    """
+    data_sections = tuple(header.strip("[]") for header in DATA_SECTION_HEADERS)
+    lines = next((lines for name, lines in read_sections(samplesheet_file).items() if name in data_sections), [])
+    return {row["Sample_ID"].strip(): row["Sample_Name"].strip() for row in csv.DictReader(lines)
+            if (row.get("Sample_ID") or "").strip() and (row.get("Sample_Name") or "").strip()}
+
+
+def expected_reads(output, sample_names=None):
+    """
+    :param sample_names: dict with the name the fastq files of a sample are named after, by
+                         sample id, see `fastq_sample_names`. None if the files are named after
+                         the sample ids.
+    :return: a dict with the number of reads bcl-convert reported for each sample and lane in
+             the Reports of `output`, by (the name its fastq files are named after, lane)
+    :raises FileNotFoundError: if there are no demultiplexing reports in the output
+    """
+    sample_names = sample_names or {}
+    reads = {}
+    for lane, lane_stats in parse_reports(output)["lanes"].items():
+        reads[(UNDETERMINED, int(lane))] = lane_stats["undetermined_reads"]
+        for sample_id, sample_stats in lane_stats["samples"].items():
+            key = (sample_names.get(sample_id, sample_id), int(lane))
+            reads[key] = reads.get(key, 0) + sample_stats["reads"]
+    return reads
+
+
+def cross_check(counts, expected):
+    """
+    Compare the number of reads in each fastq file with the number bcl-convert reported for its
+    sample and lane. Samples are identified by the name their fastq files start with. Files of all
+    lanes of a sample are compared to the reads of all its lanes. Files that are not named the way
+    bcl-convert names them are not compared.
+    :param counts: dict with the number of reads in each fastq file by path, None for files that
+                   could not be read
+    :param expected: the `expected_reads` in the output
+    :return: list of the mismatches found
+    """
+    errors = []
+    samples_with_files = set()
+    for path, reads in sorted(counts.items()):
+        match = FASTQ_NAME.match(os.path.basename(path))
+        if not match:
+            continue
+        sample_id = match.group("sample")
+        if match.group("lane"):
+            lanes = [int(match.group("lane"))]
+        else:
+            lanes = [lane for sample, lane in expected if sample == sample_id]
+        samples_with_files.update((sample_id, lane) for lane in lanes)
+        if reads is None or not any((sample_id, lane) in expected for lane in lanes):
+            continue
+        reported = sum(expected.get((sample_id, lane), 0) for lane in lanes)
+        if reads != reported:
+            errors.append(f"{path} has {reads} reads, {reported} were reported for it")
+    for (sample_id, lane), reported in sorted(expected.items()):
+        if reported and (sample_id, lane) not in samples_with_files:
+            errors.append(f"No fastq files for {sample_id} in lane {lane}, {reported} reads were reported for it")
+    return errors
+
+
+def validate_output(output, nbr_of_workers=1, sample_names=None):
+    """
+    Check every fastq file in the output of a conversion (see `check_fastq`), and that the number
+    of reads in them is the number reported in the demultiplexing stats. The files are checked
+    in parallel by a pool of processes.
+    :param output: the output directory of the conversion
+    :param nbr_of_workers: number of processes checking files
+    :param sample_names: the names the fastq files of the samples are named after, see `expected_reads`
+    :return: a dict with the number of reads in each fastq file by path, None for files that are not
+             valid, and a list of the errors found
+    """
+    paths = find_fastq_files(output)
+    if nbr_of_workers > 1 and len(paths) > 1:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        # The service runs threads, which must not be forked
+        with ProcessPoolExecutor(max_workers=min(nbr_of_workers, len(paths)),
+                                 mp_context=multiprocessing.get_context("spawn")) as executor:
+            results = list(executor.map(check_fastq, paths))
+    else:
+        results = [check_fastq(path) for path in paths]
+
+    counts = {path: None if error else reads for path, reads, error in results}
+    errors = [f"{path} {error}" for path, _, error in results if error]
+    try:
+        errors.extend(cross_check(counts, expected_reads(output, sample_names)))
+    except FileNotFoundError as e:
+        log.warning(f"Not comparing the reads in the fastq files in {output} to the demultiplexing stats: {e}")
+    log.info(f"Checked {len(paths)} fastq files with {sum(filter(None, counts.values()))} reads in {output}, "
+             f"found {len(errors)} error(s)")
+    return {"reads": counts, "errors": errors}
+
+
+class FastqValidator:
+    """
+    Validator for the `ResourceAwareAdapter`, which checks the fastq files in the output of a job
+    once it has succeeded, see `validate_output`.
+    """
+
+    def __init__(self, nbr_of_workers=None, sample_name_column_enabled=None):
+        """
+        :param nbr_of_workers: number of processes checking files, None to use the cores reserved
+                               by the job, or `DEFAULT_WORKERS` for jobs that do not reserve any
+        :param sample_name_column_enabled: `sample_name_column_enabled` of the config, true if
+                                           the fastq files are named after the Sample_Name of
+                                           the samples. Jobs run with `--sample-name-column-enabled`
+                                           are taken to name them so either way.
+        """
+        self.nbr_of_workers = nbr_of_workers
+        self.sample_name_column_enabled = sample_name_column_enabled
+
+    def sample_names(self, record, output):
+        """
+        :return: the names the fastq files of the samples of a job are named after, by sample id,
+                 or None if they are named after the sample ids
+        """
+        enabled = command_option(record["command"], "--sample-name-column-enabled") or \
+            self.sample_name_column_enabled
+        if str(enabled).lower() != "true":
+            return None
+        # bcl-convert copies the samplesheet it was run with to the Reports
+        samplesheet = os.path.join(output, REPORTS_DIR_NAME, "SampleSheet.csv")
+        if not os.path.exists(samplesheet):
+            samplesheet = command_option(record["command"], "--sample-sheet")
+        if not samplesheet or not os.path.exists(samplesheet):
+            log.warning(f"Not finding the samplesheet of job {record['job_id']}, taking its fastq files to be "
+                        f"named after the sample ids")
+            return None
+        return fastq_sample_names(samplesheet)
+
+    def __call__(self, record):
+        """
+        :param record: of a job in the `JobRegistry`
+        :raises FastqValidationError: if the fastq files are not valid
+        """
+        output = job_output_dir(record)
+        if not output:
+            raise FastqValidationError(None, [f"the output directory of job {record['job_id']} is not known"])
+        nbr_of_workers = self.nbr_of_workers or record.get("cores") or DEFAULT_WORKERS
+        errors = validate_output(output, nbr_of_workers, self.sample_names(record, output))["errors"]
+        if errors:
+            raise FastqValidationError(output, errors)
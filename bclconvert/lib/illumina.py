@@ -1,7 +1,18 @@
 # This file has been modified from the https://github.com/arteria-project/arteria-bcl2fastq repo
 # bcl2fastq/lib/illumina.py
 
-from pandas import read_csv
+import csv
+import sys
+
+OBSOLETE_SETTINGS = ("Adapter,", "TrimAdapter,", "MaskAdapter,",
+                     "Read1StartFromCycle,", "Read2StartFromCycle,",
+                     "Read1UMIStartFromCycle,", "Read2UMIStartFromCycle,",
+                     "Read1UMILength,", "Read2UMILength,")
+
+DATA_SECTION_HEADERS = ("[Data]", "[data]", "[BCLConvert_Data]")
+
+# Lines made up of only these characters carry no data, e.g. ",,,,,,"
+EMPTY_LINE_CHARACTERS = ", \t\r\n"
 
 
 class SampleRow:
@@ -16,7 +27,13 @@ class SampleRow:
     TODO Implement picking up additional information from
     samplesheet. Right only picking up the data field is
     supported.
+
+    Large samplesheets hold one instance per row, so the fields are kept in slots rather than
+    a per instance `__dict__`, and the strings that repeat between rows (project, plate, index,
+    etc.) are interned so that all rows share one copy of them.
     """
+    __slots__ = ("lane", "sample_id", "sample_name", "sample_plate", "sample_well",
+                 "index1", "index2", "sample_project", "description")
 
     def __init__(self, sample_id, sample_name, index1, sample_project, lane=None, sample_plate=None,
                  sample_well=None, index2=None, description=None):
@@ -39,26 +56,37 @@ class SampleRow:
         self.lane = int(lane) if lane else 1
         self.sample_id = str(sample_id)
         self.sample_name = str(sample_name)
-        self.sample_plate = sample_plate
-        self.sample_well = sample_well
-        self.index1 = index1
-        self.index2 = index2
-        self.sample_project = str(sample_project)
-        self.description = description
+        self.sample_plate = _intern(sample_plate)
+        self.sample_well = _intern(sample_well)
+        self.index1 = _intern(index1)
+        self.index2 = _intern(index2)
+        self.sample_project = sys.intern(str(sample_project))
+        self.description = _intern(description)
+
+    def as_dict(self):
+        return {field: getattr(self, field) for field in self.__slots__}
 
     def __str__(self):
-        return str(self.__dict__)
+        return str(self.as_dict())
 
     def __eq__(self, other):
         if isinstance(other, type(self)):
-            return self.__dict__ == other.__dict__
+            return all(getattr(self, field) == getattr(other, field) for field in self.__slots__)
         else:
             return False
 
 
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
 class Samplesheet:
     """
     Represent information contanied in a Illumina samplesheet
+
+    Besides the list of samples in file order, indexes by lane, project and index
+    sequence are built when the samplesheet is read, so that looking up the samples
+    of a lane, a project or a barcode does not require scanning all samples.
     """
 
     def __init__(self, samplesheet_file):
@@ -69,51 +97,138 @@ class Samplesheet:
         self.samplesheet_file = samplesheet_file
         with open(samplesheet_file, mode="r") as s:
             self.samples = self._read_samples(s)
+        self._build_indexes()
+
+    def _build_indexes(self):
+        by_lane = {}
+        by_project = {}
+        by_index = {}
+        for sample in self.samples:
+            by_lane.setdefault(sample.lane, []).append(sample)
+            by_project.setdefault(sample.sample_project, []).append(sample)
+            by_index.setdefault((sample.index1, sample.index2 or None), []).append(sample)
+        self._samples_by_lane = {lane: tuple(samples) for lane, samples in by_lane.items()}
+        self._samples_by_project = {project: tuple(samples) for project, samples in by_project.items()}
+        self._samples_by_index = {index: tuple(samples) for index, samples in by_index.items()}
+
+    @property
+    def lanes(self):
+        """
+        :return: the lanes in the samplesheet, sorted
+        """
+        return sorted(self._samples_by_lane)
+
+    @property
+    def projects(self):
+        """
+        :return: the projects in the samplesheet, in order of appearance
+        """
+        return list(self._samples_by_project)
+
+    def samples_in_lane(self, lane):
+        """
+        :param lane: lane number
+        :return: a tuple of the samples in `lane`, in file order
+        """
+        return self._samples_by_lane.get(int(lane), ())
+
+    def samples_in_project(self, project):
+        """
+        :param project: name of the project
+        :return: a tuple of the samples in `project`, in file order
+        """
+        return self._samples_by_project.get(project, ())
+
+    def samples_with_index(self, index1, index2=None):
+        """
+        :param index1: first index sequence
+        :param index2: second index sequence, if any
+        :return: a tuple of the samples (in any lane) with this combination of indexes
+        """
+        return self._samples_by_index.get((index1, index2 or None), ())
+
+    def first_sample_per_lane(self):
+        """
+        :return: a dict with lane as key and the first sample in that lane as value, sorted by lane
+        """
+        return {lane: self._samples_by_lane[lane][0] for lane in self.lanes}
 
     @staticmethod
     def _read_samples(samplesheet_file_handle):
         """
-        Read info about the sequencing units in the samplesheet.
+        Read info about the sequencing units in the samplesheet. The file is read once, line by
+        line: the checks for obsolete settings and for the data section are done as the lines
+        pass by, and the rows of the data section are parsed as they are reached. The data
+        section ends at the next section header (e.g. `[Cloud_Settings]`) or at the end of the file.
         :param samplesheet_file_handle: file handle for the corresponding samplesheet
         :return: a list of the sequencing units in the samplesheet in the form of `SampleRow` instances.
         """
 
-        def find_data_line():
-            enumurated_lines = list(enumerate(samplesheet_file_handle))
-            lines_with_obsolete_settings = list(filter(lambda x: "Adapter," in x[1] or
-                                                                 "TrimAdapter," in x[1] or
-                                                                 "MaskAdapter," in x[1] or
-                                                                 "Read1StartFromCycle," in x[1] or
-                                                                 "Read2StartFromCycle," in x[1] or
-                                                                 "Read1UMIStartFromCycle," in x[1] or
-                                                                 "Read2UMIStartFromCycle," in x[1] or
-                                                                 "Read1UMILength," in x[1] or
-                                                                 "Read2UMILength," in x[1], enumurated_lines))
-            assert len(lines_with_obsolete_settings) == 0, f"SampleSheet contain obsolete settings {lines_with_obsolete_settings}"
-            lines_with_data = list(filter(lambda x: "[Data]" in x[1] or "[data]" in x[1] or "[BCLConvert_Data]" in x[1], enumurated_lines))
-            assert len(lines_with_data) == 1, "There wasn't strictly one line in samplesheet with line '[Data]'"
-            return lines_with_data[0][0]
-
-        def find_cloud_footer_size():
-            enumurated_lines = list(enumerate(samplesheet_file_handle))
-            lines_with_data = list(filter(lambda x: "[Cloud" in x[1] or "[cloud" in x[1], enumurated_lines))
-            if len(lines_with_data) > 0:
-                return len(enumurated_lines) - lines_with_data[0][0]
-            return 0
-
-        def row_to_sample_row(index_and_row):
-            row = index_and_row[1]
-            return SampleRow(lane=row.get("Lane"), sample_id=row.get("Sample_ID"), sample_name=row.get("Sample_Name"),
-                             sample_plate=row.get("Sample_Plate"), sample_well=row.get("Sample_Well"),
-                             index1=row.get("index"), index2=row.get("index2"),
-                             sample_project=row.get("Sample_Project", row.get("Project")), description=row.get("Description"))
-
-        lines_to_skip = find_data_line() + 1
-        # Ensure that pointer is at beginning of file again.
-        samplesheet_file_handle.seek(0)
-        skipfooter = find_cloud_footer_size()
-        samplesheet_file_handle.seek(0)
-        samplesheet_df = read_csv(samplesheet_file_handle, skiprows=lines_to_skip, skipfooter=skipfooter)
-        samplesheet_df = samplesheet_df.fillna("")
-        samples = map(row_to_sample_row, samplesheet_df.iterrows())
-        return list(samples)
+        lines_with_obsolete_settings = []
+        lines_with_data = []
+
+        def data_section_lines():
+            in_data_section = False
+            for line_number, line in enumerate(samplesheet_file_handle):
+                if any(setting in line for setting in OBSOLETE_SETTINGS):
+                    lines_with_obsolete_settings.append((line_number, line))
+                if any(section in line for section in DATA_SECTION_HEADERS):
+                    lines_with_data.append(line_number)
+                    in_data_section = True
+                elif line.startswith("["):
+                    in_data_section = False
+                elif in_data_section and line.strip(EMPTY_LINE_CHARACTERS):
+                    yield line
+
+        rows = csv.reader(data_section_lines())
+        header = next(rows, None) or []
+
+        # Resolve the position of each column once, rather than building a dict for every row.
+        # Columns missing from the header give None, empty cells give an empty string.
+        def column(*names):
+            for name in names:
+                if name in header:
+                    return header.index(name)
+            return None
+
+        columns = (column("Lane"), column("Sample_ID"), column("Sample_Name"), column("Sample_Plate"),
+                   column("Sample_Well"), column("index", "Index"), column("index2", "Index2"),
+                   column("Sample_Project", "Project"), column("Description"))
+
+        def row_to_sample_row(row):
+            if len(row) < len(header):
+                row = row + [""] * (len(header) - len(row))
+            lane, sample_id, sample_name, sample_plate, sample_well, index1, index2, sample_project, description = \
+                (row[i] if i is not None else None for i in columns)
+            return SampleRow(lane=lane, sample_id=sample_id, sample_name=sample_name,
+                             sample_plate=sample_plate, sample_well=sample_well,
+                             index1=index1, index2=index2,
+                             sample_project=sample_project, description=description)
+
+        samples = [row_to_sample_row(row) for row in rows]
+
+        assert len(lines_with_obsolete_settings) == 0, f"SampleSheet contain obsolete settings {lines_with_obsolete_settings}"
+        assert len(lines_with_data) == 1, "There wasn't strictly one line in samplesheet with line '[Data]'"
+        return samples
+
+
+def read_sections(samplesheet_file):
+    """
+    Read the lines of each section of a samplesheet, e.g. "Header", "Reads", "BCLConvert_Settings"
+    or "BCLConvert_Data". Lines that carry no data are left out, and trailing empty cells are
+    stripped from the others, so that two samplesheets that only differ in how they were saved
+    have the same sections. Lines before the first section header are in the section "".
+    :param samplesheet_file: a path to the samplesheet file to read
+    :return: a dict with a list of the lines of each section by section name, in file order
+    """
+    sections = {}
+    name = ""
+    with open(samplesheet_file, mode="r") as s:
+        for line in s:
+            line = line.rstrip(EMPTY_LINE_CHARACTERS)
+            if line.startswith("["):
+                name = line[1:line.index("]")] if "]" in line else line[1:]
+                sections.setdefault(name, [])
+            elif line.strip(EMPTY_LINE_CHARACTERS):
+                sections.setdefault(name, []).append(line)
+    return sections
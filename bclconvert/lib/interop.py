@@ -0,0 +1,453 @@
+"""
+Readers of the binary InterOp files the instruments write to the InterOp directory of a runfolder,
+and a summary of the quality of a run per lane computed from them.
+
+Files with fixed size records are memory mapped into NumPy structured arrays, and the summary
+is computed with vectorised NumPy operations, so that no Python code runs per record. NumPy is
+imported when a file is read, so that it is not loaded when the service starts.
+"""
+import logging
+import os
+
+from bclconvert.lib.signature_cache import SignatureCache, file_signature
+
+log = logging.getLogger(__name__)
+
+INTEROP_DIR_NAME = "InterOp"
+
+TILE_METRICS_FILE = "TileMetricsOut.bin"
+Q_METRICS_FILE = "QMetricsOut.bin"
+INDEX_METRICS_FILE = "IndexMetricsOut.bin"
+EXTRACTION_METRICS_FILE = "ExtractionMetricsOut.bin"
+
+# Codes of the values in version 2 of TileMetricsOut.bin
+TILE_DENSITY = 100
+TILE_DENSITY_PF = 101
+TILE_CLUSTERS = 102
+TILE_CLUSTERS_PF = 103
+
+# Number of quality scores in the histograms of QMetricsOut.bin that are not binned
+Q_HISTOGRAM_SIZE = 50
+
+
+class InteropFormatError(Exception):
+    """
+    Raised for InterOp files of a version that can not be read, or that are malformed.
+    """
+    pass
+
+
+def _header(path, size):
+    with open(path, "rb") as f:
+        header = f.read(size)
+    # The version, and for most files the record size
+    if len(header) < min(size, 2):
+        raise InteropFormatError(f"{path} is empty")
+    return header
+
+
+def _map_records(path, dtype, offset):
+    """
+    Memory map the fixed size records of an InterOp file.
+    :return: a NumPy structured array of the records, backed by the file
+    """
+    import numpy as np
+
+    count = (os.path.getsize(path) - offset) // dtype.itemsize
+    if count <= 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=(count,))
+
+
+def read_tile_metrics(path):
+    """
+    Read TileMetricsOut.bin, version 2 or 3.
+    :return: a dict with the NumPy arrays `lane`, `tile`, `density`, `density_pf`, `clusters` and
+             `clusters_pf`, with one entry per tile. Densities are in clusters per mm2.
+    """
+    import numpy as np
+
+    header = _header(path, 6)
+    version, record_size = header[0], header[1]
+    if version == 2:
+        dtype = np.dtype([("lane", "<u2"), ("tile", "<u2"), ("code", "<u2"), ("value", "<f4")])
+        records = _map_records(path, dtype, 2)
+        tile_keys, tile_index = np.unique((records["lane"].astype(np.uint64) << 32) | records["tile"],
+                                          return_inverse=True)
+        values = {}
+        for name, code in [("density", TILE_DENSITY), ("density_pf", TILE_DENSITY_PF),
+                           ("clusters", TILE_CLUSTERS), ("clusters_pf", TILE_CLUSTERS_PF)]:
+            selected = records["code"] == code
+            values[name] = np.full(len(tile_keys), np.nan)
+            values[name][tile_index[selected]] = records["value"][selected]
+    elif version == 3:
+        area = np.frombuffer(header, dtype="<f4", count=1, offset=2)[0]
+        dtype = np.dtype([("lane", "<u2"), ("tile", "<u4"), ("code", "u1"), ("count", "<f4"), ("count_pf", "<f4")])
+        if dtype.itemsize != record_size:
+            raise InteropFormatError(f"Unexpected record size {record_size} in {path}")
+        records = _map_records(path, dtype, 6)
+        records = records[records["code"] == ord("t")]
+        tile_keys = (records["lane"].astype(np.uint64) << 32) | records["tile"]
+        values = {"clusters": records["count"].astype(np.float64),
+                  "clusters_pf": records["count_pf"].astype(np.float64)}
+        values["density"] = values["clusters"] / area if area else np.full(len(records), np.nan)
+        values["density_pf"] = values["clusters_pf"] / area if area else np.full(len(records), np.nan)
+    else:
+        raise InteropFormatError(f"Version {version} of {path} is not supported")
+
+    values["lane"] = (tile_keys >> 32).astype(np.int64)
+    values["tile"] = (tile_keys & 0xFFFFFFFF).astype(np.int64)
+    return values
+
+
+def read_q_metrics(path):
+    """
+    Read QMetricsOut.bin, version 4 to 7.
+    :return: a dict with the NumPy arrays `lane`, `tile` and `cycle`, the histogram of quality
+             scores of each tile and cycle in `histogram`, and the quality score of each column
+             of the histograms in `scores`
+    """
+    import numpy as np
+
+    header = _header(path, 3)
+    version, record_size = header[0], header[1]
+    offset = 2
+    scores = np.arange(1, Q_HISTOGRAM_SIZE + 1)
+    bins = Q_HISTOGRAM_SIZE
+    if version in (5, 6, 7):
+        with open(path, "rb") as f:
+            f.seek(2)
+            has_bins = f.read(1) == b"\x01"
+            offset = 3
+            if has_bins:
+                nbr_of_bins = f.read(1)[0]
+                # Lower bounds, upper bounds and the scores the bins are remapped to
+                bounds = np.frombuffer(f.read(3 * nbr_of_bins), dtype="u1").reshape(3, nbr_of_bins)
+                offset = 4 + 3 * nbr_of_bins
+                if version >= 6:
+                    bins = nbr_of_bins
+                    scores = bounds[2].astype(np.int64)
+                else:
+                    # Version 5 keeps a histogram of all scores, in which only the remapped scores are used
+                    pass
+    elif version != 4:
+        raise InteropFormatError(f"Version {version} of {path} is not supported")
+
+    tile_type = "<u4" if version >= 7 else "<u2"
+    dtype = np.dtype([("lane", "<u2"), ("tile", tile_type), ("cycle", "<u2"), ("histogram", "<u4", (bins,))])
+    if dtype.itemsize != record_size:
+        raise InteropFormatError(f"Unexpected record size {record_size} in {path}")
+    records = _map_records(path, dtype, offset)
+    return {"lane": records["lane"], "tile": records["tile"], "cycle": records["cycle"],
+            "histogram": records["histogram"], "scores": scores}
+
+
+def _index_record_offsets(data):
+    """
+    Find where each record of an IndexMetricsOut.bin file starts. The records hold strings of
+    varying length, so the start of a record is only known from the record before it. Instead of
+    walking the records one by one, the end of a record is computed, with array operations, for
+    every offset a record could start at, and the records are the chain of offsets that follows
+    from the first record, found by doubling the number of steps taken at each round.
+    :param data: the records, as a NumPy uint8 array
+    :return: a NumPy array of the offset of each record
+    """
+    import numpy as np
+
+    size = len(data)
+    if size == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    def u16(offsets):
+        return data[offsets].astype(np.int64) | (data[offsets + 1].astype(np.int64) << 8)
+
+    # A record is at least lane, tile, read, 3 lengths and a cluster count, 16 bytes, and lanes
+    # and reads are small numbers
+    last_start = size - 16
+    if last_start < 0:
+        raise InteropFormatError("IndexMetricsOut.bin is too short to hold a record")
+    end = last_start + 1
+    candidates = np.flatnonzero((data[:end] >= 1) & (data[:end] <= 64) & (data[1:end + 1] == 0) &
+                                (data[4:end + 4] >= 1) & (data[4:end + 4] <= 16) & (data[5:end + 5] == 0))
+    if len(candidates) == 0 or candidates[0] != 0:
+        raise InteropFormatError("IndexMetricsOut.bin does not start with a record")
+
+    # The end of the record starting at each candidate, or -1 if it would run past the end of the file
+    ends = np.full(len(candidates), -1, dtype=np.int64)
+    sample_name = candidates + 12 + u16(candidates + 6)
+    valid = sample_name + 2 <= size
+    project_name = np.where(valid, sample_name + 2 + u16(np.where(valid, sample_name, 0)), size)
+    valid &= project_name + 2 <= size
+    record_end = np.where(valid, project_name + 2 + u16(np.where(valid, project_name, 0)), size + 1)
+    valid &= record_end <= size
+    ends[valid] = record_end[valid]
+
+    # The candidate each record is followed by, with len(candidates) for the end of the file
+    following = np.searchsorted(candidates, ends)
+    matched = (following < len(candidates)) & (candidates[np.minimum(following, len(candidates) - 1)] == ends)
+    last = len(candidates)
+    steps = np.where(matched, following, last)
+    steps[ends == size] = last
+    invalid = ~(matched | (ends == size))
+    steps = np.append(steps, last)
+
+    reached = np.zeros(last + 1, dtype=bool)
+    reached[0] = True
+    frontier = np.array([0])
+    # After n rounds `reached` holds the first 2**n records, and `steps` jumps 2**n records
+    while not reached[last]:
+        frontier = np.union1d(frontier, steps[frontier])
+        reached[frontier] = True
+        steps = steps[steps]
+    records = np.flatnonzero(reached[:last])
+    if invalid[records].any():
+        raise InteropFormatError("IndexMetricsOut.bin has a record that runs past the end of the file")
+    return candidates[records]
+
+
+def _strings(data, offsets, lengths):
+    """
+    :return: the strings of `lengths` bytes at `offsets` in `data`, as a NumPy bytes array
+    """
+    import numpy as np
+
+    width = int(lengths.max()) if len(lengths) else 0
+    if width == 0:
+        return np.zeros(len(offsets), dtype="S1")
+    columns = np.arange(width)
+    positions = np.minimum(offsets[:, None] + columns[None, :], len(data) - 1)
+    chars = np.where(columns[None, :] < lengths[:, None], data[positions], 0).astype(np.uint8)
+    return np.ascontiguousarray(chars).view(f"S{width}").ravel()
+
+
+def read_index_metrics(path):
+    """
+    Read IndexMetricsOut.bin, version 1.
+    :return: a dict with the NumPy arrays `lane`, `tile`, `read`, `index`, `clusters`, `sample`
+             and `project`, with one entry per record
+    """
+    import numpy as np
+
+    header = _header(path, 1)
+    if header[0] != 1:
+        raise InteropFormatError(f"Version {header[0]} of {path} is not supported")
+    if os.path.getsize(path) == 1:
+        data = np.zeros(0, dtype=np.uint8)
+    else:
+        data = np.memmap(path, dtype=np.uint8, mode="r", offset=1)
+    offsets = _index_record_offsets(data)
+
+    def u16(at):
+        return data[at].astype(np.int64) | (data[at + 1].astype(np.int64) << 8)
+
+    index_length = u16(offsets + 6)
+    clusters_at = offsets + 8 + index_length
+    clusters = (data[clusters_at].astype(np.int64) | (data[clusters_at + 1].astype(np.int64) << 8) |
+                (data[clusters_at + 2].astype(np.int64) << 16) | (data[clusters_at + 3].astype(np.int64) << 24))
+    sample_length = u16(clusters_at + 4)
+    project_at = clusters_at + 6 + sample_length
+    return {"lane": u16(offsets),
+            "tile": u16(offsets + 2),
+            "read": u16(offsets + 4),
+            "index": _strings(data, offsets + 8, index_length),
+            "clusters": clusters,
+            "sample": _strings(data, clusters_at + 6, sample_length),
+            "project": _strings(data, project_at + 2, u16(project_at))}
+
+
+def read_extraction_metrics(path):
+    """
+    Read ExtractionMetricsOut.bin, version 2 or 3.
+    :return: a dict with the NumPy arrays `lane`, `tile` and `cycle`, and the intensity of each
+             channel of each tile and cycle in `intensity`
+    """
+    import numpy as np
+
+    header = _header(path, 3)
+    version, record_size = header[0], header[1]
+    if version == 2:
+        dtype = np.dtype([("lane", "<u2"), ("tile", "<u2"), ("cycle", "<u2"), ("fwhm", "<f4", (4,)),
+                          ("intensity", "<u2", (4,)), ("time", "<u8")])
+        offset = 2
+    elif version == 3:
+        channels = header[2]
+        dtype = np.dtype([("lane", "<u2"), ("tile", "<u4"), ("cycle", "<u2"), ("fwhm", "<f4", (channels,)),
+                          ("intensity", "<u2", (channels,))])
+        offset = 3
+    else:
+        raise InteropFormatError(f"Version {version} of {path} is not supported")
+    if dtype.itemsize != record_size:
+        raise InteropFormatError(f"Unexpected record size {record_size} in {path}")
+    records = _map_records(path, dtype, offset)
+    return {"lane": records["lane"], "tile": records["tile"], "cycle": records["cycle"],
+            "intensity": records["intensity"]}
+
+
+def _round(value, digits=2):
+    import numpy as np
+
+    return None if value is None or np.isnan(value) else round(float(value), digits)
+
+
+def _tile_summary(tile_metrics):
+    import numpy as np
+
+    lanes = {}
+    for lane in np.unique(tile_metrics["lane"]):
+        selected = tile_metrics["lane"] == lane
+        clusters = np.nansum(tile_metrics["clusters"][selected])
+        clusters_pf = np.nansum(tile_metrics["clusters_pf"][selected])
+        density = tile_metrics["density"][selected]
+        lanes[int(lane)] = {
+            "tiles": int(selected.sum()),
+            "density_k_per_mm2": _round(np.nanmean(density) / 1000 if np.isfinite(density).any() else np.nan),
+            "density_pf_k_per_mm2": _round(np.nanmean(tile_metrics["density_pf"][selected]) / 1000
+                                           if np.isfinite(tile_metrics["density_pf"][selected]).any() else np.nan),
+            "clusters": int(clusters),
+            "clusters_pf": int(clusters_pf),
+            "percent_pf": _round(100.0 * clusters_pf / clusters) if clusters else None}
+    return lanes
+
+
+def _q30_summary(q_metrics):
+    import numpy as np
+
+    lanes, lane_index = np.unique(q_metrics["lane"], return_inverse=True)
+    histogram = q_metrics["histogram"]
+    at_least_q30 = histogram[:, q_metrics["scores"] >= 30].sum(axis=1, dtype=np.float64)
+    total = histogram.sum(axis=1, dtype=np.float64)
+    q30_per_lane = np.bincount(lane_index, weights=at_least_q30, minlength=len(lanes))
+    total_per_lane = np.bincount(lane_index, weights=total, minlength=len(lanes))
+    return {int(lane): _round(100.0 * q30 / lane_total) if lane_total else None
+            for lane, q30, lane_total in zip(lanes, q30_per_lane, total_per_lane)}
+
+
+def _index_summary(index_metrics, clusters_pf):
+    import numpy as np
+
+    if len(index_metrics["lane"]) == 0:
+        return {}
+    # Each tile has a record per read of the index, so only the first read is counted
+    first_read = index_metrics["read"] == index_metrics["read"].min()
+    lane = index_metrics["lane"][first_read]
+    keys = np.rec.fromarrays([lane, index_metrics["index"][first_read], index_metrics["sample"][first_read],
+                              index_metrics["project"][first_read]])
+    unique_keys, key_index = np.unique(keys, return_inverse=True)
+    clusters = np.bincount(key_index.ravel(), weights=index_metrics["clusters"][first_read], minlength=len(unique_keys))
+
+    lanes = {}
+    for key, key_clusters in zip(unique_keys, clusters):
+        lane_pf = clusters_pf.get(int(key[0]))
+        lanes.setdefault(int(key[0]), []).append({
+            "index": key[1].decode(errors="replace"),
+            "sample": key[2].decode(errors="replace"),
+            "project": key[3].decode(errors="replace"),
+            "clusters": int(key_clusters),
+            "percent_of_pf": _round(100.0 * key_clusters / lane_pf) if lane_pf else None})
+    for samples in lanes.values():
+        samples.sort(key=lambda sample: -sample["clusters"])
+    return lanes
+
+
+def _intensity_summary(extraction_metrics):
+    import numpy as np
+
+    first_cycle = extraction_metrics["cycle"] == 1
+    if not first_cycle.any():
+        return {}
+    lane = extraction_metrics["lane"][first_cycle]
+    intensity = extraction_metrics["intensity"][first_cycle].astype(np.float64)
+    lanes, lane_index = np.unique(lane, return_inverse=True)
+    counts = np.bincount(lane_index, minlength=len(lanes))
+    sums = np.stack([np.bincount(lane_index, weights=intensity[:, channel], minlength=len(lanes))
+                     for channel in range(intensity.shape[1])], axis=1)
+    return {int(lane): [_round(value) for value in sums[i] / counts[i]] for i, lane in enumerate(lanes)}
+
+
+def run_qc(runfolder):
+    """
+    Summarise the quality of a run per lane from the InterOp files of the runfolder. Parts of the
+    summary for which there is no InterOp file, or a file that can not be read, are left out.
+    :param runfolder: path to the runfolder
+    :return: a dict with a dict per lane, with the cluster density, clusters passing filter,
+             percent of bases with a quality score of at least 30, mean intensity per channel at
+             the first cycle, and the clusters of each index
+    """
+    interop = os.path.join(runfolder, INTEROP_DIR_NAME)
+    lanes = {}
+
+    def read(name, reader):
+        path = os.path.join(interop, name)
+        if not os.path.exists(path):
+            return None
+        try:
+            return reader(path)
+        except (InteropFormatError, ValueError, IndexError) as e:
+            log.warning(f"Could not read {path}: {e}")
+            return None
+
+    tile_metrics = read(TILE_METRICS_FILE, read_tile_metrics)
+    clusters_pf = {}
+    if tile_metrics is not None:
+        for lane, summary in _tile_summary(tile_metrics).items():
+            lanes.setdefault(lane, {}).update(summary)
+            clusters_pf[lane] = summary["clusters_pf"]
+
+    q_metrics = read(Q_METRICS_FILE, read_q_metrics)
+    if q_metrics is not None:
+        for lane, percent_q30 in _q30_summary(q_metrics).items():
+            lanes.setdefault(lane, {})["percent_q30"] = percent_q30
+
+    extraction_metrics = read(EXTRACTION_METRICS_FILE, read_extraction_metrics)
+    if extraction_metrics is not None:
+        for lane, intensity in _intensity_summary(extraction_metrics).items():
+            lanes.setdefault(lane, {})["intensity_cycle_1"] = intensity
+
+    index_metrics = read(INDEX_METRICS_FILE, read_index_metrics)
+    if index_metrics is not None:
+        for lane, samples in _index_summary(index_metrics, clusters_pf).items():
+            lanes.setdefault(lane, {})["indexes"] = samples
+
+    return {"lanes": {str(lane): lanes[lane] for lane in sorted(lanes)}}
+
+
+class RunQcCache(SignatureCache):
+    """
+    Process wide cache of the `run_qc` of runfolders. Entries are keyed by the path of the
+    runfolder and are only reused as long as the mtime and size of each InterOp file are
+    unchanged. The least recently used entries are evicted once `maxsize` runfolders are cached.
+    """
+
+    def __init__(self, maxsize=32):
+        super().__init__(maxsize)
+
+    def get(self, runfolder):
+        """
+        Get the `run_qc` of a runfolder, reading its InterOp files only if they have changed
+        since they were last read.
+        :param runfolder: path to the runfolder
+        :return: the `run_qc` of the runfolder
+        :raises FileNotFoundError: if the runfolder has no InterOp files
+        """
+        runfolder = os.path.abspath(runfolder)
+        signature = file_signature(os.path.join(runfolder, INTEROP_DIR_NAME, name) for name in
+                                   (TILE_METRICS_FILE, Q_METRICS_FILE, INDEX_METRICS_FILE, EXTRACTION_METRICS_FILE))
+        if not any(signature):
+            raise FileNotFoundError(f"No InterOp files in {runfolder}")
+
+        def read():
+            log.debug(f"Reading the InterOp files of {runfolder}")
+            return run_qc(runfolder)
+
+        return self.lookup(runfolder, signature, read)
+
+
+_run_qc_cache = RunQcCache()
+
+
+def get_run_qc(runfolder):
+    """
+    Get the `run_qc` of a runfolder from the process wide cache.
+    :param runfolder: path to the runfolder
+    """
+    return _run_qc_cache.get(runfolder)
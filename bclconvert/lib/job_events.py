@@ -0,0 +1,74 @@
+import logging
+import threading
+import time
+from collections import deque
+
+log = logging.getLogger(__name__)
+
+
+class JobEvents:
+    """
+    A log of job state changes that listeners can subscribe to. Each event gets a version, one higher
+    than the event before it, so that a client can tell whether it has missed any changes. The last
+    `max_events` events are kept, so that a client that reconnects can catch up.
+
+    Listeners are called from the thread that publishes the event, and must not block.
+    """
+
+    def __init__(self, max_events=1000):
+        """
+        :param max_events: number of events kept for clients catching up
+        """
+        self._events = deque(maxlen=max_events)
+        self._version = 0
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    @property
+    def version(self):
+        """
+        :return: the version of the last event, 0 if there have been no events
+        """
+        return self._version
+
+    def publish(self, job_id, state, runfolder=None, parent_id=None):
+        """
+        Record that a job changed state, and tell the listeners.
+        :return: the event, a dict with the version, job id, state, runfolder, parent id and time
+        """
+        with self._lock:
+            self._version += 1
+            event = {"version": self._version,
+                     "job_id": job_id,
+                     "state": state,
+                     "runfolder": runfolder,
+                     "parent_id": parent_id,
+                     "time": time.time()}
+            self._events.append(event)
+            listeners = list(self._listeners)
+        for listener in listeners:
+            try:
+                listener(event)
+            except Exception:
+                log.exception(f"Failed to pass on the event for job {job_id}")
+        return event
+
+    def since(self, version):
+        """
+        :param version: of the last event the client has seen
+        :return: the events after `version` that are still kept, oldest first
+        """
+        with self._lock:
+            return [event for event in self._events if event["version"] > version]
+
+    def subscribe(self, listener):
+        """
+        :param listener: called with each event as it is published
+        """
+        with self._lock:
+            self._listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        with self._lock:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
@@ -0,0 +1,144 @@
+import json
+import logging
+import sqlite3
+import threading
+
+log = logging.getLogger(__name__)
+
+# Columns of the jobs table, in order. `parameters`, `command` and `finisher_args` are stored as json.
+COLUMNS = ("job_id", "parent_id", "runfolder", "parameters", "command", "run_dir", "stdout", "stderr",
+           "cores", "memory_mb", "runner_job_id", "state", "exit_code", "submitted", "started", "finished",
+           "finisher", "finisher_args", "priority", "fingerprint", "validating", "finishing")
+
+JSON_COLUMNS = ("parameters", "command", "finisher_args")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id INTEGER PRIMARY KEY,
+    parent_id INTEGER,
+    runfolder TEXT,
+    parameters TEXT,
+    command TEXT,
+    run_dir TEXT,
+    stdout TEXT,
+    stderr TEXT,
+    cores INTEGER,
+    memory_mb INTEGER,
+    runner_job_id TEXT,
+    state TEXT NOT NULL,
+    exit_code INTEGER,
+    submitted REAL,
+    started REAL,
+    finished REAL,
+    finisher TEXT,
+    finisher_args TEXT,
+    priority INTEGER,
+    fingerprint TEXT,
+    validating INTEGER,
+    finishing INTEGER
+);
+CREATE INDEX IF NOT EXISTS jobs_runfolder ON jobs (runfolder);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state);
+CREATE INDEX IF NOT EXISTS jobs_parent_id ON jobs (parent_id);
+"""
+
+# Columns added to the jobs table after it was first released, with their types. They are added
+# to databases created before them when the registry is opened.
+ADDED_COLUMNS = {"priority": "INTEGER", "fingerprint": "TEXT", "validating": "INTEGER", "finishing": "INTEGER"}
+
+
+class JobRegistry:
+    """
+    Keeps a record of every job in an SQLite database, so that job ids and states survive restarts
+    of the service. Records are dicts with the keys in `COLUMNS`.
+    """
+
+    def __init__(self, path=":memory:"):
+        """
+        :param path: path to the database file, which is created if it does not exist. ":memory:"
+                     keeps the registry in memory only.
+        """
+        self.path = path
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._connection:
+            if path != ":memory:":
+                self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.executescript(SCHEMA)
+            existing = {row["name"] for row in self._connection.execute("PRAGMA table_info(jobs)")}
+            for column, column_type in ADDED_COLUMNS.items():
+                if column not in existing:
+                    self._connection.execute(f"ALTER TABLE jobs ADD COLUMN {column} {column_type}")
+
+    @staticmethod
+    def _to_record(row):
+        record = dict(row)
+        for column in JSON_COLUMNS:
+            if record[column] is not None:
+                record[column] = json.loads(record[column])
+        return record
+
+    def save(self, record):
+        """
+        Insert or replace the record of a job.
+        :param record: dict with the values of the job, missing columns are stored as NULL
+        """
+        values = [json.dumps(record.get(column)) if column in JSON_COLUMNS and record.get(column) is not None
+                  else record.get(column) for column in COLUMNS]
+        with self._lock, self._connection:
+            self._connection.execute(
+                f"INSERT OR REPLACE INTO jobs ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})", values)
+
+    def _select(self, where="", parameters=()):
+        with self._lock:
+            rows = self._connection.execute(f"SELECT * FROM jobs {where} ORDER BY job_id", parameters).fetchall()
+        return [JobRegistry._to_record(row) for row in rows]
+
+    def get(self, job_id):
+        """
+        :return: the record of the job, or None if there is no such job
+        """
+        records = self._select("WHERE job_id = ?", (int(job_id),))
+        return records[0] if records else None
+
+    def find(self, runfolder=None, state=None):
+        """
+        :param runfolder: only return the jobs of this runfolder
+        :param state: only return jobs in this state
+        :return: list of records, ordered by job id
+        """
+        conditions = []
+        parameters = []
+        if runfolder is not None:
+            conditions.append("runfolder = ?")
+            parameters.append(runfolder)
+        if state is not None:
+            conditions.append("state = ?")
+            parameters.append(state)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        return self._select(where, parameters)
+
+    def children(self, parent_id):
+        """
+        :return: the records of the jobs grouped under `parent_id`, ordered by job id
+        """
+        return self._select("WHERE parent_id = ?", (int(parent_id),))
+
+    def unfinished(self, finished_states):
+        """
+        :param finished_states: the states a job can finish in
+        :return: the records of jobs not in any of `finished_states`, ordered by job id
+        """
+        return self._select(f"WHERE state NOT IN ({', '.join('?' * len(finished_states))})", tuple(finished_states))
+
+    def max_job_id(self):
+        """
+        :return: the highest job id in the registry, 0 if it is empty
+        """
+        with self._lock:
+            return self._connection.execute("SELECT MAX(job_id) FROM jobs").fetchone()[0] or 0
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -1,16 +1,27 @@
 # This file has been modified from the https://github.com/arteria-project/arteria-bcl2fastq repo
 # bcl2fastq/lib/jobrunner.py
 
-from localq import LocalQServer, Status
+import logging
+import shlex
+import subprocess
+import threading
+import time
+
+from arteria.exceptions import ArteriaUsageException
 from arteria.web.state import State as arteria_state
 
+log = logging.getLogger(__name__)
+
 
 class JobRunnerAdapter:
     """
     Specifies interface that should be used by jobrunners.
     """
 
-    def start(self, cmd, nbr_of_cores, run_dir, stdout=None, stderr=None):
+    # Whether jobs keep running, and can still be looked up, when the service is restarted
+    jobs_survive_restart = False
+
+    def start(self, cmd, nbr_of_cores, run_dir, stdout=None, stderr=None, memory_mb=None):
         """
         Start a job corresponding to cmd
         :param cmd: to run
@@ -18,6 +29,7 @@ class JobRunnerAdapter:
         :param run_dir: where to run the job
         :param stdout: Reroute stdout to here
         :param stderr: Reroute stderr to here
+        :param memory_mb: memory the job needs, for runners that can reserve memory
         :return: the jobid associated with it (None on failure).
         """
         raise NotImplementedError("Subclasses should implement this!")
@@ -53,6 +65,23 @@ class JobRunnerAdapter:
         """
         raise NotImplementedError("Subclasses should implement this!")
 
+    def exit_code(self, job_id):
+        """
+        Exit code of a finished job, for runners that keep track of it
+        :param job_id: to get the exit code for.
+        :return: the exit code, or None if it is not known.
+        """
+        return None
+
+    def add_finished_listener(self, listener):
+        """
+        Ask to be told when a job finishes, for runners that are notified when their jobs exit.
+        Other runners ignore this, and their jobs have to be polled with `status`.
+        :param listener: called with the job_id of each job that finishes
+        :return: Nothing
+        """
+        pass
+
 
 class LocalQAdapter(JobRunnerAdapter):
     """
@@ -67,6 +96,7 @@ class LocalQAdapter(JobRunnerAdapter):
         :param status: to convert
         :return: the arteria state
         """
+        from localq import Status
 
         if status == Status.COMPLETED:
             return arteria_state.DONE
@@ -85,11 +115,15 @@ class LocalQAdapter(JobRunnerAdapter):
 
     # TODO Make configurable
     def __init__(self, nbr_of_cores, interval=30, priority_method="fifo"):
+        # localq is imported here rather than at module level so that it is only
+        # loaded once a job runner is actually needed, see `bclconvert.app`.
+        from localq import LocalQServer
+
         self.nbr_of_cores = nbr_of_cores
         self.server = LocalQServer(nbr_of_cores, interval, priority_method)
         self.server.run()
 
-    def start(self, cmd, nbr_of_cores, run_dir, stdout=None, stderr=None):
+    def start(self, cmd, nbr_of_cores, run_dir, stdout=None, stderr=None, memory_mb=None):
         return self.server.add(cmd, nbr_of_cores, run_dir, stdout=stdout, stderr=stderr)
 
     def stop(self, job_id):
@@ -106,3 +140,195 @@ class LocalQAdapter(JobRunnerAdapter):
         for k, v in self.server.get_status_all().items():
             jobs_and_status[k] = LocalQAdapter.localq2arteria_status(v)
         return jobs_and_status
+
+
+class SlurmAdapter(JobRunnerAdapter):
+    """
+    An implementation of `JobRunnerAdapter` submitting jobs to a SLURM cluster.
+
+    Jobs are submitted with sbatch, requesting the cores and memory the job needs. The state of
+    all jobs is fetched with a single squeue call (and a single sacct call for jobs that have left
+    the queue), and is cached for `status_cache_seconds`, so that polling the status of many jobs
+    does not run one command per job. Jobs that have finished are never queried again, nor are
+    jobs that neither squeue nor sacct have known of `max_status_misses` times in a row, which
+    are taken to have failed.
+    """
+
+    jobs_survive_restart = True
+
+    SLURM_STATES = {
+        "PENDING": arteria_state.PENDING,
+        "CONFIGURING": arteria_state.PENDING,
+        "REQUEUED": arteria_state.PENDING,
+        "RUNNING": arteria_state.STARTED,
+        "COMPLETING": arteria_state.STARTED,
+        "SUSPENDED": arteria_state.STARTED,
+        "STAGE_OUT": arteria_state.STARTED,
+        "COMPLETED": arteria_state.DONE,
+        "CANCELLED": arteria_state.CANCELLED,
+        "FAILED": arteria_state.ERROR,
+        "TIMEOUT": arteria_state.ERROR,
+        "NODE_FAIL": arteria_state.ERROR,
+        "OUT_OF_MEMORY": arteria_state.ERROR,
+        "BOOT_FAIL": arteria_state.ERROR,
+        "DEADLINE": arteria_state.ERROR,
+        "PREEMPTED": arteria_state.ERROR,
+    }
+
+    FINISHED_STATES = (arteria_state.DONE, arteria_state.CANCELLED, arteria_state.ERROR)
+
+    @staticmethod
+    def slurm2arteria_status(slurm_state):
+        """
+        Convert a SLURM job state, e.g. "RUNNING" or "CANCELLED by 1234", to an arteria state
+        :param slurm_state: to convert
+        :return: the arteria state
+        """
+        return SlurmAdapter.SLURM_STATES.get(slurm_state.split(" ")[0].rstrip("+"), arteria_state.NONE)
+
+    def __init__(self, job_name="bclconvert", partition=None, account=None, time_limit=None, extra_args=None,
+                 status_cache_seconds=10, max_status_misses=3, sbatch="sbatch", squeue="squeue", sacct="sacct",
+                 scancel="scancel"):
+        """
+        :param job_name: name of the submitted jobs, used to list them with squeue
+        :param partition: partition to submit to, or None for the default partition
+        :param account: account to submit with, or None for the default account
+        :param time_limit: time limit of the jobs, e.g. "1-00:00:00", or None for the partition default
+        :param extra_args: list of any other arguments to pass to sbatch
+        :param status_cache_seconds: how long fetched job states are used before they are fetched again
+        :param max_status_misses: times in a row a job may be missing from both squeue and sacct
+                                  before it is taken to have failed, e.g. because it was purged
+                                  from the accounting database
+        :param sbatch: path to the sbatch command, and likewise for squeue, sacct and scancel
+        """
+        self.job_name = job_name
+        self.partition = partition
+        self.account = account
+        self.time_limit = time_limit
+        self.extra_args = extra_args or []
+        self.status_cache_seconds = status_cache_seconds
+        self.max_status_misses = max_status_misses
+        self.sbatch = sbatch
+        self.squeue = squeue
+        self.sacct = sacct
+        self.scancel = scancel
+        self._states = {}
+        # Times in a row each job has been missing from both squeue and sacct
+        self._misses = {}
+        self._fetched = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _run(args):
+        result = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        if result.returncode != 0:
+            raise ArteriaUsageException(f"{args[0]} failed with exit status {result.returncode}: {result.stderr.strip()}")
+        return result.stdout
+
+    def start(self, cmd, nbr_of_cores, run_dir, stdout=None, stderr=None, memory_mb=None):
+        args = [self.sbatch, "--parsable",
+                "--job-name", self.job_name,
+                "--cpus-per-task", str(nbr_of_cores),
+                "--chdir", run_dir,
+                "--output", stdout or "/dev/null",
+                "--error", stderr or stdout or "/dev/null"]
+        if memory_mb:
+            args.extend(["--mem", f"{memory_mb}M"])
+        if self.partition:
+            args.extend(["--partition", self.partition])
+        if self.account:
+            args.extend(["--account", self.account])
+        if self.time_limit:
+            args.extend(["--time", self.time_limit])
+        args.extend(self.extra_args)
+        args.extend(["--wrap", cmd if isinstance(cmd, str) else " ".join(shlex.quote(str(arg)) for arg in cmd)])
+
+        # With --parsable sbatch prints "<job id>" or "<job id>;<cluster>"
+        job_id = self._run(args).strip().split(";")[0]
+        with self._lock:
+            self._states[job_id] = arteria_state.PENDING
+        return job_id
+
+    def _fetch_states(self):
+        """
+        Fetch the state of all jobs that are not known to have finished, unless that was done less
+        than `status_cache_seconds` ago. Must be called holding the lock.
+        """
+        if time.time() - self._fetched < self.status_cache_seconds:
+            return
+        unfinished = [job_id for job_id, state in self._states.items() if state not in SlurmAdapter.FINISHED_STATES]
+        if not unfinished:
+            return
+
+        in_queue = {}
+        for line in self._run([self.squeue, "--noheader", "--states=all", "--name", self.job_name,
+                               "--format=%i|%T"]).splitlines():
+            job_id, _, state = line.strip().partition("|")
+            in_queue[job_id] = state
+
+        left_queue = [job_id for job_id in unfinished if job_id not in in_queue]
+        accounted = {}
+        if left_queue:
+            for line in self._run([self.sacct, "--noheader", "--parsable2", "--format=JobID,State",
+                                   "--jobs", ",".join(left_queue)]).splitlines():
+                job_id, _, state = line.strip().partition("|")
+                # Skip the steps of each job, e.g. "1234.batch"
+                if "." not in job_id:
+                    accounted[job_id] = state
+
+        for job_id in unfinished:
+            state = in_queue.get(job_id, accounted.get(job_id))
+            if state:
+                self._misses.pop(job_id, None)
+                self._states[job_id] = SlurmAdapter.slurm2arteria_status(state)
+                continue
+            self._misses[job_id] = self._misses.get(job_id, 0) + 1
+            if self._misses[job_id] >= self.max_status_misses:
+                log.warning(f"SLURM job {job_id} is not known to squeue or sacct, taking it to have failed.")
+                del self._misses[job_id]
+                self._states[job_id] = arteria_state.ERROR
+            else:
+                self._states[job_id] = arteria_state.NONE
+        self._fetched = time.time()
+
+    def stop(self, job_id):
+        job_id = str(job_id)
+        self._run([self.scancel, job_id])
+        with self._lock:
+            self._fetched = 0
+        return job_id
+
+    def stop_all(self):
+        with self._lock:
+            unfinished = [job_id for job_id, state in self._states.items() if state not in SlurmAdapter.FINISHED_STATES]
+            if unfinished:
+                self._run([self.scancel] + unfinished)
+            self._fetched = 0
+
+    def status(self, job_id):
+        job_id = str(job_id)
+        with self._lock:
+            if job_id not in self._states:
+                # A job submitted before the service was restarted, look it up
+                self._states[job_id] = arteria_state.NONE
+                self._fetched = 0
+            self._fetch_states()
+            return self._states[job_id]
+
+    def status_all(self):
+        with self._lock:
+            self._fetch_states()
+            return dict(self._states)
+
+    def exit_code(self, job_id):
+        try:
+            output = self._run([self.sacct, "--noheader", "--parsable2", "--format=JobID,ExitCode",
+                                "--jobs", str(job_id)])
+        except ArteriaUsageException:
+            return None
+        for line in output.splitlines():
+            accounted_id, _, exit_code = line.strip().partition("|")
+            # The exit code is given as "<exit code>:<signal>"
+            if accounted_id == str(job_id) and exit_code:
+                return int(exit_code.split(":")[0])
+        return None
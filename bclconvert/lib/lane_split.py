@@ -0,0 +1,264 @@
+import csv
+import logging
+import os
+import re
+import shutil
+
+from arteria.exceptions import ArteriaUsageException
+
+from bclconvert.lib.illumina import DATA_SECTION_HEADERS, read_sections
+
+log = logging.getLogger(__name__)
+
+# Directory in the output directory where each lane is converted, before being merged into the output.
+STAGING_DIR_NAME = ".lanes"
+
+REPORTS_DIR_NAME = "Reports"
+LOGS_DIR_NAME = "Logs"
+
+# Reports that describe the whole run, and so are the same for every lane.
+RUN_REPORTS = ("SampleSheet.csv", "RunInfo.xml")
+
+# Sections of a samplesheet that do not change what is converted
+UNCONVERTED_SECTIONS = ("Header",)
+
+# Fastq files written with lane splitting, e.g. S1_S1_L001_R1_001.fastq.gz, with the lane as group 1
+LANE_FASTQ_PATTERN = re.compile(r"_L(\d{3})_[RI]\d+_\d{3}\.fastq")
+
+
+def lane_staging_dir(output, lane):
+    """
+    :return: the directory a lane is converted into when a runfolder is split by lane
+    """
+    return os.path.join(output, STAGING_DIR_NAME, f"L{lane:03d}")
+
+
+def fastq_lane(file_name):
+    """
+    :return: the lane of a fastq file named by bcl-convert with lane splitting, or None
+    """
+    match = LANE_FASTQ_PATTERN.search(file_name)
+    return int(match.group(1)) if match else None
+
+
+def _rows_by_lane(lines, lanes):
+    """
+    :param lines: the lines of the data section of a samplesheet, starting with its header
+    :param lanes: the lanes of the run, which rows without a lane belong to
+    :return: dict with the rows of each lane, sorted, each row as a sorted tuple of its
+             non-empty (column, value) pairs apart from the lane
+    """
+    rows_by_lane = {}
+    for row in csv.DictReader(lines):
+        cells = tuple(sorted((column, value.strip()) for column, value in row.items()
+                             if column not in (None, "Lane") and isinstance(value, str) and value.strip()))
+        lane = (row.get("Lane") or "").strip()
+        for row_lane in ([int(lane)] if lane else lanes):
+            rows_by_lane.setdefault(row_lane, []).append(cells)
+    return {lane: sorted(rows) for lane, rows in rows_by_lane.items()}
+
+
+def changed_lanes(previous_samplesheet, samplesheet, lanes):
+    """
+    Compare a samplesheet with the one a runfolder was converted with before, lane by lane. A lane
+    has changed if its samples, or any of their columns, differ. Rows without a lane are in every
+    lane. Changes to sections other than the data and the header, e.g. the reads or the settings,
+    change every lane.
+    :param previous_samplesheet: path to the samplesheet of the previous conversion
+    :param samplesheet: path to the new samplesheet
+    :param lanes: the lanes of the run
+    :return: the lanes that have changed, in order
+    """
+    data_sections = tuple(header.strip("[]") for header in DATA_SECTION_HEADERS)
+    previous = read_sections(previous_samplesheet)
+    current = read_sections(samplesheet)
+
+    def settings(sections):
+        return {name: lines for name, lines in sections.items()
+                if name not in data_sections and name not in UNCONVERTED_SECTIONS}
+
+    if settings(previous) != settings(current):
+        return list(lanes)
+
+    def data(sections):
+        return next((lines for name, lines in sections.items() if name in data_sections), [])
+
+    previous_rows = _rows_by_lane(data(previous), lanes)
+    current_rows = _rows_by_lane(data(current), lanes)
+    return [lane for lane in lanes if previous_rows.get(lane, []) != current_rows.get(lane, [])]
+
+
+def _merge_csv(paths, destination, replacements):
+    """
+    Concatenate csv files with the same header into one, keeping the header of the first file.
+    :param replacements: list of (old, new) strings to replace in each row, used to point paths
+                         into the staging directories at the merged output.
+    """
+    with open(destination, "w", newline="") as out:
+        writer = csv.writer(out)
+        header = None
+        for path in paths:
+            with open(path, newline="") as f:
+                rows = csv.reader(f)
+                file_header = next(rows, None)
+                if file_header is None:
+                    continue
+                if header is None:
+                    header = file_header
+                    writer.writerow(header)
+                elif file_header != header:
+                    log.warning(f"Header of {path} differs from the other lanes, merging it anyway.")
+                for row in rows:
+                    for old, new in replacements:
+                        row = [cell.replace(old, new) for cell in row]
+                    writer.writerow(row)
+
+
+def _remove_lane_output(output, lanes):
+    """
+    Remove the fastq files and the logs of `lanes` from the output of a conversion.
+    """
+    for dir_path, dir_names, file_names in os.walk(output):
+        if dir_path == output:
+            dir_names[:] = [name for name in dir_names if name not in (STAGING_DIR_NAME, REPORTS_DIR_NAME)]
+        for file_name in file_names:
+            if fastq_lane(file_name) in lanes:
+                os.remove(os.path.join(dir_path, file_name))
+    for lane in lanes:
+        shutil.rmtree(os.path.join(output, LOGS_DIR_NAME, f"L{lane:03d}"), ignore_errors=True)
+
+
+def _replace_lanes_in_csv(paths, destination, replacements, lanes):
+    """
+    Replace the rows of `lanes` in the csv file `destination` with the rows of the csv files in
+    `paths`, keeping the rows ordered by lane. Files without a Lane column are replaced as a whole.
+    """
+    rows = []
+    if os.path.exists(destination):
+        with open(destination, newline="") as f:
+            rows = list(csv.reader(f))
+    header = rows[0] if rows else None
+    if not header or "Lane" not in header:
+        if paths:
+            if header:
+                log.warning(f"{destination} has no Lane column, replacing it with the rows of lane(s) "
+                            f"{', '.join(map(str, lanes))} only.")
+            _merge_csv(paths, destination, replacements)
+        return
+
+    new_rows = []
+    if paths:
+        _merge_csv(paths, destination, replacements)
+        with open(destination, newline="") as f:
+            new_rows = list(csv.reader(f))[1:]
+    lane_column = header.index("Lane")
+    replaced = {str(lane) for lane in lanes}
+    kept = [row for row in rows[1:] if len(row) <= lane_column or row[lane_column].strip() not in replaced]
+
+    def lane_of(row):
+        try:
+            return int(row[lane_column])
+        except (IndexError, ValueError):
+            return 0
+
+    with open(destination, "w", newline="") as out:
+        writer = csv.writer(out)
+        writer.writerow(header)
+        writer.writerows(sorted(kept + new_rows, key=lane_of))
+
+
+def merge_lane_outputs(output, lanes, replace=False):
+    """
+    Merge the output of lanes converted separately into `output`:
+     - fastq files and project directories are moved into the output as is
+     - csv files in Reports are concatenated, with the header from the first lane
+     - other files in Reports, e.g. RunInfo.xml and SampleSheet.csv, are the same for all lanes
+       and are taken from the first lane
+     - the Logs of each lane are moved to Logs/L00<lane>
+    The staging directories of the merged lanes are removed afterwards, those of any other
+    lanes (e.g. lanes that failed) are left for inspection. Lanes without a staging directory
+    have been merged already, e.g. by a finisher that ran before the service was restarted.
+
+    With `replace` the lanes replace those lanes in an existing output, and the other lanes are
+    kept: their fastq files and logs are removed before those of the staging directories are
+    moved in, only the rows of these lanes are replaced in the csv files in Reports, and the other
+    files in Reports are replaced.
+    :param output: the output directory of the runfolder
+    :param lanes: the lanes to merge, in order
+    :param replace: True to replace the lanes in the existing output, rather than merging into an empty one
+    :raises ArteriaUsageException: if two lanes produced a file with the same name outside of Reports
+    """
+    merged = [lane for lane in lanes if not os.path.isdir(lane_staging_dir(output, lane))]
+    if merged:
+        log.info(f"Lane(s) {', '.join(map(str, merged))} have already been merged into {output}")
+        lanes = [lane for lane in lanes if lane not in merged]
+
+    csv_reports = {}
+    if replace:
+        _remove_lane_output(output, lanes)
+        # The rows of the lanes are also removed from the reports they no longer have
+        reports_dir = os.path.join(output, REPORTS_DIR_NAME)
+        for dir_path, _, file_names in os.walk(reports_dir):
+            for file_name in file_names:
+                if file_name.endswith(".csv") and file_name not in RUN_REPORTS:
+                    csv_reports[os.path.relpath(os.path.join(dir_path, file_name), output)] = []
+
+    replacements = []
+    for lane in lanes:
+        staging_dir = lane_staging_dir(output, lane)
+        replacements.append((staging_dir, output))
+        for dir_path, _, file_names in os.walk(staging_dir):
+            relative_dir = os.path.relpath(dir_path, staging_dir)
+            top_dir = relative_dir.split(os.sep)[0]
+            for file_name in file_names:
+                source = os.path.join(dir_path, file_name)
+                relative_path = os.path.normpath(os.path.join(relative_dir, file_name))
+
+                if top_dir == LOGS_DIR_NAME:
+                    destination = os.path.join(output, LOGS_DIR_NAME, f"L{lane:03d}",
+                                               os.path.relpath(source, os.path.join(staging_dir, LOGS_DIR_NAME)))
+                elif top_dir == REPORTS_DIR_NAME and file_name.endswith(".csv") and file_name not in RUN_REPORTS:
+                    csv_reports.setdefault(relative_path, []).append(source)
+                    continue
+                else:
+                    destination = os.path.join(output, relative_path)
+                    if replace and fastq_lane(file_name) not in (None, lane):
+                        # Only this lane is replaced, whatever else was converted with it
+                        continue
+                    if os.path.exists(destination) and not replace:
+                        if top_dir == REPORTS_DIR_NAME:
+                            continue
+                        raise ArteriaUsageException(f"Lane {lane} produced {relative_path}, which another lane "
+                                                    f"also produced. Was lane splitting turned off?")
+
+                os.makedirs(os.path.dirname(destination), exist_ok=True)
+                os.replace(source, destination)
+
+    for relative_path, paths in csv_reports.items():
+        destination = os.path.join(output, relative_path)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        if replace:
+            _replace_lanes_in_csv(paths, destination, replacements, lanes)
+        else:
+            _merge_csv(paths, destination, replacements)
+
+    for lane in lanes:
+        shutil.rmtree(lane_staging_dir(output, lane))
+    try:
+        os.rmdir(os.path.join(output, STAGING_DIR_NAME))
+    except FileNotFoundError:
+        pass
+    except OSError:
+        log.warning(f"Leaving the output of lanes that were not merged in {os.path.join(output, STAGING_DIR_NAME)}")
+    log.info(f"Merged the output of lane(s) {', '.join(map(str, lanes))} into {output}")
+
+
+def merge_lane_jobs(finisher_args, succeeded):
+    """
+    Finisher for a group of lane jobs, see `ResourceAwareAdapter.start_group`.
+    :param finisher_args: dict with the `output` directory and the `lanes` of the jobs in the group,
+                          and `replace` set if the lanes replace those in an existing output
+    :param succeeded: positions in the group of the lane jobs that succeeded
+    """
+    merge_lane_outputs(finisher_args["output"], [finisher_args["lanes"][position] for position in succeeded],
+                       replace=finisher_args.get("replace", False))
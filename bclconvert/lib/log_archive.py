@@ -0,0 +1,105 @@
+import bisect
+import json
+import os
+import zlib
+
+# Bytes of log compressed into each block of an archive, and so the most that has to be
+# decompressed beyond what is asked for when reading part of an archive
+DEFAULT_BLOCK_SIZE = 2 ** 20
+
+ARCHIVE_SUFFIX = ".gz"
+INDEX_SUFFIX = ".idx"
+
+
+def _compress_block(block):
+    # Each block is a gzip member of its own, so that it can be decompressed on its own
+    # while the archive is still an ordinary gzip file.
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(block) + compressor.flush()
+
+
+def compress_log(path, block_size=DEFAULT_BLOCK_SIZE):
+    """
+    Compress a log to `<path>.gz`, block by block, and write an index of where each block starts
+    to `<path>.gz.idx`. The log is removed once the archive is complete.
+    :param path: of the log to compress
+    :param block_size: bytes of the log per block
+    :return: the path of the archive
+    """
+    archive_path = path + ARCHIVE_SUFFIX
+    blocks = []
+    size = 0
+    compressed_size = 0
+    with open(path, "rb") as log_file, open(archive_path + ".tmp", "wb") as archive:
+        while True:
+            block = log_file.read(block_size)
+            if not block and blocks:
+                break
+            compressed = _compress_block(block)
+            archive.write(compressed)
+            blocks.append([size, compressed_size])
+            size += len(block)
+            compressed_size += len(compressed)
+            if not block:
+                break
+
+    with open(archive_path + INDEX_SUFFIX + ".tmp", "w") as index:
+        json.dump({"block_size": block_size, "size": size, "compressed_size": compressed_size, "blocks": blocks}, index)
+    os.replace(archive_path + INDEX_SUFFIX + ".tmp", archive_path + INDEX_SUFFIX)
+    os.replace(archive_path + ".tmp", archive_path)
+    os.remove(path)
+    return archive_path
+
+
+def remove_archive(archive_path):
+    """
+    Remove an archive and its index.
+    """
+    for path in [archive_path, archive_path + INDEX_SUFFIX]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class LogArchive:
+    """
+    A log compressed with `compress_log`, which can be read from any offset by only decompressing
+    the blocks the part that is read is in.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: of the archive
+        """
+        self.path = path
+        with open(path + INDEX_SUFFIX) as f:
+            index = json.load(f)
+        self.size = index["size"]
+        self.compressed_size = index["compressed_size"]
+        self._starts = [start for start, _ in index["blocks"]]
+        self._compressed_starts = [compressed_start for _, compressed_start in index["blocks"]] + [self.compressed_size]
+
+    def read(self, offset=0, limit=None):
+        """
+        :param offset: offset in the uncompressed log to read from
+        :param limit: maximum number of bytes to read, None to read to the end of the log
+        :return: the bytes read
+        """
+        end = self.size if limit is None else min(offset + limit, self.size)
+        if offset >= end:
+            return b""
+        first = bisect.bisect_right(self._starts, offset) - 1
+        last = bisect.bisect_left(self._starts, end) - 1
+        with open(self.path, "rb") as f:
+            f.seek(self._compressed_starts[first])
+            compressed = f.read(self._compressed_starts[last + 1] - self._compressed_starts[first])
+
+        blocks = []
+        position = 0
+        for block in range(first, last + 1):
+            length = self._compressed_starts[block + 1] - self._compressed_starts[block]
+            blocks.append(zlib.decompress(compressed[position:position + length], 16 + zlib.MAX_WBITS))
+            position += length
+        data = b"".join(blocks)
+        return data[offset - self._starts[first]:end - self._starts[first]]
@@ -0,0 +1,226 @@
+import errno
+import itertools
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+log = logging.getLogger(__name__)
+
+
+class PurgeState:
+    """
+    States a trashed output directory goes through.
+    """
+    PENDING = "pending"
+    PURGING = "purging"
+    DONE = "done"
+    ERROR = "error"
+
+
+class Purge:
+    """
+    Book-keeping for a single output directory that has been moved to the trash.
+    """
+
+    def __init__(self, purge_id, original_path, trash_path):
+        self.purge_id = purge_id
+        self.original_path = original_path
+        self.trash_path = trash_path
+        self.state = PurgeState.PENDING
+        self.files_removed = 0
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+
+    def as_dict(self):
+        return {"purge_id": self.purge_id,
+                "original_path": self.original_path,
+                "trash_path": self.trash_path,
+                "state": self.state,
+                "files_removed": self.files_removed,
+                "error": self.error,
+                "created": self.created,
+                "started": self.started,
+                "finished": self.finished}
+
+
+class OutputDeletionService:
+    """
+    Removes old output directories without blocking the caller.
+
+    A directory is first renamed into a trash directory next to it (which keeps it on
+    the same filesystem, so the rename is atomic and instant), after which the caller can
+    go on and reuse the original path. The trashed trees are then purged one at a time by
+    a background thread, which fans the unlinking of the files out over a pool of workers.
+    Unlinking on network filesystems is dominated by round trips, so running many of them
+    concurrently is what makes large trees go away quickly.
+    """
+
+    TRASH_DIR_NAME = ".bclconvert_trash"
+
+    def __init__(self, nbr_of_workers=8, batch_size=256, max_finished_purges=100):
+        """
+        Instantiate a OutputDeletionService
+        :param nbr_of_workers: number of threads unlinking files in parallel
+        :param batch_size: number of files each unlink task handles
+        :param max_finished_purges: number of finished purges whose status is kept, the oldest
+                                    are forgotten first
+        """
+        self.batch_size = batch_size
+        self.max_finished_purges = max_finished_purges
+        self._unlink_pool = ThreadPoolExecutor(max_workers=nbr_of_workers)
+        self._purge_pool = ThreadPoolExecutor(max_workers=1)
+        self._purges = {}
+        self._purge_ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def trash_dir_for(path):
+        """
+        The trash directory used for `path`. It is placed in the parent directory of `path`
+        so that moving into it never crosses a filesystem boundary.
+        """
+        return os.path.join(os.path.dirname(os.path.abspath(path)), OutputDeletionService.TRASH_DIR_NAME)
+
+    def delete(self, path):
+        """
+        Move `path` to the trash and schedule it to be purged in the background.
+        :param path: directory to delete
+        :return: the `Purge` tracking the deletion, or None if there was nothing to delete
+        :raises: OSError if the directory could not be moved to the trash
+        """
+        if not os.path.lexists(path):
+            log.debug(f"No such output directory, with path: {path} will not remove it.")
+            return None
+
+        trash_dir = OutputDeletionService.trash_dir_for(path)
+        os.makedirs(trash_dir, exist_ok=True)
+
+        with self._lock:
+            purge_id = next(self._purge_ids)
+        trash_path = os.path.join(
+            trash_dir, f"{os.path.basename(os.path.abspath(path))}.{time.strftime('%Y%m%d-%H%M%S')}.{purge_id}")
+
+        try:
+            os.rename(path, trash_path)
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                log.debug(f"Output directory {path} disappeared before it could be moved to the trash.")
+                return None
+            log.error(f"Got error with error number {e.errno} when trying to move {path} to {trash_path}")
+            raise e
+
+        log.info(f"Moved {path} to {trash_path}, it will be purged in the background.")
+        return self._schedule(Purge(purge_id, path, trash_path))
+
+    def purge_leftovers(self, directories, outputs=()):
+        """
+        Schedule purges for anything left in the trash of `directories`, e.g. by a
+        service restart that happened while a purge was running.
+        :param directories: directories which may contain a trash directory
+        :param outputs: output directories that may have been deleted, whose trash, in their
+                        parent directories, is purged as well
+        :return: a list of the scheduled `Purge` instances
+        """
+        trash_dirs = [os.path.join(os.path.abspath(directory), OutputDeletionService.TRASH_DIR_NAME)
+                      for directory in directories]
+        trash_dirs.extend(OutputDeletionService.trash_dir_for(output) for output in outputs)
+        scheduled = []
+        # Each trash directory is purged once, however many outputs it was used for
+        for trash_dir in dict.fromkeys(trash_dirs):
+            try:
+                entries = list(os.scandir(trash_dir))
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                with self._lock:
+                    purge_id = next(self._purge_ids)
+                log.info(f"Found leftover trash {entry.path}, will purge it.")
+                scheduled.append(self._schedule(Purge(purge_id, None, entry.path)))
+        return scheduled
+
+    def _schedule(self, purge):
+        with self._lock:
+            self._purges[purge.purge_id] = purge
+        self._purge_pool.submit(self._purge, purge)
+        return purge
+
+    def _unlink_batch(self, paths):
+        removed = 0
+        for path in paths:
+            try:
+                os.unlink(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+    def _purge(self, purge):
+        purge.state = PurgeState.PURGING
+        purge.started = time.time()
+        try:
+            if os.path.isdir(purge.trash_path) and not os.path.islink(purge.trash_path):
+                directories = []
+                futures = []
+                batch = []
+                for root, dirs, files in os.walk(purge.trash_path):
+                    directories.append(root)
+                    # Symlinks to directories are listed as dirs but must be unlinked, not walked.
+                    batch.extend(os.path.join(root, name) for name in dirs
+                                 if os.path.islink(os.path.join(root, name)))
+                    batch.extend(os.path.join(root, name) for name in files)
+                    if len(batch) >= self.batch_size:
+                        futures.append(self._unlink_pool.submit(self._unlink_batch, batch))
+                        batch = []
+                if batch:
+                    futures.append(self._unlink_pool.submit(self._unlink_batch, batch))
+
+                done, _ = wait(futures)
+                purge.files_removed = sum(f.result() for f in done)
+
+                # os.walk is top-down, so reversing it gives children before their parents.
+                for directory in reversed(directories):
+                    os.rmdir(directory)
+            else:
+                os.unlink(purge.trash_path)
+                purge.files_removed = 1
+            purge.state = PurgeState.DONE
+            log.info(f"Purged {purge.trash_path} ({purge.files_removed} files).")
+        except OSError as e:
+            purge.state = PurgeState.ERROR
+            purge.error = str(e)
+            log.error(f"Failed purging {purge.trash_path}. Message: {e}")
+        finally:
+            purge.finished = time.time()
+            self._prune()
+
+    def _prune(self):
+        """
+        Forget the oldest finished purges, keeping `max_finished_purges` of them.
+        """
+        with self._lock:
+            finished = [purge_id for purge_id, purge in self._purges.items() if purge.finished is not None]
+            for purge_id in finished[:max(0, len(finished) - self.max_finished_purges)]:
+                del self._purges[purge_id]
+
+    def status(self, purge_id):
+        """
+        Get the status of a purge
+        :param purge_id: of the purge
+        :return: a dict describing the purge, or None if it is not known
+        """
+        with self._lock:
+            purge = self._purges.get(int(purge_id))
+        return purge.as_dict() if purge else None
+
+    def status_all(self):
+        """
+        Get the status of all purges, of the finished ones only the latest `max_finished_purges`
+        :return: a dict with purge id as key and a dict describing the purge as value
+        """
+        with self._lock:
+            purges = list(self._purges.values())
+        return {purge.purge_id: purge.as_dict() for purge in purges}
@@ -0,0 +1,217 @@
+from arteria.exceptions import ArteriaUsageException
+
+from bclconvert.lib.illumina import read_sections
+
+# bcl-convert allows one mismatch per index read unless told otherwise.
+DEFAULT_BARCODE_MISMATCHES = 1
+
+# Sections of a samplesheet the settings of bcl-convert are read from, in v2 and v1 samplesheets
+SETTINGS_SECTIONS = ("BCLConvert_Settings", "Settings")
+
+
+class PreflightReport:
+    """
+    The outcome of the checks made on a samplesheet before a conversion is queued.
+    """
+
+    def __init__(self):
+        self.errors = []
+        self.warnings = []
+
+    @property
+    def ok(self):
+        return not self.errors
+
+    def add_error(self, check, message, lane=None, samples=None):
+        self.errors.append(PreflightReport._entry(check, message, lane, samples))
+
+    def add_warning(self, check, message, lane=None, samples=None):
+        self.warnings.append(PreflightReport._entry(check, message, lane, samples))
+
+    @staticmethod
+    def _entry(check, message, lane, samples):
+        entry = {"check": check, "message": message}
+        if lane is not None:
+            entry["lane"] = lane
+        if samples is not None:
+            entry["samples"] = samples
+        return entry
+
+    def as_dict(self):
+        return {"ok": self.ok, "errors": self.errors, "warnings": self.warnings}
+
+    def summary(self):
+        return "; ".join(error["message"] for error in self.errors)
+
+
+class PreflightError(ArteriaUsageException):
+    """
+    Raised when the preflight checks of a conversion fail. Carries the full report.
+    """
+
+    def __init__(self, report):
+        super().__init__(f"Preflight checks failed: {report.summary()}")
+        self.report = report
+
+
+def samplesheet_barcode_mismatches(samplesheet_file):
+    """
+    Read the allowed barcode mismatches per index read from the BarcodeMismatchesIndex1 and
+    BarcodeMismatchesIndex2 settings of a samplesheet, which bcl-convert uses.
+    :param samplesheet_file: path to the samplesheet
+    :return: a tuple with the allowed mismatches for index 1 and index 2, `DEFAULT_BARCODE_MISMATCHES`
+             for those the samplesheet does not set
+    :raises ArteriaUsageException: if a setting can not be parsed
+    """
+    mismatches = [DEFAULT_BARCODE_MISMATCHES, DEFAULT_BARCODE_MISMATCHES]
+    sections = read_sections(samplesheet_file)
+    for line in next((sections[name] for name in SETTINGS_SECTIONS if name in sections), []):
+        name, _, value = line.partition(",")
+        for position, setting in enumerate(["BarcodeMismatchesIndex1", "BarcodeMismatchesIndex2"]):
+            if name.strip() == setting and value.strip(", "):
+                try:
+                    mismatches[position] = int(value.strip(", "))
+                except ValueError:
+                    raise ArteriaUsageException(f"Invalid {setting} in {samplesheet_file}: '{value}'")
+    return tuple(mismatches)
+
+
+def parse_barcode_mismatches(barcode_mismatches):
+    """
+    Parse the number of allowed barcode mismatches per index read.
+    :param barcode_mismatches: None, an int, or a string such as "1" or "1,0"
+    :return: a tuple with the allowed mismatches for index 1 and index 2
+    :raises ArteriaUsageException: if the value can not be parsed
+    """
+    if barcode_mismatches is None or barcode_mismatches == "":
+        return DEFAULT_BARCODE_MISMATCHES, DEFAULT_BARCODE_MISMATCHES
+    try:
+        values = [int(value) for value in str(barcode_mismatches).split(",")]
+    except ValueError:
+        raise ArteriaUsageException(f"Invalid barcode_mismatches: '{barcode_mismatches}'")
+    if len(values) == 1:
+        return values[0], values[0]
+    return values[0], values[1]
+
+
+def encode_indexes(indexes):
+    """
+    Encode index sequences as a (number of indexes x longest index) uint8 array.
+    Shorter indexes are padded with 0, which never counts as a mismatch.
+    :param indexes: list of index sequences
+    :return: a numpy array
+    """
+    import numpy as np
+
+    width = max((len(index) for index in indexes), default=0)
+    if width == 0:
+        return np.zeros((len(indexes), 0), dtype=np.uint8)
+    encoded = np.array([index.upper().encode("ascii") for index in indexes], dtype=f"S{width}")
+    return encoded.view(np.uint8).reshape(len(indexes), width)
+
+
+def pairwise_hamming_distances(encoded):
+    """
+    Compute the Hamming distance between all pairs of encoded indexes. Only positions where both
+    indexes have a base are compared, so indexes of different lengths are compared on their
+    common prefix. Anything but A, C, G and T (e.g. N) mismatches every base.
+
+    The bases are one-hot encoded, so that the number of matching positions of all pairs is a
+    single matrix product.
+    :param encoded: array from `encode_indexes`
+    :return: a (n x n) array of distances
+    """
+    import numpy as np
+
+    n = encoded.shape[0]
+    lengths = np.count_nonzero(encoded, axis=1)
+    one_hot = (encoded[:, :, None] == np.frombuffer(b"ACGT", dtype=np.uint8)).reshape(n, -1).astype(np.float32)
+    matches = np.rint(one_hot @ one_hot.T).astype(np.int32)
+    return np.minimum(lengths[:, None], lengths[None, :]).astype(np.int32) - matches
+
+
+def find_barcode_collisions(index1s, index2s, mismatches):
+    """
+    Find pairs of samples whose barcodes can not be told apart with the allowed number of mismatches.
+    A read can be assigned to a sample if each of its indexes is within the allowed mismatches of
+    the sample's index, so two samples collide when the distance between them is at most twice the
+    allowed mismatches on every index read.
+    :param index1s: list of the first index of each sample
+    :param index2s: list of the second index of each sample (empty strings if single indexed)
+    :param mismatches: tuple of allowed mismatches for index 1 and index 2
+    :return: a list of (i, j) positions of colliding samples, with i < j
+    """
+    import numpy as np
+
+    n = len(index1s)
+    if n < 2:
+        return []
+
+    colliding = pairwise_hamming_distances(encode_indexes(index1s)) <= 2 * mismatches[0]
+    if any(index2s):
+        colliding &= pairwise_hamming_distances(encode_indexes(index2s)) <= 2 * mismatches[1]
+
+    i, j = np.nonzero(np.triu(colliding, k=1))
+    return list(zip(i.tolist(), j.tolist()))
+
+
+def run_preflight(samplesheet, run_info, barcode_mismatches=None):
+    """
+    Check a samplesheet against the run it is to be used for:
+     - all lanes in the samplesheet exist on the flowcell
+     - no index is longer than the index read it is sequenced in
+     - no two samples in a lane have barcodes that collide with the allowed mismatches
+    :param samplesheet: a `Samplesheet`
+    :param run_info: the `RunInfo` of the run
+    :param barcode_mismatches: allowed mismatches, see `parse_barcode_mismatches`. If they are
+                               not set, those in the settings of the samplesheet are used.
+    :return: a `PreflightReport`
+    """
+    report = PreflightReport()
+    if barcode_mismatches is None or barcode_mismatches == "":
+        mismatches = samplesheet_barcode_mismatches(samplesheet.samplesheet_file)
+    else:
+        mismatches = parse_barcode_mismatches(barcode_mismatches)
+    index_read_lengths = [read.num_cycles for read in run_info.index_reads]
+
+    for lane in samplesheet.lanes:
+        samples = samplesheet.samples_in_lane(lane)
+
+        if lane < 1 or lane > run_info.lane_count:
+            report.add_error("lanes", f"Lane {lane} is in the samplesheet, but the flowcell only has "
+                                      f"{run_info.lane_count} lane(s)", lane=lane)
+            continue
+
+        index1s = [(sample.index1 or "").strip() for sample in samples]
+        index2s = [(sample.index2 or "").strip() for sample in samples]
+
+        for read_number, indexes in enumerate([index1s, index2s], start=1):
+            longest = max(len(index) for index in indexes)
+            if longest == 0:
+                continue
+            if read_number > len(index_read_lengths):
+                report.add_error("index_length", f"Samplesheet has index {read_number} in lane {lane}, but the run "
+                                                 f"only has {len(index_read_lengths)} index read(s)", lane=lane)
+            elif longest > index_read_lengths[read_number - 1]:
+                too_long = [sample.sample_id for sample, index in zip(samples, indexes)
+                            if len(index) > index_read_lengths[read_number - 1]]
+                report.add_error("index_length", f"Index {read_number} in lane {lane} is up to {longest} bases, but "
+                                                 f"only {index_read_lengths[read_number - 1]} cycles were sequenced",
+                                 lane=lane, samples=too_long)
+
+        if not any(index1s):
+            if len(samples) > 1:
+                report.add_error("barcode_collision", f"Lane {lane} has {len(samples)} samples but no indexes",
+                                 lane=lane, samples=[sample.sample_id for sample in samples])
+            continue
+
+        collisions = find_barcode_collisions(index1s, index2s, mismatches)
+        for i, j in collisions:
+            barcode_i = "+".join(filter(None, [index1s[i], index2s[i]]))
+            barcode_j = "+".join(filter(None, [index1s[j], index2s[j]]))
+            report.add_error("barcode_collision",
+                             f"Barcodes {barcode_i} ({samples[i].sample_id}) and {barcode_j} ({samples[j].sample_id}) "
+                             f"in lane {lane} collide with barcode mismatches {mismatches[0]},{mismatches[1]}",
+                             lane=lane, samples=[samples[i].sample_id, samples[j].sample_id])
+
+    return report
@@ -0,0 +1,296 @@
+import logging
+import os
+import re
+import threading
+import time
+
+from arteria.web.state import State as arteria_state
+
+from bclconvert.lib.lane_split import LOGS_DIR_NAME
+from bclconvert.lib.runinfo import get_runinfo
+
+log = logging.getLogger(__name__)
+
+# Lines of the output of bcl-convert that name a tile it has processed, with the lane and the
+# tile number as the groups `lane` and `tile`, e.g. "Lane 1 tile 1101" or "s_1_1101"
+DEFAULT_TILE_PATTERNS = (r"[Ll]ane\W*(?P<lane>\d+)\W+[Tt]ile\W*(?P<tile>\d{4,5})\b",
+                         r"\b(?:s_)?(?P<lane>\d)_(?P<tile>\d{4,5})\b")
+
+# Written by bcl-convert to the Logs of the output directory once the conversion is complete
+FASTQ_COMPLETE_FILE = "FastqComplete.txt"
+
+INFO_LOG_FILE = "Info.log"
+
+
+def tile_selector(tiles):
+    """
+    Compile a selection of tiles as given to bcl-convert with --tiles or --exclude-tiles: regular
+    expressions joined by "+", e.g. "s_1+s_3", of which any may match a tile.
+    :param tiles: the selection, None or empty for none
+    :return: a function that is true for the names of the tiles selected, e.g. "s_1_1101", or None
+             if `tiles` is empty
+    """
+    if not tiles:
+        return None
+    patterns = [re.compile(part) for part in str(tiles).split("+") if part]
+    return lambda name: any(pattern.match(name) for pattern in patterns)
+
+
+class LogTail:
+    """
+    Reads the lines added to a file since it was last read, so that a growing log is read once
+    however often it is looked at. If the file is replaced or truncated it is read from the start.
+    """
+
+    # Most bytes read from the file at a time
+    READ_SIZE = 1024 * 1024
+
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+        self._inode = None
+        self._partial = b""
+
+    def read_lines(self):
+        """
+        :return: the lines ended since the last read
+        """
+        try:
+            with open(self.path, "rb") as f:
+                stat = os.fstat(f.fileno())
+                if stat.st_ino != self._inode or stat.st_size < self.offset:
+                    self._inode = stat.st_ino
+                    self.offset = 0
+                    self._partial = b""
+                f.seek(self.offset)
+                lines = []
+                while True:
+                    data = f.read(LogTail.READ_SIZE)
+                    if not data:
+                        break
+                    self.offset += len(data)
+                    data = self._partial + data
+                    end = data.rfind(b"\n") + 1
+                    lines.extend(data[:end].decode(errors="replace").splitlines())
+                    self._partial = data[end:]
+                return lines
+        except FileNotFoundError:
+            return []
+
+
+def command_option(cmd, option):
+    """
+    :return: the value following `option` in a command given as a list, or None
+    """
+    if isinstance(cmd, list) and option in cmd[:-1]:
+        return cmd[cmd.index(option) + 1]
+    return None
+
+
+def job_output_dir(record):
+    """
+    :param record: the record of a job in the `JobRegistry`
+    :return: the output directory of the job, for a group of lane jobs the directory the lanes
+             are merged into, or None if it is not known
+    """
+    if record["command"] is None:
+        return (record["finisher_args"] or {}).get("output")
+    return command_option(record["command"], "--output-directory")
+
+
+class JobProgress:
+    """
+    Follows the progress of a bcl-convert job, by the tiles named in its log and in the Info.log
+    in its output directory. Only the lines added to these since they were last read are read.
+    """
+
+    def __init__(self, record, tile_patterns=DEFAULT_TILE_PATTERNS):
+        """
+        :param record: the record of the job in the `JobRegistry`
+        :param tile_patterns: regular expressions matching lines that name a processed tile, or a
+                              single one. Unlike the tiles given to bcl-convert they are not split
+                              on "+", which is a quantifier in them.
+        """
+        if isinstance(tile_patterns, str):
+            tile_patterns = [tile_patterns]
+        self.tile_patterns = [re.compile(pattern) for pattern in tile_patterns]
+        cmd = record["command"]
+        self.output = job_output_dir(record)
+        self.tiles = JobProgress.expected_tiles(record["run_dir"], command_option(cmd, "--tiles"),
+                                                command_option(cmd, "--exclude-tiles"))
+        logs = [record["stdout"]]
+        if self.output:
+            logs.append(os.path.join(self.output, LOGS_DIR_NAME, INFO_LOG_FILE))
+        self.tails = [LogTail(path) for path in logs if path]
+        self.tiles_done = set()
+
+    @staticmethod
+    def expected_tiles(run_dir, tiles=None, exclude_tiles=None):
+        """
+        :param run_dir: the runfolder converted
+        :param tiles: the tiles bcl-convert was given to select, e.g. "s_[13]" or "s_1+s_3", see `tile_selector`
+        :param exclude_tiles: the tiles bcl-convert was given to leave out
+        :return: the set of tiles the job converts, named as in RunInfo.xml e.g. "1_1101", or
+                 None if they are not known
+        """
+        try:
+            run_info = get_runinfo(run_dir)
+        except (OSError, TypeError):
+            return None
+        except Exception as e:
+            log.warning(f"Could not read the tiles of {run_dir}: {e}")
+            return None
+        if not run_info.tiles:
+            return None
+        selected = tile_selector(tiles)
+        excluded = tile_selector(exclude_tiles)
+        return {tile for tile in run_info.tiles
+                if (not selected or selected(f"s_{tile}")) and not (excluded and excluded(f"s_{tile}"))}
+
+    @property
+    def complete(self):
+        return bool(self.output) and os.path.exists(os.path.join(self.output, LOGS_DIR_NAME, FASTQ_COMPLETE_FILE))
+
+    def update(self):
+        """
+        Read what has been added to the logs since the last update.
+        """
+        for tail in self.tails:
+            for line in tail.read_lines():
+                for pattern in self.tile_patterns:
+                    for match in pattern.finditer(line):
+                        tile = f"{int(match.group('lane'))}_{match.group('tile')}"
+                        if self.tiles is None or tile in self.tiles:
+                            self.tiles_done.add(tile)
+
+    def as_dict(self, started, now=None):
+        """
+        :param started: the time the job started
+        :return: the tiles done and to do, percent complete, tiles processed per second, and the
+                 estimated seconds left, as a dict. Values that are not known are None.
+        """
+        now = time.time() if now is None else now
+        total = len(self.tiles) if self.tiles is not None else None
+        done = total if self.complete and total is not None else len(self.tiles_done)
+        elapsed = now - started if started else None
+        rate = done / elapsed if elapsed and elapsed > 0 else None
+        if self.complete:
+            percent = 100.0
+        elif total:
+            percent = round(min(100.0 * done / total, 99.9), 1)
+        else:
+            percent = None
+        return {"tiles_done": done,
+                "tiles_total": total,
+                "percent": percent,
+                "tiles_per_second": round(rate, 3) if rate is not None else None,
+                "eta": _eta(total, done, rate) if not self.complete else 0}
+
+
+def _eta(total, done, rate):
+    if total is None or not rate:
+        return None
+    return round(max(total - done, 0) / rate, 1)
+
+
+def progress_without_logs(record, complete):
+    """
+    :param record: the record of the job in the `JobRegistry`
+    :param complete: True if the job has converted all its tiles, False if it has not started
+    :return: the progress of a job that is not running, see `JobProgress.as_dict`
+    """
+    tiles = JobProgress.expected_tiles(record["run_dir"], command_option(record["command"], "--tiles"),
+                                       command_option(record["command"], "--exclude-tiles"))
+    total = len(tiles) if tiles is not None else None
+    return {"tiles_done": total if complete else 0,
+            "tiles_total": total,
+            "percent": 100.0 if complete else 0.0,
+            "tiles_per_second": None,
+            "eta": 0 if complete else None}
+
+
+class ProgressTracker:
+    """
+    Keeps a `JobProgress` for each running job, so that the logs of a job are read incrementally
+    from one status request to the next, and reports the progress of jobs and groups of jobs.
+    The progress of a job is forgotten once it is no longer running.
+    """
+
+    def __init__(self, tile_patterns=DEFAULT_TILE_PATTERNS, events=None):
+        """
+        :param tile_patterns: regular expressions matching the lines of the logs that name a processed tile
+        :param events: the `JobEvents` of the scheduler, to forget the progress of jobs as soon as they
+                       stop running rather than the next time it is asked for. None to not listen for them.
+        """
+        self.tile_patterns = tile_patterns
+        self.events = events
+        self._jobs = {}
+        self._lock = threading.Lock()
+        if events is not None:
+            events.subscribe(self.on_event)
+
+    def on_event(self, event):
+        if event["state"] != arteria_state.STARTED:
+            # Not taking the lock, listeners must not wait for the logs of other jobs to be read
+            self._jobs.pop(event["job_id"], None)
+
+    def _job_progress(self, scheduler, job_info):
+        job_id = job_info["job_id"]
+        state = job_info["state"]
+        if state != arteria_state.STARTED:
+            with self._lock:
+                self._jobs.pop(job_id, None)
+            record = scheduler.registry.get(job_id)
+            if record and state in (arteria_state.PENDING, arteria_state.DONE):
+                return progress_without_logs(record, complete=state == arteria_state.DONE)
+            return None
+
+        with self._lock:
+            progress = self._jobs.get(job_id)
+            if progress is None:
+                record = scheduler.registry.get(job_id)
+                if not record:
+                    return None
+                progress = self._jobs[job_id] = JobProgress(record, self.tile_patterns)
+            progress.update()
+            return progress.as_dict(job_info["started"])
+
+    def progress(self, scheduler, job_id):
+        """
+        :param scheduler: the `ResourceAwareAdapter` running the job
+        :param job_id: the job, or the parent of a group of jobs, whose progress is wanted
+        :return: the progress of the job as a dict, see `JobProgress.as_dict`, or None if the job
+                 has failed or been cancelled. The progress of a group adds up the progress of its
+                 jobs, leaving out jobs that have failed.
+        """
+        job_info = scheduler.job_info(job_id)
+        if not job_info:
+            return None
+        if "children" not in job_info:
+            return self._job_progress(scheduler, job_info)
+
+        if job_info["state"] not in (arteria_state.PENDING, arteria_state.STARTED, arteria_state.DONE):
+            return None
+        children = [progress for progress in
+                    (self._job_progress(scheduler, child_info) for child_info in
+                     filter(None, (scheduler.job_info(child_id) for child_id in job_info["children"])))
+                    if progress is not None]
+        if not children:
+            return None
+        totals = [child["tiles_total"] for child in children]
+        total = sum(totals) if None not in totals else None
+        done = sum(child["tiles_done"] or 0 for child in children)
+        rates = [child["tiles_per_second"] for child in children if child["tiles_per_second"] is not None]
+        # Lanes run at the same time, so their rates add up
+        rate = sum(rates) if rates else None
+        if all(child["percent"] == 100.0 for child in children):
+            percent = 100.0
+        elif total:
+            percent = round(min(100.0 * done / total, 99.9), 1)
+        else:
+            percent = None
+        return {"tiles_done": done,
+                "tiles_total": total,
+                "percent": percent,
+                "tiles_per_second": round(rate, 3) if rate is not None else None,
+                "eta": 0 if percent == 100.0 else _eta(total, done, rate)}
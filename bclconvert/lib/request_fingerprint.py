@@ -0,0 +1,47 @@
+import hashlib
+import json
+import os
+
+# Values of a `BclConvertConfig` that change what a conversion writes. The thread counts only
+# change how fast it does so, and the priority of a request only when it runs.
+FINGERPRINT_FIELDS = ("barcode_mismatches", "tiles", "exclude_tiles", "use_base_mask", "create_indexes",
+                      "additional_args", "split_lanes", "lanes", "bcl_sampleproject_subdirectories",
+                      "sample_name_column_enabled", "strict_mode", "fastq_gzip_compression_level",
+                      "no_lane_splitting", "num_unknown_barcodes_reported", "output_legacy_stats")
+
+
+def samplesheet_sha256(runfolder_input, samplesheet=None):
+    """
+    :param runfolder_input: path to the runfolder
+    :param samplesheet: the samplesheet given in the request as a string, None to use the one in the runfolder
+    :return: the sha256 of the samplesheet as a hex string, or None if the runfolder has none
+    """
+    if samplesheet:
+        return hashlib.sha256(samplesheet.encode()).hexdigest()
+    try:
+        with open(os.path.join(runfolder_input, "SampleSheet.csv"), "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except FileNotFoundError:
+        return None
+
+
+def request_fingerprint(config, rerun="all"):
+    """
+    Fingerprint a request to start a conversion by what it resolves to, so that requests to convert
+    the same data in the same way can be recognised. Two requests have the same fingerprint if they
+    resolve to the same runfolder, samplesheet content, output directory, bcl-convert version and
+    `FINGERPRINT_FIELDS`, whether they spell out the defaults or not. Values that are not set, and
+    values given as strings or as numbers or booleans, are the same.
+    :param config: the `BclConvertConfig` the request resolves to
+    :param rerun: the rerun of the request, see `StartHandler.post`
+    :return: the fingerprint as a hex string
+    """
+    resolved = {name: str(value) for name, value in ((name, getattr(config, name, None)) for name in FINGERPRINT_FIELDS)
+                if value not in (None, "", False)}
+    fingerprint = {"runfolder": os.path.abspath(config.runfolder_input),
+                   "samplesheet": samplesheet_sha256(config.runfolder_input, config.samplesheet),
+                   "output": os.path.abspath(config.output),
+                   "bclconvert_version": str(config.bclconvert_version),
+                   "rerun": rerun or "all",
+                   "config": resolved}
+    return hashlib.sha256(json.dumps(fingerprint, sort_keys=True).encode()).hexdigest()
@@ -0,0 +1,308 @@
+import logging
+import os
+import select
+import struct
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+# Files written to a runfolder once the instrument, or the copy from it, has finished
+DEFAULT_MARKERS = ("CopyComplete.txt", "RTAComplete.txt")
+
+# Times a runfolder that could not be started is tried again, and seconds before it is tried
+# again the first time. The wait doubles for every try.
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_RETRY_DELAY = 300
+
+# inotify flags, see inotify(7)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+class Inotify:
+    """
+    A minimal binding of the Linux inotify API through ctypes.
+    """
+
+    def __init__(self):
+        """
+        :raises OSError: if inotify is not available
+        """
+        import ctypes
+        import ctypes.util
+
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("inotify is not available")
+        self._libc = libc
+        self._libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+    def add_watch(self, path, mask):
+        """
+        :return: the watch descriptor of `path`
+        :raises OSError: if the path can not be watched
+        """
+        import ctypes
+
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), path)
+        return wd
+
+    def rm_watch(self, wd):
+        self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self, timeout):
+        """
+        Wait at most `timeout` seconds for events.
+        :return: list of (watch descriptor, mask, name) of the events read
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0").decode(errors="replace")
+            offset += length
+            events.append((wd, mask, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class RunfolderWatcher:
+    """
+    Watches the directories runfolders are written to, and calls `on_complete` with the name of
+    each runfolder once one of the `markers` has been written to it. Runfolders for which
+    `is_converted` is true are left alone, so runfolders are only handed on once.
+
+    inotify is used where it is available, so that a runfolder is found as soon as it is
+    complete. Since inotify does not see changes made by other hosts on network file systems,
+    the roots are also scanned every `interval` seconds. A scan only looks for markers in
+    runfolders that have changed since the last scan, so it costs a stat per runfolder.
+
+    Runfolders that could not be started, because `on_complete` raised an exception or `failed`
+    was called for them, are handed on again up to `max_retries` times, waiting longer every time.
+    Unless `start_existing` is true, runfolders that are complete when the watcher is started are
+    taken to have been handled before, and are not handed on.
+    """
+
+    def __init__(self, roots, on_complete, is_converted, markers=DEFAULT_MARKERS, interval=60, use_inotify=True,
+                 start_existing=False, max_retries=DEFAULT_MAX_RETRIES, retry_delay=DEFAULT_RETRY_DELAY):
+        """
+        :param roots: the directories runfolders are written to
+        :param on_complete: called with the name of a runfolder that is complete, from the thread of the watcher
+        :param is_converted: called with the name of a runfolder, true if it should not be handed on
+        :param markers: names of files that mark a runfolder as complete, any of them will do
+        :param interval: seconds between scans of the roots
+        :param use_inotify: False to only scan the roots
+        :param start_existing: True to also hand on the runfolders that are complete when the watcher is started
+        :param max_retries: times a runfolder that could not be started is handed on again
+        :param retry_delay: seconds before a runfolder that could not be started is handed on again
+                            the first time, doubled for every retry
+        """
+        self.roots = [os.path.abspath(root) for root in roots]
+        self.on_complete = on_complete
+        self.is_converted = is_converted
+        self.markers = tuple(markers)
+        self.interval = interval
+        self.use_inotify = use_inotify
+        self.start_existing = start_existing
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        # Runfolders handed on, or found to be converted already
+        self.done = set()
+        # The number of failed starts of each runfolder and when it may be handed on again
+        self._failures = {}
+        # `failed` is called from other threads
+        self._lock = threading.Lock()
+        # The mtime of each runfolder the last time it was scanned
+        self._scanned = {}
+        self._inotify = None
+        self._watches = {}
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.use_inotify:
+            try:
+                self._inotify = Inotify()
+            except OSError as e:
+                log.warning(f"Can not use inotify ({e}), scanning for runfolders every {self.interval} seconds")
+        self._thread = threading.Thread(target=self._run, name="runfolder-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+
+    def _watch(self, path, mask):
+        try:
+            self._watches[self._inotify.add_watch(path, mask)] = path
+        except OSError as e:
+            log.warning(f"Can not watch {path}: {e}")
+
+    def _unwatch(self, path):
+        for wd, watched in list(self._watches.items()):
+            if watched == path:
+                self._inotify.rm_watch(wd)
+                del self._watches[wd]
+
+    def _is_complete(self, path):
+        return any(os.path.exists(os.path.join(path, marker)) for marker in self.markers)
+
+    def seed(self):
+        """
+        Take the runfolders that are complete now to have been handled, so that they are not handed on.
+        """
+        for root in self.roots:
+            try:
+                entries = list(os.scandir(root))
+            except OSError as e:
+                log.warning(f"Can not scan {root}: {e}")
+                continue
+            for entry in entries:
+                try:
+                    if entry.is_dir() and self._is_complete(entry.path):
+                        self.done.add(entry.name)
+                except OSError:
+                    continue
+        log.info(f"Not starting the {len(self.done)} runfolders that were complete when the watcher started")
+
+    def failed(self, name):
+        """
+        Called when the runfolder `name` could not be started, to hand it on again later unless it
+        has been tried `max_retries` times.
+        """
+        with self._lock:
+            attempts, _ = self._failures.get(name, (0, None))
+            attempts += 1
+            if attempts > self.max_retries:
+                log.error(f"Not starting {name} again, it could not be started {attempts} times")
+                return
+            delay = self.retry_delay * 2 ** (attempts - 1)
+            self._failures[name] = (attempts, time.time() + delay)
+            self.done.discard(name)
+            log.warning(f"Starting {name} again in {delay} seconds")
+
+    def _check(self, root, name):
+        """
+        Hand on the runfolder `name` in `root` if it is complete and has not been converted.
+        """
+        path = os.path.join(root, name)
+        with self._lock:
+            if name in self.done:
+                return
+            _, retry_at = self._failures.get(name, (0, None))
+            if retry_at is not None and time.time() < retry_at:
+                # Checked again on the next scan
+                self._scanned.pop(path, None)
+                return
+            if not self._is_complete(path):
+                if self._inotify and path not in self._watches.values():
+                    self._watch(path, IN_CREATE | IN_MOVED_TO | IN_CLOSE_WRITE)
+                return
+            self.done.add(name)
+        self._scanned.pop(path, None)
+        if self._inotify:
+            self._unwatch(path)
+        try:
+            if self.is_converted(name):
+                log.debug(f"Not starting {name}, it has already been converted")
+                return
+            log.info(f"Runfolder {name} is complete, starting it")
+            self.on_complete(name)
+        except Exception:
+            log.exception(f"Failed to start {name}")
+            self.failed(name)
+
+    def scan(self):
+        """
+        Look for complete runfolders in all roots, checking only the runfolders that have
+        changed since the last scan.
+        """
+        for root in self.roots:
+            try:
+                entries = list(os.scandir(root))
+            except OSError as e:
+                log.warning(f"Can not scan {root}: {e}")
+                continue
+            for entry in entries:
+                if entry.name in self.done:
+                    continue
+                try:
+                    if not entry.is_dir():
+                        continue
+                    mtime = entry.stat().st_mtime_ns
+                except OSError:
+                    continue
+                if self._scanned.get(entry.path) != mtime:
+                    self._scanned[entry.path] = mtime
+                    self._check(root, entry.name)
+
+    def _handle(self, events):
+        for wd, mask, name in events:
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost, so look at everything again
+                self._scanned.clear()
+                self.scan()
+                continue
+            path = self._watches.get(wd)
+            if path is None:
+                continue
+            if mask & (IN_IGNORED | IN_DELETE_SELF | IN_MOVE_SELF):
+                self._watches.pop(wd, None)
+            elif path in self.roots:
+                if mask & IN_ISDIR:
+                    self._check(path, name)
+            elif name in self.markers:
+                self._check(os.path.dirname(path), os.path.basename(path))
+
+    def _run(self):
+        if not self.start_existing:
+            self.seed()
+        if self._inotify:
+            for root in self.roots:
+                self._watch(root, IN_CREATE | IN_MOVED_TO)
+        try:
+            while not self._stop_event.is_set():
+                self.scan()
+                if self._inotify:
+                    # Wake up regularly to see if the watcher has been stopped
+                    deadline = self.interval
+                    while deadline > 0 and not self._stop_event.is_set():
+                        self._handle(self._inotify.read(min(deadline, 1)))
+                        deadline -= 1
+                else:
+                    self._stop_event.wait(self.interval)
+        except Exception:
+            log.exception("The runfolder watcher failed")
+        finally:
+            if self._inotify:
+                self._inotify.close()
@@ -0,0 +1,179 @@
+import logging
+import os
+from xml.etree import ElementTree
+
+from bclconvert.lib.signature_cache import SignatureCache
+
+log = logging.getLogger(__name__)
+
+
+class Read:
+    """
+    A read as described in RunInfo.xml
+    """
+    __slots__ = ("number", "num_cycles", "is_index")
+
+    def __init__(self, number, num_cycles, is_index):
+        self.number = number
+        self.num_cycles = num_cycles
+        self.is_index = is_index
+
+    def __eq__(self, other):
+        if isinstance(other, type(self)):
+            return (self.number, self.num_cycles, self.is_index) == (other.number, other.num_cycles, other.is_index)
+        else:
+            return False
+
+    def __repr__(self):
+        return f"Read(number={self.number}, num_cycles={self.num_cycles}, is_index={self.is_index})"
+
+
+class RunInfo:
+    """
+    The parts of RunInfo.xml that the service uses, parsed once into plain attributes.
+    Instances are shared between callers through `RunInfoCache`, so they should be
+    treated as read-only.
+    """
+    __slots__ = ("run_id", "instrument", "flowcell", "reads", "lane_count", "surface_count",
+                 "swath_count", "tile_count", "tiles")
+
+    def __init__(self, run_id, instrument, flowcell, reads, lane_count, surface_count=1, swath_count=1,
+                 tile_count=0, tiles=()):
+        """
+        Instantiate RunInfo
+        :param run_id: id of the run, i.e. the name of the runfolder
+        :param instrument: name of the instrument the run was sequenced on
+        :param flowcell: flowcell id
+        :param reads: tuple of `Read`, ordered by read number
+        :param lane_count: number of lanes on the flowcell
+        :param surface_count: number of surfaces imaged per lane
+        :param swath_count: number of swaths per surface
+        :param tile_count: number of tiles per swath
+        :param tiles: tuple of the tile names in the run, e.g. ("1_1101", "1_1102", ...)
+        """
+        self.run_id = run_id
+        self.instrument = instrument
+        self.flowcell = flowcell
+        self.reads = reads
+        self.lane_count = lane_count
+        self.surface_count = surface_count
+        self.swath_count = swath_count
+        self.tile_count = tile_count
+        self.tiles = tiles
+
+    @property
+    def index_reads(self):
+        return tuple(read for read in self.reads if read.is_index)
+
+    @property
+    def data_reads(self):
+        return tuple(read for read in self.reads if not read.is_index)
+
+    @property
+    def index_lengths(self):
+        """
+        :return: a dict with the read number as key and the length of each index as value e.g.:
+                 {2: 7, 3: 8}
+        """
+        return {read.number: read.num_cycles for read in self.index_reads}
+
+    @property
+    def is_single_read(self):
+        return len(self.data_reads) < 2
+
+    @property
+    def total_cycles(self):
+        return sum(read.num_cycles for read in self.reads)
+
+    def tiles_for_lane(self, lane):
+        """
+        :param lane: lane number
+        :return: the names of the tiles in `lane`
+        """
+        prefix = f"{lane}_"
+        return tuple(tile for tile in self.tiles if tile.startswith(prefix))
+
+    @staticmethod
+    def from_file(runinfo_path):
+        """
+        Parse a RunInfo.xml file
+        :param runinfo_path: path to RunInfo.xml
+        :return: a RunInfo instance
+        """
+        run = ElementTree.parse(runinfo_path).getroot().find("Run")
+
+        reads = tuple(sorted(
+            (Read(int(read.get("Number")), int(read.get("NumCycles")), read.get("IsIndexedRead") == "Y")
+             for read in run.iter("Read")),
+            key=lambda read: read.number))
+
+        layout = run.find("FlowcellLayout")
+        lane_count = int(layout.get("LaneCount", 1))
+        surface_count = int(layout.get("SurfaceCount", 1))
+        swath_count = int(layout.get("SwathCount", 1))
+        tile_count = int(layout.get("TileCount", 0))
+        sections_per_lane = int(layout.get("SectionPerLane", 1))
+
+        listed_tiles = tuple(tile.text.strip() for tile in layout.iter("Tile") if tile.text)
+        if listed_tiles:
+            tiles = listed_tiles
+        else:
+            tile_set = layout.find("TileSet")
+            five_digit = tile_set is not None and tile_set.get("TileNamingConvention") == "FiveDigit"
+            tiles = tuple(
+                f"{lane}_{surface}{swath}{section if five_digit else ''}{tile:02d}"
+                for lane in range(1, lane_count + 1)
+                for surface in range(1, surface_count + 1)
+                for swath in range(1, swath_count + 1)
+                for section in (range(1, sections_per_lane + 1) if five_digit else (None,))
+                for tile in range(1, tile_count + 1))
+
+        return RunInfo(run_id=run.get("Id"),
+                       instrument=run.findtext("Instrument"),
+                       flowcell=run.findtext("Flowcell"),
+                       reads=reads,
+                       lane_count=lane_count,
+                       surface_count=surface_count,
+                       swath_count=swath_count,
+                       tile_count=tile_count,
+                       tiles=tiles)
+
+
+class RunInfoCache(SignatureCache):
+    """
+    Process wide cache of parsed RunInfo.xml files. Entries are keyed by the path of the file
+    and are only reused as long as the mtime and size of the file are unchanged. The least
+    recently used entries are evicted once `maxsize` runfolders are cached.
+    """
+
+    def __init__(self, maxsize=128):
+        super().__init__(maxsize)
+
+    def get(self, runfolder):
+        """
+        Get the RunInfo of a runfolder, parsing RunInfo.xml only if it has not been seen
+        before or has changed since it was parsed.
+        :param runfolder: path to the runfolder
+        :return: a RunInfo instance
+        :raises: OSError if there is no RunInfo.xml in the runfolder
+        """
+        runinfo_path = os.path.abspath(os.path.join(runfolder, "RunInfo.xml"))
+        stat = os.stat(runinfo_path)
+
+        def parse():
+            log.debug(f"Parsing {runinfo_path}")
+            return RunInfo.from_file(runinfo_path)
+
+        return self.lookup(runinfo_path, (stat.st_mtime_ns, stat.st_size), parse)
+
+
+_runinfo_cache = RunInfoCache()
+
+
+def get_runinfo(runfolder):
+    """
+    Get the RunInfo for a runfolder from the process wide cache.
+    :param runfolder: path to the runfolder
+    :return: a RunInfo instance
+    """
+    return _runinfo_cache.get(runfolder)
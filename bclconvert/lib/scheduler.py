@@ -0,0 +1,816 @@
+import heapq
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from arteria.exceptions import ArteriaUsageException
+from arteria.web.state import State as arteria_state
+
+from bclconvert.lib.config_utils import get_config_value
+from bclconvert.lib.job_events import JobEvents
+from bclconvert.lib.job_registry import JobRegistry
+from bclconvert.lib.jobrunner import JobRunnerAdapter
+
+log = logging.getLogger(__name__)
+
+FINISHED_STATES = (arteria_state.DONE, arteria_state.ERROR, arteria_state.CANCELLED, arteria_state.NONE)
+
+DEFAULT_PRIORITY_CLASSES = {"high": 100, "normal": 50, "low": 0}
+DEFAULT_PRIORITY_CLASS = "normal"
+
+# Finished jobs kept in memory by the `ResourceAwareAdapter`, older ones are only in its registry
+FINISHED_JOBS_KEPT = 100
+
+
+def node_memory_mb():
+    """
+    :return: the physical memory of the node in MB, or None if it can not be determined
+    """
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // 2 ** 20
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def estimate_memory_mb(nbr_of_threads, config):
+    """
+    Estimate the memory a bcl-convert job uses, as a fixed base plus an amount per thread.
+    :param nbr_of_threads: total number of conversion, compression and decompression threads
+    :param config: the general configuration, read for `job_memory_base_mb` and `job_memory_per_thread_mb`
+    :return: estimated memory footprint in MB
+    """
+    base = get_config_value(config, "job_memory_base_mb", 2048)
+    per_thread = get_config_value(config, "job_memory_per_thread_mb", 512)
+    return base + per_thread * nbr_of_threads
+
+
+def job_priority(config, runfolder, priority_class=None):
+    """
+    Find the priority of a job from its priority class. Classes are named in `priority_classes` in
+    the config, by default high, normal and low. A job is in the class it was requested with, or
+    else in the class of the first of `priority_runfolder_patterns` whose `pattern` matches the
+    name of its runfolder, or else in `default_priority_class`.
+    :param config: the general configuration
+    :param runfolder: name of the runfolder the job is for
+    :param priority_class: the class the job was requested with, None if not given
+    :return: the name of the class and the priority, higher priorities are started first
+    :raises ArteriaUsageException: if there is no such class
+    """
+    classes = get_config_value(config, "priority_classes", DEFAULT_PRIORITY_CLASSES)
+    if not priority_class:
+        priority_class = get_config_value(config, "default_priority_class", DEFAULT_PRIORITY_CLASS)
+        for runfolder_pattern in get_config_value(config, "priority_runfolder_patterns", []):
+            if re.search(runfolder_pattern["pattern"], runfolder):
+                priority_class = runfolder_pattern["priority"]
+                break
+    if priority_class not in classes:
+        raise ArteriaUsageException(f"Unknown priority {priority_class}, should be one of {', '.join(classes)}")
+    return priority_class, classes[priority_class]
+
+
+class Reservation:
+    """
+    The resources a job holds on the node while it runs.
+    """
+    __slots__ = ("cores", "memory_mb")
+
+    def __init__(self, cores, memory_mb=0):
+        self.cores = cores
+        self.memory_mb = memory_mb
+
+    def fits_in(self, free_cores, free_memory_mb):
+        return self.cores <= free_cores and self.memory_mb <= free_memory_mb
+
+    def as_dict(self):
+        return {"cores": self.cores, "memory_mb": self.memory_mb}
+
+
+class ScheduledJob:
+    """
+    A job submitted to the `ResourceAwareAdapter`, and the times it was submitted, started and finished.
+    """
+
+    def __init__(self, job_id, cmd, reservation, run_dir, stdout=None, stderr=None, children=None,
+                 finisher=None, finisher_args=None, runfolder=None, parameters=None, priority=0, fingerprint=None):
+        self.job_id = job_id
+        self.cmd = cmd
+        self.reservation = reservation
+        self.run_dir = run_dir
+        self.stdout = stdout
+        self.stderr = stderr
+        self.children = children
+        self.finisher = finisher
+        self.finisher_args = finisher_args
+        self.runfolder = runfolder
+        self.parameters = parameters
+        self.priority = priority
+        # Identifies the request the job was started for, see `request_fingerprint`
+        self.fingerprint = fingerprint
+        # Number of times the job has been stopped to make room for a job of higher priority
+        self.preemptions = 0
+        self.parent_id = None
+        self.runner_job_id = None
+        self.exit_code = None
+        self.state = arteria_state.PENDING
+        # The version of the last state change of the job published, see `JobEvents`
+        self.version = 0
+        self.published_state = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        # True while the output of the job is checked by the validator of the scheduler
+        self.validating = False
+        # True while the finisher of a group is called, once all jobs in the group have finished
+        self.finishing = False
+
+    @property
+    def queue_wait(self):
+        """
+        :return: seconds the job waited, or has waited so far, before it was started
+        """
+        return (self.started or time.time()) - self.submitted
+
+    @property
+    def is_group(self):
+        return self.children is not None
+
+    def as_dict(self):
+        job_dict = {"job_id": self.job_id,
+                    "state": self.state,
+                    "runfolder": self.runfolder,
+                    "reservation": self.reservation.as_dict(),
+                    "queue_wait": round(self.queue_wait, 3),
+                    "submitted": self.submitted,
+                    "started": self.started,
+                    "finished": self.finished,
+                    "exit_code": self.exit_code,
+                    "priority": self.priority,
+                    "preemptions": self.preemptions,
+                    "fingerprint": self.fingerprint,
+                    "version": self.version}
+        if self.is_group:
+            job_dict["children"] = list(self.children)
+        return job_dict
+
+    def as_record(self):
+        """
+        :return: the job as a record for the `JobRegistry`
+        """
+        return {"job_id": self.job_id,
+                "parent_id": self.parent_id,
+                "runfolder": self.runfolder,
+                "parameters": self.parameters,
+                "command": self.cmd,
+                "run_dir": self.run_dir,
+                "stdout": self.stdout,
+                "stderr": self.stderr,
+                "cores": self.reservation.cores,
+                "memory_mb": self.reservation.memory_mb,
+                "runner_job_id": None if self.runner_job_id is None else str(self.runner_job_id),
+                "state": self.state,
+                "exit_code": self.exit_code,
+                "submitted": self.submitted,
+                "started": self.started,
+                "finished": self.finished,
+                "finisher": self.finisher,
+                "finisher_args": self.finisher_args,
+                "priority": self.priority,
+                "fingerprint": self.fingerprint,
+                "validating": self.validating,
+                "finishing": self.finishing}
+
+    @staticmethod
+    def from_record(record, children=None):
+        """
+        Recreate a job from its record in the `JobRegistry`.
+        :param children: the ids of the jobs in the group, if the job is a group
+        """
+        job = ScheduledJob(record["job_id"], record["command"], Reservation(record["cores"], record["memory_mb"]),
+                           record["run_dir"], stdout=record["stdout"], stderr=record["stderr"], children=children,
+                           finisher=record["finisher"], finisher_args=record["finisher_args"],
+                           runfolder=record["runfolder"], parameters=record["parameters"],
+                           priority=record.get("priority") or 0, fingerprint=record.get("fingerprint"))
+        job.parent_id = record["parent_id"]
+        job.runner_job_id = record["runner_job_id"]
+        job.exit_code = record["exit_code"]
+        job.state = record["state"]
+        job.submitted = record["submitted"]
+        job.started = record["started"]
+        job.finished = record["finished"]
+        job.validating = bool(record.get("validating"))
+        job.finishing = bool(record.get("finishing"))
+        return job
+
+
+class ResourceAwareAdapter(JobRunnerAdapter):
+    """
+    A `JobRunnerAdapter` which keeps a queue of jobs in front of another adapter, and only hands a
+    job on once the cores and memory it reserves are free on the node. Jobs are admitted in order
+    of their priority, which grows by `aging_per_hour` for every hour a job waits so that jobs of
+    low priority are not starved, and in the order they were submitted within a priority. A
+    smaller job may go ahead of one that does not fit yet, unless that job has waited longer than
+    `max_backfill_wait` seconds.
+
+    With `preemption`, running jobs of a lower priority are stopped and queued again to make room
+    for the first job in the queue, if that is what it takes for it to fit.
+
+    Job ids are assigned here and map to the id of the job in the wrapped runner once the job has
+    been started. Every job is recorded in a `JobRegistry`, and when the adapter is created the
+    jobs that had not finished before a restart are taken up again: queued jobs are queued again,
+    jobs whose output was being validated are validated again, and started jobs are followed in
+    the runner if its jobs survive a restart, and are marked as failed otherwise.
+
+    Jobs can be grouped under a parent job (see `start_group`), which reserves nothing itself
+    and whose state rolls up the states of its children.
+
+    Every change of the state of a job is published to `events`.
+
+    If there is a `validator`, the output of jobs that succeed is checked before they are marked as
+    done. Only jobs that are not part of a group, and groups, are checked. A job stays started, and
+    keeps its reservation, while it is checked in the background, and fails if the check does.
+    """
+
+    def __init__(self, runner, nbr_of_cores, memory_mb=None, interval=2, max_backfill_wait=3600, registry=None,
+                 finishers=None, validator=None, aging_per_hour=0, preemption=False):
+        """
+        :param runner: the `JobRunnerAdapter` that runs the admitted jobs
+        :param nbr_of_cores: cores available for jobs on the node, None to not limit the number of cores
+                             (e.g. when the runner submits to a cluster that does its own scheduling)
+        :param memory_mb: memory available for jobs on the node, None to not take memory into account
+        :param interval: seconds between checks for finished jobs, None to only check when `update` is called
+        :param max_backfill_wait: seconds the first job in the queue may wait before no other jobs may pass it
+        :param registry: the `JobRegistry` to record jobs in, None to keep them in memory only
+        :param finishers: dict with the finishers of job groups by name, see `register_finisher`
+        :param validator: called with the record of a job that has succeeded, raises an exception if
+                          the output of the job is not valid. None to not check the output of jobs.
+        :param aging_per_hour: priority a queued job gains for every hour it has waited
+        :param preemption: True to stop running jobs of a lower priority when a job does not fit
+        """
+        self.runner = runner
+        self.nbr_of_cores = nbr_of_cores
+        self.memory_mb = memory_mb
+        self.max_backfill_wait = max_backfill_wait
+        self.aging_per_hour = aging_per_hour
+        self.preemption = preemption
+        self.registry = registry or JobRegistry()
+        self.finishers = dict(finishers or {})
+        self.validator = validator
+        # Validates the output of jobs, and calls the finishers of groups, off the caller's thread
+        self._validations = ThreadPoolExecutor(max_workers=1, thread_name_prefix="validation")
+        self.events = JobEvents()
+        self._jobs = OrderedDict()
+        # The last jobs that have finished, by job id, see `_forget_finished`
+        self._finished = OrderedDict()
+        # Queue waits of the jobs in the registry only, for `utilization`
+        self._forgotten_waits = 0.0
+        self._forgotten_started = 0
+        self._lock = threading.RLock()
+        self._reload()
+
+        self._wake = None
+        if interval:
+            self._stop_event = threading.Event()
+            self._wake = threading.Event()
+            thread = threading.Thread(target=self._poll, args=(interval,), name="scheduler", daemon=True)
+            thread.start()
+        self.runner.add_finished_listener(self._on_runner_job_finished)
+
+    def _reload(self):
+        """
+        Take up the jobs in the registry that had not finished. They are started on the next `update`.
+        """
+        records = self.registry.unfinished(FINISHED_STATES)
+        groups = {record["job_id"] for record in records if record["command"] is None}
+        # The children of unfinished groups are needed to roll up the group, even if they have finished.
+        for group_id in groups:
+            records.extend(self.registry.children(group_id))
+        children = {}
+        for record in records:
+            if record["parent_id"] in groups:
+                children.setdefault(record["parent_id"], set()).add(record["job_id"])
+
+        interrupted_validations = []
+        for record in sorted({record["job_id"]: record for record in records}.values(), key=lambda r: r["job_id"]):
+            job = ScheduledJob.from_record(
+                record, sorted(children.get(record["job_id"], ())) if record["job_id"] in groups else None)
+            job.published_state = job.state
+            self._jobs[job.job_id] = job
+            if job.finishing:
+                # The finisher was cut short, the group is finished again on the next `update`
+                job.finishing = False
+                self._save(job)
+            elif job.validating:
+                # The job had succeeded, only the check of its output was cut short
+                if self.validator:
+                    interrupted_validations.append(job)
+                else:
+                    job.validating = False
+                    job.state = arteria_state.DONE
+                    job.finished = time.time()
+                    self._save(job)
+            elif job.state == arteria_state.STARTED and not job.is_group and not self.runner.jobs_survive_restart:
+                log.warning(f"Job {job.job_id} was running when the service stopped, marking it as failed.")
+                job.state = arteria_state.ERROR
+                job.finished = time.time()
+                self._save(job)
+
+        self._next_job_id = self.registry.max_job_id() + 1
+        if self._jobs:
+            log.info(f"Took up {len(self._jobs)} unfinished jobs from {self.registry.path}")
+        with self._lock:
+            for job in interrupted_validations:
+                self._validate(job)
+
+    def _poll(self, interval):
+        while not self._stop_event.is_set():
+            self._wake.wait(interval)
+            self._wake.clear()
+            if self._stop_event.is_set():
+                break
+            try:
+                self.update()
+            except Exception:
+                log.exception("Failed to update the job scheduler")
+
+    def _on_runner_job_finished(self, runner_job_id):
+        """
+        Called by runners that are notified when a job exits, so that its resources are released
+        and the next job is started at once, rather than on the next poll.
+        """
+        if self._wake is not None:
+            self._wake.set()
+        else:
+            self.update()
+
+    def _save(self, job):
+        """
+        Record the job in the registry, and publish the change if its state changed.
+        """
+        self.registry.save(job.as_record())
+        if job.state != job.published_state:
+            job.published_state = job.state
+            job.version = self.events.publish(job.job_id, job.state, job.runfolder, job.parent_id)["version"]
+
+    def _add_job(self, **kwargs):
+        job_id = self._next_job_id
+        self._next_job_id += 1
+        self._jobs[job_id] = ScheduledJob(job_id, **kwargs)
+        self._save(self._jobs[job_id])
+        return self._jobs[job_id]
+
+    def _reserved(self):
+        running = [job for job in self._jobs.values() if job.state == arteria_state.STARTED]
+        return (sum(job.reservation.cores for job in running),
+                sum(job.reservation.memory_mb for job in running))
+
+    def _free(self):
+        """
+        :return: the cores and memory not reserved by running jobs
+        """
+        reserved_cores, reserved_memory = self._reserved()
+        return (self.nbr_of_cores - reserved_cores if self.nbr_of_cores is not None else float("inf"),
+                self.memory_mb - reserved_memory if self.memory_mb is not None else float("inf"))
+
+    def _pending(self):
+        """
+        :return: the queued jobs in the order they are to be started: by priority, including what
+                 they have gained by waiting, and then in the order they were submitted
+        """
+        now = time.time()
+        pending = [job for job in self._jobs.values() if job.state == arteria_state.PENDING and not job.is_group]
+        return sorted(pending, key=lambda job: (-(job.priority + self.aging_per_hour * (now - job.submitted) / 3600),
+                                                job.submitted, job.job_id))
+
+    def _preempt(self, job, free_cores, free_memory):
+        """
+        Stop running jobs of a lower priority than `job`, and queue them again, if that makes room
+        for it. The jobs of the lowest priority, and of those the ones started last, are stopped
+        first. Must be called holding the lock.
+        :return: the cores and memory freed
+        """
+        candidates = sorted((running for running in self._jobs.values()
+                             if running.state == arteria_state.STARTED and not running.is_group
+                             and not running.validating and running.priority < job.priority),
+                            key=lambda running: (running.priority, -running.started))
+        preempted = []
+        freed_cores = freed_memory = 0
+        for running in candidates:
+            if job.reservation.fits_in(free_cores + freed_cores, free_memory + freed_memory):
+                break
+            preempted.append(running)
+            freed_cores += running.reservation.cores
+            freed_memory += running.reservation.memory_mb
+        if not preempted or not job.reservation.fits_in(free_cores + freed_cores, free_memory + freed_memory):
+            return 0, 0
+
+        for running in preempted:
+            log.info(f"Stopping job {running.job_id} (priority {running.priority}) to make room for job "
+                     f"{job.job_id} (priority {job.priority}), it will be queued again.")
+            self.runner.stop(running.runner_job_id)
+            running.state = arteria_state.PENDING
+            running.runner_job_id = None
+            running.started = None
+            running.preemptions += 1
+            self._save(running)
+        return freed_cores, freed_memory
+
+    def _admit(self):
+        """
+        Start the queued jobs that fit in the free resources. Must be called holding the lock.
+        """
+        free_cores, free_memory = self._free()
+        for position, job in enumerate(self._pending()):
+            if position == 0 and self.preemption and not job.reservation.fits_in(free_cores, free_memory):
+                freed_cores, freed_memory = self._preempt(job, free_cores, free_memory)
+                free_cores += freed_cores
+                free_memory += freed_memory
+            if not job.reservation.fits_in(free_cores, free_memory):
+                if position == 0 and job.queue_wait > self.max_backfill_wait:
+                    log.info(f"Job {job.job_id} has waited {job.queue_wait:.0f} s, holding the queue for it.")
+                    break
+                continue
+            job.runner_job_id = self.runner.start(job.cmd, job.reservation.cores, job.run_dir,
+                                                  stdout=job.stdout, stderr=job.stderr,
+                                                  memory_mb=job.reservation.memory_mb or None)
+            job.state = arteria_state.STARTED
+            job.started = time.time()
+            self._save(job)
+            free_cores -= job.reservation.cores
+            free_memory -= job.reservation.memory_mb
+            log.info(f"Started job {job.job_id} reserving {job.reservation.cores} cores and "
+                     f"{job.reservation.memory_mb} MB after waiting {job.queue_wait:.1f} s in the queue.")
+
+    def update(self):
+        """
+        Release the resources of jobs that have finished and start queued jobs that now fit.
+        """
+        with self._lock:
+            for job in self._jobs.values():
+                if job.state == arteria_state.STARTED and not job.is_group and not job.validating:
+                    state = self.runner.status(job.runner_job_id)
+                    if state in FINISHED_STATES:
+                        job.exit_code = self.runner.exit_code(job.runner_job_id)
+                        if state == arteria_state.DONE and self.validator and job.parent_id is None:
+                            self._validate(job)
+                            continue
+                        job.state = state
+                        job.finished = time.time()
+                        self._save(job)
+            for job in self._jobs.values():
+                if job.is_group:
+                    self._roll_up(job)
+            self._admit()
+            self._forget_finished()
+
+    def _forget_finished(self):
+        """
+        Move the jobs that have finished, and are no longer validated or finished, out of `_jobs`,
+        so that it only holds the jobs that are queued or running. The jobs of a group are moved
+        with the group, once it has finished. The last `FINISHED_JOBS_KEPT` are kept in `_finished`,
+        the others are only in the registry. Must be called holding the lock.
+        """
+        for job in list(self._jobs.values()):
+            if job.parent_id is not None or job.state not in FINISHED_STATES or job.validating or job.finishing:
+                continue
+            children = [self._jobs.get(child_id) for child_id in job.children or []]
+            if any(child and child.state not in FINISHED_STATES for child in children):
+                continue
+            for finished in [child for child in children if child] + [job]:
+                del self._jobs[finished.job_id]
+                self._finished[finished.job_id] = finished
+        while len(self._finished) > FINISHED_JOBS_KEPT:
+            _, forgotten = self._finished.popitem(last=False)
+            if forgotten.started is not None and not forgotten.is_group:
+                self._forgotten_waits += forgotten.queue_wait
+                self._forgotten_started += 1
+
+    def _validate(self, job):
+        """
+        Check the output of a job that has succeeded in the background, and mark it as done, or as
+        failed, once it has been checked. Must be called holding the lock.
+        """
+        job.validating = True
+        # Recorded so that the check is done again if the service is restarted before it is done
+        self._save(job)
+        log.info(f"Job {job.job_id} has finished, checking its output.")
+        self._validations.submit(self._run_validation, job)
+
+    def _run_validation(self, job):
+        try:
+            self.validator(job.as_record())
+            state = arteria_state.DONE
+        except Exception as e:
+            log.error(f"The output of job {job.job_id} is not valid: {e}")
+            state = arteria_state.ERROR
+        with self._lock:
+            job.validating = False
+            # The job may have been stopped while it was checked
+            if job.state != arteria_state.STARTED:
+                self._save(job)
+                return
+            job.state = state
+            job.finished = time.time()
+            self._save(job)
+            self._admit()
+
+    def register_finisher(self, name, finisher):
+        """
+        Register a function that can be called when the jobs of a group have finished, see `start_group`.
+        Finishers are referred to by name, so that groups taken up after a restart can still be finished.
+        :param name: of the finisher
+        :param finisher: called with the `finisher_args` of the group and the positions of the jobs in
+                         the group that succeeded
+        """
+        self.finishers[name] = finisher
+
+    def _roll_up(self, group):
+        """
+        Update the state of a group from the states of its children. The group has started once any
+        child has, and finishes when all children have. Once all children are done the finisher of
+        the group is called for the children that succeeded, so that their output can be collected
+        even if some other child failed. The group is done if all children are done and the finisher
+        succeeded, and in error otherwise.
+        Must be called holding the lock.
+        """
+        if group.state in FINISHED_STATES or group.validating or group.finishing:
+            return
+        children = [self._jobs[child_id] for child_id in group.children]
+        if any(child.started is not None for child in children) and group.started is None:
+            group.state = arteria_state.STARTED
+            group.started = min(child.started for child in children if child.started is not None)
+            self._save(group)
+        if not all(child.state in FINISHED_STATES for child in children):
+            return
+
+        succeeded = [position for position, child in enumerate(children) if child.state == arteria_state.DONE]
+        if len(succeeded) == len(children):
+            state = arteria_state.DONE
+        elif all(child.state == arteria_state.CANCELLED for child in children):
+            state = arteria_state.CANCELLED
+        else:
+            state = arteria_state.ERROR
+
+        if group.finisher and succeeded:
+            # Finishers move and merge whole outputs, which must not hold up the scheduler
+            group.finishing = True
+            self._save(group)
+            log.info(f"All jobs of group {group.job_id} have finished, finishing it in the background.")
+            self._validations.submit(self._finish_group, group, succeeded, state)
+            return
+        if state == arteria_state.DONE and self.validator:
+            self._validate(group)
+            return
+        group.state = state
+        group.finished = time.time()
+        self._save(group)
+
+    def _finish_group(self, group, succeeded, state):
+        """
+        Call the finisher of a group whose jobs have all finished, and then validate the group, or
+        mark it as finished.
+        :param succeeded: the positions of the jobs in the group that succeeded
+        :param state: the state the group finishes in if the finisher succeeds
+        """
+        try:
+            self.finishers[group.finisher](group.finisher_args, succeeded)
+        except Exception:
+            log.exception(f"Failed to finish job {group.job_id}")
+            state = arteria_state.ERROR
+        with self._lock:
+            group.finishing = False
+            # The group may have been stopped while it was finished
+            if group.state != arteria_state.STARTED:
+                self._save(group)
+                return
+            if state == arteria_state.DONE and self.validator:
+                self._validate(group)
+                return
+            group.state = state
+            group.finished = time.time()
+            self._save(group)
+            self._admit()
+
+    def start(self, cmd, nbr_of_cores, run_dir, stdout=None, stderr=None, memory_mb=0, runfolder=None,
+              parameters=None, priority=0, fingerprint=None):
+        """
+        Queue a job, and start it at once if its reservation fits on the node.
+        :param memory_mb: estimated memory the job needs, see `estimate_memory_mb`
+        :param runfolder: name of the runfolder the job is for, recorded in the registry
+        :param parameters: dict with the parameters the job was requested with, recorded in the registry
+        :param priority: of the job, see `job_priority`
+        :param fingerprint: of the request the job was started for, see `request_fingerprint`
+        :return: the job id
+        """
+        # A job can never reserve more than the node has, or it would never be started.
+        reservation = Reservation(min(nbr_of_cores, self.nbr_of_cores) if self.nbr_of_cores is not None else nbr_of_cores,
+                                  min(memory_mb, self.memory_mb) if self.memory_mb is not None else memory_mb)
+        with self._lock:
+            job = self._add_job(cmd=cmd, reservation=reservation, run_dir=run_dir, stdout=stdout, stderr=stderr,
+                                runfolder=runfolder, parameters=parameters, priority=priority,
+                                fingerprint=fingerprint)
+            self._admit()
+        return job.job_id
+
+    def start_group(self, jobs, finisher=None, finisher_args=None, runfolder=None, parameters=None, priority=0,
+                    fingerprint=None):
+        """
+        Queue a number of jobs together under a parent job.
+        :param jobs: list of dicts with the arguments to `start` for each job
+        :param finisher: name of a registered finisher to call once all jobs have finished
+        :param finisher_args: json serializable arguments to the finisher
+        :param runfolder: name of the runfolder the jobs are for
+        :param parameters: dict with the parameters the jobs were requested with
+        :param priority: of the jobs, unless given for a job in `jobs`
+        :param fingerprint: of the request the jobs were started for, recorded with the parent job
+        :return: the id of the parent job, and a list of the ids of the jobs in the same order as `jobs`
+        """
+        if finisher is not None and finisher not in self.finishers:
+            raise ArteriaUsageException(f"Unknown finisher: {finisher}")
+        with self._lock:
+            children = [self.start(**dict({"priority": priority}, **job)) for job in jobs]
+            group = self._add_job(cmd=None, reservation=Reservation(0, 0), run_dir=None, children=children,
+                                  finisher=finisher, finisher_args=finisher_args, runfolder=runfolder,
+                                  parameters=parameters, priority=priority, fingerprint=fingerprint)
+            for child_id in children:
+                self._jobs[child_id].parent_id = group.job_id
+                self._save(self._jobs[child_id])
+            self._roll_up(group)
+        return group.job_id, children
+
+    def _job(self, job_id):
+        try:
+            job_id = int(job_id)
+        except ValueError:
+            raise ArteriaUsageException(f"Invalid job id: {job_id}")
+        return self._jobs.get(job_id) or self._finished.get(job_id)
+
+    def stop(self, job_id):
+        with self._lock:
+            job = self._job(job_id)
+            if not job:
+                return None
+            if job.validating or job.finishing:
+                job.state = arteria_state.CANCELLED
+                job.finished = time.time()
+                self._save(job)
+                self._admit()
+            elif job.is_group:
+                for child_id in job.children:
+                    self.stop(child_id)
+                self._roll_up(job)
+            elif job.state == arteria_state.PENDING:
+                job.state = arteria_state.CANCELLED
+                job.finished = time.time()
+                self._save(job)
+            elif job.state == arteria_state.STARTED:
+                self.runner.stop(job.runner_job_id)
+                self.update()
+            return job.job_id
+
+    def stop_all(self):
+        with self._lock:
+            for job_id in list(self._jobs):
+                self.stop(job_id)
+
+    def status(self, job_id):
+        with self._lock:
+            job = self._job(job_id)
+            if not job:
+                record = self.registry.get(job_id)
+                return record["state"] if record else arteria_state.NONE
+            if job.state == arteria_state.STARTED and not job.is_group and not job.validating:
+                state = self.runner.status(job.runner_job_id)
+                # A job that has succeeded is not done until its output has been validated, which
+                # starts on the next `update`
+                if state == arteria_state.DONE and self.validator and job.parent_id is None:
+                    return arteria_state.STARTED
+                return state
+            return job.state
+
+    def status_all(self, runfolder=None, state=None):
+        """
+        :param runfolder: only include the jobs of this runfolder
+        :param state: only include jobs in this state
+        :return: a dict with the state of each job in the registry
+        """
+        with self._lock:
+            return {record["job_id"]: record["state"]
+                    for record in self.registry.find(runfolder=runfolder, state=state)}
+
+    def in_flight(self, runfolder):
+        """
+        :return: the jobs of a runfolder that are queued or running, not counting the jobs in groups,
+                 as dicts (see `ScheduledJob.as_dict`) ordered by job id
+        """
+        self.update()
+        with self._lock:
+            return [job.as_dict() for job_id, job in sorted(self._jobs.items())
+                    if job.runfolder == runfolder and job.parent_id is None and job.state not in FINISHED_STATES]
+
+    def job_info(self, job_id):
+        """
+        :return: the reservation, queue wait, times and exit code of a job as a dict, or None if there is no such job
+        """
+        with self._lock:
+            job = self._job(job_id)
+            if job:
+                return job.as_dict()
+            record = self.registry.get(job_id)
+            if not record:
+                return None
+            children = [child["job_id"] for child in self.registry.children(job_id)] \
+                if record["command"] is None else None
+            return ScheduledJob.from_record(record, children).as_dict()
+
+    def _expected_starts(self, remaining_seconds=None):
+        """
+        Simulate the queue to find when each queued job can be expected to start, assuming that
+        queued jobs run as long as the median of the last jobs that have finished.
+        :param remaining_seconds: called with the id of a running job, returns the seconds it has
+                                  left or None if that is not known
+        :return: dict with the expected start time of each queued job, None where it is not known
+        """
+        now = time.time()
+        durations = sorted(job.finished - job.started for job in list(self._jobs.values()) + list(self._finished.values())
+                           if job.state == arteria_state.DONE and not job.is_group and job.started and job.finished)
+        typical = durations[len(durations) // 2] if durations else None
+
+        unknown = float("inf")
+        ends = []
+        for job in self._jobs.values():
+            if job.state == arteria_state.STARTED and not job.is_group:
+                remaining = remaining_seconds(job.job_id) if remaining_seconds else None
+                if remaining is None and typical is not None:
+                    remaining = max(0, typical - (now - job.started))
+                ends.append((now + remaining if remaining is not None else unknown,
+                             job.reservation.cores, job.reservation.memory_mb))
+        heapq.heapify(ends)
+
+        free_cores, free_memory = self._free()
+        clock = now
+        starts = {}
+        for job in self._pending():
+            while not job.reservation.fits_in(free_cores, free_memory) and ends:
+                end, cores, memory_mb = heapq.heappop(ends)
+                clock = max(clock, end)
+                free_cores += cores
+                free_memory += memory_mb
+            if clock == unknown or not job.reservation.fits_in(free_cores, free_memory):
+                starts[job.job_id] = None
+                continue
+            starts[job.job_id] = clock
+            free_cores -= job.reservation.cores
+            free_memory -= job.reservation.memory_mb
+            heapq.heappush(ends, (clock + typical if typical is not None else unknown,
+                                  job.reservation.cores, job.reservation.memory_mb))
+        return starts
+
+    def queue_info(self, job_id, remaining_seconds=None):
+        """
+        :param job_id: a queued job, or a group with queued jobs
+        :param remaining_seconds: called with the id of a running job, returns the seconds it has
+                                  left or None if that is not known
+        :return: a dict with the position of the job in the queue, counted from 1, and the time it
+                 can be expected to start, or None if the job is not queued
+        """
+        with self._lock:
+            job = self._job(job_id)
+            if not job:
+                return None
+            job_ids = [child_id for child_id in job.children if self._job(child_id).state == arteria_state.PENDING] \
+                if job.is_group else [job.job_id] if job.state == arteria_state.PENDING else []
+            if not job_ids:
+                return None
+            positions = {pending.job_id: position for position, pending in enumerate(self._pending(), start=1)}
+            starts = self._expected_starts(remaining_seconds)
+            expected_starts = [starts[job_id] for job_id in job_ids if starts[job_id] is not None]
+            return {"position": min(positions[job_id] for job_id in job_ids),
+                    "expected_start": round(min(expected_starts), 3) if expected_starts else None}
+
+    def utilization(self):
+        """
+        :return: a dict with the resources reserved on the node, and the jobs running and waiting
+        """
+        with self._lock:
+            reserved_cores, reserved_memory = self._reserved()
+            pending = self._pending()
+            started = [job for job in list(self._jobs.values()) + list(self._finished.values())
+                       if job.started is not None and not job.is_group]
+            nbr_started = len(started) + self._forgotten_started
+            return {
+                "cores": {"total": self.nbr_of_cores,
+                          "reserved": reserved_cores,
+                          "utilization": round(reserved_cores / self.nbr_of_cores, 3) if self.nbr_of_cores else None},
+                "memory_mb": {"total": self.memory_mb,
+                              "reserved": reserved_memory,
+                              "utilization": round(reserved_memory / self.memory_mb, 3) if self.memory_mb else None},
+                "jobs": {"running": sum(1 for job in self._jobs.values()
+                                        if job.state == arteria_state.STARTED and not job.is_group),
+                         "pending": len(pending)},
+                "queue_wait": {"longest_pending": round(max((job.queue_wait for job in pending), default=0), 3),
+                               "mean_started": round((sum(job.queue_wait for job in started) + self._forgotten_waits)
+                                                     / nbr_started, 3) if nbr_started else 0}}
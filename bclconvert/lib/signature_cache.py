@@ -0,0 +1,62 @@
+import os
+import threading
+from collections import OrderedDict
+
+
+def file_signature(paths):
+    """
+    :param paths: of the files a cached value is read from
+    :return: the mtime and size of each file, or None for files that do not exist, as a tuple
+    """
+    signature = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            signature.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            signature.append(None)
+    return tuple(signature)
+
+
+class SignatureCache:
+    """
+    Thread safe cache of values read from files. Each entry is stored with a signature of the files
+    it was read from, see `file_signature`, and is only reused as long as the signature is unchanged.
+    The least recently used entries are evicted once `maxsize` are cached.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, key, signature, load):
+        """
+        :param key: of the entry
+        :param signature: of the files the value is read from as they are now
+        :param load: called without arguments to read the value if there is no entry for `key`
+                     with the same signature. Not called holding the lock, so that other entries
+                     can be looked up while a value is read.
+        :return: the value
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] == signature:
+                self._entries.move_to_end(key)
+                return entry[1]
+
+        value = load()
+
+        with self._lock:
+            self._entries[key] = (signature, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,125 @@
+import math
+
+# Tiles kept in flight per core given to a job. Each tile in flight holds its decompressed
+# cycles in memory, so more than this mostly costs memory without speeding up the conversion.
+CORES_PER_PARALLEL_TILE = 4
+
+
+class ThreadPlan:
+    """
+    The thread counts chosen for a bcl-convert job, and why they were chosen.
+    """
+
+    def __init__(self, parallel_tiles, conversion_threads, compression_threads, decompression_threads, reason):
+        self.parallel_tiles = parallel_tiles
+        self.conversion_threads = conversion_threads
+        self.compression_threads = compression_threads
+        self.decompression_threads = decompression_threads
+        self.reason = reason
+        self.overridden = []
+
+    def override(self, **thread_counts):
+        """
+        Replace planned values with explicitly requested ones, e.g. `override(conversion_threads=8)`.
+        Values that are None are left as planned.
+        """
+        for name, value in thread_counts.items():
+            if value is not None:
+                setattr(self, name, value)
+                self.overridden.append(f"bcl_num_{name}")
+
+    @property
+    def total_threads(self):
+        """
+        :return: the threads of each tile processed in parallel
+        """
+        return self.conversion_threads + self.compression_threads + self.decompression_threads
+
+    @property
+    def cores(self):
+        """
+        :return: the cores the job uses, as bcl-convert runs the threads of each stage for every
+                 tile processed in parallel
+        """
+        return self.parallel_tiles * self.total_threads
+
+    def as_dict(self):
+        return {"bcl_num_parallel_tiles": self.parallel_tiles,
+                "bcl_num_conversion_threads": self.conversion_threads,
+                "bcl_num_compression_threads": self.compression_threads,
+                "bcl_num_decompression_threads": self.decompression_threads,
+                "reason": self.reason,
+                "overridden": self.overridden}
+
+
+def core_budget(node_cores, free_cores=None, running_jobs=0):
+    """
+    Decide how many cores to plan a new job for. The node is shared evenly between the running
+    jobs and the new one, but if fewer cores than that are free, the job is planned for the free
+    cores so that it can start at once.
+    :param node_cores: cores on the node
+    :param free_cores: cores not reserved by running jobs, None if unknown
+    :param running_jobs: number of jobs running on the node
+    :return: number of cores and a description of how it was chosen
+    """
+    share = max(1, node_cores // (running_jobs + 1))
+    if free_cores is not None and 0 < free_cores < share:
+        return free_cores, f"{free_cores} free of {node_cores} cores with {running_jobs} job(s) running"
+    return share, f"{share} of {node_cores} cores shared with {running_jobs} running job(s)"
+
+
+def _split(budget, weights):
+    """
+    Split `budget` threads in proportion to `weights`, giving every stage at least one thread.
+    """
+    if budget <= len(weights):
+        return [1] * len(weights)
+    spare = budget - len(weights)
+    total_weight = sum(weights)
+    shares = [spare * weight / total_weight for weight in weights]
+    threads = [1 + math.floor(share) for share in shares]
+    # Hand out what is left after rounding down to the stages that lost the most in the rounding.
+    by_remainder = sorted(range(len(weights)), key=lambda i: shares[i] - math.floor(shares[i]), reverse=True)
+    for i in by_remainder[:budget - sum(threads)]:
+        threads[i] += 1
+    return threads
+
+
+def plan_threads(run_info, node_cores, free_cores=None, running_jobs=0):
+    """
+    Choose the bcl-convert thread counts for a run from its geometry and the load on the node.
+
+    The number of tiles processed in parallel follows the cores given to the job (see
+    `core_budget`), but never exceeds the number of tiles on the flowcell. bcl-convert runs the
+    threads of each stage for every tile in parallel, so the cores of each tile are what is split
+    between the stages, by how much work each has per cluster:
+     - decompression reads every cycle of the run
+     - conversion demultiplexes on the index cycles, and assembles the records of the data cycles
+     - compression gzips the bases and qualities of the data cycles, and is the most expensive per base
+    :param run_info: `RunInfo` of the run
+    :param node_cores: cores on the node
+    :param free_cores: cores not reserved by running jobs, None if unknown
+    :param running_jobs: number of jobs running on the node
+    :return: a `ThreadPlan`
+    """
+    budget, budget_reason = core_budget(node_cores, free_cores, running_jobs)
+
+    nbr_of_tiles = len(run_info.tiles) or run_info.lane_count
+    parallel_tiles = max(1, min(nbr_of_tiles, budget // CORES_PER_PARALLEL_TILE))
+
+    data_cycles = sum(read.num_cycles for read in run_info.data_reads)
+    index_cycles = sum(read.num_cycles for read in run_info.index_reads)
+    decompression, conversion, compression = _split(
+        budget // parallel_tiles, [data_cycles + index_cycles, data_cycles / 2 + 2 * index_cycles, 2 * data_cycles])
+
+    cycles = "+".join(str(read.num_cycles) for read in run_info.reads)
+    reason = (f"Planned for {budget_reason}. Run has {cycles} cycles ({len(run_info.index_reads)} index read(s)) "
+              f"on {run_info.lane_count} lane(s) with {nbr_of_tiles} tiles: {decompression} decompression, "
+              f"{conversion} conversion and {compression} compression threads for each of {parallel_tiles} "
+              f"parallel tiles.")
+
+    return ThreadPlan(parallel_tiles=parallel_tiles,
+                      conversion_threads=conversion,
+                      compression_threads=compression,
+                      decompression_threads=decompression,
+                      reason=reason)
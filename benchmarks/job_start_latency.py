@@ -0,0 +1,116 @@
+"""
+Benchmark of the queue-to-start latency of the job runners.
+
+Queues a number of jobs that each need all cores of the node, so that each job waits for the one
+before it, and measures the time from when a job exits until the next job has started. Jobs run the
+dummy bcl-convert in docker/bin, which needs click, on a small synthetic runfolder.
+
+Compares the localq adapter, polled as in the service (every 2 seconds by both localq and the
+scheduler), with the asyncio adapter, which is notified when a job exits. localq is skipped if it
+is not installed.
+
+Usage:
+    PYTHONPATH=. python benchmarks/job_start_latency.py [--jobs 4] [--bcl-convert docker/bin/bcl-convert]
+"""
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from arteria.web.state import State
+
+from bclconvert.lib.scheduler import FINISHED_STATES, ResourceAwareAdapter
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SAMPLESHEET = """[Header]
+FileFormatVersion,2
+[Data]
+Lane,Sample_ID,Sample_Name,Sample_Project,Index
+1,S1,S1,Project,ACGTACGT
+"""
+
+# Records when the job starts and exits, so that the latency does not depend on how the runner
+# notices either.
+WRAPPER = 'date +%s.%N > "$1.started"; shift; "$@"; status=$?; date +%s.%N > "$0.exited"; exit $status'
+
+
+def create_runfolder(directory):
+    runfolder = os.path.join(directory, "runfolder")
+    os.makedirs(runfolder)
+    with open(os.path.join(runfolder, "SampleSheet.csv"), "w") as f:
+        f.write(SAMPLESHEET)
+    return runfolder
+
+
+def read_time(path):
+    with open(path) as f:
+        return float(f.read())
+
+
+def create_runner(name):
+    if name == "localq":
+        from bclconvert.lib.jobrunner import LocalQAdapter
+        return LocalQAdapter(nbr_of_cores=1, interval=2)
+    else:
+        from bclconvert.lib.async_jobrunner import AsyncioAdapter
+        return AsyncioAdapter()
+
+
+def measure(runner_name, bcl_convert, nbr_of_jobs, directory):
+    runfolder = create_runfolder(os.path.join(directory, runner_name))
+    scheduler = ResourceAwareAdapter(create_runner(runner_name), nbr_of_cores=1, interval=2)
+
+    markers = []
+    job_ids = []
+    for i in range(nbr_of_jobs):
+        marker = os.path.join(directory, runner_name, f"job{i}")
+        markers.append(marker)
+        cmd = ["sh", "-c", WRAPPER, marker, marker, bcl_convert,
+               "--bcl-input-directory", runfolder,
+               "--output-directory", os.path.join(directory, runner_name, f"output{i}"),
+               "--force"]
+        job_ids.append(scheduler.start(cmd, nbr_of_cores=1, run_dir=runfolder,
+                                       stdout=marker + ".log", stderr=marker + ".log"))
+
+    while not all(scheduler.status(job_id) in FINISHED_STATES for job_id in job_ids):
+        time.sleep(0.05)
+    scheduler._stop_event.set()
+
+    failed = [job_id for job_id in job_ids if scheduler.status(job_id) != State.DONE]
+    if failed:
+        sys.exit(f"{runner_name}: jobs {failed} failed, see the logs in {os.path.join(directory, runner_name)}")
+
+    return [read_time(markers[i] + ".started") - read_time(markers[i - 1] + ".exited")
+            for i in range(1, nbr_of_jobs)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=4, help="number of jobs queued after each other")
+    parser.add_argument("--bcl-convert", default=os.path.join(REPO_ROOT, "docker", "bin", "bcl-convert"),
+                        help="the bcl-convert to run")
+    args = parser.parse_args()
+
+    runners = ["asyncio"]
+    try:
+        import localq  # noqa: F401
+        runners.insert(0, "localq")
+    except ImportError:
+        print("localq is not installed, only measuring the asyncio adapter")
+
+    directory = tempfile.mkdtemp()
+    try:
+        print(f"{'runner':<10}{'median (s)':>12}{'max (s)':>12}")
+        for runner_name in runners:
+            latencies = measure(runner_name, os.path.abspath(args.bcl_convert), args.jobs, directory)
+            print(f"{runner_name:<10}{statistics.median(latencies):>12.3f}{max(latencies):>12.3f}")
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
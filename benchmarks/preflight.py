@@ -0,0 +1,75 @@
+"""
+Benchmark of the samplesheet preflight checks on a 384-plex, 8 lane, dual indexed samplesheet.
+
+Compares the vectorized pairwise Hamming distances of `run_preflight` with comparing
+each pair of barcodes in pure Python.
+
+Usage:
+    PYTHONPATH=. python benchmarks/preflight.py [--samples 384] [--lanes 8] [--repeat 5]
+"""
+import argparse
+import itertools
+import os
+import random
+import tempfile
+import timeit
+
+from bclconvert.lib.illumina import Samplesheet
+from bclconvert.lib.preflight import run_preflight
+from bclconvert.lib.runinfo import Read, RunInfo
+
+
+def write_samplesheet(path, nbr_of_samples, nbr_of_lanes, index_length=10):
+    rng = random.Random(42)
+    barcodes = set()
+    while len(barcodes) < nbr_of_samples:
+        barcodes.add(("".join(rng.choice("ACGT") for _ in range(index_length)),
+                      "".join(rng.choice("ACGT") for _ in range(index_length))))
+    with open(path, "w") as f:
+        f.write("[Header]\nFileFormatVersion,2\n[BCLConvert_Settings]\nCreateFastqForIndexReads,0\n")
+        f.write("[BCLConvert_Data]\nLane,Sample_ID,Index,Index2\n")
+        for lane in range(1, nbr_of_lanes + 1):
+            for i, (index1, index2) in enumerate(sorted(barcodes)):
+                f.write(f"{lane},Sample_{lane}_{i},{index1},{index2}\n")
+
+
+def python_collisions(samplesheet, mismatches=1):
+    def distance(a, b):
+        return sum(x != y for x, y in zip(a, b))
+
+    collisions = []
+    for lane in samplesheet.lanes:
+        for a, b in itertools.combinations(samplesheet.samples_in_lane(lane), 2):
+            if distance(a.index1, b.index1) <= 2 * mismatches and distance(a.index2, b.index2) <= 2 * mismatches:
+                collisions.append((a.sample_id, b.sample_id))
+    return collisions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--samples", type=int, default=384, help="number of samples per lane")
+    parser.add_argument("--lanes", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    run_info = RunInfo(run_id="run", instrument="instrument", flowcell="flowcell",
+                       reads=(Read(1, 151, False), Read(2, 10, True), Read(3, 10, True), Read(4, 151, False)),
+                       lane_count=args.lanes)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "SampleSheet.csv")
+        write_samplesheet(path, args.samples, args.lanes)
+        samplesheet = Samplesheet(path)
+
+        report = run_preflight(samplesheet, run_info)
+        vectorized_time = min(timeit.repeat(lambda: run_preflight(samplesheet, run_info),
+                                            number=1, repeat=args.repeat))
+        python_time = min(timeit.repeat(lambda: python_collisions(samplesheet), number=1, repeat=args.repeat))
+
+    print(f"{args.samples} samples x {args.lanes} lanes, {len(report.errors)} preflight error(s)")
+    print(f"{'vectorized preflight':<22} {vectorized_time * 1000:>10.1f} ms")
+    print(f"{'pure Python pairs':<22} {python_time * 1000:>10.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Benchmark of the memory use and lookup times of `Samplesheet` on a large synthetic
+NovaSeq X samplesheet.
+
+Compares the slotted, interned and indexed representation with the previous one, where
+each `SampleRow` had its own `__dict__` and every per-lane, per-project or per-barcode
+lookup scanned (or sorted and grouped) the whole list of samples.
+
+Usage:
+    PYTHONPATH=. python benchmarks/samplesheet_memory.py [--rows 100000] [--repeat 5]
+"""
+import argparse
+import csv
+import gc
+import os
+import tempfile
+import timeit
+import tracemalloc
+from itertools import groupby
+
+from bclconvert.lib.illumina import Samplesheet
+from benchmarks.samplesheet_parsing import write_novaseq_x_samplesheet
+
+
+class LegacySampleRow:
+    """
+    `SampleRow` as it looked before it got slots and interned strings.
+    """
+
+    def __init__(self, sample_id, sample_name, index1, sample_project, lane=None, sample_plate=None,
+                 sample_well=None, index2=None, description=None):
+        self.lane = int(lane) if lane else 1
+        self.sample_id = str(sample_id)
+        self.sample_name = str(sample_name)
+        self.sample_plate = sample_plate
+        self.sample_well = sample_well
+        self.index1 = index1
+        self.index2 = index2
+        self.sample_project = str(sample_project)
+        self.description = description
+
+
+def legacy_samples(path):
+    with open(path) as f:
+        for line in f:
+            if "[BCLConvert_Data]" in line:
+                break
+        rows = []
+        for row in csv.DictReader(f):
+            if row.get("Lane", "").startswith("["):
+                break
+            if not row.get("Sample_ID"):
+                continue
+            rows.append(LegacySampleRow(lane=row.get("Lane"), sample_id=row.get("Sample_ID"),
+                                        sample_name=row.get("Sample_Name"), index1=row.get("index"),
+                                        index2=row.get("index2"), sample_project=row.get("Sample_Project")))
+        return rows
+
+
+def retained_memory(build):
+    """
+    :return: the object built by `build` and the number of bytes it keeps allocated
+    """
+    gc.collect()
+    tracemalloc.start()
+    obj = build()
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return obj, current
+
+
+def legacy_lookups(samples, lanes, projects, barcodes):
+    def by_lane(x):
+        return x.lane
+    {k: next(v) for k, v in groupby(sorted(samples, key=by_lane), by_lane)}
+    for lane in lanes:
+        [s for s in samples if s.lane == lane]
+    for project in projects:
+        [s for s in samples if s.sample_project == project]
+    for index1, index2 in barcodes:
+        [s for s in samples if s.index1 == index1 and s.index2 == index2]
+
+
+def indexed_lookups(samplesheet, lanes, projects, barcodes):
+    samplesheet.first_sample_per_lane()
+    for lane in lanes:
+        samplesheet.samples_in_lane(lane)
+    for project in projects:
+        samplesheet.samples_in_project(project)
+    for index1, index2 in barcodes:
+        samplesheet.samples_with_index(index1, index2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--barcodes", type=int, default=100, help="number of barcode lookups to time")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "SampleSheet.csv")
+        write_novaseq_x_samplesheet(path, args.rows, with_cloud_section=False)
+
+        legacy, legacy_bytes = retained_memory(lambda: legacy_samples(path))
+        samplesheet, indexed_bytes = retained_memory(lambda: Samplesheet(path))
+        assert len(legacy) == len(samplesheet.samples) == args.rows
+
+        lanes = samplesheet.lanes
+        projects = samplesheet.projects
+        barcodes = [(s.index1, s.index2) for s in samplesheet.samples[::max(1, args.rows // args.barcodes)]]
+
+        legacy_time = min(timeit.repeat(lambda: legacy_lookups(legacy, lanes, projects, barcodes),
+                                        number=1, repeat=args.repeat))
+        indexed_time = min(timeit.repeat(lambda: indexed_lookups(samplesheet, lanes, projects, barcodes),
+                                         number=1, repeat=args.repeat))
+
+    print(f"{args.rows} rows, {len(lanes)} lanes, {len(projects)} projects, {len(barcodes)} barcode lookups")
+    print(f"{'':<10} {'memory (MiB)':>14} {'lookups (ms)':>14}")
+    print(f"{'legacy':<10} {legacy_bytes / 2 ** 20:>14.1f} {legacy_time * 1000:>14.2f}")
+    print(f"{'indexed':<10} {indexed_bytes / 2 ** 20:>14.1f} {indexed_time * 1000:>14.2f}")
+
+
+if __name__ == "__main__":
+    main()
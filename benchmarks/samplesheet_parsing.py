@@ -0,0 +1,129 @@
+"""
+Benchmark of samplesheet parsing on synthetic NovaSeq X samplesheets.
+
+Compares `Samplesheet` with the pandas based parser it replaced (kept below for
+reference). The legacy parser is skipped if pandas is not installed.
+
+Usage:
+    PYTHONPATH=. python benchmarks/samplesheet_parsing.py [--rows 10000 20000 50000] [--repeat 5]
+"""
+import argparse
+import os
+import random
+import tempfile
+import timeit
+
+from bclconvert.lib.illumina import SampleRow, Samplesheet
+
+
+def write_novaseq_x_samplesheet(path, nbr_of_rows, nbr_of_lanes=8, with_cloud_section=True):
+    """
+    Write a v2 samplesheet with `nbr_of_rows` rows in the [BCLConvert_Data] section, spread
+    evenly over `nbr_of_lanes` lanes, optionally followed by [Cloud_Settings]/[Cloud_Data].
+    """
+    rng = random.Random(nbr_of_rows)
+    rows_per_lane = nbr_of_rows // nbr_of_lanes
+    # As with a real index kit, the same set of barcodes is used in every lane.
+    barcodes = [("".join(rng.choice("ACGT") for _ in range(10)), "".join(rng.choice("ACGT") for _ in range(10)))
+                for _ in range(rows_per_lane)]
+    with open(path, "w") as f:
+        f.write("[Header],\nFileFormatVersion,2\nRunName,Benchmark\nInstrumentPlatform,NovaSeqXSeries\n"
+                "IndexOrientation,Forward\n\n[Reads]\nRead1Cycles,151\nRead2Cycles,151\n"
+                "Index1Cycles,10\nIndex2Cycles,10\n\n[BCLConvert_Settings]\nSoftwareVersion,4.2.7\n"
+                "FastqCompressionFormat,gzip\n\n[BCLConvert_Data]\n")
+        f.write("Lane,Sample_ID,index,index2,Sample_Project,OverrideCycles\n")
+        for lane in range(1, nbr_of_lanes + 1):
+            for i, (index1, index2) in enumerate(barcodes):
+                f.write(f"{lane},Sample_{lane}_{i},{index1},{index2},Project_{i % 12},Y151;I10;I10;Y151\n")
+        if with_cloud_section:
+            f.write("\n[Cloud_Settings]\nGeneratedVersion,1.7.0\n\n[Cloud_Data]\nSample_ID,ProjectName,LibraryName\n")
+            for i in range(rows_per_lane):
+                f.write(f"Sample_1_{i},Project_{i % 12},Library_{i}\n")
+
+
+def legacy_read_samples(samplesheet_file_handle):
+    """
+    The pandas based `Samplesheet._read_samples` as it looked before the streaming parser.
+    """
+    from pandas import read_csv
+
+    def find_data_line():
+        enumurated_lines = list(enumerate(samplesheet_file_handle))
+        lines_with_obsolete_settings = list(filter(lambda x: "Adapter," in x[1] or
+                                                             "TrimAdapter," in x[1] or
+                                                             "MaskAdapter," in x[1] or
+                                                             "Read1StartFromCycle," in x[1] or
+                                                             "Read2StartFromCycle," in x[1] or
+                                                             "Read1UMIStartFromCycle," in x[1] or
+                                                             "Read2UMIStartFromCycle," in x[1] or
+                                                             "Read1UMILength," in x[1] or
+                                                             "Read2UMILength," in x[1], enumurated_lines))
+        assert len(lines_with_obsolete_settings) == 0
+        lines_with_data = list(filter(lambda x: "[Data]" in x[1] or "[data]" in x[1] or "[BCLConvert_Data]" in x[1],
+                                      enumurated_lines))
+        assert len(lines_with_data) == 1
+        return lines_with_data[0][0]
+
+    def find_cloud_footer_size():
+        enumurated_lines = list(enumerate(samplesheet_file_handle))
+        lines_with_data = list(filter(lambda x: "[Cloud" in x[1] or "[cloud" in x[1], enumurated_lines))
+        if len(lines_with_data) > 0:
+            return len(enumurated_lines) - lines_with_data[0][0]
+        return 0
+
+    def row_to_sample_row(index_and_row):
+        row = index_and_row[1]
+        return SampleRow(lane=row.get("Lane"), sample_id=row.get("Sample_ID"), sample_name=row.get("Sample_Name"),
+                         sample_plate=row.get("Sample_Plate"), sample_well=row.get("Sample_Well"),
+                         index1=row.get("index"), index2=row.get("index2"),
+                         sample_project=row.get("Sample_Project", row.get("Project")), description=row.get("Description"))
+
+    lines_to_skip = find_data_line() + 1
+    samplesheet_file_handle.seek(0)
+    skipfooter = find_cloud_footer_size()
+    samplesheet_file_handle.seek(0)
+    samplesheet_df = read_csv(samplesheet_file_handle, skiprows=lines_to_skip, skipfooter=skipfooter, engine="python")
+    samplesheet_df = samplesheet_df.fillna("")
+    return list(map(row_to_sample_row, samplesheet_df.iterrows()))
+
+
+def legacy_samplesheet(path):
+    with open(path) as f:
+        return legacy_read_samples(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 20000, 50000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    try:
+        import pandas  # noqa: F401
+        has_pandas = True
+    except ImportError:
+        has_pandas = False
+        print("pandas is not installed, skipping the legacy parser.")
+
+    print(f"{'rows':>8} {'streaming (s)':>14} {'pandas (s)':>12} {'speedup':>8}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for nbr_of_rows in args.rows:
+            path = os.path.join(tmp_dir, f"SampleSheet_{nbr_of_rows}.csv")
+            write_novaseq_x_samplesheet(path, nbr_of_rows)
+
+            samples = Samplesheet(path).samples
+            assert len(samples) == nbr_of_rows, f"expected {nbr_of_rows} samples, got {len(samples)}"
+            streaming = min(timeit.repeat(lambda: Samplesheet(path), number=1, repeat=args.repeat))
+
+            if has_pandas:
+                legacy_samples = legacy_samplesheet(path)
+                assert [(s.lane, s.sample_id, s.index1, s.index2, s.sample_project) for s in samples] == \
+                       [(s.lane, s.sample_id, s.index1, s.index2, s.sample_project) for s in legacy_samples]
+                legacy = min(timeit.repeat(lambda: legacy_samplesheet(path), number=1, repeat=args.repeat))
+                print(f"{nbr_of_rows:>8} {streaming:>14.4f} {legacy:>12.4f} {legacy / streaming:>7.1f}x")
+            else:
+                print(f"{nbr_of_rows:>8} {streaming:>14.4f} {'-':>12} {'-':>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+Startup benchmark for bclconvert-ws.
+
+Measures:
+ - the import time of `bclconvert.app`, broken down per top level package
+   (from `python -X importtime`)
+ - the time from spawning the service until the first successful response
+   from /api/1.0/versions
+
+The service is started with a temporary configuration based on config/app.config.
+With --budget-ms the script exits with a non-zero status if the median time to the
+first response exceeds the budget, so that it can be used to catch regressions.
+
+Usage:
+    PYTHONPATH=. python benchmarks/startup.py [--repeat 5] [--budget-ms 2000]
+"""
+import argparse
+import http.client
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+import yaml
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LOGGER_CONFIG = """
+version: 1
+disable_existing_loggers: False
+formatters:
+    simple:
+        format: "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+handlers:
+    file_handler:
+        class: logging.FileHandler
+        level: WARNING
+        formatter: simple
+        filename: {log_file}
+root:
+    level: WARNING
+    handlers: [file_handler]
+"""
+
+
+def import_time_breakdown():
+    """
+    :return: the total import time in ms, and a list of (package, import time in ms)
+             for the packages loaded by `import bclconvert.app`, slowest first
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import bclconvert.app"],
+                            cwd=REPO_ROOT, env=_env(), stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    per_package = defaultdict(float)
+    total = 0.0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_time, _, name = line[len("import time:"):].split("|")
+        # Attribute the time spent in each module itself to its top level package,
+        # so that the per package numbers add up to the total.
+        package = name.strip().split(".")[0]
+        per_package[package] += int(self_time) / 1000
+        total += int(self_time) / 1000
+    return total, sorted(per_package.items(), key=lambda item: item[1], reverse=True)
+
+
+def _env():
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([REPO_ROOT] + [p for p in [env.get("PYTHONPATH")] if p])
+    return env
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _write_config(config_root):
+    with open(os.path.join(REPO_ROOT, "config", "app.config")) as f:
+        app_config = yaml.safe_load(f)
+    app_config["runfolder_path"] = [os.path.join(config_root, "runfolders")]
+    app_config["default_output_path"] = os.path.join(config_root, "fastq")
+    app_config["allowed_output_folders"] = [os.path.join(config_root, "fastq")]
+    app_config["bclconvert_logs_path"] = os.path.join(config_root, "logs")
+    with open(os.path.join(config_root, "app.config"), "w") as f:
+        yaml.safe_dump(app_config, f)
+    with open(os.path.join(config_root, "logger.config"), "w") as f:
+        f.write(LOGGER_CONFIG.format(log_file=os.path.join(config_root, "bclconvert-ws.log")))
+
+
+def time_to_first_response(config_root, timeout=60):
+    """
+    Start the service and poll /api/1.0/versions until it answers.
+    :return: seconds from spawning the process until the first 200 response
+    """
+    port = _free_port()
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-c", "from bclconvert.app import start; start()",
+         "--port", str(port), "--configroot", config_root],
+        cwd=config_root, env=_env(), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - start < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f"bclconvert-ws exited with status {process.returncode}")
+            try:
+                connection = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+                connection.request("GET", "/api/1.0/versions")
+                if connection.getresponse().status == 200:
+                    return time.perf_counter() - start
+            except OSError:
+                time.sleep(0.005)
+        raise RuntimeError(f"bclconvert-ws did not answer within {timeout} s")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=None,
+                        help="fail if the median time to the first response exceeds this")
+    args = parser.parse_args()
+
+    total, breakdown = import_time_breakdown()
+    print(f"Import time of bclconvert.app: {total:.1f} ms")
+    for package, ms in breakdown[:15]:
+        print(f"  {package:<30} {ms:>8.1f} ms")
+
+    with tempfile.TemporaryDirectory() as config_root:
+        _write_config(config_root)
+        timings = [time_to_first_response(config_root) * 1000 for _ in range(args.repeat)]
+
+    median = statistics.median(timings)
+    print(f"Time to first /api/1.0/versions response: median {median:.1f} ms, "
+          f"min {min(timings):.1f} ms, max {max(timings):.1f} ms ({args.repeat} runs)")
+
+    if args.budget_ms is not None and median > args.budget_ms:
+        print(f"Startup budget of {args.budget_ms:.0f} ms exceeded!")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
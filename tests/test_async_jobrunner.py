@@ -0,0 +1,75 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from arteria.web.state import State
+
+from bclconvert.lib.async_jobrunner import AsyncioAdapter
+from bclconvert.lib.scheduler import ResourceAwareAdapter
+
+
+class TestAsyncioAdapter(unittest.TestCase):
+
+    def setUp(self):
+        self.run_dir = tempfile.mkdtemp()
+        self.adapter = AsyncioAdapter()
+        self.finished = threading.Event()
+        self.adapter.add_finished_listener(lambda job_id: self.finished.set())
+
+    def tearDown(self):
+        shutil.rmtree(self.run_dir)
+
+    def wait_for(self, job_id, states=(State.DONE, State.ERROR, State.CANCELLED)):
+        deadline = time.time() + 5
+        while self.adapter.status(job_id) not in states and time.time() < deadline:
+            time.sleep(0.01)
+        return self.adapter.status(job_id)
+
+    def test_done(self):
+        log_file = os.path.join(self.run_dir, "job.log")
+        job_id = self.adapter.start(["sh", "-c", "pwd; echo failed >&2"], nbr_of_cores=1, run_dir=self.run_dir,
+                                    stdout=log_file, stderr=log_file)
+        self.assertEqual(self.wait_for(job_id), State.DONE)
+        self.assertEqual(self.adapter.exit_code(job_id), 0)
+        self.assertTrue(self.finished.wait(5))
+        with open(log_file) as f:
+            self.assertEqual(f.read().splitlines(), [os.path.realpath(self.run_dir), "failed"])
+
+    def test_error(self):
+        job_id = self.adapter.start("exit 3", nbr_of_cores=1, run_dir=self.run_dir)
+        self.assertEqual(self.wait_for(job_id), State.ERROR)
+        self.assertEqual(self.adapter.exit_code(job_id), 3)
+
+    def test_command_not_found(self):
+        job_id = self.adapter.start(["/does/not/exist"], nbr_of_cores=1, run_dir=self.run_dir)
+        self.assertEqual(self.wait_for(job_id), State.ERROR)
+        self.assertIsNone(self.adapter.exit_code(job_id))
+        self.assertTrue(self.finished.wait(5))
+
+    def test_stop(self):
+        job_id = self.adapter.start(["sleep", "30"], nbr_of_cores=1, run_dir=self.run_dir)
+        self.assertEqual(self.wait_for(job_id, [State.STARTED]), State.STARTED)
+        self.assertEqual(self.adapter.stop(job_id), job_id)
+        self.assertEqual(self.wait_for(job_id), State.CANCELLED)
+        self.assertIsNone(self.adapter.stop(1234))
+
+    def test_status_unknown_job(self):
+        self.assertEqual(self.adapter.status(1234), State.NONE)
+        self.assertEqual(self.adapter.status_all(), {})
+
+    def test_next_job_starts_when_one_exits(self):
+        # The scheduler would only poll after a minute, so the second job is started on the exit of the first
+        scheduler = ResourceAwareAdapter(self.adapter, nbr_of_cores=1, interval=60)
+        first = scheduler.start(["true"], nbr_of_cores=1, run_dir=self.run_dir)
+        second = scheduler.start(["sleep", "30"], nbr_of_cores=1, run_dir=self.run_dir)
+        deadline = time.time() + 5
+        while scheduler.status(second) != State.STARTED and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(scheduler.status(first), State.DONE)
+        self.assertEqual(scheduler.status(second), State.STARTED)
+        self.assertEqual(scheduler.job_info(first)["exit_code"], 0)
+        scheduler.stop_all()
+        scheduler._stop_event.set()
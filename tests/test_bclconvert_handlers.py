@@ -7,13 +7,19 @@ from tornado.escape import json_encode
 import mock
 from .test_utils import TestUtils, DummyConfig, DummyRunnerConfig
 import shutil
+import tempfile
+import threading
+import time
 
 from bclconvert.handlers.bclconvert_handlers import *
 from bclconvert.lib.bclconvert_utils import BclConvertRunner, BclConvertRunner
-from bclconvert.lib.bclconvert_logs import BclConvertLogFileProvider
+from bclconvert.lib.bclconvert_logs import BclConvertLogFileProvider, LogArchiver
+from bclconvert.lib.preflight import PreflightReport
+from bclconvert.lib.runinfo import Read, RunInfo
 from bclconvert.app import routes
 from tornado.web import Application
-from .test_utils import FakeRunner
+from tornado.httpclient import HTTPRequest
+from .test_utils import FakeRunner, FakeJobRunner
 
 
 class TestBclConvertHandlers(AsyncHTTPTestCase):
@@ -41,6 +47,13 @@ class TestBclConvertHandlers(AsyncHTTPTestCase):
     def get_app(self):
         return Application(routes(config=self.dummy_config))
 
+    def tearDown(self):
+        # A runfolder can not be started again while it is being converted, so the jobs started on
+        # the shared runner service must not outlive the test that started them
+        if BclConvertServiceMixin._runner_service:
+            BclConvertServiceMixin._runner_service.stop_all()
+        super().tearDown()
+
     def test_versions(self):
         response = self.fetch(self.API_BASE + "/versions")
         self.assertEqual(response.code, 200)
@@ -75,6 +88,61 @@ class TestBclConvertHandlers(AsyncHTTPTestCase):
             self.assertEqual(json.loads(response.body)["bclconvert_version"], "4.0.3")
             self.assertEqual(json.loads(response.body)["state"], "started")
 
+    def test_start_preflight_failed(self):
+        report = PreflightReport()
+        report.add_error("lanes", "Lane 9 is in the samplesheet, but the flowcell only has 8 lane(s)", lane=9)
+        with mock.patch.object(os.path, 'isdir', return_value=True), \
+             mock.patch.object(BclConvertConfig, 'get_bclconvert_version_from_run_parameters', return_value="4.0.3"), \
+             mock.patch.object(BclConvertRunnerFactory, "create_bclconvert_runner",
+                               return_value=FakeRunner("4.0.3", self.DUMMY_RUNNER_CONF)), \
+             mock.patch.object(FakeRunner, "preflight", side_effect=PreflightError(report)), \
+             mock.patch.object(BclConvertServiceMixin, "_runner_service",
+                               ResourceAwareAdapter(FakeJobRunner(), nbr_of_cores=8, interval=None)):
+
+            response = self.fetch(
+                self.API_BASE + "/start/150415_D00457_0091_AC6281ANXX", method="POST", body=json_encode({}))
+
+            self.assertEqual(response.code, 400)
+            response_body = json.loads(response.body)
+            self.assertFalse(response_body["preflight"]["ok"])
+            self.assertEqual(response_body["preflight"]["errors"][0]["lane"], 9)
+
+    def test_refused_start_leaves_the_samplesheet_alone(self):
+        runfolders = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, runfolders)
+        runfolder = "160101_D00457_0001_AREFUSEDXX"
+        os.makedirs(os.path.join(runfolders, runfolder))
+        samplesheet_file = os.path.join(runfolders, runfolder, "SampleSheet.csv")
+        with open(samplesheet_file, "w") as f:
+            f.write(TestUtils.DUMMY_SAMPLESHEET_STRING)
+        report = PreflightReport()
+        report.add_error("lanes", "Lane 9 is in the samplesheet, but the flowcell only has 8 lane(s)", lane=9)
+        configs = []
+
+        def create_runner(config):
+            configs.append(config)
+            with open(config.samplesheet_file) as f:
+                self.assertEqual(f.read(), "[Data]\nLane,Sample_ID,index\n9,S1,ACGT\n")
+            return FakeRunner("4.0.3", self.DUMMY_RUNNER_CONF)
+
+        with mock.patch.dict(DummyConfig.DUMMY_CONFIG, {"runfolder_path": [runfolders]}), \
+             mock.patch.object(BclConvertConfig, 'get_bclconvert_version_from_run_parameters', return_value="4.0.3"), \
+             mock.patch.object(BclConvertRunnerFactory, "create_bclconvert_runner", side_effect=create_runner), \
+             mock.patch.object(FakeRunner, "preflight", side_effect=PreflightError(report)), \
+             mock.patch.object(BclConvertServiceMixin, "_runner_service",
+                               ResourceAwareAdapter(FakeJobRunner(), nbr_of_cores=8, interval=None)):
+
+            body = {"samplesheet": "[Data]\nLane,Sample_ID,index\n9,S1,ACGT\n"}
+            response = self.fetch(self.API_BASE + f"/start/{runfolder}", method="POST", body=json_encode(body))
+
+            self.assertEqual(response.code, 400)
+            # The samplesheet of the request was checked, but not written into the runfolder
+            self.assertEqual(os.listdir(os.path.join(runfolders, runfolder)), ["SampleSheet.csv"])
+            with open(samplesheet_file) as f:
+                self.assertEqual(f.read(), TestUtils.DUMMY_SAMPLESHEET_STRING)
+            self.assertFalse(os.path.exists(configs[0].samplesheet_file))
+            self.assertFalse(os.path.exists(os.path.join("tests", runfolder)))
+
     def test_start_with_tiles_parameter(self):
         """Test that tiles parameter is converted to tiles regex"""
         with mock.patch.object(os.path, 'isdir', return_value=True), \
@@ -349,6 +417,517 @@ class TestBclConvertHandlers(AsyncHTTPTestCase):
             self.assertEqual(response.code, 200)
             self.assertEqual(json.loads(response.body)["log"], "This is a string")
 
+    def write_log(self, runfolder, content, mode="w"):
+        path = BclConvertLogFileProvider(self.dummy_config).log_file_path(runfolder)
+        with open(path, mode) as f:
+            f.write(content)
+        self.addCleanup(lambda: os.path.exists(path) and os.remove(path))
+
+    def test_get_logs_part(self):
+        self.write_log("log_part_runfolder", "line 1\nline 2\nline 3\n")
+        response = self.fetch(self.API_BASE + "/logs/log_part_runfolder?offset=7&limit=7", method="GET")
+        self.assertEqual(response.code, 200)
+        self.assertEqual(json.loads(response.body), {"runfolder": "log_part_runfolder", "log": "line 2\n",
+                                                     "offset": 7, "next_offset": 14, "size": 21})
+
+        response = self.fetch(self.API_BASE + "/logs/log_part_runfolder?tail=1", method="GET")
+        self.assertEqual(json.loads(response.body)["log"], "line 3\n")
+        self.assertEqual(json.loads(response.body)["offset"], 14)
+
+        response = self.fetch(self.API_BASE + "/logs/log_part_runfolder?tail=many", method="GET")
+        self.assertEqual(response.code, 400)
+
+    def test_get_logs_of_job(self):
+        provider = BclConvertLogFileProvider(self.dummy_config)
+        self.addCleanup(shutil.rmtree, provider.job_log_dir("log_job_runfolder"), True)
+        registry = JobRegistry()
+        scheduler = ResourceAwareAdapter(FakeJobRunner(), nbr_of_cores=8, interval=None, registry=registry)
+        log_paths = []
+        for content in ["first job\n", "second job\n"]:
+            log_paths.append(provider.job_log_path("log_job_runfolder"))
+            with open(log_paths[-1], "w") as f:
+                f.write(content)
+            scheduler.start("fake_bcl_command", nbr_of_cores=8, run_dir="/path/to/runfolder",
+                            stdout=log_paths[-1], stderr=log_paths[-1], runfolder="log_job_runfolder")
+        LogArchiver(self.dummy_config, registry).archive(1, "log_job_runfolder")
+
+        with mock.patch.object(BclConvertServiceMixin, "_runner_service", scheduler):
+            response = self.fetch(self.API_BASE + "/logs/log_job_runfolder", method="GET")
+            self.assertEqual(json.loads(response.body)["log"], "second job\n")
+
+            response = self.fetch(self.API_BASE + "/logs/log_job_runfolder?job_id=1&offset=6", method="GET")
+            self.assertEqual(json.loads(response.body)["log"], "job\n")
+
+            response = self.fetch(self.API_BASE + "/logs/other_runfolder?job_id=1", method="GET")
+            self.assertEqual(response.code, 404)
+
+    def test_get_logs_range(self):
+        self.write_log("log_range_runfolder", "line 1\nline 2\nline 3\n")
+        response = self.fetch(self.API_BASE + "/logs/log_range_runfolder", headers={"Range": "bytes=7-13"})
+        self.assertEqual(response.code, 206)
+        self.assertEqual(response.body, b"line 2\n")
+        self.assertEqual(response.headers["Content-Range"], "bytes 7-13/21")
+
+        response = self.fetch(self.API_BASE + "/logs/log_range_runfolder", headers={"Range": "bytes=-7"})
+        self.assertEqual(response.body, b"line 3\n")
+
+        response = self.fetch(self.API_BASE + "/logs/log_range_runfolder", headers={"Range": "bytes=100-"})
+        self.assertEqual(response.code, 416)
+        self.assertEqual(response.headers["Content-Range"], "bytes */21")
+
+    def test_get_logs_not_modified(self):
+        self.write_log("log_etag_runfolder", "line 1\n")
+        response = self.fetch(self.API_BASE + "/logs/log_etag_runfolder?tail=10")
+        etag = response.headers["Etag"]
+        response = self.fetch(self.API_BASE + "/logs/log_etag_runfolder?tail=10", headers={"If-None-Match": etag})
+        self.assertEqual(response.code, 304)
+
+        self.write_log("log_etag_runfolder", "line 2\n", mode="a")
+        response = self.fetch(self.API_BASE + "/logs/log_etag_runfolder?tail=10", headers={"If-None-Match": etag})
+        self.assertEqual(response.code, 200)
+
+    def test_follow_logs(self):
+        self.write_log("log_follow_runfolder", "line 1\n")
+        runner = FakeJobRunner()
+        scheduler = ResourceAwareAdapter(runner, nbr_of_cores=8, interval=None)
+        scheduler.start("fake_bcl_command", nbr_of_cores=8, run_dir="/path/to/runfolder",
+                        runfolder="log_follow_runfolder")
+
+        def write_and_finish():
+            self.write_log("log_follow_runfolder", "line 2\nline 3 without newline", mode="a")
+            runner.finish(1)
+            scheduler.update()
+
+        with mock.patch.object(BclConvertServiceMixin, "_runner_service", scheduler), \
+                mock.patch.dict(DummyConfig.DUMMY_CONFIG, {"log_follow_interval": 0.05}):
+            self.io_loop.call_later(0.2, write_and_finish)
+            response = self.fetch(self.API_BASE + "/logs/log_follow_runfolder?follow=true&tail=1",
+                                  request_timeout=5)
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.body, b"line 1\nline 2\nline 3 without newline")
+
     def test_get_logs_trying_to_reach_other_files(self):
         response = self.fetch(self.API_BASE + "/logs/../../../etc/shadow", method="GET")
         self.assertEqual(response.code, 404)
+
+    def test_purge_status_all(self):
+        response = self.fetch(self.API_BASE + "/purges/", method="GET")
+        self.assertEqual(response.code, 200)
+        self.assertEqual(json.loads(response.body), {})
+
+    def test_purge_status_unknown_id(self):
+        response = self.fetch(self.API_BASE + "/purges/1234", method="GET")
+        self.assertEqual(response.code, 404)
+
+    def test_utilization(self):
+        scheduler = ResourceAwareAdapter(FakeJobRunner(), nbr_of_cores=8, memory_mb=16000, interval=None)
+        scheduler.start("fake_bcl_command", nbr_of_cores=2, run_dir="/path/to/runfolder", memory_mb=4000)
+        with mock.patch.object(BclConvertServiceMixin, "_runner_service", scheduler):
+            response = self.fetch(self.API_BASE + "/utilization", method="GET")
+            self.assertEqual(response.code, 200)
+            utilization = json.loads(response.body)
+            self.assertEqual(utilization["cores"]["reserved"], 2)
+            self.assertEqual(utilization["jobs"], {"running": 1, "pending": 0})
+
+            response = self.fetch(self.API_BASE + "/status/1", method="GET")
+            self.assertEqual(json.loads(response.body)["reservation"], {"cores": 2, "memory_mb": 4000})
+
+    def test_status_with_progress(self):
+        scheduler = ResourceAwareAdapter(FakeJobRunner(), nbr_of_cores=8, interval=None)
+        scheduler.start("fake_bcl_command", nbr_of_cores=8, run_dir="/path/to/runfolder")
+        with mock.patch.object(BclConvertServiceMixin, "_runner_service", scheduler):
+            response = self.fetch(self.API_BASE + "/status/1", method="GET")
+            # Without a RunInfo.xml the number of tiles to convert is not known
+            self.assertEqual(json.loads(response.body)["progress"],
+                             {"tiles_done": 0, "tiles_total": None, "percent": None, "tiles_per_second": 0.0,
+                              "eta": None})
+
+    def test_run_qc(self):
+        runfolders = os.path.join(os.path.dirname(os.path.realpath(__file__)), "sampledata", "MiSeq-samples")
+        with mock.patch.dict(DummyConfig.DUMMY_CONFIG, {"runfolder_path": [runfolders]}):
+            response = self.fetch(self.API_BASE + "/qc/2013-04_16_2-index", method="GET")
+            self.assertEqual(response.code, 200)
+            qc = json.loads(response.body)
+            self.assertEqual(qc["runfolder"], "2013-04_16_2-index")
+            self.assertEqual(qc["lanes"]["1"]["tiles"], 28)
+
+            response = self.fetch(self.API_BASE + "/qc/no_such_runfolder", method="GET")
+            self.assertEqual(response.code, 404)
+
+    def test_run_qc_is_read_off_the_ioloop(self):
+        runfolders = os.path.join(os.path.dirname(os.path.realpath(__file__)), "sampledata", "MiSeq-samples")
+        read_on = []
+
+        def read(runfolder):
+            read_on.append(threading.current_thread())
+            return {"lanes": {}}
+
+        with mock.patch.dict(DummyConfig.DUMMY_CONFIG, {"runfolder_path": [runfolders]}), \
+             mock.patch("bclconvert.handlers.bclconvert_handlers.get_run_qc", side_effect=read):
+            response = self.fetch(self.API_BASE + "/qc/2013-04_16_2-index", method="GET")
+            self.assertEqual(response.code, 200)
+            self.assertEqual(len(read_on), 1)
+            self.assertNotEqual(read_on[0], threading.current_thread())
+
+        with mock.patch.dict(DummyConfig.DUMMY_CONFIG, {"runfolder_path": [runfolders]}), \
+             mock.patch("bclconvert.handlers.bclconvert_handlers.get_run_qc",
+                        side_effect=FileNotFoundError("No InterOp files")):
+            response = self.fetch(self.API_BASE + "/qc/2013-04_16_2-index", method="GET")
+            self.assertEqual(response.code, 404)
+
+    def test_demux_stats(self):
+        from .test_demux_stats import write_reports
+        output = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output)
+        write_reports(output)
+        runner = FakeJobRunner()
+        scheduler = ResourceAwareAdapter(runner, nbr_of_cores=8, interval=None, registry=JobRegistry())
+        job_id = scheduler.start(["bcl-convert", "--output-directory", output], nbr_of_cores=8,
+                                 run_dir="/path/to/runfolder", runfolder="runfolder1")
+        with mock.patch.object(BclConvertServiceMixin, "_runner_service", scheduler):
+            response = self.fetch(self.API_BASE + f"/stats/{job_id}", method="GET")
+            self.assertEqual(response.code, 404)
+
+            runner.finish(job_id)
+            scheduler.update()
+            response = self.fetch(self.API_BASE + f"/stats/{job_id}", method="GET")
+            self.assertEqual(response.code, 200)
+            stats = json.loads(response.body)
+            self.assertEqual(stats["runfolder"], "runfolder1")
+            self.assertEqual(stats["lanes"]["1"]["undetermined_reads"], 100)
+
+    def test_checksums(self):
+        output = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output)
+        with open(os.path.join(output, "S1_S1_L001_R1_001.fastq.gz"), "wb") as f:
+            f.write(b"reads")
+        runner = FakeJobRunner()
+        scheduler = ResourceAwareAdapter(runner, nbr_of_cores=8, interval=None, registry=JobRegistry())
+        job_id = scheduler.start(["bcl-convert", "--output-directory", output], nbr_of_cores=1,
+                                 run_dir="/path/to/runfolder", runfolder="runfolder1")
+        with mock.patch.object(BclConvertServiceMixin, "_runner_service", scheduler):
+            response = self.fetch(self.API_BASE + f"/checksums/{job_id}", method="POST", body="")
+            self.assertEqual(response.code, 404)
+
+            runner.finish(job_id)
+            scheduler.update()
+            response = self.fetch(self.API_BASE + f"/checksums/{job_id}", method="GET")
+            self.assertEqual(response.code, 404)
+
+            response = self.fetch(self.API_BASE + f"/checksums/{job_id}", method="POST", body="")
+            self.assertEqual(response.code, 202)
+            BclConvertServiceMixin.checksum_service(self.dummy_config)._executor.submit(lambda: None).result()
+            response = self.fetch(self.API_BASE + f"/checksums/{job_id}", method="GET")
+            self.assertEqual(response.code, 200)
+            self.assertEqual(response.body.decode(), "0fb9cf5f04f61bb6f1151da57ceb1ca1  S1_S1_L001_R1_001.fastq.gz\n")
+            response = self.fetch(self.API_BASE + f"/checksums/{job_id}?format=json", method="GET")
+            self.assertEqual(list(json.loads(response.body)["files"]), ["S1_S1_L001_R1_001.fastq.gz"])
+
+    def test_status_of_queued_job(self):
+        scheduler = ResourceAwareAdapter(FakeJobRunner(), nbr_of_cores=8, interval=None)
+        scheduler.start("fake_bcl_command", nbr_of_cores=8, run_dir="/path/to/runfolder")
+        job_id = scheduler.start("fake_bcl_command", nbr_of_cores=8, run_dir="/path/to/runfolder", priority=100)
+        with mock.patch.object(BclConvertServiceMixin, "_runner_service", scheduler):
+            response = self.fetch(self.API_BASE + f"/status/{job_id}", method="GET")
+            status = json.loads(response.body)
+            self.assertEqual(status["priority"], 100)
+            self.assertEqual(status["queue"], {"position": 1, "expected_start": None})
+
+    def test_status_from_registry(self):
+        registry = JobRegistry()
+        scheduler = ResourceAwareAdapter(FakeJobRunner(), nbr_of_cores=8, interval=None, registry=registry)
+        for runfolder in ["run1", "run2"]:
+            scheduler.start("fake_bcl_command", nbr_of_cores=8, run_dir="/path/to/runfolder", runfolder=runfolder)
+        # The jobs are still known after the service has been restarted
+        scheduler = ResourceAwareAdapter(FakeJobRunner(), nbr_of_cores=8, interval=None, registry=registry)
+        with mock.patch.object(BclConvertServiceMixin, "_runner_service", scheduler):
+            response = self.fetch(self.API_BASE + "/status/2", method="GET")
+            self.assertEqual(response.code, 200)
+            status = json.loads(response.body)
+            self.assertEqual((status["state"], status["runfolder"]), (State.PENDING, "run2"))
+
+            response = self.fetch(self.API_BASE + "/status/?runfolder=run1", method="GET")
+            self.assertEqual(json.loads(response.body), {"1": {"state": State.ERROR}})
+
+    def test_status_long_poll(self):
+        runner = FakeJobRunner()
+        scheduler = ResourceAwareAdapter(runner, nbr_of_cores=8, interval=None)
+        job_id = scheduler.start("fake_bcl_command", nbr_of_cores=8, run_dir="/path/to/runfolder")
+        with mock.patch.object(BclConvertServiceMixin, "_runner_service", scheduler):
+            response = self.fetch(self.API_BASE + f"/status/{job_id}", method="GET")
+            version = json.loads(response.body)["version"]
+
+            # A client that has not seen the latest version gets the status at once
+            response = self.fetch(self.API_BASE + f"/status/{job_id}?version={version - 1}", method="GET")
+            self.assertEqual(json.loads(response.body)["version"], version)
+
+            # Otherwise the request is held until the job changes
+            def finish():
+                runner.finish(1)
+                scheduler.update()
+            self.io_loop.call_later(0.1, finish)
+            response = self.fetch(self.API_BASE + f"/status/{job_id}?version={version}&timeout=5", method="GET")
+            status = json.loads(response.body)
+            self.assertEqual(status["state"], State.DONE)
+            self.assertGreater(status["version"], version)
+
+    def test_status_long_poll_timeout(self):
+        scheduler = ResourceAwareAdapter(FakeJobRunner(), nbr_of_cores=8, interval=None)
+        job_id = scheduler.start("fake_bcl_command", nbr_of_cores=8, run_dir="/path/to/runfolder")
+        version = scheduler.job_info(job_id)["version"]
+        with mock.patch.object(BclConvertServiceMixin, "_runner_service", scheduler):
+            response = self.fetch(self.API_BASE + f"/status/{job_id}?version={version}&timeout=0.1", method="GET")
+            self.assertEqual(response.code, 200)
+            self.assertEqual(json.loads(response.body)["version"], version)
+
+    def read_events(self, path, headers=None, until=b"event: state"):
+        chunks = []
+
+        def on_chunk(chunk):
+            chunks.append(chunk)
+            if b"".join(chunks).count(until) and not self.stopped:
+                self.stopped = True
+                self.stop()
+
+        self.stopped = False
+        self.http_client.fetch(HTTPRequest(self.get_url(self.API_BASE + path), headers=headers,
+                                           streaming_callback=on_chunk, request_timeout=5),
+                               callback=lambda response: None)
+        self.wait(timeout=5)
+        return b"".join(chunks).decode()
+
+    def test_events_stream(self):
+        runner = FakeJobRunner()
+        scheduler = ResourceAwareAdapter(runner, nbr_of_cores=8, interval=None)
+        scheduler.start("fake_bcl_command", nbr_of_cores=8, run_dir="/path/to/runfolder", runfolder="run1")
+
+        def finish():
+            runner.finish(1)
+            scheduler.update()
+        with mock.patch.object(BclConvertServiceMixin, "_runner_service", scheduler):
+            self.io_loop.call_later(0.1, finish)
+            stream = self.read_events("/events?runfolder=run1")
+        self.assertIn('id: 3\nevent: state\ndata: {"version": 3, "job_id": 1, "state": "done"', stream)
+
+    def test_events_stream_catches_up(self):
+        scheduler = ResourceAwareAdapter(FakeJobRunner(), nbr_of_cores=8, interval=None)
+        scheduler.start("fake_bcl_command", nbr_of_cores=8, run_dir="/path/to/runfolder")
+        with mock.patch.object(BclConvertServiceMixin, "_runner_service", scheduler):
+            stream = self.read_events("/events", headers={"Last-Event-ID": "1"})
+            self.assertIn('id: 2\nevent: state\ndata: {"version": 2, "job_id": 1, "state": "started"', stream)
+            self.assertNotIn("id: 1\n", stream)
+
+            stream = self.read_events("/events", headers={"Last-Event-ID": "10"}, until=b"event: reset")
+            self.assertIn('event: reset\ndata: {"version": 2}', stream)
+
+    def test_start_with_auto_thread_tuning(self):
+        scheduler = ResourceAwareAdapter(FakeJobRunner(), nbr_of_cores=16, memory_mb=64000, interval=None)
+        run_info = RunInfo(run_id="150415_D00457_0091_AC6281ANXX", instrument="D00457", flowcell="C6281ANXX",
+                           reads=(Read(1, 151, False), Read(2, 8, True), Read(3, 151, False)), lane_count=8)
+        with mock.patch.object(os.path, 'isdir', return_value=True), \
+             mock.patch.object(BclConvertConfig, 'get_bclconvert_version_from_run_parameters', return_value="4.0.3"), \
+             mock.patch.object(BclConvertRunnerFactory, "create_bclconvert_runner",
+                               return_value=FakeRunner("4.0.3", self.DUMMY_RUNNER_CONF)), \
+             mock.patch("bclconvert.handlers.bclconvert_handlers.get_runinfo", return_value=run_info), \
+             mock.patch("multiprocessing.cpu_count", return_value=16), \
+             mock.patch.object(BclConvertServiceMixin, "_runner_service", scheduler):
+
+            body = {"thread_tuning": "auto", "bcl_num_conversion_threads": 2}
+            response = self.fetch(
+                self.API_BASE + "/start/150415_D00457_0091_AC6281ANXX", method="POST", body=json_encode(body))
+
+            self.assertEqual(response.code, 202)
+            thread_plan = json.loads(response.body)["thread_plan"]
+            self.assertEqual(thread_plan["bcl_num_conversion_threads"], 2)
+            self.assertEqual(thread_plan["overridden"], ["bcl_num_conversion_threads"])
+            self.assertIn("16 of 16 cores", thread_plan["reason"])
+            self.assertEqual(json.loads(response.body)["reservation"]["cores"],
+                             min(16, thread_plan["bcl_num_parallel_tiles"] *
+                                 (thread_plan["bcl_num_conversion_threads"] + thread_plan["bcl_num_compression_threads"] +
+                                  thread_plan["bcl_num_decompression_threads"])))
+
+    def test_start_without_disk_space(self):
+        scheduler = ResourceAwareAdapter(FakeJobRunner(), nbr_of_cores=16, memory_mb=None, interval=None)
+        with mock.patch.object(os.path, 'isdir', return_value=True), \
+             mock.patch.object(os, 'makedirs'), \
+             mock.patch.object(BclConvertConfig, 'get_bclconvert_version_from_run_parameters', return_value="4.0.3"), \
+             mock.patch.object(BclConvertRunnerFactory, "create_bclconvert_runner",
+                               return_value=FakeRunner("4.0.3", self.DUMMY_RUNNER_CONF)), \
+             mock.patch("bclconvert.lib.disk_space.estimate_output_bytes", return_value=2 ** 60), \
+             mock.patch.object(BclConvertServiceMixin, "_runner_service", scheduler):
+
+            response = self.fetch(
+                self.API_BASE + "/start/150415_D00457_0091_AC6281ANXX", method="POST", body=json_encode({}))
+
+            self.assertEqual(response.code, 400)
+            response_body = json.loads(response.body)
+            self.assertEqual(response_body["preflight"]["errors"][0]["check"], "disk_space")
+            self.assertEqual(scheduler.status_all(), {})
+
+    def test_start_same_runfolder_twice(self):
+        runner = FakeJobRunner()
+        scheduler = ResourceAwareAdapter(runner, nbr_of_cores=16, memory_mb=None, interval=None)
+        with mock.patch.object(os.path, 'isdir', return_value=True), \
+             mock.patch.object(os, 'makedirs'), \
+             mock.patch.object(BclConvertConfig, 'get_bclconvert_version_from_run_parameters', return_value="4.0.3"), \
+             mock.patch.object(BclConvertRunnerFactory, "create_bclconvert_runner",
+                               return_value=FakeRunner("4.0.3", self.DUMMY_RUNNER_CONF)) as create_runner, \
+             mock.patch.object(BclConvertServiceMixin, "_runner_service", scheduler):
+
+            def start(body):
+                return self.fetch(self.API_BASE + "/start/150415_D00457_0091_AC6281ANXX", method="POST",
+                                  body=json_encode(body))
+
+            response = start({"barcode_mismatches": 1})
+            self.assertEqual(response.code, 202)
+            job_id = json.loads(response.body)["job_id"]
+
+            # A retried request, with another priority, is answered with the job already started
+            response = start({"barcode_mismatches": "1", "priority": "high"})
+            self.assertEqual(response.code, 202)
+            response_body = json.loads(response.body)
+            self.assertEqual((response_body["job_id"], response_body["coalesced"]), (job_id, True))
+            self.assertEqual(create_runner.call_count, 1)
+
+            # Another request is refused while the job runs
+            response = start({"barcode_mismatches": 0})
+            self.assertEqual(response.code, 409)
+            self.assertEqual(json.loads(response.body)["job_ids"], [job_id])
+            self.assertEqual(list(scheduler.status_all()), [job_id])
+
+            runner.finish(1)
+            response = start({"barcode_mismatches": 1})
+            self.assertEqual(response.code, 202)
+            self.assertNotEqual(json.loads(response.body)["job_id"], job_id)
+
+    def test_start_with_the_defaults_spelled_out(self):
+        scheduler = ResourceAwareAdapter(FakeJobRunner(), nbr_of_cores=16, memory_mb=None, interval=None)
+        with mock.patch.object(os.path, 'isdir', return_value=True), \
+             mock.patch.object(os, 'makedirs'), \
+             mock.patch.object(BclConvertConfig, 'get_bclconvert_version_from_run_parameters', return_value="4.0.3"), \
+             mock.patch.object(BclConvertRunnerFactory, "create_bclconvert_runner",
+                               return_value=FakeRunner("4.0.3", self.DUMMY_RUNNER_CONF)), \
+             mock.patch.object(BclConvertServiceMixin, "_runner_service", scheduler):
+
+            response = self.fetch(self.API_BASE + "/start/150415_D00457_0091_AC6281ANXX", method="POST",
+                                  body=json_encode({}))
+            self.assertEqual(response.code, 202)
+            job_id = json.loads(response.body)["job_id"]
+
+            body = {"bclconvert_version": "4.0.3", "output": "tests/150415_D00457_0091_AC6281ANXX",
+                    "create_indexes": "False", "split_lanes": "False", "rerun": "all", "barcode_mismatches": ""}
+            response = self.fetch(self.API_BASE + "/start/150415_D00457_0091_AC6281ANXX", method="POST",
+                                  body=json_encode(body))
+            self.assertEqual(response.code, 202)
+            self.assertEqual((json.loads(response.body)["job_id"], json.loads(response.body)["coalesced"]),
+                             (job_id, True))
+
+    def test_start_same_runfolder_during_disk_space_check(self):
+        runner = FakeJobRunner()
+        scheduler = ResourceAwareAdapter(runner, nbr_of_cores=16, memory_mb=None, interval=None)
+        checked_on = []
+
+        def slow_check(*args, **kwargs):
+            checked_on.append(threading.current_thread())
+            time.sleep(0.2)
+            return None
+
+        with mock.patch.object(os.path, 'isdir', return_value=True), \
+             mock.patch.object(os, 'makedirs'), \
+             mock.patch.object(BclConvertConfig, 'get_bclconvert_version_from_run_parameters', return_value="4.0.3"), \
+             mock.patch.object(BclConvertRunnerFactory, "create_bclconvert_runner",
+                               return_value=FakeRunner("4.0.3", self.DUMMY_RUNNER_CONF)) as create_runner, \
+             mock.patch("bclconvert.handlers.bclconvert_handlers.check_disk_space", side_effect=slow_check), \
+             mock.patch.object(BclConvertServiceMixin, "_runner_service", scheduler):
+
+            responses = []
+
+            def answered(response):
+                responses.append(response)
+                if len(responses) == 3:
+                    self.stop()
+
+            # The requests come in while the disk space of the first one is being checked
+            for body in [{"barcode_mismatches": 1}, {"barcode_mismatches": 1}, {"barcode_mismatches": 0}]:
+                self.http_client.fetch(self.get_url(self.API_BASE + "/start/150415_D00457_0091_AC6281ANXX"),
+                                       answered, method="POST", body=json_encode(body))
+            self.wait(timeout=5)
+
+            self.assertNotIn(threading.main_thread(), checked_on)
+            self.assertEqual(create_runner.call_count, 1)
+            self.assertEqual(sorted(response.code for response in responses), [202, 202, 409])
+            started = [json.loads(response.body) for response in responses if response.code == 202]
+            self.assertEqual(started[0]["job_id"], started[1]["job_id"])
+            self.assertEqual(sorted(response.get("coalesced", False) for response in started), [False, True])
+            self.assertEqual(list(scheduler.status_all()), [started[0]["job_id"]])
+            self.assertEqual(StartHandler._starting, {})
+
+    def test_rerun_changed_lanes(self):
+        runfolder = tempfile.mkdtemp()
+        output = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, runfolder)
+        self.addCleanup(shutil.rmtree, output)
+        samplesheet = "[BCLConvert_Data]\nLane,Sample_ID,Index\n1,S1,ACGTACGT\n2,S2,ACGTACGT\n"
+        os.makedirs(os.path.join(output, "Reports"))
+        for path in [os.path.join(output, "Reports", "SampleSheet.csv"), os.path.join(runfolder, "SampleSheet.csv")]:
+            with open(path, "w") as f:
+                f.write(samplesheet)
+
+        registry = JobRegistry()
+        registry.save({"job_id": 1, "runfolder": "150415_D00457_0091_AC6281ANXX", "state": State.DONE,
+                       "finisher_args": {"output": output, "lanes": [1, 2]}})
+        scheduler = ResourceAwareAdapter(FakeJobRunner(), nbr_of_cores=16, memory_mb=None, interval=None,
+                                         registry=registry, finishers=FINISHERS)
+        run_info = RunInfo(run_id="150415_D00457_0091_AC6281ANXX", instrument="D00457", flowcell="C6281ANXX",
+                           reads=(Read(1, 151, False), Read(2, 8, True)), lane_count=2)
+        with mock.patch.object(StartHandler, "find_runfolder", return_value=runfolder), \
+             mock.patch.object(BclConvertConfig, 'get_bclconvert_version_from_run_parameters', return_value="4.0.3"), \
+             mock.patch.object(BclConvertRunnerFactory, "create_bclconvert_runner",
+                               return_value=FakeRunner("4.0.3", self.DUMMY_RUNNER_CONF)), \
+             mock.patch("bclconvert.handlers.bclconvert_handlers.get_runinfo", return_value=run_info), \
+             mock.patch.object(BclConvertServiceMixin, "_runner_service", scheduler):
+
+            def rerun():
+                return self.fetch(self.API_BASE + "/start/150415_D00457_0091_AC6281ANXX", method="POST",
+                                  body=json_encode({"rerun": "changed_lanes", "output": output}))
+
+            response = rerun()
+            self.assertEqual(response.code, 200)
+            self.assertEqual(json.loads(response.body)["job_id"], 1)
+
+            with open(os.path.join(runfolder, "SampleSheet.csv"), "w") as f:
+                f.write(samplesheet.replace("2,S2,ACGTACGT", "2,S2,ACGTACGA"))
+            response = rerun()
+            self.assertEqual(response.code, 202)
+            response_body = json.loads(response.body)
+            self.assertEqual((response_body["rerun_of"], response_body["lanes"]), (1, {"2": 2}))
+            self.assertNotIn("purge_id", response_body)
+            self.assertEqual(registry.get(response_body["job_id"])["finisher_args"],
+                             {"output": output, "lanes": [2], "replace": True})
+            self.assertEqual(registry.get(2)["command"], "fake_bcl_command")
+
+    def test_start_split_lanes(self):
+        scheduler = ResourceAwareAdapter(FakeJobRunner(), nbr_of_cores=16, memory_mb=None, interval=None,
+                                         finishers=FINISHERS)
+        with mock.patch.object(os.path, 'isdir', return_value=True), \
+             mock.patch.object(os, 'makedirs'), \
+             mock.patch.object(BclConvertConfig, 'get_bclconvert_version_from_run_parameters', return_value="4.0.3"), \
+             mock.patch.object(BclConvertRunnerFactory, "create_bclconvert_runner",
+                               return_value=FakeRunner("4.0.3", self.DUMMY_RUNNER_CONF)) as create_runner, \
+             mock.patch.object(BclConvertServiceMixin, "_runner_service", scheduler):
+
+            body = {"split_lanes": "True", "lanes": "13"}
+            response = self.fetch(
+                self.API_BASE + "/start/150415_D00457_0091_AC6281ANXX", method="POST", body=json_encode(body))
+
+            self.assertEqual(response.code, 202)
+            response_body = json.loads(response.body)
+            self.assertEqual(response_body["lanes"], {"1": 1, "3": 2})
+            self.assertEqual(response_body["job_id"], 3)
+            lane_configs = [call[0][0] for call in create_runner.call_args_list[1:]]
+            self.assertEqual([config.tiles for config in lane_configs], ["s_1", "s_3"])
+            self.assertTrue(all(config.output.endswith(f"/.lanes/L00{lane}")
+                                for config, lane in zip(lane_configs, [1, 3])))
+
+            response = self.fetch(self.API_BASE + "/status/3", method="GET")
+            self.assertEqual(json.loads(response.body)["children"], {"1": "started", "2": "started"})
@@ -1,10 +1,14 @@
 # This file has been modified from the https://github.com/arteria-project/arteria-bcl2fastq repo
 # bcl2fastq/tests/test_bcl2fastq_logs.py
 
+import os
+import shutil
+import tempfile
 import unittest
 from mock import MagicMock, patch, mock_open
 
-from bclconvert.lib.bclconvert_logs import BclConvertLogFileProvider
+from bclconvert.lib.bclconvert_logs import BclConvertLogFileProvider, LogArchiver, LogChunk
+from bclconvert.lib.job_registry import JobRegistry
 
 
 class TestBclConvertLogFileProvider(unittest.TestCase):
@@ -34,3 +38,118 @@ class TestBclConvertLogFileProvider(unittest.TestCase):
     def test_get_log_for_runfolder_does_not_exist(self):
         with self.assertRaises(IOError):
             self.log_filer_provider.get_log_for_runfolder(self.runfolder)
+
+
+class TestReadingPartsOfLogs(unittest.TestCase):
+
+    runfolder = "160218_ST-E00215_0070_BHKGLFCCXX"
+
+    def setUp(self):
+        self.log_dir = tempfile.mkdtemp()
+        self.provider = BclConvertLogFileProvider({"bclconvert_logs_path": self.log_dir})
+        self.write("line 1\nline 2\nline 3\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.log_dir)
+
+    def write(self, content, mode="w"):
+        with open(self.provider.log_file_path(self.runfolder), mode) as f:
+            f.write(content)
+
+    def test_read_log(self):
+        self.assertEqual(self.provider.read_log(self.runfolder, 7, 6), LogChunk("line 2", 7, 13, 21))
+        self.assertEqual(self.provider.read_log(self.runfolder, -7), LogChunk("line 3\n", 14, 21, 21))
+        self.assertEqual(self.provider.read_log(self.runfolder, 100), LogChunk("", 21, 21, 21))
+
+    def test_read_whole_lines(self):
+        self.write("line 4 is not", mode="a")
+        self.assertEqual(self.provider.read_log(self.runfolder, 14, whole_lines=True).content, "line 3\n")
+        self.assertEqual(self.provider.read_log(self.runfolder, 21, whole_lines=True).content, "")
+        # A line longer than the limit is returned in parts
+        self.assertEqual(self.provider.read_log(self.runfolder, 21, 4, whole_lines=True).content, "line")
+
+    def test_tail_log(self):
+        BclConvertLogFileProvider.TAIL_BLOCK_SIZE = 4
+        try:
+            self.assertEqual(self.provider.tail_log(self.runfolder, 2), LogChunk("line 2\nline 3\n", 7, 21, 21))
+            self.assertEqual(self.provider.tail_log(self.runfolder, 10).content, "line 1\nline 2\nline 3\n")
+            self.assertEqual(self.provider.tail_log(self.runfolder, 0).content, "")
+            self.write("line 4", mode="a")
+            self.assertEqual(self.provider.tail_log(self.runfolder, 1).content, "line 4")
+        finally:
+            BclConvertLogFileProvider.TAIL_BLOCK_SIZE = 64 * 1024
+
+    def test_etag_changes_when_the_log_is_written(self):
+        etag = self.provider.etag(self.runfolder)
+        self.assertEqual(self.provider.etag(self.runfolder), etag)
+        self.write("line 4\n", mode="a")
+        self.assertNotEqual(self.provider.etag(self.runfolder), etag)
+
+
+class TestLogsPerJob(unittest.TestCase):
+
+    runfolder = "160218_ST-E00215_0070_BHKGLFCCXX"
+
+    def setUp(self):
+        self.log_dir = tempfile.mkdtemp()
+        self.config = {"bclconvert_logs_path": self.log_dir, "log_archive_block_bytes": 4,
+                       "log_retention_count": 2}
+        self.provider = BclConvertLogFileProvider(self.config)
+
+    def tearDown(self):
+        shutil.rmtree(self.log_dir)
+
+    def write_job_log(self, content, suffix=None):
+        path = self.provider.job_log_path(self.runfolder, suffix)
+        with open(path, "w") as f:
+            f.write(content)
+        return path
+
+    def test_latest_log(self):
+        # Without logs per job, the single log of the runfolder is read
+        self.assertEqual(self.provider.latest_log_path(self.runfolder), self.provider.log_file_path(self.runfolder))
+        first = self.write_job_log("first\n")
+        second = self.write_job_log("second\n", suffix="L001")
+        self.assertEqual(os.path.dirname(first), self.provider.job_log_dir(self.runfolder))
+        self.assertTrue(second.endswith("_L001.log"))
+        self.assertEqual(self.provider.job_logs(self.runfolder), [first, second])
+        self.assertEqual(self.provider.get_log_for_runfolder(self.runfolder), "second\n")
+        self.assertEqual(self.provider.get_log_for_runfolder(self.runfolder, log_path=first), "first\n")
+
+    def test_read_compressed_log(self):
+        path = self.write_job_log("line 1\nline 2\nline 3\n")
+        etag = self.provider.etag(self.runfolder)
+        registry = JobRegistry()
+        registry.save({"job_id": 1, "runfolder": self.runfolder, "stdout": path, "state": "done"})
+        LogArchiver(self.config, registry).archive(1, self.runfolder)
+
+        self.assertEqual(self.provider.job_logs(self.runfolder), [path + ".gz"])
+        self.assertNotEqual(self.provider.etag(self.runfolder), etag)
+        # The log can still be read by its path from before it was compressed
+        self.assertEqual(self.provider.read_log(self.runfolder, 7, 6, log_path=path), LogChunk("line 2", 7, 13, 21))
+        self.assertEqual(self.provider.tail_log(self.runfolder, 1).content, "line 3\n")
+        self.assertEqual(self.provider.get_log_for_runfolder(self.runfolder), "line 1\nline 2\nline 3\n")
+
+    def test_old_logs_are_removed(self):
+        registry = JobRegistry()
+        archiver = LogArchiver(self.config, registry)
+        paths = []
+        for job_id in range(1, 5):
+            paths.append(self.write_job_log(f"job {job_id}\n"))
+            registry.save({"job_id": job_id, "runfolder": self.runfolder, "stdout": paths[-1], "state": "done"})
+        running = self.write_job_log("still running\n")
+        for job_id in range(1, 5):
+            archiver.archive(job_id, self.runfolder)
+
+        self.assertEqual(self.provider.job_logs(self.runfolder), [paths[2] + ".gz", paths[3] + ".gz", running])
+        self.assertEqual(self.provider.prune_logs(self.runfolder, keep_count=10, keep_bytes=0), [paths[2] + ".gz"])
+        self.assertEqual(self.provider.job_logs(self.runfolder), [paths[3] + ".gz", running])
+
+    def test_legacy_log_is_not_compressed(self):
+        path = self.provider.log_file_path(self.runfolder)
+        with open(path, "w") as f:
+            f.write("line 1\n")
+        registry = JobRegistry()
+        registry.save({"job_id": 1, "runfolder": self.runfolder, "stdout": path, "state": "done"})
+        LogArchiver(self.config, registry).archive(1, self.runfolder)
+        self.assertTrue(os.path.exists(path))
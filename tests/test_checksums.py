@@ -0,0 +1,106 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+from arteria.web.state import State
+
+from bclconvert.lib.checksums import DEFAULT_WORKERS, ChecksumService, hash_file, read_manifest, update_manifest
+from bclconvert.lib.job_registry import JobRegistry
+
+
+class TestChecksums(unittest.TestCase):
+
+    def setUp(self):
+        self.output = tempfile.mkdtemp()
+        self.write("ProjectA/S1_S1_L001_R1_001.fastq.gz", b"reads of S1")
+        self.write("Undetermined_S0_L001_R1_001.fastq.gz", b"undetermined reads")
+        self.write("Reports/Demultiplex_Stats.csv", b"Lane,SampleID\n")
+        self.write("Empty.txt", b"")
+        self.write(".lanes/L002/S1_S1_L002_R1_001.fastq.gz", b"not merged")
+
+    def tearDown(self):
+        shutil.rmtree(self.output)
+
+    def write(self, name, content):
+        path = os.path.join(self.output, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(content)
+
+    def read(self, name):
+        with open(os.path.join(self.output, name)) as f:
+            return f.read()
+
+    def test_hash_file(self):
+        path = os.path.join(self.output, "Undetermined_S0_L001_R1_001.fastq.gz")
+        self.assertEqual(hash_file(path), (path, hashlib.md5(b"undetermined reads").hexdigest(),
+                                           hashlib.sha256(b"undetermined reads").hexdigest()))
+        empty = os.path.join(self.output, "Empty.txt")
+        self.assertEqual(hash_file(empty)[1], hashlib.md5(b"").hexdigest())
+
+    def test_manifest(self):
+        manifest = update_manifest(self.output, nbr_of_workers=2)
+        self.assertEqual(sorted(manifest), ["Empty.txt", "ProjectA/S1_S1_L001_R1_001.fastq.gz",
+                                            "Reports/Demultiplex_Stats.csv", "Undetermined_S0_L001_R1_001.fastq.gz"])
+        self.assertEqual(read_manifest(self.output), manifest)
+        self.assertIn(f"{hashlib.md5(b'reads of S1').hexdigest()}  ProjectA/S1_S1_L001_R1_001.fastq.gz\n",
+                      self.read("md5sums.txt"))
+        self.assertIn(f"{hashlib.sha256(b'reads of S1').hexdigest()}  ProjectA/S1_S1_L001_R1_001.fastq.gz\n",
+                      self.read("sha256sums.txt"))
+        # The manifest does not list itself when it is written again
+        self.assertEqual(sorted(update_manifest(self.output)), sorted(manifest))
+
+    def test_unchanged_files_are_not_hashed_again(self):
+        update_manifest(self.output)
+        path = os.path.join(self.output, "ProjectA", "S1_S1_L001_R1_001.fastq.gz")
+        manifest = read_manifest(self.output)
+        manifest["Undetermined_S0_L001_R1_001.fastq.gz"]["md5"] = "not hashed again"
+        with open(os.path.join(self.output, "checksums.json"), "w") as f:
+            json.dump({"files": manifest}, f)
+        self.write("ProjectA/S1_S1_L001_R1_001.fastq.gz", b"reads of S1, again")
+        os.utime(path, ns=(0, 0))
+
+        manifest = update_manifest(self.output)
+        self.assertEqual(manifest["Undetermined_S0_L001_R1_001.fastq.gz"]["md5"], "not hashed again")
+        self.assertEqual(manifest["ProjectA/S1_S1_L001_R1_001.fastq.gz"]["md5"],
+                         hashlib.md5(b"reads of S1, again").hexdigest())
+
+
+class TestChecksumService(unittest.TestCase):
+
+    def setUp(self):
+        self.output = tempfile.mkdtemp()
+        with open(os.path.join(self.output, "S1_S1_L001_R1_001.fastq.gz"), "wb") as f:
+            f.write(b"reads")
+        self.registry = JobRegistry()
+        for job_id, state in [(1, State.DONE), (2, State.ERROR)]:
+            self.registry.save({"job_id": job_id, "runfolder": "runfolder1", "state": state, "cores": 1,
+                                "command": ["bcl-convert", "--output-directory", self.output]})
+        self.service = ChecksumService(self.registry)
+
+    def tearDown(self):
+        shutil.rmtree(self.output)
+
+    def test_written_when_the_job_finishes(self):
+        self.service.on_event({"job_id": 1, "state": State.DONE, "parent_id": None})
+        self.service._executor.shutdown(wait=True)
+        self.assertFalse(self.service.is_pending(1))
+        self.assertEqual(list(read_manifest(self.output)), ["S1_S1_L001_R1_001.fastq.gz"])
+
+    def test_workers_are_bounded(self):
+        with mock.patch("bclconvert.lib.checksums.update_manifest") as update:
+            for cores, nbr_of_workers in [(0, DEFAULT_WORKERS), (64, DEFAULT_WORKERS), (2, 2)]:
+                self.registry.save(dict(self.registry.get(1), cores=cores))
+                self.service._update(1, self.output)
+                self.assertEqual(update.call_args[0][1], nbr_of_workers)
+
+    def test_failed_jobs(self):
+        self.service.on_event({"job_id": 2, "state": State.ERROR, "parent_id": None})
+        with self.assertRaises(KeyError):
+            self.service.submit(2)
+        self.service._executor.shutdown(wait=True)
+        self.assertEqual(read_manifest(self.output), {})
@@ -0,0 +1,127 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from arteria.web.state import State
+
+from bclconvert.lib.demux_stats import DemuxStatsService, parse_reports
+from bclconvert.lib.job_registry import JobRegistry
+
+SAMPLESHEET = """[Header]
+FileFormatVersion,2
+[BCLConvert_Data]
+Lane,Sample_ID,Sample_Name,Sample_Project,Index
+1,S1,S1,ProjectA,ACGTACGT
+1,S2,S2,ProjectB,TTGGCCAA
+2,S1,S1,ProjectA,ACGTACGT
+"""
+
+DEMULTIPLEX_STATS = """Lane,SampleID,Index,# Reads,# Perfect Index Reads,# One Mismatch Index Reads,# Two Mismatch Index Reads,\
+% Reads,% Perfect Index Reads,% One Mismatch Index Reads,% Two Mismatch Index Reads
+1,S1,ACGTACGT,600,540,60,0,0.6000,0.9000,0.1000,0.0000
+1,S2,TTGGCCAA,300,300,0,0,0.3000,1.0000,0.0000,0.0000
+1,Undetermined,,100,100,0,0,0.1000,1.0000,0.0000,0.0000
+2,S1,ACGTACGT,1000,1000,0,0,1.0000,1.0000,0.0000,0.0000
+"""
+
+QUALITY_METRICS = """Lane,SampleID,index,index2,ReadNumber,Yield,YieldQ30,QualityScoreSum,Mean Quality Score (PF),% Q30
+1,S1,ACGTACGT,,1,60000,54000,2000000,33.3,0.90
+1,S1,ACGTACGT,,2,60000,42000,1800000,30.0,0.70
+1,S2,TTGGCCAA,,1,30000,30000,1000000,33.3,1.00
+1,Undetermined,,,1,10000,5000,300000,30.0,0.50
+2,S1,ACGTACGT,,1,100000,100000,3500000,35.0,1.00
+"""
+
+TOP_UNKNOWN_BARCODES = """Lane,index,# Reads,% of Unknown Barcodes,% of All Reads
+1,GGGGGGGG,80,0.800000,0.080000
+1,AGATCTCG,20,0.200000,0.020000
+"""
+
+
+def write_reports(output):
+    reports = os.path.join(output, "Reports")
+    os.makedirs(reports, exist_ok=True)
+    for name, content in [("SampleSheet.csv", SAMPLESHEET), ("Demultiplex_Stats.csv", DEMULTIPLEX_STATS),
+                          ("Quality_Metrics.csv", QUALITY_METRICS),
+                          ("Top_Unknown_Barcodes.csv", TOP_UNKNOWN_BARCODES)]:
+        with open(os.path.join(reports, name), "w") as f:
+            f.write(content)
+
+
+class TestParseReports(unittest.TestCase):
+
+    def setUp(self):
+        self.output = tempfile.mkdtemp()
+        write_reports(self.output)
+
+    def tearDown(self):
+        shutil.rmtree(self.output)
+
+    def test_lanes(self):
+        lane = parse_reports(self.output)["lanes"]["1"]
+        self.assertEqual(lane["reads"], 1000)
+        self.assertEqual((lane["undetermined_reads"], lane["undetermined_fraction"]), (100, 0.1))
+        self.assertEqual(lane["percent_perfect_index"], 94.0)
+        self.assertEqual(lane["percent_one_mismatch_index"], 6.0)
+        self.assertEqual(lane["yield"], 160000)
+        # Undetermined reads count towards the lane
+        self.assertEqual(lane["percent_q30"], 81.88)
+        self.assertEqual(lane["samples"]["S1"]["percent_of_lane"], 60.0)
+        self.assertEqual(lane["samples"]["S1"]["percent_q30"], 80.0)
+        self.assertNotIn("Undetermined", lane["samples"])
+
+    def test_samples_and_projects(self):
+        stats = parse_reports(self.output)
+        self.assertEqual(stats["samples"]["S1"]["reads"], 1600)
+        self.assertEqual(stats["samples"]["S1"]["project"], "ProjectA")
+        self.assertEqual(stats["projects"]["ProjectA"]["samples"], ["S1"])
+        self.assertEqual(stats["projects"]["ProjectB"]["reads"], 300)
+        self.assertEqual(stats["projects"]["ProjectB"]["percent_q30"], 100.0)
+
+    def test_top_unknown_barcodes(self):
+        barcodes = parse_reports(self.output)["top_unknown_barcodes"]["1"]
+        self.assertEqual(barcodes[0], {"index": "GGGGGGGG", "reads": 80, "percent_of_unknown": 80.0,
+                                       "percent_of_lane": 8.0})
+
+    def test_no_reports(self):
+        shutil.rmtree(os.path.join(self.output, "Reports"))
+        with self.assertRaises(FileNotFoundError):
+            parse_reports(self.output)
+
+
+class TestDemuxStatsService(unittest.TestCase):
+
+    def setUp(self):
+        self.output = tempfile.mkdtemp()
+        write_reports(self.output)
+        self.registry = JobRegistry()
+        self.registry.save({"job_id": 1, "runfolder": "runfolder1", "state": State.DONE,
+                            "command": ["bcl-convert", "--output-directory", self.output]})
+        self.registry.save({"job_id": 2, "runfolder": "runfolder1", "state": State.STARTED,
+                            "command": ["bcl-convert", "--output-directory", self.output]})
+        self.service = DemuxStatsService(self.registry)
+
+    def tearDown(self):
+        shutil.rmtree(self.output)
+
+    def test_parsed_once(self):
+        stats = self.service.get(1)
+        self.assertEqual((stats["job_id"], stats["runfolder"]), (1, "runfolder1"))
+        self.assertIs(self.service.get(1), stats)
+
+        # Reports that change are parsed again
+        with open(os.path.join(self.output, "Reports", "Top_Unknown_Barcodes.csv"), "w") as f:
+            f.write("Lane,index,# Reads,% of Unknown Barcodes,% of All Reads\n")
+        self.assertEqual(self.service.get(1)["top_unknown_barcodes"], {})
+
+    def test_parsed_when_the_job_finishes(self):
+        self.service.on_event({"job_id": 1, "state": State.DONE, "parent_id": None})
+        self.service._executor.shutdown(wait=True)
+        self.assertEqual(len(self.service), 1)
+
+    def test_unfinished_job(self):
+        with self.assertRaises(KeyError):
+            self.service.get(2)
+        with self.assertRaises(KeyError):
+            self.service.get(3)
@@ -0,0 +1,102 @@
+import os
+import shutil
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+import mock
+from arteria.web.state import State
+
+from bclconvert.lib.disk_space import check_disk_space, estimate_output_bytes, pf_clusters, reserved_bytes
+from bclconvert.lib.job_registry import JobRegistry
+from bclconvert.lib.preflight import PreflightError
+
+RUNFOLDER = os.path.join(os.path.dirname(os.path.realpath(__file__)), "sampledata", "MiSeq-samples", "2013-04_16_2-index")
+
+# Clusters passing filter in the runfolder, and the bytes of each of its records: two reads of
+# 151 cycles with a header of 50 bytes and a 6 base index
+CLUSTERS_PF = 11870888
+RECORD_BYTES = 2 * (50 + 6 + 1 + 2 * 151 + 5)
+
+
+class TestEstimate(unittest.TestCase):
+
+    def test_pf_clusters(self):
+        self.assertEqual(pf_clusters(RUNFOLDER), CLUSTERS_PF)
+        self.assertLess(pf_clusters(RUNFOLDER, tiles="s_1_11"), CLUSTERS_PF)
+        self.assertEqual(pf_clusters(RUNFOLDER, exclude_tiles="s_1"), 0)
+        self.assertIsNone(pf_clusters(os.path.dirname(RUNFOLDER)))
+
+    def test_pf_clusters_of_several_tile_patterns(self):
+        self.assertEqual(pf_clusters(RUNFOLDER, tiles="s_1+s_2"), CLUSTERS_PF)
+        self.assertEqual(pf_clusters(RUNFOLDER, tiles="s_1_11+s_1_21"),
+                         pf_clusters(RUNFOLDER, tiles="s_1_11") + pf_clusters(RUNFOLDER, tiles="s_1_21"))
+        self.assertEqual(pf_clusters(RUNFOLDER, exclude_tiles="s_1_11+s_1_21"), 0)
+
+    def test_estimate(self):
+        self.assertEqual(estimate_output_bytes(RUNFOLDER, compression_level=0), CLUSTERS_PF * RECORD_BYTES)
+        self.assertEqual(estimate_output_bytes(RUNFOLDER), int(CLUSTERS_PF * RECORD_BYTES * 0.32))
+        self.assertLess(estimate_output_bytes(RUNFOLDER, compression_level="9"), estimate_output_bytes(RUNFOLDER))
+        self.assertIsNone(estimate_output_bytes(os.path.dirname(RUNFOLDER)))
+
+
+class TestCheckDiskSpace(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.registry = JobRegistry()
+        self.estimate = estimate_output_bytes(RUNFOLDER)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def runfolder_config(self, output):
+        return SimpleNamespace(output=os.path.join(self.tmp_dir, output), runfolder_input=RUNFOLDER, tiles=None,
+                               exclude_tiles=None, fastq_gzip_compression_level=1)
+
+    def free(self, nbr_of_bytes):
+        return mock.patch("os.statvfs", return_value=SimpleNamespace(f_bavail=nbr_of_bytes // 4096, f_frsize=4096))
+
+    def add_job(self, job_id, output, state=State.STARTED):
+        self.registry.save({"job_id": job_id, "state": state, "run_dir": RUNFOLDER,
+                            "command": ["bcl-convert", "--output-directory", os.path.join(self.tmp_dir, output)]})
+
+    def test_enough_space(self):
+        with self.free(2 * self.estimate):
+            space = check_disk_space(self.runfolder_config("run1"), self.registry)
+        self.assertEqual(space["estimated_bytes"], self.estimate)
+        self.assertEqual(space["reserved_bytes"], 0)
+
+    def test_not_enough_space(self):
+        with self.free(self.estimate), self.assertRaises(PreflightError) as context:
+            check_disk_space(self.runfolder_config("run1"), self.registry)
+        self.assertEqual(context.exception.report.errors[0]["check"], "disk_space")
+        self.assertIn("needs about", str(context.exception))
+
+    def test_space_reserved_by_other_jobs(self):
+        self.add_job(1, "run2")
+        self.add_job(2, "run3", state=State.DONE)
+        self.assertEqual(reserved_bytes(self.registry, os.stat(self.tmp_dir).st_dev), (self.estimate, 1))
+        with self.free(int(1.5 * self.estimate)), self.assertRaises(PreflightError):
+            check_disk_space(self.runfolder_config("run1"), self.registry)
+
+        # What a job has written already is no longer reserved
+        os.makedirs(os.path.join(self.tmp_dir, "run2"))
+        with open(os.path.join(self.tmp_dir, "run2", "S1_S1_L001_R1_001.fastq.gz"), "wb") as f:
+            f.write(b"\0" * 1024 * 1024)
+        self.assertLess(reserved_bytes(self.registry, os.stat(self.tmp_dir).st_dev)[0], self.estimate)
+
+    def test_unknown_clusters(self):
+        runfolder_config = self.runfolder_config("run1")
+        runfolder_config.runfolder_input = self.tmp_dir
+        with self.free(0):
+            self.assertIsNone(check_disk_space(runfolder_config, self.registry)["estimated_bytes"])
+
+    def test_kept_output_is_not_free(self):
+        os.makedirs(os.path.join(self.tmp_dir, "run1"))
+        with open(os.path.join(self.tmp_dir, "run1", "S1_S1_L001_R1_001.fastq.gz"), "wb") as f:
+            f.write(b"\0" * 1024 * 1024)
+        with self.free(2 * self.estimate):
+            self.assertGreater(check_disk_space(self.runfolder_config("run1"), self.registry)["reclaimable_bytes"], 0)
+            self.assertEqual(check_disk_space(self.runfolder_config("run1"), self.registry,
+                                              output_deleted=False)["reclaimable_bytes"], 0)
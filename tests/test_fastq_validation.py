@@ -0,0 +1,153 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from bclconvert.lib.fastq_validation import (DEFAULT_WORKERS, FastqValidationError, FastqValidator, check_fastq,
+                                             cross_check, validate_output)
+
+from .test_demux_stats import write_reports
+
+
+def records(nbr_of_reads, length=8):
+    return b"".join(b"@read%d 1:N:0:ACGTACGT\n%s\n+\n%s\n" % (i, b"A" * length, b"F" * length)
+                    for i in range(nbr_of_reads))
+
+
+class TestCheckFastq(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "S1_S1_L001_R1_001.fastq.gz")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self, content):
+        with gzip.open(self.path, "wb") as f:
+            f.write(content)
+
+    def test_valid(self):
+        self.write(records(1000))
+        # Records are split across chunks
+        self.assertEqual(check_fastq(self.path, chunk_bytes=100), (self.path, 1000, None))
+
+    def test_multiple_gzip_members(self):
+        self.write(records(3))
+        with open(self.path, "ab") as f:
+            f.write(gzip.compress(records(2)))
+        self.assertEqual(check_fastq(self.path), (self.path, 5, None))
+
+    def test_uncompressed(self):
+        path = os.path.join(self.tmp_dir, "S1_S1_L001_R1_001.fastq")
+        with open(path, "wb") as f:
+            f.write(records(3))
+        self.assertEqual(check_fastq(path), (path, 3, None))
+
+    def test_truncated_gzip(self):
+        self.write(records(1000))
+        size = os.path.getsize(self.path)
+        with open(self.path, "r+b") as f:
+            f.truncate(size // 2)
+        path, _, error = check_fastq(self.path)
+        self.assertIn("could not be read to the end", error)
+
+    def test_corrupt_gzip(self):
+        self.write(records(1000))
+        with open(self.path, "r+b") as f:
+            f.seek(os.path.getsize(self.path) - 6)
+            f.write(b"\0\0")
+        self.assertIn("could not be read to the end", check_fastq(self.path)[2])
+
+    def test_incomplete_record(self):
+        self.write(records(2) + b"@read2\nACGT\n")
+        self.assertEqual(check_fastq(self.path), (self.path, 2, "ends with an incomplete record at line 9"))
+
+    def test_malformed_records(self):
+        self.write(records(2) + b"@read2\nACGT\n+\nFFF\n")
+        self.assertEqual(check_fastq(self.path)[2], "the record at line 9 has 4 bases but 3 qualities")
+        self.write(records(2) + b"read2\nACGT\n+\nFFFF\n")
+        self.assertEqual(check_fastq(self.path)[2], "line 9 is not a record header")
+        self.write(b"@read0\nACGT\nFFFF\n+\n")
+        self.assertEqual(check_fastq(self.path)[2], "line 3 is not a record separator")
+
+
+class TestValidateOutput(unittest.TestCase):
+
+    def setUp(self):
+        self.output = tempfile.mkdtemp()
+        # 600 and 300 reads of S1 and S2 and 100 undetermined reads in lane 1, 1000 reads of S1 in lane 2
+        write_reports(self.output)
+        self.write("ProjectA/S1_S1_L001_R1_001.fastq.gz", 600)
+        self.write("ProjectA/S1_S1_L001_R2_001.fastq.gz", 600)
+        self.write("ProjectB/S2_S2_L001_R1_001.fastq.gz", 300)
+        self.write("Undetermined_S0_L001_R1_001.fastq.gz", 100)
+        self.write("ProjectA/S1_S1_L002_R1_001.fastq.gz", 1000)
+
+    def tearDown(self):
+        shutil.rmtree(self.output)
+
+    def write(self, name, nbr_of_reads):
+        path = os.path.join(self.output, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with gzip.open(path, "wb", compresslevel=1) as f:
+            f.write(records(nbr_of_reads))
+
+    def test_valid_output(self):
+        result = validate_output(self.output)
+        self.assertEqual(result["errors"], [])
+        self.assertEqual(sum(result["reads"].values()), 2600)
+
+    def test_in_parallel(self):
+        self.write("ProjectB/S2_S2_L001_R1_001.fastq.gz", 299)
+        result = validate_output(self.output, nbr_of_workers=2)
+        self.assertEqual(len(result["reads"]), 5)
+        self.assertEqual(result["errors"],
+                         [f"{self.output}/ProjectB/S2_S2_L001_R1_001.fastq.gz has 299 reads, 300 were reported for it"])
+
+    def test_missing_files(self):
+        os.remove(os.path.join(self.output, "Undetermined_S0_L001_R1_001.fastq.gz"))
+        self.assertEqual(validate_output(self.output)["errors"],
+                         ["No fastq files for Undetermined in lane 1, 100 reads were reported for it"])
+
+    def test_without_lane_splitting(self):
+        expected = {("S1", 1): 600, ("S1", 2): 1000}
+        self.assertEqual(cross_check({"/out/S1_S1_R1_001.fastq.gz": 1600}, expected), [])
+        self.assertEqual(len(cross_check({"/out/S1_S1_R1_001.fastq.gz": 600}, expected)), 1)
+        # Files that are not named like bcl-convert names them are only checked for integrity
+        self.assertEqual(len(cross_check({"/out/other.fastq.gz": 1, "/out/S1_S1_R1_001.fastq.gz": 1600}, expected)), 0)
+
+    def test_validator(self):
+        record = {"job_id": 1, "cores": 1, "command": ["bcl-convert", "--output-directory", self.output]}
+        FastqValidator()(record)
+        with open(os.path.join(self.output, "ProjectA", "S1_S1_L002_R1_001.fastq.gz"), "ab") as f:
+            f.write(b"garbage")
+        with self.assertRaises(FastqValidationError) as context:
+            FastqValidator()(record)
+        self.assertEqual(len(context.exception.errors), 1)
+
+    def test_workers_of_jobs_without_cores(self):
+        record = {"job_id": 1, "cores": 0, "command": ["bcl-convert", "--output-directory", self.output]}
+        with mock.patch("bclconvert.lib.fastq_validation.validate_output", return_value={"errors": []}) as validate:
+            FastqValidator()(record)
+            self.assertEqual(validate.call_args[0][1], DEFAULT_WORKERS)
+            FastqValidator()(dict(record, cores=16))
+            self.assertEqual(validate.call_args[0][1], 16)
+
+    def test_sample_name_column_enabled(self):
+        with open(os.path.join(self.output, "Reports", "SampleSheet.csv"), "w") as f:
+            f.write("[BCLConvert_Data]\nLane,Sample_ID,Sample_Name,Index\n1,S1,Alpha,ACGTACGT\n"
+                    "1,S2,,TTTTAAAA\n2,S1,Alpha,ACGTACGT\n")
+        for name in ["S1_S1_L001_R1_001.fastq.gz", "S1_S1_L001_R2_001.fastq.gz", "S1_S1_L002_R1_001.fastq.gz"]:
+            os.rename(os.path.join(self.output, "ProjectA", name),
+                      os.path.join(self.output, "ProjectA", name.replace("S1_", "Alpha_", 1)))
+        record = {"job_id": 1, "cores": 1, "command": ["bcl-convert", "--output-directory", self.output]}
+
+        with self.assertRaises(FastqValidationError) as context:
+            FastqValidator()(record)
+        self.assertIn("No fastq files for S1 in lane 1, 600 reads were reported for it", context.exception.errors)
+        FastqValidator(sample_name_column_enabled=True)(record)
+        FastqValidator()(dict(record, command=record["command"] + ["--sample-name-column-enabled", "true"]))
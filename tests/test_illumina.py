@@ -40,6 +40,50 @@ Lane,Sample_ID,Sample_Name,Sample_Plate,Sample_Well,I7_Index_ID,index,Sample_Pro
         result = Samplesheet._read_samples(StringIO(TestSamplesheet.tiny_dummy_samplesheet_string))
         self.assertEqual(result, TestSamplesheet.expected_samples)
 
+    def test__read_samples_stops_at_next_section(self):
+        samplesheet = TestSamplesheet.tiny_dummy_samplesheet_string + \
+            ",,,,,,,,\n\n[Cloud_Settings],,,,,,,,\nGeneratedVersion,1.7.0,,,,,,,\n"
+        result = Samplesheet._read_samples(StringIO(samplesheet))
+        self.assertEqual(result, TestSamplesheet.expected_samples)
+
+    def test__read_samples_quoted_and_short_rows(self):
+        samplesheet = "[Data]\nLane,Sample_ID,Sample_Name,index,Sample_Project,Description\n" \
+                      "2,S1,S1,ACGT,Project,\"A description, with a comma\"\n" \
+                      "3,S2,S2,TGCA,Project\n"
+        result = Samplesheet._read_samples(StringIO(samplesheet))
+        self.assertEqual(result[0].lane, 2)
+        self.assertEqual(result[0].description, "A description, with a comma")
+        self.assertEqual(result[1].lane, 3)
+        self.assertEqual(result[1].description, "")
+
+    def test__read_samples_obsolete_settings(self):
+        samplesheet = "[Settings]\nAdapter,AGATCGGAAGAGC\n" + TestSamplesheet.tiny_dummy_samplesheet_string
+        with self.assertRaises(AssertionError):
+            Samplesheet._read_samples(StringIO(samplesheet))
+
+    def test__read_samples_no_data_section(self):
+        with self.assertRaises(AssertionError):
+            Samplesheet._read_samples(StringIO("[Header]\nRunName,foo\n"))
+
+    def test_indexes(self):
+        samplesheet = Samplesheet(TestSamplesheet.samplesheet_file)
+        self.assertEqual(samplesheet.lanes, [1, 2, 3, 4, 5, 6, 7, 8])
+        self.assertEqual(samplesheet.projects, ["Test"])
+        self.assertEqual([s.sample_id for s in samplesheet.samples_in_lane(2)], ["2"])
+        self.assertEqual(samplesheet.samples_in_lane(9), ())
+        self.assertEqual(len(samplesheet.samples_in_project("Test")), 8)
+        self.assertEqual([s.lane for s in samplesheet.samples_with_index("ATTACTCG", "TATAGCCT")], [1])
+        self.assertEqual([s.lane for s in samplesheet.samples_with_index("TCCGGA")], [2])
+        self.assertEqual(samplesheet.samples_with_index("TCCGGA", "TATAGCCT"), ())
+        first_samples = samplesheet.first_sample_per_lane()
+        self.assertEqual(list(first_samples.keys()), [1, 2, 3, 4, 5, 6, 7, 8])
+        self.assertEqual(first_samples[1].index1, "ATTACTCG")
+
+    def test_samplerow_strings_are_shared(self):
+        result = Samplesheet._read_samples(StringIO(TestSamplesheet.tiny_dummy_samplesheet_string))
+        self.assertIs(result[0].sample_project, result[1].sample_project)
+        self.assertFalse(hasattr(result[0], "__dict__"))
+
     def test_samplerow_defaults(self):
         samplerow = SampleRow(sample_id="1", sample_name="1",
                               index1="CAGATC", sample_project="Dummy-Project")
@@ -69,4 +113,10 @@ class TestSamplesheetCloudSettings(unittest.TestCase):
         # TODO This can probably improved by using mocks in some smart way
         # TODO but right it doesn't feel like it's worth it. /JD 20150813
         result = Samplesheet(TestSamplesheetCloudSettings.samplesheet_file)
-        self.assertEqual(len(result.samples), 15)
\ No newline at end of file
+        self.assertEqual(len(result.samples), 15)
+    def test_read_sections(self):
+        sections = read_sections(TestSamplesheetCloudSettings.samplesheet_file)
+        self.assertEqual(list(sections), ["Header", "Reads", "BCLConvert_Settings", "BCLConvert_Data",
+                                          "Cloud_Settings", "Cloud_Data"])
+        self.assertEqual(sections["Reads"][:2], ["Read0Cycles,151", "Read1Cycles,151"])
+        self.assertEqual(len(sections["BCLConvert_Data"]), 16)
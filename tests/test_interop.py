@@ -0,0 +1,131 @@
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+import numpy as np
+
+from bclconvert.lib.interop import InteropFormatError, RunQcCache, read_index_metrics, read_q_metrics, \
+    read_tile_metrics, run_qc
+
+
+class TestInterop(unittest.TestCase):
+
+    test_dir = os.path.dirname(os.path.realpath(__file__))
+    miseq_runfolder = os.path.join(test_dir, "sampledata", "MiSeq-samples", "2013-04_16_2-index")
+    hiseq_runfolder = os.path.join(test_dir, "sampledata", "HiSeq-samples", "2014-02_13_average_run")
+
+    def test_read_tile_metrics(self):
+        tile_metrics = read_tile_metrics(os.path.join(self.miseq_runfolder, "InterOp", "TileMetricsOut.bin"))
+        self.assertEqual(len(tile_metrics["tile"]), 28)
+        self.assertEqual(set(tile_metrics["lane"]), {1})
+        self.assertTrue((tile_metrics["clusters_pf"] <= tile_metrics["clusters"]).all())
+
+    def test_read_q_metrics(self):
+        path = os.path.join(self.miseq_runfolder, "InterOp", "QMetricsOut.bin")
+        q_metrics = read_q_metrics(path)
+        # Compare with reading the records one by one
+        with open(path, "rb") as f:
+            data = f.read()
+        first = struct.unpack_from("<HHH50I", data, 2)
+        self.assertEqual(len(q_metrics["lane"]), (len(data) - 2) // 206)
+        self.assertEqual((q_metrics["lane"][0], q_metrics["tile"][0], q_metrics["cycle"][0]), first[:3])
+        self.assertEqual(list(q_metrics["histogram"][0]), list(first[3:]))
+
+    def test_read_index_metrics(self):
+        path = os.path.join(self.miseq_runfolder, "InterOp", "IndexMetricsOut.bin")
+        index_metrics = read_index_metrics(path)
+        # Compare with reading the records one by one
+        with open(path, "rb") as f:
+            data = f.read()
+        records = []
+        offset = 1
+        while offset < len(data):
+            lane, tile, read, length = struct.unpack_from("<HHHH", data, offset)
+            index = data[offset + 8:offset + 8 + length]
+            offset += 8 + length
+            clusters, length = struct.unpack_from("<IH", data, offset)
+            sample = data[offset + 6:offset + 6 + length]
+            offset += 6 + length
+            length, = struct.unpack_from("<H", data, offset)
+            project = data[offset + 2:offset + 2 + length]
+            offset += 2 + length
+            records.append((lane, tile, read, index, clusters, sample, project))
+        self.assertEqual(list(zip(*(index_metrics[key].tolist() for key in
+                                    ["lane", "tile", "read", "index", "clusters", "sample", "project"]))), records)
+
+    def test_truncated_index_metrics(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, "IndexMetricsOut.bin")
+            with open(os.path.join(self.miseq_runfolder, "InterOp", "IndexMetricsOut.bin"), "rb") as f:
+                data = f.read()
+            with open(path, "wb") as f:
+                f.write(data[:-3])
+            with self.assertRaises(InteropFormatError):
+                read_index_metrics(path)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_run_qc(self):
+        lanes = run_qc(self.miseq_runfolder)["lanes"]
+        self.assertEqual(list(lanes), ["1"])
+        lane = lanes["1"]
+        self.assertEqual(lane["tiles"], 28)
+        self.assertAlmostEqual(lane["percent_pf"], 100.0 * lane["clusters_pf"] / lane["clusters"], places=2)
+        self.assertTrue(0 < lane["percent_q30"] < 100)
+        self.assertEqual(len(lane["intensity_cycle_1"]), 4)
+        self.assertEqual([index["index"] for index in lane["indexes"]], ["CTTGTA", "GGCTAC"])
+        self.assertLess(sum(index["percent_of_pf"] for index in lane["indexes"]), 100)
+
+    def test_q30_of_lanes(self):
+        q_metrics = read_q_metrics(os.path.join(self.hiseq_runfolder, "..", "frankendataset", "InterOp",
+                                                "QMetricsOut.bin"))
+        lanes = run_qc(os.path.join(self.hiseq_runfolder, "..", "frankendataset"))["lanes"]
+        for lane in [1, 2]:
+            histogram = np.asarray(q_metrics["histogram"][q_metrics["lane"] == lane], dtype=np.float64)
+            expected = 100.0 * histogram[:, 29:].sum() / histogram.sum()
+            self.assertAlmostEqual(lanes[str(lane)]["percent_q30"], expected, places=2)
+
+    def test_tile_metrics_version_3(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, "TileMetricsOut.bin")
+            with open(path, "wb") as f:
+                f.write(struct.pack("<BBf", 3, 15, 2.0))
+                f.write(struct.pack("<HIBff", 1, 1101, ord("t"), 2000.0, 1500.0))
+                f.write(struct.pack("<HIBIf", 1, 1101, ord("r"), 1, 0.5))
+                f.write(struct.pack("<HIBff", 2, 2101, ord("t"), 4000.0, 1000.0))
+            tile_metrics = read_tile_metrics(path)
+            self.assertEqual(list(tile_metrics["lane"]), [1, 2])
+            self.assertEqual(list(tile_metrics["tile"]), [1101, 2101])
+            self.assertEqual(list(tile_metrics["density"]), [1000.0, 2000.0])
+            self.assertEqual(list(tile_metrics["clusters_pf"]), [1500.0, 1000.0])
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+class TestRunQcCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.runfolder = os.path.join(self.tmp_dir, "runfolder")
+        shutil.copytree(TestInterop.miseq_runfolder, self.runfolder)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_cached_until_interop_changes(self):
+        cache = RunQcCache()
+        qc = cache.get(self.runfolder)
+        self.assertIs(cache.get(self.runfolder), qc)
+
+        os.remove(os.path.join(self.runfolder, "InterOp", "IndexMetricsOut.bin"))
+        self.assertNotIn("indexes", cache.get(self.runfolder)["lanes"]["1"])
+        self.assertEqual(len(cache), 1)
+
+    def test_no_interop(self):
+        shutil.rmtree(os.path.join(self.runfolder, "InterOp"))
+        with self.assertRaises(FileNotFoundError):
+            RunQcCache().get(self.runfolder)
@@ -0,0 +1,43 @@
+import unittest
+
+from arteria.web.state import State
+
+from bclconvert.lib.job_events import JobEvents
+
+
+class TestJobEvents(unittest.TestCase):
+
+    def setUp(self):
+        self.events = JobEvents(max_events=3)
+
+    def test_versions(self):
+        self.assertEqual(self.events.version, 0)
+        first = self.events.publish(1, State.PENDING, runfolder="run1")
+        second = self.events.publish(1, State.STARTED, runfolder="run1")
+        self.assertEqual((first["version"], second["version"]), (1, 2))
+        self.assertEqual(self.events.version, 2)
+        self.assertEqual((second["job_id"], second["state"], second["runfolder"]), (1, State.STARTED, "run1"))
+
+    def test_since_keeps_the_last_events(self):
+        for job_id in range(1, 6):
+            self.events.publish(job_id, State.DONE)
+        self.assertEqual([event["version"] for event in self.events.since(0)], [3, 4, 5])
+        self.assertEqual([event["version"] for event in self.events.since(4)], [5])
+        self.assertEqual(self.events.since(5), [])
+
+    def test_listeners(self):
+        received = []
+        self.events.subscribe(received.append)
+        self.events.publish(1, State.STARTED)
+        self.events.unsubscribe(received.append)
+        self.events.publish(1, State.DONE)
+        self.assertEqual([event["state"] for event in received], [State.STARTED])
+
+    def test_failing_listener_does_not_stop_others(self):
+        def fail(event):
+            raise ValueError("listener failed")
+        received = []
+        self.events.subscribe(fail)
+        self.events.subscribe(received.append)
+        self.events.publish(1, State.STARTED)
+        self.assertEqual(len(received), 1)
@@ -0,0 +1,88 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from arteria.web.state import State
+
+from bclconvert.lib.job_registry import JobRegistry
+from bclconvert.lib.scheduler import FINISHED_STATES
+
+
+class TestJobRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = JobRegistry()
+
+    def record(self, job_id, state=State.PENDING, **kwargs):
+        record = {"job_id": job_id, "runfolder": "run1", "command": ["bcl-convert", "--force"], "state": state,
+                  "parameters": {"lanes": "1"}, "cores": 4, "memory_mb": 4096, "submitted": 1.5}
+        record.update(kwargs)
+        return record
+
+    def test_save_and_get(self):
+        self.registry.save(self.record(1))
+        record = self.registry.get(1)
+        self.assertEqual(record["command"], ["bcl-convert", "--force"])
+        self.assertEqual(record["parameters"], {"lanes": "1"})
+        self.assertEqual((record["state"], record["cores"], record["submitted"]), (State.PENDING, 4, 1.5))
+        self.assertIsNone(record["exit_code"])
+        self.assertIsNone(self.registry.get(2))
+
+    def test_save_replaces(self):
+        self.registry.save(self.record(1))
+        self.registry.save(self.record(1, State.DONE, exit_code=0))
+        self.assertEqual(len(self.registry.find()), 1)
+        self.assertEqual((self.registry.get(1)["state"], self.registry.get(1)["exit_code"]), (State.DONE, 0))
+
+    def test_find(self):
+        self.registry.save(self.record(1, State.DONE))
+        self.registry.save(self.record(2, State.STARTED))
+        self.registry.save(self.record(3, State.DONE, runfolder="run2"))
+        self.assertEqual([r["job_id"] for r in self.registry.find(runfolder="run1")], [1, 2])
+        self.assertEqual([r["job_id"] for r in self.registry.find(state=State.DONE)], [1, 3])
+        self.assertEqual([r["job_id"] for r in self.registry.find(runfolder="run2", state=State.DONE)], [3])
+
+    def test_children_and_unfinished(self):
+        self.registry.save(self.record(1, State.DONE, parent_id=3))
+        self.registry.save(self.record(2, State.STARTED, parent_id=3))
+        self.registry.save(self.record(3, State.STARTED, command=None))
+        self.assertEqual([r["job_id"] for r in self.registry.children(3)], [1, 2])
+        self.assertEqual([r["job_id"] for r in self.registry.unfinished(FINISHED_STATES)], [2, 3])
+
+    def test_max_job_id(self):
+        self.assertEqual(self.registry.max_job_id(), 0)
+        self.registry.save(self.record(7))
+        self.assertEqual(self.registry.max_job_id(), 7)
+
+    def test_persists_to_file(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "jobs.db")
+            registry = JobRegistry(path)
+            registry.save(self.record(1, State.DONE))
+            registry.close()
+            self.assertEqual(JobRegistry(path).get(1)["state"], State.DONE)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_columns_are_added_to_old_databases(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "jobs.db")
+            connection = sqlite3.connect(path)
+            connection.execute("CREATE TABLE jobs (job_id INTEGER PRIMARY KEY, parent_id INTEGER, runfolder TEXT, "
+                               "parameters TEXT, command TEXT, run_dir TEXT, stdout TEXT, stderr TEXT, cores INTEGER, "
+                               "memory_mb INTEGER, runner_job_id TEXT, state TEXT NOT NULL, exit_code INTEGER, "
+                               "submitted REAL, started REAL, finished REAL, finisher TEXT, finisher_args TEXT)")
+            connection.execute("INSERT INTO jobs (job_id, state) VALUES (1, 'done')")
+            connection.commit()
+            connection.close()
+
+            registry = JobRegistry(path)
+            self.assertIsNone(registry.get(1)["priority"])
+            registry.save(self.record(2, priority=100))
+            self.assertEqual(registry.get(2)["priority"], 100)
+        finally:
+            shutil.rmtree(directory)
@@ -0,0 +1,203 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from arteria.exceptions import ArteriaUsageException
+from arteria.web.state import State
+
+from bclconvert.lib.lane_split import (STAGING_DIR_NAME, changed_lanes, fastq_lane, lane_staging_dir,
+                                       merge_lane_jobs, merge_lane_outputs)
+from bclconvert.lib.scheduler import ResourceAwareAdapter
+from .test_utils import FakeJobRunner
+
+SAMPLESHEET = """[Header]
+FileFormatVersion,2
+RunName,run1
+[Reads]
+Read1Cycles,151
+[BCLConvert_Settings]
+BarcodeMismatchesIndex1,1
+[BCLConvert_Data]
+Lane,Sample_ID,Index
+1,S1,ACGTACGT
+1,S2,TGCATGCA
+2,S3,ACGTACGT
+"""
+
+
+class TestMergeLaneOutputs(unittest.TestCase):
+
+    def setUp(self):
+        self.output = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.output)
+
+    def write(self, path, content):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(content)
+
+    def read(self, *path):
+        with open(os.path.join(self.output, *path)) as f:
+            return f.read()
+
+    def stage_lane(self, lane):
+        staging_dir = lane_staging_dir(self.output, lane)
+        self.write(os.path.join(staging_dir, "Project", f"S1_S1_L00{lane}_R1_001.fastq.gz"), f"lane {lane}")
+        self.write(os.path.join(staging_dir, f"Undetermined_S0_L00{lane}_R1_001.fastq.gz"), f"lane {lane}")
+        self.write(os.path.join(staging_dir, "Reports", "Demultiplex_Stats.csv"),
+                   f"Lane,SampleID,# Reads\n{lane},S1,100\n")
+        self.write(os.path.join(staging_dir, "Reports", "fastq_list.csv"),
+                   f"RGID,Lane,Read1File\nS1.{lane},{lane},{staging_dir}/Project/S1_S1_L00{lane}_R1_001.fastq.gz\n")
+        self.write(os.path.join(staging_dir, "Reports", "SampleSheet.csv"), "[Header]\n")
+        self.write(os.path.join(staging_dir, "Reports", "RunInfo.xml"), "<RunInfo/>")
+        self.write(os.path.join(staging_dir, "Logs", "Info.log"), f"lane {lane}")
+
+    def test_merge(self):
+        self.stage_lane(1)
+        self.stage_lane(2)
+        merge_lane_outputs(self.output, [1, 2])
+
+        self.assertEqual(self.read("Project", "S1_S1_L001_R1_001.fastq.gz"), "lane 1")
+        self.assertEqual(self.read("Project", "S1_S1_L002_R1_001.fastq.gz"), "lane 2")
+        self.assertEqual(self.read("Undetermined_S0_L002_R1_001.fastq.gz"), "lane 2")
+        self.assertEqual(self.read("Reports", "Demultiplex_Stats.csv").splitlines(),
+                         ["Lane,SampleID,# Reads", "1,S1,100", "2,S1,100"])
+        self.assertEqual(self.read("Reports", "fastq_list.csv").splitlines()[2],
+                         f"S1.2,2,{self.output}/Project/S1_S1_L002_R1_001.fastq.gz")
+        self.assertEqual(self.read("Reports", "SampleSheet.csv"), "[Header]\n")
+        self.assertEqual(self.read("Logs", "L002", "Info.log"), "lane 2")
+        self.assertFalse(os.path.exists(os.path.join(self.output, STAGING_DIR_NAME)))
+
+    def test_failed_lanes_are_left_in_staging(self):
+        self.stage_lane(1)
+        self.stage_lane(2)
+        merge_lane_outputs(self.output, [2])
+        self.assertFalse(os.path.exists(lane_staging_dir(self.output, 2)))
+        self.assertTrue(os.path.exists(lane_staging_dir(self.output, 1)))
+        self.assertEqual(self.read("Reports", "Demultiplex_Stats.csv").splitlines(), ["Lane,SampleID,# Reads", "2,S1,100"])
+
+    def test_merged_lanes_are_not_merged_again(self):
+        self.stage_lane(1)
+        self.stage_lane(2)
+        merge_lane_outputs(self.output, [1, 2])
+        merge_lane_outputs(self.output, [1, 2])
+        self.assertEqual(self.read("Reports", "Demultiplex_Stats.csv").splitlines(),
+                         ["Lane,SampleID,# Reads", "1,S1,100", "2,S1,100"])
+
+    def test_conflicting_files(self):
+        for lane in [1, 2]:
+            self.write(os.path.join(lane_staging_dir(self.output, lane), "Undetermined_S0_R1_001.fastq.gz"), "")
+        with self.assertRaises(ArteriaUsageException):
+            merge_lane_outputs(self.output, [1, 2])
+
+    def test_replace_lanes(self):
+        self.stage_lane(1)
+        self.stage_lane(2)
+        merge_lane_outputs(self.output, [1, 2])
+        self.write(os.path.join(self.output, "Project", "S2_S2_L002_R1_001.fastq.gz"), "removed from lane 2")
+
+        staging_dir = lane_staging_dir(self.output, 2)
+        self.write(os.path.join(staging_dir, "Project", "S3_S2_L002_R1_001.fastq.gz"), "lane 2, again")
+        self.write(os.path.join(staging_dir, "Undetermined_S0_L002_R1_001.fastq.gz"), "lane 2, again")
+        # Only lane 2 is taken from its staging directory
+        self.write(os.path.join(staging_dir, "Undetermined_S0_L001_R1_001.fastq.gz"), "")
+        self.write(os.path.join(staging_dir, "Reports", "Demultiplex_Stats.csv"),
+                   "Lane,SampleID,# Reads\n2,S3,200\n")
+        self.write(os.path.join(staging_dir, "Reports", "SampleSheet.csv"), "[Header]\nRunName,run1\n")
+        self.write(os.path.join(staging_dir, "Logs", "Info.log"), "lane 2, again")
+        merge_lane_jobs({"output": self.output, "lanes": [2], "replace": True}, [0])
+
+        self.assertEqual(self.read("Project", "S1_S1_L001_R1_001.fastq.gz"), "lane 1")
+        self.assertEqual(self.read("Undetermined_S0_L001_R1_001.fastq.gz"), "lane 1")
+        self.assertEqual(sorted(os.listdir(os.path.join(self.output, "Project"))),
+                         ["S1_S1_L001_R1_001.fastq.gz", "S3_S2_L002_R1_001.fastq.gz"])
+        self.assertEqual(self.read("Undetermined_S0_L002_R1_001.fastq.gz"), "lane 2, again")
+        self.assertEqual(self.read("Reports", "Demultiplex_Stats.csv").splitlines(),
+                         ["Lane,SampleID,# Reads", "1,S1,100", "2,S3,200"])
+        self.assertEqual(self.read("Reports", "fastq_list.csv").splitlines(),
+                         ["RGID,Lane,Read1File", f"S1.1,1,{self.output}/Project/S1_S1_L001_R1_001.fastq.gz"])
+        self.assertEqual(self.read("Reports", "SampleSheet.csv"), "[Header]\nRunName,run1\n")
+        self.assertEqual(self.read("Logs", "L002", "Info.log"), "lane 2, again")
+        self.assertEqual(self.read("Logs", "L001", "Info.log"), "lane 1")
+        self.assertFalse(os.path.exists(os.path.join(self.output, STAGING_DIR_NAME)))
+
+    def test_replace_lanes_of_a_rerun_in_the_background(self):
+        self.stage_lane(1)
+        self.stage_lane(2)
+        merge_lane_outputs(self.output, [1, 2])
+        self.write(os.path.join(lane_staging_dir(self.output, 2), "Project", "S1_S1_L002_R1_001.fastq.gz"),
+                   "lane 2, again")
+
+        merged_on = []
+
+        def merge(finisher_args, succeeded):
+            merged_on.append(threading.current_thread())
+            merge_lane_jobs(finisher_args, succeeded)
+
+        runner = FakeJobRunner()
+        scheduler = ResourceAwareAdapter(runner, nbr_of_cores=4, interval=None, finishers={"merge_lanes": merge})
+        parent, children = scheduler.start_group([{"cmd": "lane2", "nbr_of_cores": 2, "run_dir": "/run"}],
+                                                 finisher="merge_lanes",
+                                                 finisher_args={"output": self.output, "lanes": [2], "replace": True})
+        runner.finish(1)
+        scheduler.update()
+        scheduler._validations.submit(lambda: None).result()
+
+        self.assertEqual(scheduler.status(parent), State.DONE)
+        self.assertNotIn(threading.current_thread(), merged_on)
+        self.assertEqual(self.read("Project", "S1_S1_L002_R1_001.fastq.gz"), "lane 2, again")
+        self.assertEqual(self.read("Project", "S1_S1_L001_R1_001.fastq.gz"), "lane 1")
+
+    def test_fastq_lane(self):
+        self.assertEqual(fastq_lane("S1_S1_L003_R2_001.fastq.gz"), 3)
+        self.assertEqual(fastq_lane("S1_S1_L001_I1_001.fastq.ora"), 1)
+        self.assertIsNone(fastq_lane("S1_S1_R1_001.fastq.gz"))
+
+
+class TestChangedLanes(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.previous = self.write("previous.csv", SAMPLESHEET)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self, name, content):
+        path = os.path.join(self.tmp_dir, name)
+        with open(path, "w") as f:
+            f.write(content)
+        return path
+
+    def changed(self, samplesheet, lanes=(1, 2, 3)):
+        return changed_lanes(self.previous, self.write("SampleSheet.csv", samplesheet), list(lanes))
+
+    def test_unchanged(self):
+        self.assertEqual(self.changed(SAMPLESHEET), [])
+        # Neither the header, the order of the samples nor empty cells change what is converted
+        samplesheet = SAMPLESHEET.replace("RunName,run1", "RunName,run1,,")
+        samplesheet = samplesheet.replace("1,S1,ACGTACGT\n1,S2,TGCATGCA\n", "1,S2,TGCATGCA,,\n\n1,S1,ACGTACGT\n")
+        self.assertEqual(self.changed(samplesheet.replace("RunName,run1", "RunName,run2")), [])
+
+    def test_changed_samples(self):
+        self.assertEqual(self.changed(SAMPLESHEET.replace("2,S3,ACGTACGT", "2,S3,ACGTACGA")), [2])
+        self.assertEqual(self.changed(SAMPLESHEET.replace("1,S2,TGCATGCA\n", "")), [1])
+        self.assertEqual(self.changed(SAMPLESHEET + "3,S4,ACGTACGT\n"), [3])
+        self.assertEqual(self.changed(SAMPLESHEET.replace("1,S2", "2,S2")), [1, 2])
+        self.assertEqual(self.changed(SAMPLESHEET.replace("Lane,Sample_ID,Index", "Lane,Sample_ID,Index,Index2")
+                                      .replace("2,S3,ACGTACGT", "2,S3,ACGTACGT,AAAAAAAA")), [2])
+
+    def test_changed_settings(self):
+        self.assertEqual(self.changed(SAMPLESHEET.replace("BarcodeMismatchesIndex1,1", "BarcodeMismatchesIndex1,0")),
+                         [1, 2, 3])
+        self.assertEqual(self.changed(SAMPLESHEET.replace("Read1Cycles,151", "Read1Cycles,101"), lanes=[1, 2]),
+                         [1, 2])
+
+    def test_rows_without_lane(self):
+        self.previous = self.write("previous.csv", "[Data]\nSample_ID,index\nS1,ACGTACGT\n")
+        self.assertEqual(self.changed("[Data]\nSample_ID,index\nS1,ACGTACGA\n", lanes=[1, 2]), [1, 2])
+        self.assertEqual(self.changed("[Data]\nLane,Sample_ID,index\n2,S1,ACGTACGT\n", lanes=[1, 2]), [1])
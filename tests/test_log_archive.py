@@ -0,0 +1,50 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+from bclconvert.lib.log_archive import INDEX_SUFFIX, LogArchive, compress_log, remove_archive
+
+
+class TestLogArchive(unittest.TestCase):
+
+    def setUp(self):
+        self.log_dir = tempfile.mkdtemp()
+        self.log_path = os.path.join(self.log_dir, "job.log")
+        self.content = b"".join(f"line {i}\n".encode() for i in range(1000))
+        with open(self.log_path, "wb") as f:
+            f.write(self.content)
+
+    def tearDown(self):
+        shutil.rmtree(self.log_dir)
+
+    def test_compress_log(self):
+        archive_path = compress_log(self.log_path, block_size=100)
+        self.assertEqual(archive_path, self.log_path + ".gz")
+        self.assertFalse(os.path.exists(self.log_path))
+        # The archive can be read as any gzip file
+        with gzip.open(archive_path) as f:
+            self.assertEqual(f.read(), self.content)
+
+    def test_read_from_any_offset(self):
+        archive = LogArchive(compress_log(self.log_path, block_size=100))
+        self.assertEqual(archive.size, len(self.content))
+        self.assertEqual(archive.read(), self.content)
+        for offset, limit in [(0, 1), (99, 2), (100, 100), (150, 1000), (len(self.content) - 5, 100)]:
+            self.assertEqual(archive.read(offset, limit), self.content[offset:offset + limit])
+        self.assertEqual(archive.read(len(self.content)), b"")
+        self.assertEqual(archive.read(10, 0), b"")
+
+    def test_empty_log(self):
+        open(self.log_path, "w").close()
+        archive = LogArchive(compress_log(self.log_path))
+        self.assertEqual(archive.size, 0)
+        self.assertEqual(archive.read(), b"")
+
+    def test_remove_archive(self):
+        archive_path = compress_log(self.log_path)
+        remove_archive(archive_path)
+        remove_archive(archive_path)
+        self.assertFalse(os.path.exists(archive_path))
+        self.assertFalse(os.path.exists(archive_path + INDEX_SUFFIX))
@@ -0,0 +1,94 @@
+import os
+import tempfile
+import shutil
+import time
+import unittest
+
+from bclconvert.lib.output_deletion import OutputDeletionService, PurgeState
+
+
+class TestOutputDeletionService(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.deletion_service = OutputDeletionService(nbr_of_workers=4, batch_size=3)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _create_tree(self, name, nbr_of_files=10):
+        output = os.path.join(self.tmp_dir, name)
+        os.makedirs(os.path.join(output, "Reports"))
+        os.makedirs(os.path.join(output, "Project", "Sample"))
+        for i in range(nbr_of_files):
+            for directory in [output, os.path.join(output, "Project", "Sample")]:
+                with open(os.path.join(directory, f"file_{i}.fastq.gz"), "w") as f:
+                    f.write("data")
+        os.symlink(os.path.join(output, "Reports"), os.path.join(output, "link_to_reports"))
+        return output
+
+    def _wait_for(self, purge_id, timeout=10):
+        start = time.time()
+        while time.time() - start < timeout:
+            status = self.deletion_service.status(purge_id)
+            if status["state"] in (PurgeState.DONE, PurgeState.ERROR):
+                return status
+            time.sleep(0.01)
+        self.fail(f"Purge {purge_id} did not finish in time")
+
+    def test_delete_moves_output_out_of_the_way(self):
+        output = self._create_tree("runfolder")
+        purge = self.deletion_service.delete(output)
+        self.assertFalse(os.path.exists(output))
+        self.assertTrue(purge.trash_path.startswith(OutputDeletionService.trash_dir_for(output)))
+        # The path can be reused right away.
+        os.mkdir(output)
+        status = self._wait_for(purge.purge_id)
+        self.assertEqual(status["state"], PurgeState.DONE)
+        self.assertEqual(status["files_removed"], 21)
+        self.assertFalse(os.path.exists(purge.trash_path))
+        self.assertTrue(os.path.isdir(output))
+
+    def test_delete_non_existent(self):
+        self.assertIsNone(self.deletion_service.delete(os.path.join(self.tmp_dir, "no_such_dir")))
+        self.assertEqual(self.deletion_service.status_all(), {})
+
+    def test_status_all(self):
+        purge_1 = self.deletion_service.delete(self._create_tree("runfolder1"))
+        purge_2 = self.deletion_service.delete(self._create_tree("runfolder2"))
+        self._wait_for(purge_1.purge_id)
+        self._wait_for(purge_2.purge_id)
+        self.assertEqual(sorted(self.deletion_service.status_all().keys()), [purge_1.purge_id, purge_2.purge_id])
+
+    def test_status_unknown(self):
+        self.assertIsNone(self.deletion_service.status(123))
+
+    def test_purge_leftovers(self):
+        output = self._create_tree("runfolder")
+        trash_dir = OutputDeletionService.trash_dir_for(output)
+        os.mkdir(trash_dir)
+        os.rename(output, os.path.join(trash_dir, "runfolder.old"))
+
+        purges = self.deletion_service.purge_leftovers([self.tmp_dir, "/no/such/dir"])
+        self.assertEqual(len(purges), 1)
+        self.assertEqual(self._wait_for(purges[0].purge_id)["state"], PurgeState.DONE)
+        self.assertEqual(os.listdir(trash_dir), [])
+
+    def test_purge_leftovers_next_to_outputs(self):
+        output = self._create_tree(os.path.join("nested", "runfolder"))
+        trash_dir = OutputDeletionService.trash_dir_for(output)
+        os.mkdir(trash_dir)
+        os.rename(output, os.path.join(trash_dir, "runfolder.old"))
+
+        purges = self.deletion_service.purge_leftovers([self.tmp_dir], outputs=[output, output + "/"])
+        self.assertEqual(len(purges), 1)
+        self.assertEqual(self._wait_for(purges[0].purge_id)["state"], PurgeState.DONE)
+        self.assertEqual(os.listdir(trash_dir), [])
+
+    def test_finished_purges_are_pruned(self):
+        deletion_service = OutputDeletionService(nbr_of_workers=4, max_finished_purges=1)
+        purges = [deletion_service.delete(self._create_tree(f"runfolder{i}")) for i in range(3)]
+        # Purges run one at a time, so this waits for all of them
+        deletion_service._purge_pool.submit(lambda: None).result()
+        self.assertEqual(list(deletion_service.status_all()), [purges[-1].purge_id])
+        self.assertIsNone(deletion_service.status(purges[0].purge_id))
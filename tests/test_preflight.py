@@ -0,0 +1,135 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from arteria.exceptions import ArteriaUsageException
+
+from bclconvert.lib.illumina import Samplesheet
+from bclconvert.lib.preflight import PreflightError, PreflightReport, encode_indexes, find_barcode_collisions, \
+    pairwise_hamming_distances, parse_barcode_mismatches, run_preflight, samplesheet_barcode_mismatches
+from bclconvert.lib.runinfo import Read, RunInfo
+
+
+def make_run_info(lane_count=2, index_lengths=(8, 8)):
+    reads = [Read(1, 151, False)]
+    reads += [Read(number, length, True) for number, length in enumerate(index_lengths, start=2)]
+    reads += [Read(len(reads) + 1, 151, False)]
+    return RunInfo(run_id="240101_A00001_0001_AHXXXXXXXX", instrument="A00001", flowcell="HXXXXXXXX",
+                   reads=tuple(reads), lane_count=lane_count)
+
+
+SAMPLESHEET_HEADER = """[Header]
+FileFormatVersion,2
+[BCLConvert_Settings]
+CreateFastqForIndexReads,0
+[BCLConvert_Data]
+Lane,Sample_ID,Index,Index2
+"""
+
+
+class TestHammingDistances(unittest.TestCase):
+
+    def test_pairwise_hamming_distances(self):
+        distances = pairwise_hamming_distances(encode_indexes(["ACGT", "ACGA", "TTTT"]))
+        self.assertEqual(distances.tolist(), [[0, 1, 3], [1, 0, 4], [3, 4, 0]])
+
+    def test_different_lengths_compare_common_prefix(self):
+        distances = pairwise_hamming_distances(encode_indexes(["ACGTAC", "ACGT"]))
+        self.assertEqual(distances[0, 1], 0)
+
+    def test_find_barcode_collisions_single_index(self):
+        self.assertEqual(find_barcode_collisions(["AAAAAAAA", "AAAAAACC", "CCCCCCCC"], ["", "", ""], (1, 1)),
+                         [(0, 1)])
+        self.assertEqual(find_barcode_collisions(["AAAAAAAA", "AAAAAACC", "CCCCCCCC"], ["", "", ""], (0, 0)), [])
+
+    def test_find_barcode_collisions_dual_index(self):
+        # Index 1 is identical, but index 2 tells the samples apart
+        self.assertEqual(find_barcode_collisions(["AAAAAAAA", "AAAAAAAA"], ["CCCCCCCC", "GGGGGGGG"], (1, 1)), [])
+        self.assertEqual(find_barcode_collisions(["AAAAAAAA", "AAAAAAAA"], ["CCCCCCCC", "CCCCCCGG"], (1, 1)),
+                         [(0, 1)])
+        self.assertEqual(find_barcode_collisions(["AAAAAAAA", "AAAAAAAA"], ["CCCCCCCC", "CCCCCCGG"], (1, 0)), [])
+
+    def test_parse_barcode_mismatches(self):
+        self.assertEqual(parse_barcode_mismatches(None), (1, 1))
+        self.assertEqual(parse_barcode_mismatches(""), (1, 1))
+        self.assertEqual(parse_barcode_mismatches(0), (0, 0))
+        self.assertEqual(parse_barcode_mismatches("2,0"), (2, 0))
+        with self.assertRaises(ArteriaUsageException):
+            parse_barcode_mismatches("one")
+
+
+class TestRunPreflight(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def samplesheet(self, rows):
+        path = os.path.join(self.tmp_dir, "SampleSheet.csv")
+        with open(path, "w") as f:
+            f.write(SAMPLESHEET_HEADER + "\n".join(rows) + "\n")
+        return Samplesheet(path)
+
+    def test_ok(self):
+        samplesheet = self.samplesheet(["1,S1,AAAAAAAA,CCCCCCCC", "1,S2,GGGGGGGG,TTTTTTTT", "2,S3,AAAAAAAA,CCCCCCCC"])
+        report = run_preflight(samplesheet, make_run_info())
+        self.assertTrue(report.ok)
+        self.assertEqual(report.as_dict(), {"ok": True, "errors": [], "warnings": []})
+
+    def test_lane_not_on_flowcell(self):
+        samplesheet = self.samplesheet(["1,S1,AAAAAAAA,CCCCCCCC", "3,S2,GGGGGGGG,TTTTTTTT"])
+        report = run_preflight(samplesheet, make_run_info(lane_count=2))
+        self.assertEqual([(error["check"], error["lane"]) for error in report.errors], [("lanes", 3)])
+
+    def test_index_longer_than_index_read(self):
+        samplesheet = self.samplesheet(["1,S1,AAAAAAAAAA,CCCCCCCC", "1,S2,GGGGGGGG,TTTTTTTT"])
+        report = run_preflight(samplesheet, make_run_info(index_lengths=(8, 8)))
+        self.assertEqual(len(report.errors), 1)
+        self.assertEqual(report.errors[0]["check"], "index_length")
+        self.assertEqual(report.errors[0]["samples"], ["S1"])
+
+    def test_index2_without_index_read(self):
+        samplesheet = self.samplesheet(["1,S1,AAAAAAAA,CCCCCCCC", "1,S2,GGGGGGGG,TTTTTTTT"])
+        report = run_preflight(samplesheet, make_run_info(index_lengths=(8,)))
+        self.assertEqual([error["check"] for error in report.errors], ["index_length"])
+
+    def test_barcode_collision(self):
+        samplesheet = self.samplesheet(["1,S1,AAAAAAAA,CCCCCCCC", "1,S2,AAAAAAAT,CCCCCCCC",
+                                        "2,S3,AAAAAAAA,CCCCCCCC", "2,S4,GGGGGGGG,CCCCCCCC"])
+        report = run_preflight(samplesheet, make_run_info(), barcode_mismatches="1")
+        self.assertEqual(len(report.errors), 1)
+        self.assertEqual(report.errors[0]["check"], "barcode_collision")
+        self.assertEqual(report.errors[0]["lane"], 1)
+        self.assertEqual(report.errors[0]["samples"], ["S1", "S2"])
+
+        self.assertTrue(run_preflight(samplesheet, make_run_info(), barcode_mismatches="0").ok)
+
+    def test_barcode_mismatches_from_samplesheet_settings(self):
+        rows = ["1,S1,AAAAAAAA,CCCCCCCC", "1,S2,AAAAAAAT,CCCCCCCG"]
+        self.assertFalse(run_preflight(self.samplesheet(rows), make_run_info()).ok)
+
+        settings = "CreateFastqForIndexReads,0\nBarcodeMismatchesIndex1,0\nBarcodeMismatchesIndex2,0,,\n"
+        path = os.path.join(self.tmp_dir, "SampleSheet.csv")
+        with open(path, "w") as f:
+            f.write(SAMPLESHEET_HEADER.replace("CreateFastqForIndexReads,0\n", settings) + "\n".join(rows) + "\n")
+        self.assertEqual(samplesheet_barcode_mismatches(path), (0, 0))
+        self.assertTrue(run_preflight(Samplesheet(path), make_run_info()).ok)
+        # Mismatches given in the request take precedence
+        self.assertFalse(run_preflight(Samplesheet(path), make_run_info(), barcode_mismatches="1").ok)
+
+    def test_several_samples_without_index(self):
+        samplesheet = self.samplesheet(["1,S1,,", "1,S2,,"])
+        report = run_preflight(samplesheet, make_run_info())
+        self.assertEqual([error["check"] for error in report.errors], ["barcode_collision"])
+
+    def test_preflight_error_carries_report(self):
+        report = PreflightReport()
+        report.add_error("lanes", "Lane 3 is not on the flowcell", lane=3)
+        error = PreflightError(report)
+        self.assertIsInstance(error, ArteriaUsageException)
+        self.assertIs(error.report, report)
+        self.assertIn("Lane 3 is not on the flowcell", str(error))
+
@@ -0,0 +1,159 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from arteria.web.state import State
+
+from bclconvert.lib.progress import JobProgress, LogTail, ProgressTracker
+from bclconvert.lib.scheduler import ResourceAwareAdapter
+
+from .test_runinfo import NOVASEQ_RUNINFO
+from .test_utils import FakeJobRunner
+
+
+class TestLogTail(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "job.log")
+        self.tail = LogTail(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self, content, mode="a"):
+        with open(self.path, mode) as f:
+            f.write(content)
+
+    def test_reads_only_new_lines(self):
+        self.assertEqual(self.tail.read_lines(), [])
+        self.write("line 1\nline 2\nline")
+        self.assertEqual(self.tail.read_lines(), ["line 1", "line 2"])
+        self.assertEqual(self.tail.read_lines(), [])
+        self.write(" 3\n")
+        self.assertEqual(self.tail.read_lines(), ["line 3"])
+        self.assertEqual(self.tail.offset, 21)
+
+    def test_truncated_log_is_read_from_the_start(self):
+        self.write("line 1\nline 2\n")
+        self.tail.read_lines()
+        self.write("new\n", mode="w")
+        self.assertEqual(self.tail.read_lines(), ["new"])
+
+
+class TestProgress(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.runfolder = os.path.join(self.tmp_dir, "runfolder")
+        os.makedirs(self.runfolder)
+        with open(os.path.join(self.runfolder, "RunInfo.xml"), "w") as f:
+            f.write(NOVASEQ_RUNINFO)
+        self.output = os.path.join(self.tmp_dir, "output")
+        os.makedirs(os.path.join(self.output, "Logs"))
+        self.log_file = os.path.join(self.tmp_dir, "job.log")
+        self.runner = FakeJobRunner()
+        self.scheduler = ResourceAwareAdapter(self.runner, nbr_of_cores=8, interval=None)
+        self.tracker = ProgressTracker()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def cmd(self, *args):
+        return ["bcl-convert", "--bcl-input-directory", self.runfolder, "--output-directory", self.output] + list(args)
+
+    def write_info_log(self, content):
+        with open(os.path.join(self.output, "Logs", "Info.log"), "a") as f:
+            f.write(content)
+
+    def test_expected_tiles(self):
+        self.assertEqual(JobProgress.expected_tiles(self.runfolder), {"1_1101", "1_1102", "2_1101"})
+        self.assertEqual(JobProgress.expected_tiles(self.runfolder, tiles="s_[2]"), {"2_1101"})
+        self.assertEqual(JobProgress.expected_tiles(self.runfolder, exclude_tiles="s_1_1102"), {"1_1101", "2_1101"})
+        self.assertIsNone(JobProgress.expected_tiles(os.path.join(self.tmp_dir, "missing")))
+
+    def test_expected_tiles_of_several_lanes(self):
+        # bcl-convert takes tiles as regular expressions joined by "+", as lanes are given to it
+        self.assertEqual(JobProgress.expected_tiles(self.runfolder, tiles="s_1+s_2"), {"1_1101", "1_1102", "2_1101"})
+        self.assertEqual(JobProgress.expected_tiles(self.runfolder, tiles="s_1_1101+s_2"), {"1_1101", "2_1101"})
+        self.assertEqual(JobProgress.expected_tiles(self.runfolder, exclude_tiles="s_1_1102+s_2"), {"1_1101"})
+
+        runfolder = os.path.join(os.path.dirname(os.path.realpath(__file__)), "sampledata", "HiSeq-samples",
+                                 "frankendataset")
+        one_lane = JobProgress.expected_tiles(runfolder, tiles="s_1")
+        self.assertEqual(len(one_lane), 64)
+        self.assertEqual(JobProgress.expected_tiles(runfolder, tiles="s_1+s_2"),
+                         one_lane | JobProgress.expected_tiles(runfolder, tiles="s_2"))
+        self.assertEqual(len(JobProgress.expected_tiles(runfolder, tiles="s_1+s_2")), 128)
+
+    def test_progress_of_several_lanes_with_one_tile_pattern(self):
+        record = {"command": self.cmd("--tiles", "s_1+s_2"), "run_dir": self.runfolder, "stdout": self.log_file}
+        progress = JobProgress(record, tile_patterns=r"done (?P<lane>\d)_(?P<tile>\d+)")
+        with open(self.log_file, "w") as f:
+            f.write("done 1_1101\ndone 2_1101\nLane 1 tile 1102\n")
+        progress.update()
+        self.assertEqual(progress.as_dict(started=1, now=2)["tiles_total"], 3)
+        self.assertEqual(progress.tiles_done, {"1_1101", "2_1101"})
+
+    def test_progress_of_running_job(self):
+        job_id = self.scheduler.start(self.cmd(), nbr_of_cores=8, run_dir=self.runfolder,
+                                      stdout=self.log_file, stderr=self.log_file)
+        progress = self.tracker.progress(self.scheduler, job_id)
+        self.assertEqual((progress["tiles_done"], progress["tiles_total"], progress["percent"]), (0, 3, 0.0))
+        self.assertIsNone(progress["eta"])
+
+        self.write_info_log("Lane 1 tile 1101 done\n")
+        with open(self.log_file, "w") as f:
+            f.write("Processed s_1_1102\nProcessed s_3_1101, which is not in the run\n")
+        progress = self.tracker.progress(self.scheduler, job_id)
+        self.assertEqual((progress["tiles_done"], progress["percent"]), (2, 66.7))
+        self.assertGreater(progress["tiles_per_second"], 0)
+        self.assertIsNotNone(progress["eta"])
+
+        # bcl-convert writes FastqComplete.txt once it has converted everything
+        open(os.path.join(self.output, "Logs", "FastqComplete.txt"), "w").close()
+        progress = self.tracker.progress(self.scheduler, job_id)
+        self.assertEqual((progress["tiles_done"], progress["percent"], progress["eta"]), (3, 100.0, 0))
+
+        self.runner.finish(1)
+        self.scheduler.update()
+        self.assertEqual(self.tracker.progress(self.scheduler, job_id)["percent"], 100.0)
+        self.assertEqual(self.tracker._jobs, {})
+
+    def test_progress_is_forgotten_when_the_job_finishes(self):
+        tracker = ProgressTracker(events=self.scheduler.events)
+        job_id = self.scheduler.start(self.cmd(), nbr_of_cores=8, run_dir=self.runfolder, stdout=self.log_file)
+        tracker.progress(self.scheduler, job_id)
+        self.assertEqual(list(tracker._jobs), [job_id])
+        self.runner.finish(1, State.ERROR)
+        self.scheduler.update()
+        # Without anyone asking for the progress of the job again
+        self.assertEqual(tracker._jobs, {})
+
+    def test_progress_of_failed_job(self):
+        job_id = self.scheduler.start(self.cmd(), nbr_of_cores=8, run_dir=self.runfolder)
+        self.runner.finish(1, State.ERROR)
+        self.scheduler.update()
+        self.assertIsNone(self.tracker.progress(self.scheduler, job_id))
+
+    def test_progress_of_lanes(self):
+        lane_logs = [os.path.join(self.tmp_dir, f"lane{lane}.log") for lane in [1, 2]]
+        job_id, _ = self.scheduler.start_group(
+            [{"cmd": self.cmd("--tiles", f"s_[{lane}]"), "nbr_of_cores": 4, "run_dir": self.runfolder,
+              "stdout": lane_logs[lane - 1]} for lane in [1, 2]])
+        with open(lane_logs[0], "w") as f:
+            f.write("Lane 1 tile 1101\n")
+        self.runner.finish(2)
+        self.scheduler.update()
+        progress = self.tracker.progress(self.scheduler, job_id)
+        self.assertEqual((progress["tiles_done"], progress["tiles_total"], progress["percent"]), (2, 3, 66.7))
+
+    def test_rate_and_eta(self):
+        record = {"command": self.cmd(), "run_dir": self.runfolder, "stdout": self.log_file}
+        progress = JobProgress(record)
+        with open(self.log_file, "w") as f:
+            f.write("Lane 1 tile 1101\n")
+        progress.update()
+        self.assertEqual(progress.as_dict(started=100, now=110),
+                         {"tiles_done": 1, "tiles_total": 3, "percent": 33.3, "tiles_per_second": 0.1, "eta": 20.0})
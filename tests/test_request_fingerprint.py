@@ -0,0 +1,59 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from bclconvert.lib.bclconvert_utils import BclConvertConfig
+from bclconvert.lib.request_fingerprint import request_fingerprint, samplesheet_sha256
+
+from .test_utils import DummyConfig
+
+
+class TestRequestFingerprint(unittest.TestCase):
+
+    def setUp(self):
+        self.runfolder = tempfile.mkdtemp()
+        with open(os.path.join(self.runfolder, "SampleSheet.csv"), "w") as f:
+            f.write("[Header]\nFileFormatVersion,2\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.runfolder)
+
+    def fingerprint(self, rerun=None, **kwargs):
+        kwargs = dict({"bclconvert_version": "4.0.3", "output": "/data/output/run1"}, **kwargs)
+        config = BclConvertConfig(general_config=DummyConfig(), runfolder_input=self.runfolder, **kwargs)
+        try:
+            return request_fingerprint(config, rerun)
+        finally:
+            config.discard()
+
+    def test_same_request(self):
+        fingerprint = self.fingerprint(barcode_mismatches=1, split_lanes=True)
+        self.assertEqual(self.fingerprint(split_lanes=True, barcode_mismatches="1", tiles=""), fingerprint)
+        # Thread counts do not change what is converted
+        self.assertEqual(self.fingerprint(barcode_mismatches=1, split_lanes=True, bcl_num_conversion_threads=8),
+                         fingerprint)
+
+    def test_defaults_spelled_out(self):
+        fingerprint = self.fingerprint(output=None)
+        self.assertEqual(self.fingerprint(output=os.path.join("tests", os.path.basename(self.runfolder)),
+                                          create_indexes=False, split_lanes=False, rerun="all"), fingerprint)
+        self.assertEqual(self.fingerprint(samplesheet="[Header]\nFileFormatVersion,2\n"), self.fingerprint())
+
+    def test_other_request(self):
+        fingerprint = self.fingerprint(barcode_mismatches=1)
+        self.assertNotEqual(self.fingerprint(barcode_mismatches="0"), fingerprint)
+        self.assertNotEqual(self.fingerprint(barcode_mismatches=1, bclconvert_version="4.2.7"), fingerprint)
+        self.assertNotEqual(self.fingerprint(barcode_mismatches=1, output="/data/other/run1"), fingerprint)
+        self.assertNotEqual(self.fingerprint(barcode_mismatches=1, samplesheet="[Header]\n"), fingerprint)
+        self.assertNotEqual(self.fingerprint(barcode_mismatches=1, rerun="changed_lanes"), fingerprint)
+
+        with open(os.path.join(self.runfolder, "SampleSheet.csv"), "a") as f:
+            f.write("RunName,run1\n")
+        self.assertNotEqual(self.fingerprint(barcode_mismatches=1), fingerprint)
+
+    def test_samplesheet(self):
+        self.assertEqual(samplesheet_sha256(self.runfolder, "[Header]\nFileFormatVersion,2\n"),
+                         samplesheet_sha256(self.runfolder))
+        os.remove(os.path.join(self.runfolder, "SampleSheet.csv"))
+        self.assertIsNone(samplesheet_sha256(self.runfolder))
@@ -0,0 +1,123 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from bclconvert.lib.runfolder_watcher import Inotify, RunfolderWatcher
+
+
+class TestRunfolderWatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.started = []
+        self.converted = {"converted_runfolder"}
+        self.changed = threading.Event()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def on_complete(self, runfolder):
+        self.started.append(runfolder)
+        self.changed.set()
+
+    def create_runfolder(self, name, marker=None):
+        os.makedirs(os.path.join(self.root, name), exist_ok=True)
+        if marker:
+            with open(os.path.join(self.root, name, marker), "w") as f:
+                f.write("done")
+
+    def watcher(self, **kwargs):
+        return RunfolderWatcher([self.root], self.on_complete, lambda runfolder: runfolder in self.converted, **kwargs)
+
+    def test_scan(self):
+        watcher = self.watcher(use_inotify=False)
+        self.create_runfolder("complete_runfolder", "RTAComplete.txt")
+        self.create_runfolder("copying_runfolder")
+        self.create_runfolder("converted_runfolder", "CopyComplete.txt")
+        open(os.path.join(self.root, "not_a_runfolder.txt"), "w").close()
+        watcher.scan()
+        self.assertEqual(self.started, ["complete_runfolder"])
+
+        # Complete runfolders are only started once
+        watcher.scan()
+        self.assertEqual(self.started, ["complete_runfolder"])
+
+        self.create_runfolder("copying_runfolder", "CopyComplete.txt")
+        watcher.scan()
+        self.assertEqual(self.started, ["complete_runfolder", "copying_runfolder"])
+
+    def test_only_changed_runfolders_are_checked(self):
+        watcher = self.watcher(use_inotify=False)
+        self.create_runfolder("copying_runfolder")
+        watcher.scan()
+        checked = []
+        watcher._check = lambda root, name: checked.append(name)
+        watcher.scan()
+        self.assertEqual(checked, [])
+
+    def test_runfolders_complete_at_start_are_not_started(self):
+        self.create_runfolder("old_runfolder", "CopyComplete.txt")
+        self.create_runfolder("copying_runfolder")
+        watcher = self.watcher(use_inotify=False)
+        watcher.seed()
+        watcher.scan()
+        self.assertEqual(self.started, [])
+        self.create_runfolder("copying_runfolder", "CopyComplete.txt")
+        watcher.scan()
+        self.assertEqual(self.started, ["copying_runfolder"])
+
+    def test_failed_starts_are_retried(self):
+        def refuse(runfolder):
+            self.started.append(runfolder)
+            raise RuntimeError("refused")
+
+        watcher = RunfolderWatcher([self.root], refuse, lambda runfolder: False, use_inotify=False,
+                                   max_retries=2, retry_delay=0.05)
+        self.create_runfolder("complete_runfolder", "CopyComplete.txt")
+        watcher.scan()
+        # Not started again until the delay has passed
+        watcher.scan()
+        self.assertEqual(self.started, ["complete_runfolder"])
+        time.sleep(0.06)
+        watcher.scan()
+        self.assertEqual(self.started, ["complete_runfolder"] * 2)
+        # The delay doubles
+        time.sleep(0.06)
+        watcher.scan()
+        self.assertEqual(len(self.started), 2)
+        time.sleep(0.05)
+        watcher.scan()
+        self.assertEqual(len(self.started), 3)
+        # Given up after max_retries
+        time.sleep(0.3)
+        watcher.scan()
+        self.assertEqual(len(self.started), 3)
+        self.assertIn("complete_runfolder", watcher.done)
+
+    def wait_for_start(self, runfolder):
+        deadline = time.time() + 5
+        while runfolder not in self.started and time.time() < deadline:
+            self.changed.wait(0.1)
+            self.changed.clear()
+
+    def test_inotify(self):
+        try:
+            Inotify().close()
+        except OSError:
+            self.skipTest("inotify is not available")
+        # Scans are a minute apart, so runfolders are found through inotify
+        watcher = self.watcher(interval=60)
+        watcher.start()
+        try:
+            time.sleep(0.1)
+            self.create_runfolder("new_runfolder")
+            time.sleep(0.1)
+            self.assertEqual(self.started, [])
+            self.create_runfolder("new_runfolder", "CopyComplete.txt")
+            self.wait_for_start("new_runfolder")
+            self.assertEqual(self.started, ["new_runfolder"])
+        finally:
+            watcher.stop()
@@ -0,0 +1,122 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+
+from bclconvert.lib.runinfo import Read, RunInfo, RunInfoCache
+
+
+NOVASEQ_RUNINFO = """<?xml version="1.0"?>
+<RunInfo Version="6">
+  <Run Id="240101_A00001_0001_AHXXXXXXXX" Number="1">
+    <Flowcell>HXXXXXXXX</Flowcell>
+    <Instrument>A00001</Instrument>
+    <Date>1/1/2024 12:00:00 PM</Date>
+    <Reads>
+      <Read Number="3" NumCycles="151" IsIndexedRead="N" IsReverseComplement="N"/>
+      <Read Number="1" NumCycles="151" IsIndexedRead="N" IsReverseComplement="N"/>
+      <Read Number="2" NumCycles="10" IsIndexedRead="Y" IsReverseComplement="N"/>
+    </Reads>
+    <FlowcellLayout LaneCount="2" SurfaceCount="2" SwathCount="6" TileCount="78" FlowcellSide="1">
+      <TileSet TileNamingConvention="FourDigit">
+        <Tiles>
+          <Tile>1_1101</Tile>
+          <Tile>1_1102</Tile>
+          <Tile>2_1101</Tile>
+        </Tiles>
+      </TileSet>
+    </FlowcellLayout>
+  </Run>
+</RunInfo>
+"""
+
+
+class TestRunInfo(unittest.TestCase):
+
+    test_dir = os.path.dirname(os.path.realpath(__file__))
+    hiseq_runinfo = test_dir + "/sampledata/HiSeq-samples/2014-02_13_average_run/RunInfo.xml"
+
+    def test_from_file(self):
+        run_info = RunInfo.from_file(self.hiseq_runinfo)
+        self.assertEqual(run_info.run_id, "140213_D00251_0076_BH8FW8ADXX")
+        self.assertEqual(run_info.instrument, "D00251")
+        self.assertEqual(run_info.flowcell, "H8FW8ADXX")
+        self.assertEqual(run_info.reads, (Read(1, 151, False), Read(2, 7, True), Read(3, 151, False)))
+        self.assertEqual(run_info.lane_count, 2)
+        self.assertEqual(run_info.index_lengths, {2: 7})
+        self.assertFalse(run_info.is_single_read)
+        self.assertEqual(run_info.total_cycles, 309)
+        # 2 lanes * 2 surfaces * 2 swaths * 16 tiles
+        self.assertEqual(len(run_info.tiles), 128)
+        self.assertEqual(run_info.tiles[0], "1_1101")
+        self.assertEqual(run_info.tiles[-1], "2_2216")
+        self.assertEqual(len(run_info.tiles_for_lane(2)), 64)
+
+    def test_from_file_with_listed_tiles(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            runinfo_path = os.path.join(tmp_dir, "RunInfo.xml")
+            with open(runinfo_path, "w") as f:
+                f.write(NOVASEQ_RUNINFO)
+            run_info = RunInfo.from_file(runinfo_path)
+            self.assertEqual([read.number for read in run_info.reads], [1, 2, 3])
+            self.assertEqual(run_info.tiles, ("1_1101", "1_1102", "2_1101"))
+            self.assertEqual(run_info.tiles_for_lane(1), ("1_1101", "1_1102"))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+class TestRunInfoCache(unittest.TestCase):
+
+    test_dir = os.path.dirname(os.path.realpath(__file__))
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        for name in ["runfolder1", "runfolder2", "runfolder3"]:
+            os.mkdir(os.path.join(self.tmp_dir, name))
+            shutil.copy(self.test_dir + "/sampledata/HiSeq-samples/2014-02_13_average_run/RunInfo.xml",
+                        os.path.join(self.tmp_dir, name, "RunInfo.xml"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_get_parses_only_once(self):
+        cache = RunInfoCache()
+        runfolder = os.path.join(self.tmp_dir, "runfolder1")
+        with patch.object(RunInfo, "from_file", wraps=RunInfo.from_file) as from_file:
+            first = cache.get(runfolder)
+            second = cache.get(runfolder)
+            self.assertIs(first, second)
+            self.assertEqual(from_file.call_count, 1)
+
+    def test_get_reparses_changed_file(self):
+        cache = RunInfoCache()
+        runfolder = os.path.join(self.tmp_dir, "runfolder1")
+        first = cache.get(runfolder)
+        with open(os.path.join(runfolder, "RunInfo.xml"), "w") as f:
+            f.write(NOVASEQ_RUNINFO)
+        second = cache.get(runfolder)
+        self.assertIsNot(first, second)
+        self.assertEqual(second.instrument, "A00001")
+
+    def test_lru_eviction(self):
+        cache = RunInfoCache(maxsize=2)
+        runfolder1, runfolder2, runfolder3 = [os.path.join(self.tmp_dir, name)
+                                              for name in ["runfolder1", "runfolder2", "runfolder3"]]
+        first = cache.get(runfolder1)
+        cache.get(runfolder2)
+        # Touch runfolder1 so that runfolder2 is the least recently used
+        cache.get(runfolder1)
+        cache.get(runfolder3)
+        self.assertEqual(len(cache), 2)
+        with patch.object(RunInfo, "from_file", wraps=RunInfo.from_file) as from_file:
+            self.assertIs(cache.get(runfolder1), first)
+            self.assertEqual(from_file.call_count, 0)
+            cache.get(runfolder2)
+            self.assertEqual(from_file.call_count, 1)
+
+    def test_missing_runinfo(self):
+        with self.assertRaises(OSError):
+            RunInfoCache().get(os.path.join(self.tmp_dir, "no_such_runfolder"))
@@ -0,0 +1,556 @@
+import threading
+import time
+import unittest
+
+import mock
+from arteria.exceptions import ArteriaUsageException
+from arteria.web.state import State
+
+from bclconvert.lib.job_registry import JobRegistry
+from bclconvert.lib.scheduler import ResourceAwareAdapter, estimate_memory_mb, job_priority
+from .test_utils import FakeJobRunner
+
+
+class TestResourceAwareAdapter(unittest.TestCase):
+
+    def setUp(self):
+        self.runner = FakeJobRunner()
+        self.scheduler = ResourceAwareAdapter(self.runner, nbr_of_cores=16, memory_mb=32000, interval=None)
+
+    def test_small_jobs_share_the_node(self):
+        first = self.scheduler.start("cmd1", nbr_of_cores=3, run_dir="/run1", memory_mb=4000)
+        second = self.scheduler.start("cmd2", nbr_of_cores=12, run_dir="/run2", memory_mb=8000)
+        self.assertEqual((first, second), (1, 2))
+        self.assertEqual(self.scheduler.status(first), State.STARTED)
+        self.assertEqual(self.scheduler.status(second), State.STARTED)
+        self.assertEqual(len(self.runner.jobs), 2)
+
+    def test_job_waits_until_cores_are_free(self):
+        first = self.scheduler.start("cmd1", nbr_of_cores=12, run_dir="/run1")
+        second = self.scheduler.start("cmd2", nbr_of_cores=8, run_dir="/run2")
+        self.assertEqual(self.scheduler.status(second), State.PENDING)
+
+        self.runner.finish(self.scheduler._jobs[first].runner_job_id)
+        self.scheduler.update()
+        self.assertEqual(self.scheduler.status(first), State.DONE)
+        self.assertEqual(self.scheduler.status(second), State.STARTED)
+
+    def test_job_waits_until_memory_is_free(self):
+        self.scheduler.start("cmd1", nbr_of_cores=2, run_dir="/run1", memory_mb=30000)
+        second = self.scheduler.start("cmd2", nbr_of_cores=2, run_dir="/run2", memory_mb=4000)
+        self.assertEqual(self.scheduler.status(second), State.PENDING)
+
+    def test_small_job_backfills_past_a_large_one(self):
+        self.scheduler.start("cmd1", nbr_of_cores=12, run_dir="/run1")
+        large = self.scheduler.start("cmd2", nbr_of_cores=16, run_dir="/run2")
+        small = self.scheduler.start("cmd3", nbr_of_cores=4, run_dir="/run3")
+        self.assertEqual(self.scheduler.status(large), State.PENDING)
+        self.assertEqual(self.scheduler.status(small), State.STARTED)
+
+    def test_no_backfill_past_a_job_that_waited_too_long(self):
+        self.scheduler.max_backfill_wait = 60
+        self.scheduler.start("cmd1", nbr_of_cores=12, run_dir="/run1")
+        large = self.scheduler.start("cmd2", nbr_of_cores=16, run_dir="/run2")
+        self.scheduler._jobs[large].submitted -= 120
+        small = self.scheduler.start("cmd3", nbr_of_cores=4, run_dir="/run3")
+        self.assertEqual(self.scheduler.status(small), State.PENDING)
+
+    def test_reservation_is_capped_at_the_node(self):
+        job_id = self.scheduler.start("cmd1", nbr_of_cores=64, run_dir="/run1", memory_mb=64000)
+        self.assertEqual(self.scheduler.status(job_id), State.STARTED)
+        self.assertEqual(self.scheduler.job_info(job_id)["reservation"], {"cores": 16, "memory_mb": 32000})
+
+    def test_stop_pending_job(self):
+        self.scheduler.start("cmd1", nbr_of_cores=16, run_dir="/run1")
+        second = self.scheduler.start("cmd2", nbr_of_cores=16, run_dir="/run2")
+        self.assertEqual(self.scheduler.stop(second), second)
+        self.assertEqual(self.scheduler.status(second), State.CANCELLED)
+        self.assertEqual(len(self.runner.jobs), 1)
+
+    def test_stop_running_job_releases_resources(self):
+        first = self.scheduler.start("cmd1", nbr_of_cores=16, run_dir="/run1")
+        second = self.scheduler.start("cmd2", nbr_of_cores=16, run_dir="/run2")
+        self.scheduler.stop(first)
+        self.assertEqual(self.scheduler.status(first), State.CANCELLED)
+        self.assertEqual(self.scheduler.status(second), State.STARTED)
+
+    def test_status_unknown_and_invalid_job(self):
+        self.assertEqual(self.scheduler.status(1234), State.NONE)
+        self.assertIsNone(self.scheduler.job_info(1234))
+        with self.assertRaises(ArteriaUsageException):
+            self.scheduler.stop("lll")
+
+    def test_status_all(self):
+        self.scheduler.start("cmd1", nbr_of_cores=16, run_dir="/run1")
+        self.scheduler.start("cmd2", nbr_of_cores=16, run_dir="/run2")
+        self.assertEqual(self.scheduler.status_all(), {1: State.STARTED, 2: State.PENDING})
+
+    def test_queue_wait(self):
+        first = self.scheduler.start("cmd1", nbr_of_cores=16, run_dir="/run1")
+        second = self.scheduler.start("cmd2", nbr_of_cores=16, run_dir="/run2")
+        self.scheduler._jobs[second].submitted -= 30
+        self.runner.finish(self.scheduler._jobs[first].runner_job_id)
+        self.scheduler.update()
+        self.assertGreaterEqual(self.scheduler.job_info(second)["queue_wait"], 30)
+
+    def test_utilization(self):
+        self.scheduler.start("cmd1", nbr_of_cores=4, run_dir="/run1", memory_mb=8000)
+        self.scheduler.start("cmd2", nbr_of_cores=16, run_dir="/run2", memory_mb=8000)
+        utilization = self.scheduler.utilization()
+        self.assertEqual(utilization["cores"], {"total": 16, "reserved": 4, "utilization": 0.25})
+        self.assertEqual(utilization["memory_mb"], {"total": 32000, "reserved": 8000, "utilization": 0.25})
+        self.assertEqual(utilization["jobs"], {"running": 1, "pending": 1})
+
+    def test_state_changes_are_published(self):
+        first = self.scheduler.start("cmd1", nbr_of_cores=16, run_dir="/run1", runfolder="run1")
+        second = self.scheduler.start("cmd2", nbr_of_cores=16, run_dir="/run2", runfolder="run2")
+        self.runner.finish(self.scheduler._jobs[first].runner_job_id)
+        self.scheduler.update()
+        self.assertEqual([(event["job_id"], event["state"]) for event in self.scheduler.events.since(0)],
+                         [(first, State.PENDING), (first, State.STARTED), (second, State.PENDING),
+                          (first, State.DONE), (second, State.STARTED)])
+        self.assertEqual(self.scheduler.job_info(first)["version"], 4)
+        self.assertEqual(self.scheduler.job_info(second)["version"], 5)
+
+    @mock.patch("bclconvert.lib.scheduler.FINISHED_JOBS_KEPT", 1)
+    def test_finished_jobs_are_dropped_from_memory(self):
+        first = self.scheduler.start("cmd1", nbr_of_cores=16, run_dir="/run1")
+        second = self.scheduler.start("cmd2", nbr_of_cores=16, run_dir="/run2")
+        self.runner.finish(self.scheduler._jobs[first].runner_job_id)
+        self.scheduler.update()
+        self.assertEqual(list(self.scheduler._jobs), [second])
+        self.assertEqual(self.scheduler.job_info(first)["version"], 4)
+
+        self.runner.finish(self.scheduler._jobs[second].runner_job_id)
+        self.scheduler.update()
+        self.assertEqual(list(self.scheduler._jobs), [])
+        self.assertEqual(list(self.scheduler._finished), [second])
+        # Older jobs are served from the registry
+        self.assertEqual(self.scheduler.status(first), State.DONE)
+        self.assertEqual(self.scheduler.job_info(first)["state"], State.DONE)
+        self.assertEqual(self.scheduler.status_all(), {first: State.DONE, second: State.DONE})
+        self.assertEqual(self.scheduler.utilization()["jobs"], {"running": 0, "pending": 0})
+
+    def test_polling_releases_finished_jobs(self):
+        scheduler = ResourceAwareAdapter(self.runner, nbr_of_cores=4, interval=0.01)
+        first = scheduler.start("cmd1", nbr_of_cores=4, run_dir="/run1")
+        second = scheduler.start("cmd2", nbr_of_cores=4, run_dir="/run2")
+        self.runner.finish(scheduler._jobs[first].runner_job_id)
+        deadline = time.time() + 5
+        while scheduler.status(second) != State.STARTED and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(scheduler.status(second), State.STARTED)
+        scheduler._stop_event.set()
+
+
+class TestJobGroups(unittest.TestCase):
+
+    def setUp(self):
+        self.runner = FakeJobRunner()
+        self.scheduler = ResourceAwareAdapter(self.runner, nbr_of_cores=4, memory_mb=None, interval=None)
+        self.finished_with = []
+        self.scheduler.register_finisher("record", lambda args, succeeded: self.finished_with.append((args, succeeded)))
+
+    def start_group(self, nbr_of_jobs=3):
+        jobs = [{"cmd": f"lane{i}", "nbr_of_cores": 2, "run_dir": "/run"} for i in range(nbr_of_jobs)]
+        return self.scheduler.start_group(jobs, finisher="record", finisher_args={"lanes": [1, 2, 3]})
+
+    def finish(self, job_id, state=State.DONE):
+        self.runner.finish(self.scheduler._jobs[job_id].runner_job_id, state)
+        self.scheduler.update()
+        # Groups are finished in the background
+        self.scheduler._validations.submit(lambda: None).result()
+
+    def test_children_are_scheduled_separately(self):
+        parent, children = self.start_group()
+        self.assertEqual((parent, children), (4, [1, 2, 3]))
+        self.assertEqual(self.scheduler.status(parent), State.STARTED)
+        self.assertEqual([self.scheduler.status(child) for child in children],
+                         [State.STARTED, State.STARTED, State.PENDING])
+        self.assertEqual(self.scheduler.job_info(parent)["children"], children)
+        self.assertEqual(self.scheduler.utilization()["jobs"], {"running": 2, "pending": 1})
+
+    def test_done_when_all_children_are_done(self):
+        parent, children = self.start_group()
+        self.finish(children[0])
+        self.finish(children[1])
+        self.assertEqual(self.scheduler.status(parent), State.STARTED)
+        self.assertEqual(self.finished_with, [])
+        self.finish(children[2])
+        self.assertEqual(self.scheduler.status(parent), State.DONE)
+        self.assertEqual(self.finished_with, [({"lanes": [1, 2, 3]}, [0, 1, 2])])
+
+    def test_error_when_a_child_fails(self):
+        parent, children = self.start_group()
+        self.finish(children[0], State.ERROR)
+        self.assertEqual(self.scheduler.status(parent), State.STARTED)
+        self.finish(children[1])
+        self.finish(children[2])
+        self.assertEqual(self.scheduler.status(parent), State.ERROR)
+        # The output of the children that succeeded is still collected
+        self.assertEqual(self.finished_with, [({"lanes": [1, 2, 3]}, [1, 2])])
+
+    def test_error_when_finisher_fails(self):
+        def fail(args, succeeded):
+            raise OSError("disk full")
+        self.scheduler.register_finisher("fail", fail)
+        parent, children = self.scheduler.start_group([{"cmd": "lane1", "nbr_of_cores": 2, "run_dir": "/run"}],
+                                                      finisher="fail")
+        self.finish(children[0])
+        self.assertEqual(self.scheduler.status(parent), State.ERROR)
+
+    def test_finisher_runs_in_the_background(self):
+        release = threading.Event()
+        self.scheduler.register_finisher("slow", lambda args, succeeded: release.wait(5))
+        parent, children = self.scheduler.start_group([{"cmd": "lane1", "nbr_of_cores": 2, "run_dir": "/run"}],
+                                                      finisher="slow")
+        queued = self.scheduler.start("cmd2", nbr_of_cores=4, run_dir="/run2")
+        self.runner.finish(self.scheduler._jobs[children[0]].runner_job_id)
+        self.scheduler.update()
+        # The scheduler is not held up while the group is finished
+        self.assertEqual(self.scheduler.status(parent), State.STARTED)
+        self.assertTrue(self.scheduler._jobs[parent].finishing)
+        self.assertEqual(self.scheduler.status(queued), State.STARTED)
+        release.set()
+        self.scheduler._validations.submit(lambda: None).result()
+        self.assertEqual(self.scheduler.status(parent), State.DONE)
+        self.assertFalse(self.scheduler._jobs[parent].finishing)
+
+    def test_children_are_kept_until_the_group_has_finished(self):
+        parent, children = self.start_group()
+        self.finish(children[0])
+        self.assertEqual(list(self.scheduler._jobs), children + [parent])
+        self.finish(children[1])
+        self.finish(children[2])
+        self.scheduler.update()
+        self.assertEqual(list(self.scheduler._jobs), [])
+        self.assertEqual(self.scheduler.status(parent), State.DONE)
+        self.assertEqual(self.scheduler.job_info(parent)["children"], children)
+
+    def test_groups_are_in_flight_instead_of_their_children(self):
+        jobs = [{"cmd": f"lane{i}", "nbr_of_cores": 2, "run_dir": "/run", "runfolder": "run1"} for i in range(2)]
+        parent, children = self.scheduler.start_group(jobs, runfolder="run1", fingerprint="abc")
+        self.assertEqual([(job["job_id"], job["fingerprint"]) for job in self.scheduler.in_flight("run1")],
+                         [(parent, "abc")])
+        for child in children:
+            self.finish(child)
+        self.assertEqual(self.scheduler.in_flight("run1"), [])
+
+    def test_unknown_finisher(self):
+        with self.assertRaises(ArteriaUsageException):
+            self.scheduler.start_group([{"cmd": "lane1", "nbr_of_cores": 2, "run_dir": "/run"}], finisher="nope")
+        self.assertEqual(self.runner.jobs, {})
+
+    def test_stop_group(self):
+        parent, children = self.start_group()
+        self.scheduler.stop(parent)
+        self.assertEqual([self.scheduler.status(child) for child in children], [State.CANCELLED] * 3)
+        self.assertEqual(self.scheduler.status(parent), State.CANCELLED)
+        self.assertEqual(self.finished_with, [])
+
+
+class TestValidation(unittest.TestCase):
+
+    def setUp(self):
+        self.runner = FakeJobRunner()
+        self.validated = []
+        self.valid = True
+        self.release = threading.Event()
+        self.scheduler = ResourceAwareAdapter(self.runner, nbr_of_cores=4, interval=None, validator=self.validate)
+
+    def validate(self, record):
+        self.release.wait(5)
+        self.validated.append(record["job_id"])
+        if not self.valid:
+            raise ValueError("truncated fastq file")
+
+    def wait_for_validation(self):
+        self.release.set()
+        self.scheduler._validations.submit(lambda: None).result()
+
+    def test_job_is_done_once_validated(self):
+        first = self.scheduler.start("cmd1", nbr_of_cores=4, run_dir="/run1")
+        second = self.scheduler.start("cmd2", nbr_of_cores=4, run_dir="/run2")
+        self.runner.finish(1)
+        self.scheduler.update()
+        # The job keeps its cores while it is validated
+        self.assertEqual(self.scheduler.status(first), State.STARTED)
+        self.assertEqual(self.scheduler.status(second), State.PENDING)
+        self.wait_for_validation()
+        self.assertEqual(self.scheduler.status(first), State.DONE)
+        self.assertEqual(self.scheduler.status(second), State.STARTED)
+        self.assertEqual(self.validated, [first])
+
+    def test_job_is_not_done_before_it_is_validated(self):
+        job_id = self.scheduler.start("cmd1", nbr_of_cores=4, run_dir="/run1")
+        self.runner.finish(1)
+        # The runner is done with the job, but the scheduler has not taken notice yet
+        self.assertEqual(self.scheduler.status(job_id), State.STARTED)
+        self.scheduler.update()
+        self.assertEqual(self.scheduler.status(job_id), State.STARTED)
+        self.wait_for_validation()
+        self.assertEqual(self.scheduler.status(job_id), State.DONE)
+
+    def test_job_fails_if_not_valid(self):
+        self.valid = False
+        job_id = self.scheduler.start("cmd1", nbr_of_cores=4, run_dir="/run1")
+        self.runner.finish(1)
+        self.scheduler.update()
+        self.wait_for_validation()
+        self.assertEqual(self.scheduler.status(job_id), State.ERROR)
+
+    def test_failed_jobs_are_not_validated(self):
+        job_id = self.scheduler.start("cmd1", nbr_of_cores=4, run_dir="/run1")
+        self.runner.finish(1, State.ERROR)
+        self.scheduler.update()
+        self.wait_for_validation()
+        self.assertEqual(self.scheduler.status(job_id), State.ERROR)
+        self.assertEqual(self.validated, [])
+
+    def test_groups_are_validated_instead_of_their_children(self):
+        parent, children = self.scheduler.start_group(
+            [{"cmd": f"lane{i}", "nbr_of_cores": 2, "run_dir": "/run"} for i in range(2)])
+        self.runner.finish(1)
+        self.runner.finish(2)
+        self.scheduler.update()
+        self.assertEqual([self.scheduler.status(child) for child in children], [State.DONE] * 2)
+        self.assertEqual(self.scheduler.status(parent), State.STARTED)
+        self.wait_for_validation()
+        self.assertEqual(self.scheduler.status(parent), State.DONE)
+        self.assertEqual(self.validated, [parent])
+
+    def test_stop_while_validating(self):
+        job_id = self.scheduler.start("cmd1", nbr_of_cores=4, run_dir="/run1")
+        self.runner.finish(1)
+        self.scheduler.update()
+        self.scheduler.stop(job_id)
+        self.wait_for_validation()
+        self.assertEqual(self.scheduler.status(job_id), State.CANCELLED)
+
+
+class TestPriorities(unittest.TestCase):
+
+    def setUp(self):
+        self.runner = FakeJobRunner()
+        self.scheduler = ResourceAwareAdapter(self.runner, nbr_of_cores=8, interval=None, preemption=True)
+
+    def finish(self, job_id, state=State.DONE):
+        self.runner.finish(self.scheduler._jobs[job_id].runner_job_id, state)
+        self.scheduler.update()
+
+    def test_higher_priority_goes_first(self):
+        self.scheduler.preemption = False
+        running = self.scheduler.start("cmd1", nbr_of_cores=8, run_dir="/run1")
+        low = self.scheduler.start("cmd2", nbr_of_cores=8, run_dir="/run2", priority=0)
+        high = self.scheduler.start("cmd3", nbr_of_cores=8, run_dir="/run3", priority=100)
+        self.assertEqual(self.scheduler.queue_info(high)["position"], 1)
+        self.assertEqual(self.scheduler.queue_info(low)["position"], 2)
+        self.assertIsNone(self.scheduler.queue_info(running))
+        self.finish(running)
+        self.assertEqual((self.scheduler.status(high), self.scheduler.status(low)), (State.STARTED, State.PENDING))
+
+    def test_waiting_jobs_gain_priority(self):
+        self.scheduler.preemption = False
+        self.scheduler.aging_per_hour = 10
+        self.scheduler.start("cmd1", nbr_of_cores=8, run_dir="/run1")
+        low = self.scheduler.start("cmd2", nbr_of_cores=8, run_dir="/run2", priority=0)
+        normal = self.scheduler.start("cmd3", nbr_of_cores=8, run_dir="/run3", priority=50)
+        self.scheduler._jobs[low].submitted -= 6 * 3600
+        self.assertEqual(self.scheduler.queue_info(low)["position"], 1)
+        self.assertEqual(self.scheduler.queue_info(normal)["position"], 2)
+
+    def test_preemption(self):
+        first = self.scheduler.start("cmd1", nbr_of_cores=4, run_dir="/run1", priority=0)
+        second = self.scheduler.start("cmd2", nbr_of_cores=4, run_dir="/run2", priority=50)
+        urgent = self.scheduler.start("cmd3", nbr_of_cores=4, run_dir="/run3", priority=100)
+        # The job of the lowest priority makes room, and is queued again
+        self.assertEqual([self.scheduler.status(job_id) for job_id in [first, second, urgent]],
+                         [State.PENDING, State.STARTED, State.STARTED])
+        self.assertEqual(self.runner.jobs[1]["state"], State.CANCELLED)
+        self.assertEqual(self.scheduler.job_info(first)["preemptions"], 1)
+
+        self.finish(urgent)
+        self.assertEqual(self.scheduler.status(first), State.STARTED)
+        self.assertEqual(self.scheduler._jobs[first].runner_job_id, 4)
+
+    def test_no_preemption_of_equal_priority_or_when_it_does_not_help(self):
+        first = self.scheduler.start("cmd1", nbr_of_cores=4, run_dir="/run1", priority=50)
+        second = self.scheduler.start("cmd2", nbr_of_cores=4, run_dir="/run2", priority=0)
+        same = self.scheduler.start("cmd3", nbr_of_cores=8, run_dir="/run3", priority=50)
+        self.assertEqual(self.scheduler.status(same), State.PENDING)
+        self.assertEqual([self.scheduler.status(first), self.scheduler.status(second)], [State.STARTED] * 2)
+
+    def test_expected_start(self):
+        self.scheduler.preemption = False
+        first = self.scheduler.start("cmd1", nbr_of_cores=8, run_dir="/run1")
+        second = self.scheduler.start("cmd2", nbr_of_cores=8, run_dir="/run2")
+        third = self.scheduler.start("cmd3", nbr_of_cores=8, run_dir="/run3")
+        # Nothing has finished, so it is not known how long jobs run
+        self.assertIsNone(self.scheduler.queue_info(second)["expected_start"])
+
+        now = time.time()
+        info = self.scheduler.queue_info(second, remaining_seconds=lambda job_id: 600 if job_id == first else None)
+        self.assertAlmostEqual(info["expected_start"], now + 600, delta=5)
+
+        job = self.scheduler._jobs[first]
+        job.started -= 1000
+        self.finish(first)
+        self.scheduler._jobs[second].started -= 100
+        info = self.scheduler.queue_info(third)
+        self.assertEqual(info["position"], 1)
+        self.assertAlmostEqual(info["expected_start"], now + 900, delta=5)
+
+
+class TestJobPriority(unittest.TestCase):
+
+    def test_job_priority(self):
+        config = {"priority_runfolder_patterns": [{"pattern": "_A00123_", "priority": "high"}]}
+        self.assertEqual(job_priority(config, "200101_M00123_0001_A"), ("normal", 50))
+        self.assertEqual(job_priority(config, "200101_A00123_0001_A"), ("high", 100))
+        self.assertEqual(job_priority(config, "200101_A00123_0001_A", "low"), ("low", 0))
+        with self.assertRaises(ArteriaUsageException):
+            job_priority(config, "200101_A00123_0001_A", "urgent")
+
+
+class TestRestart(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = JobRegistry()
+        self.runner = FakeJobRunner()
+        self.scheduler = ResourceAwareAdapter(self.runner, nbr_of_cores=4, interval=None, registry=self.registry)
+
+    def restart(self, runner=None):
+        return ResourceAwareAdapter(runner or FakeJobRunner(), nbr_of_cores=4, interval=None, registry=self.registry)
+
+    def test_jobs_are_recorded(self):
+        job_id = self.scheduler.start(["bcl-convert", "--force"], nbr_of_cores=2, run_dir="/run1", memory_mb=100,
+                                      runfolder="run1", parameters={"lanes": "1"})
+        self.runner.finish(self.scheduler._jobs[job_id].runner_job_id)
+        self.scheduler.update()
+        record = self.registry.get(job_id)
+        self.assertEqual(record["command"], ["bcl-convert", "--force"])
+        self.assertEqual(record["parameters"], {"lanes": "1"})
+        self.assertEqual((record["runfolder"], record["state"], record["cores"]), ("run1", State.DONE, 2))
+        self.assertIsNotNone(record["finished"])
+
+    def test_finished_jobs_are_served_after_restart(self):
+        job_id = self.scheduler.start("cmd1", nbr_of_cores=2, run_dir="/run1", runfolder="run1")
+        self.runner.finish(self.scheduler._jobs[job_id].runner_job_id)
+        self.scheduler.update()
+
+        scheduler = self.restart()
+        self.assertEqual(scheduler.status(job_id), State.DONE)
+        self.assertEqual(scheduler.job_info(job_id)["runfolder"], "run1")
+        self.assertEqual(scheduler.status_all(runfolder="run1"), {job_id: State.DONE})
+        self.assertEqual(scheduler.start("cmd2", nbr_of_cores=2, run_dir="/run2"), job_id + 1)
+
+    def test_jobs_in_flight(self):
+        self.scheduler.start("cmd1", nbr_of_cores=4, run_dir="/run1", runfolder="run1", fingerprint="abc")
+        queued = self.scheduler.start("cmd2", nbr_of_cores=4, run_dir="/run2", runfolder="run2")
+        self.runner.finish(1)
+
+        scheduler = self.restart()
+        self.assertEqual(scheduler.in_flight("run1"), [])
+        in_flight = scheduler.in_flight("run2")
+        self.assertEqual([(job["job_id"], job["fingerprint"]) for job in in_flight], [(queued, None)])
+        self.assertEqual(self.registry.get(1)["fingerprint"], "abc")
+
+    def test_queued_jobs_are_queued_again(self):
+        self.scheduler.start("cmd1", nbr_of_cores=4, run_dir="/run1")
+        queued = self.scheduler.start("cmd2", nbr_of_cores=4, run_dir="/run2")
+
+        runner = FakeJobRunner()
+        scheduler = self.restart(runner)
+        scheduler.update()
+        self.assertEqual(scheduler.status(queued), State.STARTED)
+        self.assertEqual(runner.jobs[1]["cmd"], "cmd2")
+
+    def test_running_jobs_fail_unless_they_survive_a_restart(self):
+        running = self.scheduler.start("cmd1", nbr_of_cores=4, run_dir="/run1")
+        self.assertEqual(self.restart().status(running), State.ERROR)
+        self.assertEqual(self.registry.get(running)["state"], State.ERROR)
+
+    def test_running_jobs_are_followed_if_they_survive_a_restart(self):
+        running = self.scheduler.start("cmd1", nbr_of_cores=4, run_dir="/run1")
+        runner = FakeJobRunner()
+        runner.jobs_survive_restart = True
+        runner.jobs["1"] = {"state": State.STARTED}
+        scheduler = self.restart(runner)
+        scheduler.update()
+        self.assertEqual(scheduler.status(running), State.STARTED)
+        runner.finish("1")
+        scheduler.update()
+        self.assertEqual(scheduler.status(running), State.DONE)
+
+    def test_validation_is_resumed_after_restart(self):
+        release = threading.Event()
+        scheduler = ResourceAwareAdapter(self.runner, nbr_of_cores=4, interval=None, registry=self.registry,
+                                         validator=lambda record: release.wait(5))
+        job_id = scheduler.start("cmd1", nbr_of_cores=2, run_dir="/run1")
+        group_id, _ = scheduler.start_group([{"cmd": "lane1", "nbr_of_cores": 2, "run_dir": "/run2"}])
+        self.runner.finish(1)
+        self.runner.finish(2)
+        scheduler.update()
+        self.assertEqual(self.registry.get(job_id)["validating"], 1)
+
+        validated = []
+        scheduler = ResourceAwareAdapter(FakeJobRunner(), nbr_of_cores=4, interval=None, registry=self.registry,
+                                         validator=lambda record: validated.append(record["job_id"]))
+        release.set()
+        scheduler._validations.submit(lambda: None).result()
+        self.assertEqual(validated, [job_id, group_id])
+        self.assertEqual((scheduler.status(job_id), scheduler.status(group_id)), (State.DONE, State.DONE))
+        self.assertFalse(self.registry.get(job_id)["validating"])
+
+        # Without a validator the output is taken as it is
+        self.registry.save(dict(self.registry.get(job_id), state=State.STARTED, validating=True))
+        self.assertEqual(self.restart().status(job_id), State.DONE)
+
+    def test_groups_are_finished_after_restart(self):
+        self.scheduler.register_finisher("record", lambda args, succeeded: None)
+        parent, children = self.scheduler.start_group(
+            [{"cmd": f"lane{i}", "nbr_of_cores": 2, "run_dir": "/run"} for i in range(2)],
+            finisher="record", finisher_args={"lanes": [1, 2]})
+
+        finished_with = []
+        runner = FakeJobRunner()
+        runner.jobs_survive_restart = True
+        runner.jobs.update({"1": {"state": State.DONE}, "2": {"state": State.STARTED}})
+        scheduler = ResourceAwareAdapter(runner, nbr_of_cores=4, interval=None, registry=self.registry,
+                                         finishers={"record": lambda args, succeeded: finished_with.append((args, succeeded))})
+        self.assertEqual(scheduler.job_info(parent)["children"], children)
+        scheduler.update()
+        self.assertEqual(scheduler.status(parent), State.STARTED)
+        runner.finish("2")
+        scheduler.update()
+        scheduler._validations.submit(lambda: None).result()
+        self.assertEqual(scheduler.status(parent), State.DONE)
+        self.assertEqual(finished_with, [({"lanes": [1, 2]}, [0, 1])])
+
+    def test_groups_are_finished_again_after_restart(self):
+        release = threading.Event()
+        self.scheduler.register_finisher("record", lambda args, succeeded: release.wait(5))
+        parent, children = self.scheduler.start_group(
+            [{"cmd": f"lane{i}", "nbr_of_cores": 2, "run_dir": "/run"} for i in range(2)], finisher="record")
+        self.runner.finish(1)
+        self.runner.finish(2)
+        self.scheduler.update()
+        self.assertEqual(self.registry.get(parent)["finishing"], 1)
+
+        finished_with = []
+        scheduler = ResourceAwareAdapter(FakeJobRunner(), nbr_of_cores=4, interval=None, registry=self.registry,
+                                         finishers={"record": lambda args, succeeded: finished_with.append(succeeded)})
+        release.set()
+        scheduler.update()
+        scheduler._validations.submit(lambda: None).result()
+        self.assertEqual(scheduler.status(parent), State.DONE)
+        self.assertEqual(finished_with, [[0, 1]])
+
+
+class TestEstimateMemory(unittest.TestCase):
+
+    def test_defaults(self):
+        self.assertEqual(estimate_memory_mb(3, {}), 2048 + 3 * 512)
+
+    def test_configured(self):
+        self.assertEqual(estimate_memory_mb(4, {"job_memory_base_mb": 1000, "job_memory_per_thread_mb": 100}), 1400)
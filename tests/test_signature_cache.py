@@ -0,0 +1,53 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from bclconvert.lib.signature_cache import SignatureCache, file_signature
+
+
+class TestSignatureCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "file.txt")
+        with open(self.path, "w") as f:
+            f.write("content")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_file_signature(self):
+        missing = os.path.join(self.tmp_dir, "missing.txt")
+        signature = file_signature([self.path, missing])
+        self.assertEqual(signature[0][1], 7)
+        self.assertIsNone(signature[1])
+        with open(self.path, "a") as f:
+            f.write(", more content")
+        self.assertNotEqual(file_signature([self.path, missing]), signature)
+
+    def test_reused_while_the_signature_is_unchanged(self):
+        cache = SignatureCache(maxsize=2)
+        loads = []
+
+        def load():
+            loads.append(1)
+            return len(loads)
+
+        self.assertEqual(cache.lookup("a", (1,), load), 1)
+        self.assertEqual(cache.lookup("a", (1,), load), 1)
+        self.assertEqual(cache.lookup("a", (2,), load), 2)
+        self.assertEqual(len(loads), 2)
+
+    def test_lru_eviction(self):
+        cache = SignatureCache(maxsize=2)
+        cache.lookup("a", (), lambda: "a")
+        cache.lookup("b", (), lambda: "b")
+        # Touch a so that b is the least recently used
+        cache.lookup("a", (), lambda: "not loaded again")
+        cache.lookup("c", (), lambda: "c")
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.lookup("a", (), lambda: "not loaded again"), "a")
+        self.assertEqual(cache.lookup("b", (), lambda: "loaded again"), "loaded again")
+        cache.clear()
+        self.assertEqual(len(cache), 0)
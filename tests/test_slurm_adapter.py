@@ -0,0 +1,149 @@
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+from arteria.exceptions import ArteriaUsageException
+from arteria.web.state import State
+
+from bclconvert.lib.jobrunner import SlurmAdapter
+
+# The stubs log their arguments to <command>.calls, and print <command>.out if it exists.
+STUB_SCRIPT = """#!/bin/sh
+DIR=$(dirname "$0")
+echo "$@" >> "$DIR/{command}.calls"
+{body}
+"""
+
+SBATCH_BODY = """
+COUNT=$(cat "$DIR/sbatch.count" 2>/dev/null || echo 100)
+COUNT=$((COUNT + 1))
+echo $COUNT > "$DIR/sbatch.count"
+echo "$COUNT;cluster"
+"""
+
+OUTPUT_BODY = """
+[ -f "$DIR/{command}.out" ] && cat "$DIR/{command}.out"
+exit 0
+"""
+
+
+class TestSlurmAdapter(unittest.TestCase):
+
+    def setUp(self):
+        self.stub_dir = tempfile.mkdtemp()
+        for command in ["sbatch", "squeue", "sacct", "scancel"]:
+            body = SBATCH_BODY if command == "sbatch" else OUTPUT_BODY.format(command=command)
+            path = os.path.join(self.stub_dir, command)
+            with open(path, "w") as f:
+                f.write(STUB_SCRIPT.format(command=command, body=body))
+            os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+        self.adapter = self.create_adapter()
+
+    def tearDown(self):
+        shutil.rmtree(self.stub_dir)
+
+    def create_adapter(self, **kwargs):
+        return SlurmAdapter(sbatch=self.stub("sbatch"), squeue=self.stub("squeue"), sacct=self.stub("sacct"),
+                            scancel=self.stub("scancel"), **kwargs)
+
+    def stub(self, command):
+        return os.path.join(self.stub_dir, command)
+
+    def calls(self, command):
+        try:
+            with open(self.stub(command) + ".calls") as f:
+                return f.read().splitlines()
+        except FileNotFoundError:
+            return []
+
+    def set_output(self, command, output):
+        with open(self.stub(command) + ".out", "w") as f:
+            f.write(output)
+
+    def test_start(self):
+        adapter = self.create_adapter(partition="core", account="sens2024", time_limit="1-00:00:00",
+                                      extra_args=["--qos", "high"])
+        job_id = adapter.start(["bcl-convert", "--bcl-input-directory", "/runfolders/run 1"], nbr_of_cores=8,
+                               run_dir="/runfolders/run1", stdout="/logs/run1.log", stderr="/logs/run1.log",
+                               memory_mb=16384)
+        self.assertEqual(job_id, "101")
+        sbatch_args = self.calls("sbatch")[0]
+        for expected in ["--parsable", "--job-name bclconvert", "--cpus-per-task 8", "--mem 16384M",
+                         "--chdir /runfolders/run1", "--output /logs/run1.log", "--partition core",
+                         "--account sens2024", "--time 1-00:00:00", "--qos high",
+                         "--wrap bcl-convert --bcl-input-directory '/runfolders/run 1'"]:
+            self.assertIn(expected, sbatch_args)
+
+    def test_start_failure(self):
+        with open(self.stub("sbatch"), "w") as f:
+            f.write("#!/bin/sh\necho 'sbatch: error: invalid partition' >&2\nexit 1\n")
+        with self.assertRaises(ArteriaUsageException):
+            self.adapter.start("bcl-convert", nbr_of_cores=1, run_dir="/runfolders/run1")
+
+    def test_status_all_is_batched(self):
+        job_ids = [self.adapter.start("bcl-convert", nbr_of_cores=1, run_dir="/run") for _ in range(3)]
+        self.set_output("squeue", "101|RUNNING\n102|PENDING\n")
+        self.set_output("sacct", "103|COMPLETED\n103.batch|COMPLETED\n")
+
+        self.assertEqual(self.adapter.status_all(),
+                         {"101": State.STARTED, "102": State.PENDING, "103": State.DONE})
+        for job_id in job_ids:
+            self.adapter.status(job_id)
+
+        self.assertEqual(len(self.calls("squeue")), 1)
+        self.assertEqual(self.calls("sacct"), ["--noheader --parsable2 --format=JobID,State --jobs 103"])
+
+    def test_finished_jobs_are_not_queried_again(self):
+        adapter = self.create_adapter(status_cache_seconds=0)
+        adapter.start("bcl-convert", nbr_of_cores=1, run_dir="/run")
+        self.set_output("sacct", "101|CANCELLED by 1000\n")
+        self.assertEqual(adapter.status("101"), State.CANCELLED)
+        self.assertEqual(adapter.status("101"), State.CANCELLED)
+        self.assertEqual(len(self.calls("squeue")), 1)
+
+    def test_failed_states(self):
+        for slurm_state in ["FAILED", "TIMEOUT", "OUT_OF_MEMORY", "NODE_FAIL"]:
+            self.assertEqual(SlurmAdapter.slurm2arteria_status(slurm_state), State.ERROR)
+        self.assertEqual(SlurmAdapter.slurm2arteria_status("SOMETHING_NEW"), State.NONE)
+
+    def test_unknown_job(self):
+        self.assertEqual(self.adapter.status("999"), State.NONE)
+        self.assertEqual(self.calls("sacct"), ["--noheader --parsable2 --format=JobID,State --jobs 999"])
+
+    def test_jobs_unknown_to_slurm_are_not_queried_forever(self):
+        adapter = self.create_adapter(status_cache_seconds=0, max_status_misses=2)
+        adapter.start("bcl-convert", nbr_of_cores=1, run_dir="/run")
+        self.assertEqual(adapter.status("101"), State.NONE)
+        self.assertEqual(adapter.status("101"), State.ERROR)
+        self.assertEqual(adapter.status("101"), State.ERROR)
+        self.assertEqual(len(self.calls("sacct")), 2)
+
+    def test_jobs_found_again_are_not_failed(self):
+        adapter = self.create_adapter(status_cache_seconds=0, max_status_misses=2)
+        adapter.start("bcl-convert", nbr_of_cores=1, run_dir="/run")
+        self.assertEqual(adapter.status("101"), State.NONE)
+        self.set_output("squeue", "101|RUNNING\n")
+        self.assertEqual(adapter.status("101"), State.STARTED)
+        os.remove(self.stub("squeue") + ".out")
+        self.assertEqual(adapter.status("101"), State.NONE)
+
+    def test_stop(self):
+        job_id = self.adapter.start("bcl-convert", nbr_of_cores=1, run_dir="/run")
+        self.adapter.stop(job_id)
+        self.assertEqual(self.calls("scancel"), ["101"])
+
+    def test_stop_all(self):
+        for _ in range(2):
+            self.adapter.start("bcl-convert", nbr_of_cores=1, run_dir="/run")
+        self.adapter.stop_all()
+        self.assertEqual(self.calls("scancel"), ["101 102"])
+
+    def test_exit_code(self):
+        self.set_output("sacct", "101|2:0\n101.batch|2:0\n")
+        self.assertEqual(self.adapter.exit_code("101"), 2)
+        self.assertEqual(self.calls("sacct"), ["--noheader --parsable2 --format=JobID,ExitCode --jobs 101"])
+
+    def test_exit_code_unknown(self):
+        self.assertIsNone(self.adapter.exit_code("999"))
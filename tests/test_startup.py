@@ -0,0 +1,22 @@
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+
+class TestStartup(unittest.TestCase):
+    """
+    Keeps the start up of bclconvert-ws cheap. Heavy dependencies should only be imported by the
+    code paths that need them. See benchmarks/startup.py for measuring the actual start up time.
+    """
+
+    repo_root = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+    heavy_modules = ["numpy", "pandas", "localq", "xmltodict"]
+
+    def test_importing_app_does_not_load_heavy_modules(self):
+        code = "import sys, json; import bclconvert.app; " \
+               f"print(json.dumps([m for m in {self.heavy_modules!r} if m in sys.modules]))"
+        result = subprocess.run([sys.executable, "-c", code], cwd=self.repo_root,
+                                stdout=subprocess.PIPE, universal_newlines=True, check=True)
+        self.assertEqual(json.loads(result.stdout), [])
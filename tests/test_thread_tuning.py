@@ -0,0 +1,76 @@
+import unittest
+
+from bclconvert.lib.runinfo import Read, RunInfo
+from bclconvert.lib.thread_tuning import ThreadPlan, core_budget, plan_threads
+
+
+NOVASEQ_RUN = RunInfo(run_id="run", instrument="A00001", flowcell="HXXXXXXXX",
+                      reads=(Read(1, 151, False), Read(2, 10, True), Read(3, 10, True), Read(4, 151, False)),
+                      lane_count=4, surface_count=2, swath_count=6, tile_count=78,
+                      tiles=tuple(f"{lane}_{tile}" for lane in range(1, 5) for tile in range(1101, 1101 + 936)))
+
+MISEQ_RUN = RunInfo(run_id="run", instrument="M00001", flowcell="000000000-AAAAA",
+                    reads=(Read(1, 151, False), Read(2, 8, True)),
+                    lane_count=1, tiles=("1_1101", "1_1102"))
+
+
+class TestCoreBudget(unittest.TestCase):
+
+    def test_whole_node_when_idle(self):
+        self.assertEqual(core_budget(64, free_cores=64, running_jobs=0)[0], 64)
+
+    def test_share_with_running_jobs(self):
+        self.assertEqual(core_budget(64, free_cores=48, running_jobs=1)[0], 32)
+
+    def test_free_cores_when_fewer_than_share(self):
+        self.assertEqual(core_budget(64, free_cores=8, running_jobs=1)[0], 8)
+
+    def test_share_when_nothing_is_free(self):
+        self.assertEqual(core_budget(64, free_cores=0, running_jobs=3)[0], 16)
+
+
+class TestPlanThreads(unittest.TestCase):
+
+    def test_uses_the_budget(self):
+        plan = plan_threads(NOVASEQ_RUN, node_cores=64, free_cores=64)
+        self.assertEqual(plan.cores, 64)
+        self.assertEqual(plan.parallel_tiles, 16)
+        self.assertGreater(plan.compression_threads, plan.conversion_threads)
+        self.assertIn("64 of 64 cores", plan.reason)
+
+        # Few tiles leave many cores to each of them
+        plan = plan_threads(MISEQ_RUN, node_cores=64, free_cores=64)
+        self.assertEqual(plan.cores, 64)
+        self.assertGreater(plan.compression_threads, plan.decompression_threads)
+        self.assertGreater(plan.decompression_threads, plan.conversion_threads)
+
+    def test_threads_of_parallel_tiles_fit_in_the_budget(self):
+        for node_cores in [3, 4, 7, 16, 23, 64, 96, 128]:
+            plan = plan_threads(NOVASEQ_RUN, node_cores=node_cores)
+            self.assertLessEqual(plan.parallel_tiles * plan.total_threads, node_cores)
+            self.assertEqual(plan.cores, plan.parallel_tiles * plan.total_threads)
+
+    def test_parallel_tiles_limited_by_tiles(self):
+        plan = plan_threads(MISEQ_RUN, node_cores=64, free_cores=64)
+        self.assertEqual(plan.parallel_tiles, 2)
+
+    def test_small_node(self):
+        plan = plan_threads(MISEQ_RUN, node_cores=2)
+        self.assertEqual((plan.conversion_threads, plan.compression_threads, plan.decompression_threads), (1, 1, 1))
+        self.assertEqual(plan.parallel_tiles, 1)
+
+    def test_override(self):
+        plan = plan_threads(NOVASEQ_RUN, node_cores=16)
+        plan.override(conversion_threads=8, compression_threads=None)
+        self.assertEqual(plan.conversion_threads, 8)
+        self.assertEqual(plan.as_dict()["overridden"], ["bcl_num_conversion_threads"])
+
+    def test_as_dict(self):
+        plan = ThreadPlan(parallel_tiles=2, conversion_threads=3, compression_threads=4, decompression_threads=5,
+                          reason="because")
+        self.assertEqual(plan.as_dict(), {"bcl_num_parallel_tiles": 2,
+                                          "bcl_num_conversion_threads": 3,
+                                          "bcl_num_compression_threads": 4,
+                                          "bcl_num_decompression_threads": 5,
+                                          "reason": "because",
+                                          "overridden": []})
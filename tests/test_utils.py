@@ -2,6 +2,9 @@
 # bcl2fastq/tests/test_utils_logs.py
 
 from bclconvert.lib.bclconvert_utils import BclConvertRunner, BclConvertConfig
+from bclconvert.lib.jobrunner import JobRunnerAdapter
+from bclconvert.lib.preflight import PreflightReport
+from arteria.web.state import State
 
 class TestUtils:
 
@@ -87,3 +90,36 @@ class FakeRunner(BclConvertRunner):
 
     def construct_command(self):
         return "fake_bcl_command"
+
+    def preflight(self):
+        return PreflightReport()
+
+
+class FakeJobRunner(JobRunnerAdapter):
+    """
+    Keeps jobs in memory. Jobs are started at once and run until `finish` is called.
+    """
+    def __init__(self):
+        self.jobs = {}
+
+    def start(self, cmd, nbr_of_cores, run_dir, stdout=None, stderr=None, memory_mb=None):
+        job_id = len(self.jobs) + 1
+        self.jobs[job_id] = {"cmd": cmd, "nbr_of_cores": nbr_of_cores, "memory_mb": memory_mb, "state": State.STARTED}
+        return job_id
+
+    def finish(self, job_id, state=State.DONE):
+        self.jobs[job_id]["state"] = state
+
+    def stop(self, job_id):
+        self.finish(job_id, State.CANCELLED)
+        return job_id
+
+    def stop_all(self):
+        for job_id in self.jobs:
+            self.stop(job_id)
+
+    def status(self, job_id):
+        return self.jobs[job_id]["state"] if job_id in self.jobs else State.NONE
+
+    def status_all(self):
+        return {job_id: job["state"] for job_id, job in self.jobs.items()}
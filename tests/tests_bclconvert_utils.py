@@ -60,6 +60,22 @@ class TestBclConvertConfig(unittest.TestCase):
 
             ws.assert_called_once_with(TestUtils.DUMMY_SAMPLESHEET_STRING, config.samplesheet_file)
 
+    def test_reservation_counts_the_threads_of_each_parallel_tile(self):
+        with patch("multiprocessing.cpu_count", return_value=32):
+            config = BclConvertConfig(general_config=DUMMY_CONFIG, bclconvert_version="4.0.3",
+                                      runfolder_input="test/runfolder", output="test/output",
+                                      bcl_num_parallel_tiles=4, bcl_num_conversion_threads=2,
+                                      bcl_num_compression_threads=3, bcl_num_decompression_threads=2)
+            self.assertEqual(config.nbr_of_cores, 28)
+            self.assertEqual(config.memory_mb, estimate_memory_mb(28, DUMMY_CONFIG))
+
+            # More threads than the node has are capped at its cores
+            config = BclConvertConfig(general_config=DUMMY_CONFIG, bclconvert_version="4.0.3",
+                                      runfolder_input="test/runfolder", output="test/output",
+                                      bcl_num_parallel_tiles=8, bcl_num_conversion_threads=2,
+                                      bcl_num_compression_threads=3, bcl_num_decompression_threads=2)
+            self.assertEqual(config.nbr_of_cores, 32)
+
     def test_get_bases_mask_per_lane_from_samplesheet(self):
         mock_read_index_lengths = {2: 9, 3: 9}
         expected_bases_mask = {1: "y*,i8n*,i8n*,y*",
@@ -299,3 +315,12 @@ class TestLaneParsing(unittest.TestCase):
     def test_consecutive_hyphens(self):
         with self.assertRaises(ArteriaUsageException):
             BclConvertConfig.parse_lanes_to_tiles_regex("1--3")
+
+    def test_parse_lanes(self):
+        self.assertEqual(BclConvertConfig.parse_lanes("1"), [1])
+        self.assertEqual(BclConvertConfig.parse_lanes("13-5"), [1, 3, 4, 5])
+        self.assertEqual(BclConvertConfig.parse_lanes("1-46-7"), [1, 2, 3, 4, 6, 7])
+
+    def test_parse_lanes_invalid(self):
+        with self.assertRaises(ArteriaUsageException):
+            BclConvertConfig.parse_lanes("9")